@@ -21,6 +21,7 @@ from protorpc import remote
 
 from components import auth
 
+from cipd import impl
 import config
 
 # This is used by endpoints indirectly.
@@ -90,3 +91,16 @@ class AdminApi(remote.Service):
       logging.warning('Updated Google Storage paths configuration')
 
     return message_types.VoidMessage()
+
+  @auth.endpoints_method(
+      message_types.VoidMessage, name='rebuildPackageDirectories')
+  @auth.require(auth.is_admin)
+  def rebuild_package_directories(self, _request):
+    """Adds packages registered before the package directories tree to it.
+
+    Starts a one-off chain of tasks, each adding a page of packages.
+    """
+    if not impl.enqueue_rebuild_package_directories():
+      raise endpoints.InternalServerErrorException('Failed to enqueue a task')
+    logging.warning('Started rebuilding package directories')
+    return message_types.VoidMessage()
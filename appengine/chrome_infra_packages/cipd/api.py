@@ -9,6 +9,7 @@ import logging
 
 import endpoints
 
+from google.appengine.api import datastore_errors
 from protorpc import message_types
 from protorpc import messages
 from protorpc import remote
@@ -245,6 +246,8 @@ class ListPackagesResponse(messages.Message):
   # For SUCCESS, names of the packages and names of directories.
   packages = messages.StringField(3, repeated=True)
   directories = messages.StringField(4, repeated=True)
+  # For SUCCESS, a cursor to pass to listPackages to fetch the next page.
+  cursor = messages.StringField(5, required=False)
 
 
 ################################################################################
@@ -350,6 +353,8 @@ class SearchResponse(messages.Message):
 
   # For SUCCESS, list of instances found.
   instances = messages.MessageField(PackageInstance, 3, repeated=True)
+  # For SUCCESS, a cursor to pass to searchInstances to fetch the next page.
+  cursor = messages.StringField(4, required=False)
 
 
 class ResolveVersionResponse(messages.Message):
@@ -587,7 +592,9 @@ class PackageRepositoryApi(remote.Service):
       endpoints.ResourceContainer(
           message_types.VoidMessage,
           path=messages.StringField(1, required=False),
-          recursive=messages.BooleanField(2, required=False)),
+          recursive=messages.BooleanField(2, required=False),
+          limit=messages.IntegerField(3, required=False),
+          cursor=messages.StringField(4, required=False)),
       ListPackagesResponse,
       http_method='GET',
       path='package/search',
@@ -596,13 +603,20 @@ class PackageRepositoryApi(remote.Service):
     """Returns packages in the given directory and possibly subdirectories."""
     path = request.path or ''
     recursive = request.recursive or False
-
-    pkgs, dirs = self.service.list_packages(path, recursive)
+    if request.limit is not None and request.limit <= 0:
+      raise ValidationError('Invalid limit')
+    cursor = None
+    if request.cursor:
+      cursor = validate_package_path(request.cursor)
+
+    pkgs, dirs, cursor = self.service.list_directory(
+        path, recursive, limit=request.limit, cursor=cursor)
     caller = auth.get_current_identity()
     visible_pkgs = [p for p in pkgs if acl.can_fetch_package(p, caller)]
     visible_dirs = [d for d in dirs if acl.can_fetch_package(d, caller)]
 
-    return ListPackagesResponse(packages=visible_pkgs, directories=visible_dirs)
+    return ListPackagesResponse(
+        packages=visible_pkgs, directories=visible_dirs, cursor=cursor)
 
 
   ### PackageInstance methods.
@@ -656,6 +670,12 @@ class PackageRepositoryApi(remote.Service):
           status=Status.ALREADY_REGISTERED,
           instance=instance_to_proto(instance))
 
+    if (not impl.is_valid_new_package_depth(package_name) and
+        self.service.get_package(package_name) is None):
+      raise ValidationError(
+          'Package name has more than %d components' %
+          impl.MAX_NEW_PACKAGE_DEPTH)
+
     # Need to upload to CAS first? Open an upload session. Caller must use
     # CASServiceApi to finish the upload and then call registerInstance again.
     if not self.service.is_instance_file_uploaded(package_name, instance_id):
@@ -808,18 +828,28 @@ class PackageRepositoryApi(remote.Service):
       endpoints.ResourceContainer(
           message_types.VoidMessage,
           tag=messages.StringField(1, required=True),
-          package_name=messages.StringField(2, required=False)),
+          package_name=messages.StringField(2, required=False),
+          page_size=messages.IntegerField(3, required=False),
+          cursor=messages.StringField(4, required=False)),
       SearchResponse,
       path='instance/search',
       http_method='GET',
       name='searchInstances')
   def search_instances(self, request):
-    """Returns package instances with given tag (in no particular order)."""
+    """Returns package instances with given tag (in no particular order).
+
+    Returns all of them, unless page_size or cursor is given. Then returns a
+    page of them and a cursor of the next page, if any.
+    """
     tag = validate_instance_tag(request.tag)
     if request.package_name:
       package_name = validate_package_name(request.package_name)
     else:
       package_name = None
+    page_size = request.page_size
+    if page_size is not None and (
+        page_size <= 0 or page_size > impl.SEARCH_MAX_PAGE_SIZE):
+      raise ValidationError('Invalid page size')
 
     caller = auth.get_current_identity()
     callback = None
@@ -836,8 +866,20 @@ class PackageRepositoryApi(remote.Service):
         return acl_cache[package_name]
       callback = check_readable
 
-    found = self.service.search_by_tag(tag, package_name, callback)
-    return SearchResponse(instances=[instance_to_proto(i) for i in found])
+    # Without page_size or cursor returns all instances, as it did before the
+    # search was paged.
+    if page_size is None and not request.cursor:
+      found = self.service.search_by_tag(tag, package_name, callback)
+      return SearchResponse(instances=[instance_to_proto(i) for i in found])
+
+    try:
+      found, cursor = self.service.search_by_tag_page(
+          tag, package_name, callback,
+          page_size=page_size or impl.SEARCH_PAGE_SIZE, cursor=request.cursor)
+    except datastore_errors.BadValueError:
+      raise ValidationError('Invalid cursor')
+    return SearchResponse(
+        instances=[instance_to_proto(i) for i in found], cursor=cursor)
 
 
   @endpoints_method(
@@ -7,7 +7,6 @@
 import logging
 
 from . import processing
-from . import reader
 
 
 # Package name suffix -> location of cipd binary file.
@@ -46,43 +45,60 @@ class ExtractCIPDClientProcessor(processing.Processor):
   def should_process(self, instance):
     return is_cipd_client_package(instance.package_name)
 
-  def run(self, instance, data):
+  def start(self, instance):
     assert self.should_process(instance)
-    binary_name = get_cipd_client_filename(instance.package_name)
+    return _ExtractCIPDClientVisitor(
+        self.cas_service, get_cipd_client_filename(instance.package_name))
 
-    logging.info('Opening the package...')
-    try:
-      src = data.open_packaged_file(binary_name)
-    except reader.NoSuchPackagedFileError:
-      raise processing.ProcessingError(
-          'CIPD client binary "%s" was not found in the package' % binary_name)
 
+class _ExtractCIPDClientVisitor(processing.FileVisitor):
+  """Streams CIPD client binary from the package to CAS."""
+
+  def __init__(self, cas_service, binary_name):
+    super(_ExtractCIPDClientVisitor, self).__init__()
+    self.cas_service = cas_service
+    self.binary_name = binary_name
+    self.dst = None
+    self.result = None
+
+  def wants_file(self, info):
+    return info.path == self.binary_name
+
+  def begin_file(self, info):
     # Upload the binary to CAS store. Don't bother to check whether it is
     # already there since extracting the file from the package to calculate
     # its hash (to query CAS for presence) is as expensive as just overwriting
     # the file in CAS. In most cases it isn't there anyway.
-    try:
-      logging.info('Extracting "%s"...', binary_name)
-      with self.cas_service.start_direct_upload('SHA1') as dst:
-        while True:
-          buf = src.read(512 * 1024)
-          if not buf:
-            break
-          dst.write(buf)
-          del buf
-        hash_digest = dst.hash_digest
-        data_length = dst.length
-    finally:
-      src.close()
+    logging.info('Extracting "%s"...', self.binary_name)
+    self.dst = self.cas_service.start_direct_upload('SHA1')
+
+  def write(self, chunk):
+    self.dst.write(chunk)
 
+  def end_file(self):
+    self.dst.close()
     # Return the location of the extracted binary. If format of this dict
     # changes in a non backward compatible way, the version number in
     # CIPD_BINARY_EXTRACT_PROCESSOR should change too.
-    # See impl.RepoService.get_client_binary_info for code that reads this data.
-    return {
+    # See impl.RepoService.get_client_binary_info for code that reads this
+    # data.
+    self.result = {
       'client_binary': {
-        'size': data_length,
+        'size': self.dst.length,
         'hash_algo': 'SHA1',
-        'hash_digest': hash_digest,
+        'hash_digest': self.dst.hash_digest,
       },
     }
+    self.dst = None
+
+  def finish(self):
+    if self.result is None:
+      raise processing.ProcessingError(
+          'CIPD client binary "%s" was not found in the package' %
+          self.binary_name)
+    return self.result
+
+  def abort(self):
+    if self.dst:
+      self.dst.close(commit=False)
+      self.dst = None
@@ -27,7 +27,9 @@ All PackageInstance that belong to the same package are stored in the same
 entity group (with root key derived from package name, see Package entity).
 
 Package entity (even though it is empty) is also instantiated in the datastore
-to make possible querying for a list of known packages.
+to make possible querying for a list of known packages. Package names are also
+indexed in a tree of PackageDirectory entities (one per directory), used to list
+the contents of a directory without scanning all packages under it.
 
 Once a package instance is uploaded, it may be asynchronously processed by
 a number of "processors" that read and evaluate package contents producing some
@@ -93,14 +95,17 @@ Buildbot builders should not be allowed to set by other WRITERs.
 """
 
 import collections
+import functools
 import hashlib
 import json
 import logging
 import re
+import threading
 import webapp2
 
 from google.appengine import runtime
 from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
 from components import auth
@@ -118,6 +123,12 @@ from . import reader
 # be lower case.
 PACKAGE_NAME_RE = re.compile(r'^([a-z0-9_\-]+/)*[a-z0-9_\-]+$')
 
+# Maximum number of path components in a name of a new package. A package is
+# registered in one cross group transaction with all its parent PackageDirectory
+# entities (including the root), and transactions can span at most 25 entity
+# groups.
+MAX_NEW_PACKAGE_DEPTH = 24
+
 # Regular expression for a package path (path inside package namespace).
 PACKAGE_PATH_RE = re.compile(r'^([a-z0-9_\-]+/)*[a-z0-9_\-]+$')
 
@@ -133,6 +144,29 @@ TAG_KEY_RE = re.compile(r'^[a-z0-9_\-]+$')
 # Hash algorithm used to derive package instance ID from package data.
 DIGEST_ALGO = 'SHA1'
 
+# Default and maximum number of instances returned by search_by_tag_page.
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_PAGE_SIZE = 1000
+
+# How many page_size batches of tags search_by_tag_page scans at most.
+SEARCH_MAX_SCANNED_PAGES = 10
+
+# How long to keep resolved refs and tags in memcache. Entries are deleted when
+# refs or tags change, expiration only limits staleness in case of races.
+RESOLVE_CACHE_SEC = 5 * 60
+
+# How long to keep signed fetch URLs in the cache. Must be smaller than
+# cas.impl.FETCH_URL_EXPIRATION_SEC, so that clients get URLs that are valid for
+# at least FETCH_URL_EXPIRATION_SEC - FETCH_URL_CACHE_SEC seconds.
+FETCH_URL_CACHE_SEC = 30 * 60
+
+# How long to keep entries in the local in-process cache. Other instances can't
+# invalidate it, so it defines how long they may serve an outdated ref.
+LOCAL_CACHE_SEC = 30
+
+# Maximum number of entries in the local in-process cache.
+LOCAL_CACHE_SIZE = 10000
+
 
 # Information about extract CIPD client binary, see get_client_binary_info.
 ClientBinaryInfo = collections.namedtuple(
@@ -179,6 +213,19 @@ class RepoService(object):
     """
     return package_key(package_name).get()
 
+  def list_packages(self, dir_path, recursive):
+    """Returns lists of package names and directory names with the given prefix.
+
+    Args:
+      dir_path: string directory from which to list packages.
+      recursive: boolean whether to list contents of subdirectories.
+
+    Returns:
+      [package name, ...], [directory name, ...]
+    """
+    pkgs, dirs, _ = self.list_directory(dir_path, recursive)
+    return pkgs, dirs
+
   @staticmethod
   def _is_in_directory(directory, path, recursive):
     """Tests if the path is under the given directory.
@@ -210,21 +257,14 @@ class RepoService(object):
       return False
     return True
 
-  def list_packages(self, dir_path, recursive):
-    """Returns lists of package names and directory names with the given prefix.
-
-    Args:
-      dir_path: string directory from which to list packages.
-      recursive: boolean whether to list contents of subdirectories.
+  def _list_packages_by_query(self, dir_path, recursive):
+    """Returns sets of package names and directory names under dir_path.
 
-    Returns:
-      [package name, ...], [directory name, ...]
+    Scans all packages with the prefix. Used by list_directory until the
+    PackageDirectory tree is complete.
     """
     query = Package.query()
 
-    # Normalize directory to simplify matching logic later.
-    dir_path = dir_path.rstrip('/')
-
     # Only apply the filtering if a prefix was given. The empty string isn't a
     # valid key and will result in an exception.
     if dir_path:
@@ -249,11 +289,97 @@ class RepoService(object):
         parts = pkg.split('/')
         dirs.update('/'.join(parts[:n]) for n in xrange(1, len(parts)))
 
-    dirs = [d for d in dirs if self._is_in_directory(dir_path, d, recursive)]
-    pkgs = [p for p in pkgs if self._is_in_directory(dir_path, p, recursive)
-            or len(dir_path) == len(p)]
+    dirs = set(
+        d for d in dirs if self._is_in_directory(dir_path, d, recursive))
+    pkgs = set(
+        p for p in pkgs if self._is_in_directory(dir_path, p, recursive)
+        or len(dir_path) == len(p))
     return pkgs, dirs
 
+  def list_directory(self, dir_path, recursive, limit=None, cursor=None):
+    """Lists packages and directories under the given directory page by page.
+
+    Walks the PackageDirectory tree maintained by register_instance, so the cost
+    is proportional to the number of returned entries, not to the number of
+    packages that share the prefix. Entries are ordered by path components
+    (depth first traversal of the tree). A package whose name matches dir_path
+    is returned as well. Until the tree is complete (see
+    rebuild_package_directories), scans all packages under dir_path instead.
+
+    Args:
+      dir_path: string directory from which to list packages.
+      recursive: boolean whether to list contents of subdirectories.
+      limit: maximum number of names to return (or None for all).
+      cursor: a value returned by a previous call to continue the listing.
+
+    Returns:
+      ([package name, ...], [directory name, ...], cursor or None if done).
+    """
+    # Normalize directory to simplify matching logic later.
+    dir_path = dir_path.rstrip('/')
+    if dir_path and not is_valid_package_path(dir_path):
+      return [], [], None
+    after = cursor.split('/') if cursor else None
+    tree_complete = is_package_directory_tree_complete()
+
+    pkgs = []
+    dirs = []
+    state = {'count': 0, 'last': None}
+
+    def emit(path, is_pkg, is_dir):
+      if limit is not None and state['count'] >= limit:
+        return False
+      if is_pkg:
+        pkgs.append(path)
+      if is_dir:
+        dirs.append(path)
+      state['count'] += 1
+      state['last'] = path
+      return True
+
+    # Until rebuild_package_directories has added packages registered before
+    # the tree existed, scan all packages under the directory instead.
+    if not tree_complete:
+      found_pkgs, found_dirs = self._list_packages_by_query(dir_path, recursive)
+      for path in sorted(found_pkgs | found_dirs, key=lambda p: p.split('/')):
+        if after and path.split('/') <= after:
+          continue
+        if not emit(path, path in found_pkgs, path in found_dirs):
+          return pkgs, dirs, state['last']
+      return pkgs, dirs, None
+
+    # The package with the exact name goes first, before anything inside it.
+    if dir_path and not after and package_key(dir_path).get():
+      emit(dir_path, True, False)
+
+    def visit(node):
+      children = sorted(
+          set(node.packages) | set(node.directories),
+          key=lambda p: p.split('/'))
+      subdirs = set(node.directories)
+      # Batch fetch subdirectories that the walk is going to descend into.
+      descend = []
+      if recursive:
+        descend = [
+          d for d in children
+          if d in subdirs and (not after or _after_or_ancestor(d, after))
+        ]
+      nodes = dict(zip(
+          descend, ndb.get_multi(package_directory_key(d) for d in descend)))
+      for child in children:
+        parts = child.split('/')
+        if not after or parts > after:
+          if not emit(child, child in node.packages, child in subdirs):
+            return False
+        if nodes.get(child) and not visit(nodes[child]):
+          return False
+      return True
+
+    root = package_directory_key(dir_path).get()
+    if root and not visit(root):
+      return pkgs, dirs, state['last']
+    return pkgs, dirs, None
+
   def get_processing_result(self, package_name, instance_id, processor_name):
     """Returns results of some asynchronous processor or None if not ready.
 
@@ -268,13 +394,17 @@ class RepoService(object):
     return processing_result_key(
         package_name, instance_id, processor_name).get()
 
-  @ndb.transactional
+  @ndb.transactional(xg=True)
   def register_instance(self, package_name, instance_id, caller, now=None):
     """Makes new PackageInstance entity if it is not yet there.
 
     Caller must verify that package data is already uploaded to CAS (by using
     is_instance_file_uploaded method).
 
+    When a new package is created, all its parent PackageDirectory entities are
+    updated in the same (cross group) transaction, so names of new packages can
+    have at most MAX_NEW_PACKAGE_DEPTH components.
+
     Args:
       package_name: name of the package, e.g. 'infra/tools/cipd'.
       instance_id: identifier of the package instance (SHA1 of package file).
@@ -294,7 +424,9 @@ class RepoService(object):
     now = now or utils.utcnow()
     pkg_key = package_key(package_name)
     if not pkg_key.get():
+      assert is_valid_new_package_depth(package_name), package_name
       Package(key=pkg_key, registered_by=caller, registered_ts=now).put()
+      add_to_package_directories(package_name)
 
     inst = PackageInstance(
         key=key,
@@ -325,6 +457,8 @@ class RepoService(object):
   def generate_fetch_url(self, instance):
     """Given PackageInstance returns signed URL to a package file.
 
+    Signed URLs are cached for FETCH_URL_CACHE_SEC.
+
     Args:
       instance: existing PackageInstance entity.
 
@@ -332,8 +466,14 @@ class RepoService(object):
       Signed URL that can be used by a client to fetch package file.
     """
     assert self.is_fetch_configured()
-    return self.cas_service.generate_fetch_url(
-        DIGEST_ALGO, instance.instance_id)
+    return self._cached_fetch_url(DIGEST_ALGO, instance.instance_id)
+
+  def _cached_fetch_url(self, hash_algo, hash_digest):
+    """Returns a signed URL to a CAS object, generating it if not cached."""
+    return hot_cache.get_or_fill(
+        ('fetch_url', hash_algo, hash_digest),
+        lambda: self.cas_service.generate_fetch_url(hash_algo, hash_digest),
+        FETCH_URL_CACHE_SEC)
 
   def get_client_binary_info(self, instance):
     """Returns URL to the client binary, its SHA1 hash and size.
@@ -369,7 +509,7 @@ class RepoService(object):
     assert isinstance(data['size'], (int, long))
     assert data['hash_algo'] == 'SHA1'
     assert cas.is_valid_hash_digest('SHA1', data['hash_digest'])
-    fetch_url = self.cas_service.generate_fetch_url('SHA1', data['hash_digest'])
+    fetch_url = self._cached_fetch_url('SHA1', data['hash_digest'])
     return ClientBinaryInfo(
         sha1=data['hash_digest'],
         size=data['size'],
@@ -435,6 +575,9 @@ class RepoService(object):
       ref.modified_by = caller
       ref.modified_ts = now or utils.utcnow()
       ref.put()
+      ndb.get_context().call_on_commit(
+          lambda: hot_cache.delete_multi(
+              [('ref', package_name, key.string_id())]))
     return ref
 
   def query_tags(self, package_name, instance_id):
@@ -506,6 +649,10 @@ class RepoService(object):
       for tag, ent in zip(tags, existing) if not ent
     ]
     ndb.put_multi(to_create)
+    if to_create:
+      ndb.get_context().call_on_commit(
+          lambda: hot_cache.delete_multi(
+              ('tag', package_name, e.tag) for e in to_create))
 
     attached = {}
     attached.update({e.tag: e for e in existing if e})
@@ -528,11 +675,15 @@ class RepoService(object):
     ndb.delete_multi(
         instance_tag_key(package_name, instance_id, tag)
         for tag in tags)
+    ndb.get_context().call_on_commit(
+        lambda: hot_cache.delete_multi(
+            ('tag', package_name, tag) for tag in tags))
 
   def search_by_tag(self, tag, package_name=None, callback=None):
     """Returns package instances with a given tag.
 
-    Sorts by tagging time. Newest tags first.
+    Sorts by tagging time. Newest tags first. Fetches all matching instances,
+    see search_by_tag_page for a paged version.
 
     Args:
       tag: tag to search for.
@@ -543,26 +694,84 @@ class RepoService(object):
     Returns:
       List of PackageInstance entities.
     """
-    # TODO(vadimsh): Support cursors.
+    found = []
+    cursor = None
+    while True:
+      page, cursor = self.search_by_tag_page(
+          tag, package_name, callback, cursor=cursor)
+      found.extend(page)
+      if not cursor:
+        return found
+
+  def search_by_tag_page(
+      self, tag, package_name=None, callback=None,
+      page_size=SEARCH_PAGE_SIZE, cursor=None):
+    """Returns a page of package instances with a given tag.
+
+    Sorts by tagging time. Newest tags first. Tag keys are fetched in batches.
+    PackageInstance entities of a batch are fetched asynchronously while the
+    next batch of tag keys is being queried.
+
+    Scans at most SEARCH_MAX_SCANNED_PAGES * page_size tags per call, so the
+    page can be shorter than page_size (or even empty) if callback rejects most
+    of them. The search is finished only when returned cursor is None.
+
+    Args:
+      tag: tag to search for.
+      package_name: if given, limit search only to given package.
+      callback: called as callback(package_name, instance_id), returns True to
+          continue processing the instance, False to skip. Used to plug in ACLs.
+      page_size: maximum number of instances to return.
+      cursor: urlsafe cursor returned by a previous call, or None to start.
+
+    Returns:
+      Tuple (list of PackageInstance entities, urlsafe cursor or None).
+    """
     assert is_valid_instance_tag(tag), tag
+    assert page_size > 0, page_size
     q = InstanceTag.query(
         InstanceTag.tag == tag,
         ancestor=package_key(package_name) if package_name else None)
     q = q.order(-InstanceTag.registered_ts)
+
+    max_scanned = page_size * SEARCH_MAX_SCANNED_PAGES
+    scanned = 0
+    accepted = 0
+    inst_futures = []
+
+    curs = ndb.Cursor(urlsafe=cursor) if cursor else None
+    batch_future = q.fetch_page_async(
+        page_size, start_cursor=curs, keys_only=True)
+    while batch_future:
+      tag_keys, curs, more = batch_future.get_result()
+      batch_future = None
+      scanned += len(tag_keys)
+
+      # Apply the callback to the whole batch, fetch accepted instances.
+      inst_keys = [
+        k.parent() for k in tag_keys
+        if not callback or callback(
+            k.parent().parent().string_id(), k.parent().string_id())
+      ]
+      inst_futures.append(ndb.get_multi_async(inst_keys))
+      accepted += len(inst_keys)
+
+      # Query the next batch while instances of this one are being fetched. Ask
+      # only for as many tags as needed to fill the page, so that the cursor
+      # always points right after the last returned instance.
+      if more and accepted < page_size and scanned < max_scanned:
+        batch_future = q.fetch_page_async(
+            page_size - accepted, start_cursor=curs, keys_only=True)
+
     found = []
-    for tag_key in q.iter(keys_only=True):
-      package_name = tag_key.parent().parent().string_id()
-      instance_id = tag_key.parent().string_id()
-      if callback and not callback(package_name, instance_id):
-        continue
-      # TODO(vadimsh): This can be fetched asynchronously while next page of
-      # query results is being fetched.
-      inst = tag_key.parent().get()
-      if inst is None:  # pragma: no cover
-        continue
-      assert isinstance(inst, PackageInstance), inst
-      found.append(inst)
-    return found
+    for futures in inst_futures:
+      for f in futures:
+        inst = f.get_result()
+        if inst is None:  # pragma: no cover
+          continue
+        assert isinstance(inst, PackageInstance), inst
+        found.append(inst)
+    return found, (curs.urlsafe() if more and curs else None)
 
   def resolve_version(self, package_name, version, limit):
     """Given an instance ID, a ref or a tag returns instance IDs that match it.
@@ -584,18 +793,28 @@ class RepoService(object):
 
     # A ref? set_package_ref ensures the instance exists, no need to recheck it.
     if is_valid_package_ref(version):
-      ref = package_ref_key(package_name, version).get()
-      return [ref.instance_id] if ref else []
+      def resolve_ref():
+        ref = package_ref_key(package_name, version).get()
+        return [ref.instance_id] if ref else []
+      return hot_cache.get_or_fill(
+          ('ref', package_name, version), resolve_ref, RESOLVE_CACHE_SEC)
 
     # If looks like a tag, resolve it to a list of instance IDs.
     if is_valid_instance_tag(version):
-      q = InstanceTag.query(
-          InstanceTag.tag == version,
-          ancestor=package_key(package_name))
-      return [
-        k.parent().string_id()
-        for k in q.iter(keys_only=True, limit=limit)
-      ]
+      def resolve_tag():
+        q = InstanceTag.query(
+            InstanceTag.tag == version,
+            ancestor=package_key(package_name))
+        ids = [
+          k.parent().string_id()
+          for k in q.iter(keys_only=True, limit=limit)
+        ]
+        return ids, len(ids) < limit
+      # Cached list is usable if it is complete or has enough items.
+      ids, _ = hot_cache.get_or_fill(
+          ('tag', package_name, version), resolve_tag, RESOLVE_CACHE_SEC,
+          is_usable=lambda cached: cached[1] or len(cached[0]) >= limit)
+      return ids[:limit]
 
     raise AssertionError('Impossible state')
 
@@ -647,10 +866,39 @@ class RepoService(object):
       # Apply the change.
       ndb.put_multi([package_instance, result_entity])
 
+    # Streaming processors all run during a single pass over the package. The
+    # rest run one after another, reusing the already opened package.
+    streaming = []
+    sequential = []
+    for proc in to_run:
+      visitor = proc.start(inst)
+      if visitor is not None:
+        streaming.append((proc, visitor))
+      else:
+        sequential.append(proc)
+
     # Run the processing.
-    data = reader.PackageReader(self.cas_service, DIGEST_ALGO, instance_id)
+    data = reader.PackageReader(
+        self.cas_service, DIGEST_ALGO, instance_id,
+        read_buffer_size=(
+            reader.STREAMING_READ_BUFFER_SIZE if streaming else
+            reader.DEFAULT_READ_BUFFER_SIZE))
     try:
-      for proc in to_run:
+      if streaming:
+        logging.info(
+            'Running streaming processors %s on %s:%s',
+            ', '.join(p.name for p, _ in streaming), package_name, instance_id)
+        results = processing.run_streaming(streaming, data)
+        for proc, _ in streaming:
+          result, exc = results[proc.name]
+          if exc is not None:
+            logging.error(
+                'Processor "%s" failed.\nInstance: %s:%s\n\n%s',
+                proc.name, package_name, instance_id, exc)
+            store_result(proc.name, None, str(exc))
+          else:
+            store_result(proc.name, result, None)
+      for proc in sequential:
         logging.info(
             'Running processor "%s" on %s:%s',
             proc.name, package_name, instance_id)
@@ -686,11 +934,119 @@ class RepoService(object):
           (instance_id, ' '.join(inst.processors_pending)))
 
 
+class HotCache(object):
+  """Two level cache (in-process LRU in front of memcache) for hot read paths.
+
+  Used to cache results of resolve_version and signed fetch URLs requested by
+  every bot running 'cipd ensure'. Keys are tuples of strings.
+
+  Entries in the local cache expire after LOCAL_CACHE_SEC, since other instances
+  have no way to invalidate them. Memcache entries are deleted explicitly via
+  delete_multi when the underlying data changes, and get_or_fill never puts
+  back a value read before the deletion.
+  """
+
+  # Stored in memcache while a value is being filled.
+  _PLACEHOLDER = '\0placeholder'
+  _PLACEHOLDER_SEC = 60
+
+  def __init__(self, namespace, max_size):
+    self._namespace = namespace
+    self._max_size = max_size
+    self._lock = threading.Lock()
+    # Cache key -> (expiration timestamp, value). Least recently used first.
+    self._local = collections.OrderedDict()
+
+  @staticmethod
+  def _memcache_key(key):
+    # Package names and tags can be longer than memcache key size limit.
+    return hashlib.sha1('\0'.join(key)).hexdigest()
+
+  def get_or_fill(self, key, fill, expiration_sec, is_usable=None):
+    """Returns cached value, calling fill() to get and cache it if missing.
+
+    Memcache is filled with compare-and-set against the entry (or a placeholder
+    added on a miss) as it was before fill() was called. An invalidation by
+    delete_multi in the meantime makes the compare-and-set fail, so a value
+    read before the underlying data changed is never cached after it.
+
+    Args:
+      key: tuple of strings.
+      fill: called to produce the value (that must not be None).
+      expiration_sec: how long to keep the value in memcache.
+      is_usable: if given, called with a cached value, returns False if the
+          value can't be used and must be filled again.
+
+    Returns:
+      Cached or just filled value.
+    """
+    is_usable = is_usable or (lambda _value: True)
+    now = utils.time_time()
+    with self._lock:
+      entry = self._local.pop(key, None)
+      if entry and entry[0] > now:
+        self._local[key] = entry
+        if is_usable(entry[1]):
+          return entry[1]
+
+    client = memcache.Client()
+    memcache_key = self._memcache_key(key)
+    value = client.gets(memcache_key, namespace=self._namespace)
+    if value is None:
+      client.add(
+          memcache_key, self._PLACEHOLDER, time=self._PLACEHOLDER_SEC,
+          namespace=self._namespace)
+      value = client.gets(memcache_key, namespace=self._namespace)
+    if value is not None and value != self._PLACEHOLDER and is_usable(value):
+      self._set_local(key, value, now + LOCAL_CACHE_SEC)
+      return value
+
+    # Without a CAS ID from gets() there is nothing to safely update.
+    has_cas_id = value is not None
+    value = fill()
+    assert value is not None
+    if has_cas_id and client.cas(
+        memcache_key, value, time=expiration_sec, namespace=self._namespace):
+      self._set_local(key, value, now + min(expiration_sec, LOCAL_CACHE_SEC))
+    return value
+
+  def delete_multi(self, keys):
+    """Removes given keys from the cache."""
+    keys = list(keys)
+    with self._lock:
+      for key in keys:
+        self._local.pop(key, None)
+    memcache.delete_multi(
+        [self._memcache_key(k) for k in keys], namespace=self._namespace)
+
+  def clear_local(self):
+    """Clears the local in-process part of the cache."""
+    with self._lock:
+      self._local.clear()
+
+  def _set_local(self, key, value, expiration_ts):
+    with self._lock:
+      self._local.pop(key, None)
+      self._local[key] = (expiration_ts, value)
+      while len(self._local) > self._max_size:
+        self._local.popitem(last=False)
+
+
+# Shared by all RepoService instances in the process.
+hot_cache = HotCache('cipd', LOCAL_CACHE_SIZE)
+
+
 def is_valid_package_name(package_name):
   """True if string looks like a valid package name."""
   return package_name and bool(PACKAGE_NAME_RE.match(package_name))
 
 
+def is_valid_new_package_depth(package_name):
+  """True if a package with this name can be registered, see register_instance.
+  """
+  return package_name.count('/') < MAX_NEW_PACKAGE_DEPTH
+
+
 def is_valid_package_path(package_path):
   """True if string looks like a valid package path."""
   return package_path and bool(PACKAGE_PATH_RE.match(package_path))
@@ -797,6 +1153,139 @@ def package_instance_key(package_name, instance_id):
   return ndb.Key(PackageInstance, instance_id, parent=package_key(package_name))
 
 
+################################################################################
+## Package directories support.
+
+
+# ID of PackageDirectory entity that represents the root of the namespace.
+ROOT_DIRECTORY_ID = '/'
+
+
+class PackageDirectory(ndb.Model):
+  """Immediate children of some directory in the package namespace.
+
+  ID is a directory path (e.g. 'infra/tools') or ROOT_DIRECTORY_ID for the root.
+  Directories are derived from package names: each package name prefix that
+  ends before a '/' is a directory. Entities are updated transactionally when
+  a new package is registered and never removed (packages are never removed
+  either).
+
+  Each directory is a separate entity group, so registering a package touches
+  one entity group per path component of its name.
+  """
+  # Full names of packages located directly in this directory.
+  packages = ndb.StringProperty(repeated=True, indexed=False)
+  # Full paths of subdirectories located directly in this directory.
+  directories = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class PackageDirectoryRebuild(ndb.Model):
+  """Marks that the PackageDirectory tree has all packages.
+
+  Packages registered before the tree was introduced are added to it by
+  rebuild_package_directories. Until it is done, list_directory scans Package
+  entities instead of walking the tree.
+
+  Entity key: PACKAGE_DIRECTORY_REBUILD_KEY.
+  """
+  complete = ndb.BooleanProperty(default=False, indexed=False)
+
+
+PACKAGE_DIRECTORY_REBUILD_KEY = ndb.Key(PackageDirectoryRebuild, 'rebuild')
+
+
+def is_package_directory_tree_complete():
+  """True if all packages were added to the PackageDirectory tree."""
+  rebuild = PACKAGE_DIRECTORY_REBUILD_KEY.get()
+  return bool(rebuild and rebuild.complete)
+
+
+def package_directory_key(dir_path):
+  """Returns ndb.Key corresponding to particular PackageDirectory entity."""
+  if not dir_path:
+    return ndb.Key(PackageDirectory, ROOT_DIRECTORY_ID)
+  assert is_valid_package_path(dir_path), dir_path
+  return ndb.Key(PackageDirectory, dir_path)
+
+
+def add_to_package_directories(package_name):
+  """Adds a package and all its parent directories to PackageDirectory tree.
+
+  Idempotent. Puts only entities that actually changed. Should be called in
+  a cross group transaction to keep the tree consistent with Package entities.
+
+  Args:
+    package_name: name of the package, e.g. 'infra/tools/cipd'.
+  """
+  assert is_valid_package_name(package_name), package_name
+  parts = package_name.split('/')
+  # Pairs (directory path, name of its immediate child).
+  chain = [
+    ('/'.join(parts[:i]), '/'.join(parts[:i+1])) for i in xrange(len(parts))
+  ]
+  keys = [package_directory_key(d) for d, _ in chain]
+  entities = ndb.get_multi(keys)
+  to_put = []
+  for i, ((_, child), ent) in enumerate(zip(chain, entities)):
+    ent = ent or PackageDirectory(key=keys[i])
+    # The last item in the chain is the package itself, the rest are dirs.
+    children = ent.packages if i == len(chain) - 1 else ent.directories
+    if child not in children:
+      children.append(child)
+      to_put.append(ent)
+  ndb.put_multi(to_put)
+
+
+def _after_or_ancestor(path, after):
+  """True if path is ordered after path components 'after' or is its ancestor.
+
+  Used when resuming a listing from a cursor: such directories may still have
+  entries that were not returned yet.
+  """
+  parts = path.split('/')
+  return parts > after or after[:len(parts)] == parts
+
+
+def rebuild_package_directories(cursor=None, page_size=500):
+  """Adds a page of existing packages to PackageDirectory tree.
+
+  Used to populate the tree for packages registered before it was introduced,
+  see RebuildDirectoriesTaskHandler. Idempotent. After the last page, marks the
+  tree complete, so list_directory starts using it.
+
+  Args:
+    cursor: urlsafe cursor returned by the previous call, or None to start.
+    page_size: number of packages to add.
+
+  Returns:
+    Urlsafe cursor of the next page, or None if all packages were added.
+  """
+  start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+  keys, next_cursor, more = Package.query().fetch_page(
+      page_size, keys_only=True, start_cursor=start_cursor)
+  for key in keys:
+    ndb.transaction(
+        functools.partial(add_to_package_directories, key.string_id()),
+        xg=True)
+  if more and next_cursor:
+    return next_cursor.urlsafe()
+  PackageDirectoryRebuild(
+      key=PACKAGE_DIRECTORY_REBUILD_KEY, complete=True).put()
+  return None
+
+
+def enqueue_rebuild_package_directories(cursor=None):
+  """Enqueues a task to add a page of packages to PackageDirectory tree.
+
+  Returns:
+    True if the task was enqueued.
+  """
+  return utils.enqueue_task(
+      url='/internal/taskqueue/cipd-rebuild-directories',
+      queue_name='cipd-rebuild-directories',
+      payload=json.dumps({'cursor': cursor}, sort_keys=True))
+
+
 ################################################################################
 ## Refs support.
 
@@ -929,9 +1418,28 @@ class ProcessTaskQueueHandler(webapp2.RequestHandler):  # pragma: no cover
         processors=payload['processors'])
 
 
+class RebuildDirectoriesTaskHandler(webapp2.RequestHandler):  # pragma: no cover
+  """Adds a page of packages to PackageDirectory tree, chaining the next one.
+
+  A one-off job started by admins via admin API rebuildPackageDirectories.
+  """
+  # pylint: disable=R0201
+  @decorators.require_taskqueue('cipd-rebuild-directories')
+  def post(self):
+    payload = json.loads(self.request.body)
+    cursor = rebuild_package_directories(payload['cursor'])
+    if cursor is None:
+      logging.info('PackageDirectory tree is rebuilt')
+    elif not enqueue_rebuild_package_directories(cursor):
+      self.abort(500, detail='Failed to enqueue the next page')
+
+
 def get_backend_routes():  # pragma: no cover
   """Returns a list of webapp2.Route to add to backend WSGI app."""
   return [
+    webapp2.Route(
+        r'/internal/taskqueue/cipd-rebuild-directories',
+        RebuildDirectoriesTaskHandler),
     webapp2.Route(
         r'/internal/taskqueue/cipd-process/<instance_id:.+>',
         ProcessTaskQueueHandler),
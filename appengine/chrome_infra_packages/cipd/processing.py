@@ -2,7 +2,26 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-"""Post-processing steps applied to uploaded package instances."""
+"""Post-processing steps applied to uploaded package instances.
+
+There are two kinds of processors:
+  * Processors that implement 'run'. They get random access to the package via
+    PackageReader and are executed one after another.
+  * Streaming processors that implement 'start' and return a FileVisitor. All
+    such processors are executed at once, during a single sequential pass over
+    the package file (see run_streaming). Each package file is inflated only
+    once and its data is fanned out to all interested visitors.
+"""
+
+import time
+import zipfile
+import zlib
+
+from . import reader
+
+
+# Size of a chunk of inflated data passed to FileVisitor.write.
+STREAM_CHUNK_SIZE = 512 * 1024
 
 
 class ProcessingError(Exception):
@@ -12,22 +31,47 @@ class ProcessingError(Exception):
   """
 
 
+class BudgetExceededError(ProcessingError):
+  """Streaming processor used more time or read more data than allowed."""
+
+
 class Processor(object):
   """Object that runs some post processing step on a package instance data."""
 
   # Must be set in subclasses, identifies the processor kind.
   name = None
 
+  # Limits enforced in streaming mode (None for no limit): maximum wall clock
+  # time spent in FileVisitor calls, and maximum amount of inflated data
+  # passed to FileVisitor.write.
+  time_budget_sec = None
+  data_budget_bytes = None
+
   def should_process(self, instance):
     """Returns True if this processor should process given PackageInstance."""
     raise NotImplementedError()
 
+  def start(self, instance):
+    """Starts the processing step in streaming mode.
+
+    Args:
+      instance: PackageInstance entity to process.
+
+    Returns:
+      FileVisitor that receives package files, or None if the processor doesn't
+      support streaming mode (and 'run' should be used instead).
+    """
+    return None
+
   def run(self, instance, data):
     """Runs the processing step on the package instance.
 
     It must be idempotent. The processor may be called multiple times for same
     package (when retrying task queue tasks and so on).
 
+    Default implementation runs FileVisitor returned by 'start' in a pass over
+    the package.
+
     Args:
       instance: PackageInstance entity to process.
       data: PackageReader that can be used to read package data.
@@ -44,4 +88,149 @@ class Processor(object):
     Storage flakes, etc, etc.) are considered transient errors and trigger
     retry of the processing task.
     """
+    visitor = self.start(instance)
+    if visitor is None:
+      raise NotImplementedError()
+    result, error = run_streaming([(self, visitor)], data)[self.name]
+    if error is not None:
+      raise error
+    return result
+
+
+class FileVisitor(object):
+  """Receives package files during a single sequential pass over the package.
+
+  Returned by Processor.start. Files are visited in the order they are stored
+  in the package. Any method can raise ProcessingError or ReaderError to fail
+  the processing step.
+  """
+
+  def wants_file(self, info):
+    """Returns True to receive the body of a file given as PackagedFileInfo."""
+    return False
+
+  def begin_file(self, info):
+    """Called before the body of a wanted file is passed to 'write'."""
+
+  def write(self, chunk):
+    """Called with consecutive chunks of the body of the current file."""
+
+  def end_file(self):
+    """Called after the whole body of the current file was passed to 'write'."""
+
+  def finish(self):
+    """Called after the pass is complete, returns JSON serializable result."""
     raise NotImplementedError()
+
+  def abort(self):
+    """Called instead of 'finish' if the visitor failed. Releases resources."""
+
+
+class _VisitorState(object):
+  """Tracks resource usage of a FileVisitor during run_streaming."""
+
+  def __init__(self, processor, visitor):
+    self.processor = processor
+    self.visitor = visitor
+    self.elapsed = 0.0
+    self.consumed = 0
+    self.error = None
+
+  def call(self, method, *args):
+    """Calls a visitor method, returns its result or None if the visitor failed.
+
+    ProcessingError and ReaderError are remembered as the visitor error, any
+    other exception is propagated (to retry the whole processing task).
+    """
+    if self.error:
+      return None
+    started = time.time()
+    try:
+      return getattr(self.visitor, method)(*args)
+    except (ProcessingError, reader.ReaderError) as exc:
+      self.error = exc
+      return None
+    finally:
+      self.elapsed += time.time() - started
+      self._check_budget()
+
+  def account(self, length):
+    """Records that 'length' bytes are about to be passed to the visitor."""
+    self.consumed += length
+    self._check_budget()
+
+  def _check_budget(self):
+    if self.error:
+      return
+    budget = self.processor.time_budget_sec
+    if budget is not None and self.elapsed > budget:
+      self.error = BudgetExceededError(
+          'Processor exceeded its time budget of %.1f sec' % budget)
+    budget = self.processor.data_budget_bytes
+    if budget is not None and self.consumed > budget:
+      self.error = BudgetExceededError(
+          'Processor exceeded its data budget of %d bytes' % budget)
+
+
+def run_streaming(processors, data):
+  """Runs streaming processors during a single sequential pass over the package.
+
+  Each package file is read and inflated at most once, only if some visitor
+  wants it, and its body is passed to all such visitors in chunks. A visitor
+  that raises ProcessingError or ReaderError, or exceeds the budget of its
+  processor, is excluded from the rest of the pass, without affecting others.
+
+  Args:
+    processors: list of (Processor, FileVisitor returned by its 'start').
+    data: PackageReader to read the package with.
+
+  Returns:
+    {processor name: (result, None) or (None, exception)}.
+  """
+  states = [_VisitorState(p, v) for p, v in processors]
+  try:
+    files = data.iter_packaged_files()
+  except reader.ReaderError as exc:
+    return {s.processor.name: (None, exc) for s in states}
+
+  for info in files:
+    wanted = [s for s in states if s.call('wants_file', info)]
+    if not wanted:
+      continue
+    try:
+      src = data.open_packaged_file(info.path)
+    except reader.ReaderError as exc:
+      for s in wanted:
+        s.error = s.error or exc
+      continue
+    try:
+      for s in wanted:
+        s.call('begin_file', info)
+      while any(not s.error for s in wanted):
+        try:
+          chunk = src.read(STREAM_CHUNK_SIZE)
+        except (zipfile.BadZipfile, zlib.error) as exc:
+          for s in wanted:
+            s.error = s.error or reader.BadPackageError(str(exc))
+          break
+        if not chunk:
+          break
+        for s in wanted:
+          if not s.error:
+            s.account(len(chunk))
+          s.call('write', chunk)
+        del chunk
+      for s in wanted:
+        s.call('end_file')
+    finally:
+      src.close()
+
+  results = {}
+  for s in states:
+    result = s.call('finish')
+    if s.error:
+      s.visitor.abort()
+      results[s.processor.name] = (None, s.error)
+    else:
+      results[s.processor.name] = (result, None)
+  return results
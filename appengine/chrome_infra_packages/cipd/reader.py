@@ -15,6 +15,14 @@ import cas
 # Information about single file in the package.
 PackagedFileInfo = collections.namedtuple('PackagedFileInfo', ['path', 'size'])
 
+# ZipFile makes lot of seeks when reading zip directory, smaller chunk size
+# helps here.
+DEFAULT_READ_BUFFER_SIZE = 256 * 1024
+
+# Chunk size to use when the whole package is read sequentially. Bigger chunks
+# mean fewer ranged reads from Cloud Storage.
+STREAMING_READ_BUFFER_SIZE = 2 * 1024 * 1024
+
 
 class ReaderError(Exception):
   """Base class for exception from this module."""
@@ -31,13 +39,17 @@ class NoSuchPackagedFileError(ReaderError):
 class PackageReader(object):
   """Knows how to read contents of a package file."""
 
-  def __init__(self, cas_service, hash_algo, hash_digest):
+  def __init__(
+      self, cas_service, hash_algo, hash_digest,
+      read_buffer_size=DEFAULT_READ_BUFFER_SIZE):
     self.cas_service = cas_service
     self.hash_algo = hash_algo
     self.hash_digest = hash_digest
+    self.read_buffer_size = read_buffer_size
     self._raw = None
     self._zip = None
     self._dir = None
+    self._ordered = None
 
   def __enter__(self):
     return self
@@ -55,6 +67,18 @@ class PackageReader(object):
     self.ensure_open()
     return self._dir
 
+  def iter_packaged_files(self):
+    """Returns an iterator over PackagedFileInfo in order of their zip offsets.
+
+    Reading files in this order results in a sequential scan of the underlying
+    package file, so each chunk of it is fetched only once.
+
+    Raises:
+      BadPackageError if package is missing or not a valid zip.
+    """
+    self.ensure_open()
+    return iter(self._ordered)
+
   def open_packaged_file(self, path):
     """Returns a file-like object with contents of a given package item.
 
@@ -73,6 +97,7 @@ class PackageReader(object):
   def close(self):
     """Releases any open resources."""
     self._dir = None
+    self._ordered = None
     try:
       try:
         if self._zip:  # pragma: no branch
@@ -98,20 +123,22 @@ class PackageReader(object):
     # Open underlying raw file.
     try:
       assert not self._raw
-      # ZipFile makes lot of seeks when reading zip directory, smaller chunk
-      # size helps here,
       self._raw = self.cas_service.open(
           hash_algo=self.hash_algo,
           hash_digest=self.hash_digest,
-          read_buffer_size=256*1024)
+          read_buffer_size=self.read_buffer_size)
     except cas.NotFoundError:
       raise BadPackageError('No package file')
     # Parse its zip directory.
     try:
       self._zip = zipfile.ZipFile(self._raw, 'r', zipfile.ZIP_DEFLATED)
+      infolist = self._zip.infolist()
       self._dir = tuple([
+        PackagedFileInfo(i.filename, i.file_size) for i in infolist
+      ])
+      self._ordered = tuple([
         PackagedFileInfo(i.filename, i.file_size)
-        for i in self._zip.infolist()
+        for i in sorted(infolist, key=lambda i: i.header_offset)
       ])
     except zipfile.BadZipfile as exc:
       self.close()
@@ -27,6 +27,7 @@ class PackageRepositoryApiTest(testing.EndpointsTestCase):
     auth_testing.mock_is_admin(self)
     self.repo_service = MockedRepoService()
     self.mock(impl, 'get_repo_service', lambda: self.repo_service)
+    impl.hot_cache.clear_local()
 
   def register_fake_instance(self, pkg_name):
     _, registered = self.repo_service.register_instance(
@@ -127,6 +128,36 @@ class PackageRepositoryApiTest(testing.EndpointsTestCase):
       ],
     }, resp.json_body)
 
+  def test_list_packages_paging(self):
+    self.register_fake_instance('p/a')
+    self.register_fake_instance('p/y')
+    self.register_fake_instance('q')
+
+    resp = self.call_api('list_packages', {'recursive': True, 'limit': 2})
+    self.assertEqual({
+      'status': 'SUCCESS',
+      'packages': ['p/a'],
+      'directories': ['p'],
+      'cursor': 'p/a',
+    }, resp.json_body)
+
+    resp = self.call_api('list_packages', {
+      'recursive': True,
+      'limit': 2,
+      'cursor': 'p/a',
+    })
+    self.assertEqual({
+      'status': 'SUCCESS',
+      'packages': ['p/y', 'q'],
+    }, resp.json_body)
+
+  def test_list_packages_bad_cursor(self):
+    resp = self.call_api('list_packages', {'cursor': 'BAD/'})
+    self.assertEqual({
+      'status': 'ERROR',
+      'error_message': 'Invalid package path',
+    }, resp.json_body)
+
   def test_fetch_instance_ok(self):
     inst, registered = self.repo_service.register_instance(
         package_name='good/name',
@@ -309,6 +340,33 @@ class PackageRepositoryApiTest(testing.EndpointsTestCase):
       'error_message': 'Invalid package name',
     }, resp.json_body)
 
+  def test_register_instance_too_deep(self):
+    deep_name = '/'.join(['a'] * (impl.MAX_NEW_PACKAGE_DEPTH + 1))
+    self.repo_service.uploaded.add('a'*40)
+    resp = self.call_api('register_instance', {
+      'package_name': deep_name,
+      'instance_id': 'a'*40,
+    })
+    self.assertEqual({
+      'status': 'ERROR',
+      'error_message': 'Package name has more than 24 components',
+    }, resp.json_body)
+
+    # Packages that already exist can get new instances.
+    impl.Package(id=deep_name).put()
+    resp = self.call_api('register_instance', {
+      'package_name': deep_name,
+      'instance_id': 'a'*40,
+    })
+    self.assertEqual('REGISTERED', resp.json_body['status'])
+
+    # The deepest new package fits in a transaction.
+    resp = self.call_api('register_instance', {
+      'package_name': deep_name[2:],
+      'instance_id': 'a'*40,
+    })
+    self.assertEqual('REGISTERED', resp.json_body['status'])
+
   def test_register_instance_bad_instance_id(self):
     resp = self.call_api('register_instance', {
       'package_name': 'good/name',
@@ -961,6 +1019,59 @@ class PackageRepositoryApiTest(testing.EndpointsTestCase):
       'status': 'SUCCESS',
     }, resp.json_body)
 
+  def test_search_paged(self):
+    self.set_tag('a/b', 'tag1:', datetime.datetime(2014, 1, 1), 'a'*40)
+    self.set_tag('a/b', 'tag1:', datetime.datetime(2015, 1, 1), 'b'*40)
+    self.set_tag('a/b', 'tag1:', datetime.datetime(2016, 1, 1), 'c'*40)
+
+    resp = self.call_api('search_instances', {'tag': 'tag1:', 'page_size': 2})
+    self.assertEqual(
+        ['c'*40, 'b'*40],
+        [i['instance_id'] for i in resp.json_body['instances']])
+    cursor = resp.json_body['cursor']
+    self.assertTrue(cursor)
+
+    resp = self.call_api('search_instances', {
+      'tag': 'tag1:',
+      'page_size': 2,
+      'cursor': cursor,
+    })
+    self.assertEqual(
+        ['a'*40], [i['instance_id'] for i in resp.json_body['instances']])
+    self.assertNotIn('cursor', resp.json_body)
+
+  def test_search_unpaged(self):
+    self.set_tag('a/b', 'tag1:', datetime.datetime(2014, 1, 1), 'a'*40)
+    self.set_tag('a/b', 'tag1:', datetime.datetime(2015, 1, 1), 'b'*40)
+    self.set_tag('a/b', 'tag1:', datetime.datetime(2016, 1, 1), 'c'*40)
+
+    # Pages of one instance, all of them are still returned.
+    search_by_tag_page = self.repo_service.search_by_tag_page
+    self.mock(
+        self.repo_service, 'search_by_tag_page',
+        lambda *args, **kwargs: search_by_tag_page(
+            *args, **dict(kwargs, page_size=1)))
+
+    resp = self.call_api('search_instances', {'tag': 'tag1:'})
+    self.assertEqual(
+        ['c'*40, 'b'*40, 'a'*40],
+        [i['instance_id'] for i in resp.json_body['instances']])
+    self.assertNotIn('cursor', resp.json_body)
+
+  def test_search_bad_page_size(self):
+    resp = self.call_api('search_instances', {'tag': 'tag1:', 'page_size': -1})
+    self.assertEqual({
+      'status': 'ERROR',
+      'error_message': 'Invalid page size',
+    }, resp.json_body)
+
+  def test_search_bad_cursor(self):
+    resp = self.call_api('search_instances', {'tag': 'tag1:', 'cursor': '!!'})
+    self.assertEqual({
+      'status': 'ERROR',
+      'error_message': 'Invalid cursor',
+    }, resp.json_body)
+
   def test_search_no_access_single_pkg(self):
     self.mock(api.acl, 'can_fetch_instance', lambda *_: False)
     with self.call_should_fail(403):
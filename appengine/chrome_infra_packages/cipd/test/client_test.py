@@ -52,6 +52,22 @@ class ClientUtilsTest(auto_stub.TestCase):
     with self.assertRaises(processing.ProcessingError):
       proc.run(FakeInstance(), FakePackageReader(None))
 
+  def test_extract_cipd_client_processor_aborted(self):
+    uploads = []
+    class FailingCASService(FakeCASService):
+      def start_direct_upload(self, hash_algo):
+        upload = cas_impl.DirectUpload(
+            file_obj=StringIO.StringIO(),
+            hasher=hashlib.sha1(),
+            callback=lambda _digest, commit: uploads.append(commit))
+        return upload
+    proc = client.ExtractCIPDClientProcessor(FailingCASService())
+    proc.data_budget_bytes = 5
+    with self.assertRaises(processing.BudgetExceededError):
+      proc.run(FakeInstance(), FakePackageReader('some data'))
+    # The temp file was discarded.
+    self.assertEqual([False], uploads)
+
 
 class FakeInstance(object):
   package_name = 'infra/tools/cipd/linux-amd64'
@@ -62,6 +78,12 @@ class FakePackageReader(object):
   def __init__(self, data):
     self.data = data
 
+  def iter_packaged_files(self):
+    files = [reader.PackagedFileInfo('README', 0)]
+    if self.data is not None:
+      files.append(reader.PackagedFileInfo('cipd', len(self.data)))
+    return iter(files)
+
   def open_packaged_file(self, path):
     assert path == 'cipd'
     if self.data is None:
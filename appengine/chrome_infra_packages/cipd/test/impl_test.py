@@ -82,6 +82,7 @@ class TestRepoService(testing.AppengineTestCase):
     self.mocked_cas_service = MockedCASService()
     self.mock(impl.cas, 'get_cas_service', lambda: self.mocked_cas_service)
     self.service = impl.get_repo_service()
+    impl.hot_cache.clear_local()
 
   def register_fake_instance(self, pkg_name):
     _, registered = self.service.register_instance(
@@ -150,6 +151,79 @@ class TestRepoService(testing.AppengineTestCase):
     self.assertEqual((['good/sub/path'], ['good', 'good/sub']),
                      self.service.list_packages('', True))
 
+  def test_list_directory_paging(self):
+    for name in ('a/b-c', 'a/b/c', 'a/b/d', 'a/e', 'f'):
+      self.register_fake_instance(name)
+    # Scanning packages and walking the tree return the same pages.
+    self.check_list_directory_paging()
+    self.assertIsNone(impl.rebuild_package_directories())
+    self.assertTrue(impl.is_package_directory_tree_complete())
+    self.check_list_directory_paging()
+
+  def check_list_directory_paging(self):
+    self.assertEqual(
+        (['a/b/c', 'a/b/d', 'a/b-c', 'a/e', 'f'], ['a', 'a/b'], None),
+        self.service.list_directory('', True))
+    self.assertEqual(
+        ([], ['a', 'a/b'], 'a/b'),
+        self.service.list_directory('', True, limit=2))
+    self.assertEqual(
+        (['a/b/c', 'a/b/d', 'a/b-c'], [], 'a/b-c'),
+        self.service.list_directory('', True, limit=3, cursor='a/b'))
+    self.assertEqual(
+        (['a/e', 'f'], [], None),
+        self.service.list_directory('', True, limit=3, cursor='a/b-c'))
+    self.assertEqual(
+        (['a/e'], [], None),
+        self.service.list_directory('a', False, cursor='a/b-c'))
+
+  def test_package_directories_entities(self):
+    self.register_fake_instance('a/b/c')
+    self.register_fake_instance('a/d')
+    root = impl.package_directory_key('').get()
+    self.assertEqual({'packages': [], 'directories': ['a']}, root.to_dict())
+    node = impl.package_directory_key('a').get()
+    self.assertEqual(
+        {'packages': ['a/d'], 'directories': ['a/b']}, node.to_dict())
+    node = impl.package_directory_key('a/b').get()
+    self.assertEqual(
+        {'packages': ['a/b/c'], 'directories': []}, node.to_dict())
+
+  def test_rebuild_package_directories(self):
+    impl.Package(id='a/b').put()
+    impl.Package(id='c').put()
+    self.assertIsNone(impl.package_directory_key('').get())
+    # Packages are found by a query until the tree is complete.
+    self.assertEqual(
+        (['a/b', 'c'], ['a'], None), self.service.list_directory('', True))
+    self.assertIsNone(impl.rebuild_package_directories())
+    self.assertIsNone(impl.rebuild_package_directories())
+    self.assertTrue(impl.is_package_directory_tree_complete())
+    self.assertEqual(
+        (['a/b', 'c'], ['a'], None), self.service.list_directory('', True))
+
+  def test_rebuild_package_directories_pages(self):
+    impl.Package(id='a/b').put()
+    impl.Package(id='c').put()
+    cursor = impl.rebuild_package_directories(page_size=1)
+    self.assertIsNotNone(cursor)
+    self.assertFalse(impl.is_package_directory_tree_complete())
+    self.assertEqual(
+        (['a/b', 'c'], ['a'], None), self.service.list_directory('', True))
+    while cursor:
+      cursor = impl.rebuild_package_directories(cursor, page_size=1)
+    self.assertTrue(impl.is_package_directory_tree_complete())
+    self.assertEqual(
+        (['a/b', 'c'], ['a'], None), self.service.list_directory('', True))
+
+  def test_list_directory_uses_tree_when_complete(self):
+    self.assertIsNone(impl.rebuild_package_directories())
+    self.register_fake_instance('a/b')
+    # Not in the tree, so not listed once the tree is used.
+    impl.Package(id='c').put()
+    self.assertEqual(
+        (['a/b'], ['a'], None), self.service.list_directory('', True))
+
   def test_register_instance_new(self):
     self.assertIsNone(self.service.get_instance('a/b', 'a'*40))
     self.assertIsNone(self.service.get_package('a/b'))
@@ -543,18 +617,59 @@ class TestRepoService(testing.AppengineTestCase):
     found = self.service.search_by_tag('tag1:value1')
     self.assertFalse(found)
 
-  def add_tagged_instance(self, package_name, instance_id, tags):
+  def add_tagged_instance(self, package_name, instance_id, tags, day=1):
     self.service.register_instance(
         package_name=package_name,
         instance_id=instance_id,
         caller=auth.Identity.from_bytes('user:abc@example.com'),
-        now=datetime.datetime(2014, 1, 1, 0, 0))
+        now=datetime.datetime(2014, 1, day, 0, 0))
     self.service.attach_tags(
         package_name=package_name,
         instance_id=instance_id,
         tags=tags,
         caller=auth.Identity.from_bytes('user:abc@example.com'),
-        now=datetime.datetime(2014, 1, 1, 0, 0))
+        now=datetime.datetime(2014, 1, day, 0, 0))
+
+  def test_search_by_tag_page(self):
+    for i, c in enumerate('abcde'):
+      self.add_tagged_instance('a/%s' % c, c*40, ['tag:v'], day=i+1)
+
+    def ids(found):
+      return [e.instance_id[0] for e in found]
+
+    found, cursor = self.service.search_by_tag_page('tag:v', page_size=2)
+    self.assertEqual(['e', 'd'], ids(found))
+    self.assertTrue(cursor)
+    found, cursor = self.service.search_by_tag_page(
+        'tag:v', page_size=2, cursor=cursor)
+    self.assertEqual(['c', 'b'], ids(found))
+    found, cursor = self.service.search_by_tag_page(
+        'tag:v', page_size=2, cursor=cursor)
+    self.assertEqual(['a'], ids(found))
+    self.assertIsNone(cursor)
+
+    # Callback is applied to each batch, pages are still filled up.
+    callback = lambda pkg, _iid: pkg != 'a/d'
+    found, cursor = self.service.search_by_tag_page(
+        'tag:v', callback=callback, page_size=3)
+    self.assertEqual(['e', 'c', 'b'], ids(found))
+    found, cursor = self.service.search_by_tag_page(
+        'tag:v', callback=callback, page_size=3, cursor=cursor)
+    self.assertEqual(['a'], ids(found))
+    self.assertIsNone(cursor)
+
+  def test_search_by_tag_page_scan_limit(self):
+    self.mock(impl, 'SEARCH_MAX_SCANNED_PAGES', 2)
+    for i, c in enumerate('abcde'):
+      self.add_tagged_instance('a/%s' % c, c*40, ['tag:v'], day=i+1)
+    callback = lambda pkg, _iid: pkg == 'a/a'
+    found, cursor = self.service.search_by_tag_page(
+        'tag:v', callback=callback, page_size=2)
+    self.assertEqual([], found)
+    self.assertTrue(cursor)
+    found, cursor = self.service.search_by_tag_page(
+        'tag:v', callback=callback, page_size=2, cursor=cursor)
+    self.assertEqual(['a'*40], [e.instance_id for e in found])
 
   def test_resolve_version(self):
     self.add_tagged_instance('a/b', 'a'*40, ['tag1:value1', 'tag2:value2'])
@@ -578,6 +693,116 @@ class TestRepoService(testing.AppengineTestCase):
     self.assertTrue(set(['a'*40, 'b'*40, 'c'*40]).issuperset(res))
 
 
+  def test_resolve_version_cached_ref(self):
+    caller = auth.Identity.from_bytes('user:abc@example.com')
+    self.add_tagged_instance('a/b', 'a'*40, ['tag1:value1'])
+    self.add_tagged_instance('a/b', 'b'*40, ['tag2:value2'])
+    self.assertEqual([], self.service.resolve_version('a/b', 'ref', 2))
+    self.service.set_package_ref('a/b', 'ref', 'a'*40, caller)
+    self.assertEqual(['a'*40], self.service.resolve_version('a/b', 'ref', 2))
+
+    # Served from the cache, even after local cache is gone.
+    impl.hot_cache.clear_local()
+    self.mock(impl, 'package_ref_key', lambda *_: self.fail('Not cached'))
+    self.assertEqual(['a'*40], self.service.resolve_version('a/b', 'ref', 2))
+
+  def test_resolve_version_cache_invalidation(self):
+    caller = auth.Identity.from_bytes('user:abc@example.com')
+    self.add_tagged_instance('a/b', 'a'*40, ['tag1:value1'])
+    self.add_tagged_instance('a/b', 'b'*40, ['tag2:value2'])
+    self.service.set_package_ref('a/b', 'ref', 'a'*40, caller)
+    self.assertEqual(['a'*40], self.service.resolve_version('a/b', 'ref', 2))
+    self.assertEqual(
+        ['a'*40], self.service.resolve_version('a/b', 'tag1:value1', 2))
+
+    # Moving the ref and tagging drop cached values.
+    self.service.set_package_ref('a/b', 'ref', 'b'*40, caller)
+    self.assertEqual(['b'*40], self.service.resolve_version('a/b', 'ref', 2))
+    self.service.attach_tags('a/b', 'b'*40, ['tag1:value1'], caller)
+    self.assertEqual(
+        set(['a'*40, 'b'*40]),
+        set(self.service.resolve_version('a/b', 'tag1:value1', 2)))
+    self.service.detach_tags('a/b', 'a'*40, ['tag1:value1'])
+    self.assertEqual(
+        ['b'*40], self.service.resolve_version('a/b', 'tag1:value1', 2))
+
+  def test_resolve_version_cached_tag_limit(self):
+    self.add_tagged_instance('a/b', 'a'*40, ['tag1:value1'])
+    self.add_tagged_instance('a/b', 'b'*40, ['tag1:value1'])
+    # Cached incomplete list with one item can't be used to answer limit=2.
+    self.assertEqual(
+        1, len(self.service.resolve_version('a/b', 'tag1:value1', 1)))
+    self.assertEqual(
+        2, len(self.service.resolve_version('a/b', 'tag1:value1', 3)))
+    # Complete list of two items can be used to answer any limit.
+    self.mock(impl.InstanceTag, 'query', lambda *_a, **_k: self.fail('Query'))
+    self.assertEqual(
+        1, len(self.service.resolve_version('a/b', 'tag1:value1', 1)))
+    self.assertEqual(
+        2, len(self.service.resolve_version('a/b', 'tag1:value1', 5)))
+
+  def test_generate_fetch_url_cached(self):
+    calls = []
+    def generate_fetch_url(algo, digest):
+      calls.append(digest)
+      return 'https://signed-url/%s/%s' % (algo, digest)
+    self.mock(self.mocked_cas_service, 'generate_fetch_url', generate_fetch_url)
+    inst = impl.PackageInstance(key=impl.package_instance_key('a/b', 'a'*40))
+    url = self.service.generate_fetch_url(inst)
+    self.assertEqual('https://signed-url/SHA1/%s' % ('a'*40), url)
+    self.assertEqual(url, self.service.generate_fetch_url(inst))
+    self.assertEqual(['a'*40], calls)
+
+
+class TestHotCache(testing.AppengineTestCase):
+  def setUp(self):
+    super(TestHotCache, self).setUp()
+    self.now = 1000.0
+    self.mock(impl.utils, 'time_time', lambda: self.now)
+    self.cache = impl.HotCache('test', 2)
+
+  def test_get_or_fill_delete(self):
+    self.assertEqual([], self.cache.get_or_fill(('a', 'b'), lambda: [], 60))
+    self.assertEqual(
+        [], self.cache.get_or_fill(('a', 'b'), lambda: self.fail('Fill'), 60))
+    self.cache.delete_multi([('a', 'b')])
+    self.assertEqual(
+        ['c'], self.cache.get_or_fill(('a', 'b'), lambda: ['c'], 60))
+
+  def test_get_or_fill_not_usable(self):
+    self.cache.get_or_fill(('a',), lambda: 1, 60)
+    self.assertEqual(
+        2, self.cache.get_or_fill(('a',), lambda: 2, 60, lambda v: v > 1))
+    self.cache.clear_local()
+    self.assertEqual(
+        2, self.cache.get_or_fill(('a',), lambda: self.fail('Fill'), 60))
+
+  def test_get_or_fill_invalidated_while_filling(self):
+    def fill():
+      # The data changes and the cache is invalidated after it was read.
+      self.cache.delete_multi([('a',)])
+      return 'stale'
+    self.assertEqual('stale', self.cache.get_or_fill(('a',), fill, 60))
+    self.assertEqual(
+        'fresh', self.cache.get_or_fill(('a',), lambda: 'fresh', 60))
+
+  def test_local_expiration(self):
+    self.cache.get_or_fill(('a',), lambda: 'v1', 600)
+    # Another instance updates the value in memcache.
+    impl.memcache.set(
+        impl.HotCache._memcache_key(('a',)), 'v2', namespace='test')
+    self.assertEqual('v1', self.cache.get_or_fill(('a',), lambda: 'v3', 600))
+    self.now += impl.LOCAL_CACHE_SEC + 1
+    self.assertEqual('v2', self.cache.get_or_fill(('a',), lambda: 'v3', 600))
+
+  def test_local_lru_eviction(self):
+    self.cache.get_or_fill(('a',), lambda: 'a', 60)
+    self.cache.get_or_fill(('b',), lambda: 'b', 60)
+    self.cache.get_or_fill(('a',), lambda: 'a', 60)
+    self.cache.get_or_fill(('c',), lambda: 'c', 60)
+    self.assertEqual([('a',), ('c',)], sorted(self.cache._local))
+
+
 class MockedCASService(object):
   def __init__(self):
     self.uploaded = {}
@@ -0,0 +1,135 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import StringIO
+import zipfile
+
+from testing_support import auto_stub
+
+from cipd import processing
+from cipd import reader
+
+
+class RecordingVisitor(processing.FileVisitor):
+  def __init__(self, wanted, fail_on=None):
+    super(RecordingVisitor, self).__init__()
+    self.wanted = wanted
+    self.fail_on = fail_on
+    self.files = {}
+    self.current = None
+    self.aborted = False
+
+  def wants_file(self, info):
+    return info.path in self.wanted
+
+  def begin_file(self, info):
+    self.current = info.path
+    self.files[info.path] = ''
+
+  def write(self, chunk):
+    if self.current == self.fail_on:
+      raise processing.ProcessingError('Failed on %s' % self.current)
+    self.files[self.current] += chunk
+
+  def end_file(self):
+    self.current = None
+
+  def finish(self):
+    return self.files
+
+  def abort(self):
+    self.aborted = True
+
+
+class FakeProcessor(processing.Processor):
+  def __init__(self, name, visitor):
+    super(FakeProcessor, self).__init__()
+    self.name = name
+    self.visitor = visitor
+
+  def should_process(self, instance):
+    return True
+
+  def start(self, instance):
+    return self.visitor
+
+
+class RunStreamingTest(auto_stub.TestCase):
+  def setUp(self):
+    super(RunStreamingTest, self).setUp()
+    self.mock(processing, 'STREAM_CHUNK_SIZE', 4)
+    self.opened = []
+
+  def package(self, items):
+    out = StringIO.StringIO()
+    zf = zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED)
+    for path, data in items:
+      zf.writestr(path, data)
+    zf.close()
+    test = self
+    class FakeCASService(object):
+      def open(self, hash_algo, hash_digest, read_buffer_size):
+        return StringIO.StringIO(out.getvalue())
+    data = reader.PackageReader(FakeCASService(), 'SHA1', 'a'*40)
+    original_open = data.open_packaged_file
+    def open_packaged_file(path):
+      test.opened.append(path)
+      return original_open(path)
+    data.open_packaged_file = open_packaged_file
+    return data
+
+  def run_procs(self, data, *procs):
+    return processing.run_streaming([(p, p.start(None)) for p in procs], data)
+
+  def test_fan_out(self):
+    data = self.package([
+      ('a', 'aaaaaaaaaa'),
+      ('b', 'bbbbbbbbbb'),
+      ('c', 'cccccccccc'),
+    ])
+    p1 = FakeProcessor('p1', RecordingVisitor(['a', 'b']))
+    p2 = FakeProcessor('p2', RecordingVisitor(['b']))
+    results = self.run_procs(data, p1, p2)
+    self.assertEqual({
+      'p1': ({'a': 'aaaaaaaaaa', 'b': 'bbbbbbbbbb'}, None),
+      'p2': ({'b': 'bbbbbbbbbb'}, None),
+    }, results)
+    # Each file was inflated once, unwanted files are not touched.
+    self.assertEqual(['a', 'b'], self.opened)
+
+  def test_failing_visitor_is_isolated(self):
+    data = self.package([('a', 'aaaaaaaaaa'), ('b', 'bbbbbbbbbb')])
+    bad_visitor = RecordingVisitor(['a', 'b'], fail_on='a')
+    bad = FakeProcessor('bad', bad_visitor)
+    good = FakeProcessor('good', RecordingVisitor(['a', 'b']))
+    results = self.run_procs(data, bad, good)
+    self.assertEqual(
+        ({'a': 'aaaaaaaaaa', 'b': 'bbbbbbbbbb'}, None), results['good'])
+    self.assertEqual('Failed on a', str(results['bad'][1]))
+    self.assertTrue(bad_visitor.aborted)
+
+  def test_data_budget(self):
+    data = self.package([('a', 'aaaaaaaaaa')])
+    proc = FakeProcessor('p', RecordingVisitor(['a']))
+    proc.data_budget_bytes = 5
+    _, exc = self.run_procs(data, proc)['p']
+    self.assertIsInstance(exc, processing.BudgetExceededError)
+
+  def test_time_budget(self):
+    data = self.package([('a', 'aaaaaaaaaa')])
+    ticks = iter(xrange(1000))
+    self.mock(processing.time, 'time', lambda: float(next(ticks)))
+    proc = FakeProcessor('p', RecordingVisitor(['a']))
+    proc.time_budget_sec = 2
+    _, exc = self.run_procs(data, proc)['p']
+    self.assertIsInstance(exc, processing.BudgetExceededError)
+
+  def test_bad_package(self):
+    class FakeCASService(object):
+      def open(self, hash_algo, hash_digest, read_buffer_size):
+        return StringIO.StringIO('not a zip')
+    data = reader.PackageReader(FakeCASService(), 'SHA1', 'a'*40)
+    proc = FakeProcessor('p', RecordingVisitor(['a']))
+    _, exc = self.run_procs(data, proc)['p']
+    self.assertIsInstance(exc, reader.BadPackageError)
@@ -34,6 +34,20 @@ class ReaderTest(auto_stub.TestCase):
       with self.assertRaises(reader.NoSuchPackagedFileError):
         r.open_packaged_file('missing_file')
 
+  def test_iter_packaged_files(self):
+    zipped_data = self.zip_data([
+      ('b', 'some data'),
+      ('a', '123456'),
+    ])
+    cas_service = self.fake_cas_service(zipped_data, read_buffer_size=123)
+    with reader.PackageReader(
+        cas_service, 'SHA1', 'a'*40, read_buffer_size=123) as r:
+      # Order matches the order of files in the zip, not the names.
+      self.assertEqual([
+        reader.PackagedFileInfo('b', 9),
+        reader.PackagedFileInfo('a', 6),
+      ], list(r.iter_packaged_files()))
+
   def test_bad_zip_file(self):
     cas_service = self.fake_cas_service('im not a zip file, at all')
     with reader.PackageReader(cas_service, 'SHA1', 'a'*40) as r:
@@ -54,13 +68,16 @@ class ReaderTest(auto_stub.TestCase):
       with self.assertRaises(reader.BadPackageError):
         r.open_packaged_file('file')
 
-  def fake_cas_service(self, zipped_data):
+  def fake_cas_service(self, zipped_data, read_buffer_size=None):
     test = self
+    read_buffer_size_expected = read_buffer_size
     class FakeCASService(object):
       def open(self, hash_algo, hash_digest, read_buffer_size):
         test.assertEqual('SHA1', hash_algo)
         test.assertEqual('a'*40, hash_digest)
         test.assertTrue(read_buffer_size)
+        if read_buffer_size_expected is not None:
+          test.assertEqual(read_buffer_size_expected, read_buffer_size)
         if zipped_data is None:
           raise reader.cas.NotFoundError()
         return StringIO.StringIO(zipped_data)
@@ -0,0 +1,74 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Benchmark for RepoService.search_by_tag_page.
+
+Disabled by default, since populating the datastore stub is slow. Run with:
+  CIPD_BENCHMARK=1 ./test.py test appengine/chrome_infra_packages \
+      cipd/test/search_benchmark_test.py
+"""
+
+import datetime
+import hashlib
+import logging
+import os
+import time
+import unittest
+
+from google.appengine.ext import ndb
+from testing_utils import testing
+
+from components import auth
+
+from cipd import impl
+
+from cipd.test.impl_test import MockedCASService
+
+
+# Number of tagged instances to create.
+INSTANCES_COUNT = 10000
+
+
+@unittest.skipUnless(os.environ.get('CIPD_BENCHMARK'), 'CIPD_BENCHMARK unset')
+class SearchBenchmark(testing.AppengineTestCase):
+  def setUp(self):
+    super(SearchBenchmark, self).setUp()
+    self.service = impl.RepoService(MockedCASService())
+    caller = auth.Identity.from_bytes('user:abc@example.com')
+    ts = datetime.datetime(2015, 1, 1)
+    entities = []
+    for i in xrange(INSTANCES_COUNT):
+      package_name = 'bench/pkg%d' % (i % 50)
+      instance_id = hashlib.sha1(str(i)).hexdigest()
+      entities.append(impl.PackageInstance(
+          key=impl.package_instance_key(package_name, instance_id),
+          registered_by=caller,
+          registered_ts=ts))
+      entities.append(impl.InstanceTag(
+          key=impl.instance_tag_key(
+              package_name, instance_id, 'git_revision:deadbeef'),
+          tag='git_revision:deadbeef',
+          registered_by=caller,
+          registered_ts=ts + datetime.timedelta(seconds=i)))
+    ndb.put_multi(entities)
+
+  def test_search_all_pages(self):
+    started = time.time()
+    total = 0
+    pages = 0
+    cursor = None
+    while True:
+      found, cursor = self.service.search_by_tag_page(
+          'git_revision:deadbeef',
+          callback=lambda pkg, _iid: pkg != 'bench/pkg0',
+          cursor=cursor)
+      total += len(found)
+      pages += 1
+      if not cursor:
+        break
+    elapsed = time.time() - started
+    logging.warning(
+        'search_by_tag_page: %d instances in %d pages, %.2f sec (%.1f ms/page)',
+        total, pages, elapsed, elapsed * 1000.0 / pages)
+    self.assertEqual(INSTANCES_COUNT - INSTANCES_COUNT / 50, total)
@@ -5,6 +5,7 @@
 from testing_utils import testing
 from components import auth_testing
 
+from cipd import impl
 import admin
 import config
 
@@ -30,6 +31,8 @@ class TestAdminHandlers(testing.EndpointsTestCase):
       self.call_api('service_account', SERVICE_ACCOUNT_INFO)
     with self.call_should_fail(403):
       self.call_api('gs_config', GS_CONFIG)
+    with self.call_should_fail(403):
+      self.call_api('rebuild_package_directories', {})
 
   def test_service_account(self):
     auth_testing.mock_is_admin(self, True)
@@ -62,3 +65,12 @@ class TestAdminHandlers(testing.EndpointsTestCase):
         'cas_gs_path': 'bucket/gs_path',
         'cas_gs_temp': '/bucket/gs_temp/'
       })
+
+  def test_rebuild_package_directories(self):
+    auth_testing.mock_is_admin(self, True)
+    calls = []
+    self.mock(
+        impl, 'enqueue_rebuild_package_directories',
+        lambda: calls.append(1) or True)
+    self.call_api('rebuild_package_directories', {})
+    self.assertEqual([1], calls)
@@ -14,6 +14,7 @@ app = webapp2.WSGIApplication([
     ('/cache_page', views.CachePage),
     ('/cull_steps', views.CullOldSteps),
     ('/cache_steps', views.CacheSteps),
+    ('/rollup_step_hours', views.RollupStepHours),
     ('/run_step_summary/(.+)/(.+)/(.+)', views.RunStepSummary),
     ('/run_step_summary/(.+)/(.+)', views.RunStepSummary),
     ('/run_step_summary/(.+)', views.RunStepSummary),
@@ -2,11 +2,13 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
 import contextlib
 from datetime import datetime
 from datetime import timedelta
 import json
 import logging
+import math
 import numpy
 import pickle
 import re
@@ -101,27 +103,37 @@ def get_builders_cached(master):  # pragma: no cover
   return result
 
 
-def get_json(url, follow_redirects=True):  # pragma: no cover
-  urlfetch.set_default_fetch_deadline(15)
-  max_age = 20
-  result = urlfetch.fetch(url, follow_redirects=follow_redirects,
+JSON_MAX_AGE = 20
+
+
+def get_json_async(url, follow_redirects=True):  # pragma: no cover
+  rpc = urlfetch.create_rpc(deadline=15)
+  urlfetch.make_fetch_call(rpc, url, follow_redirects=follow_redirects,
       headers={
-        'Cache-Control': 'no-cache,max-age=%d' % max_age,
+        'Cache-Control': 'no-cache,max-age=%d' % JSON_MAX_AGE,
         'Pragma': 'no-cache'})
+  return rpc
+
 
+def get_json_result(url, result):  # pragma: no cover
   if result.status_code == 200:
     cache_hit = result.headers.get('X-Google-Cache-Control')
     if cache_hit == 'remote-cache-hit':
       cache_age = int(result.headers.get('Age', '-1'))
-      if cache_age > max_age:
+      if cache_age > JSON_MAX_AGE:
         raise ValueError(
         'got cached content older than max-age: %d (instead of %d)' % (
-          cache_age, max_age))
+          cache_age, JSON_MAX_AGE))
     return json.loads(result.content)
   else:
     raise ValueError('error fetching %s: %d' % (url, result.status_code))
 
 
+def get_json(url, follow_redirects=True):  # pragma: no cover
+  return get_json_result(
+      url, get_json_async(url, follow_redirects=follow_redirects).get_result())
+
+
 def get_master_json(master):  # pragma: no cover
   url = ('https://chrome-build-extract.appspot.com/get_master/%s'
       % urllib.quote(master))
@@ -129,11 +141,18 @@ def get_master_json(master):  # pragma: no cover
   return data.get('builders', {}).keys()
 
 
+def get_build_steps_url(master, builder):  # pragma: no cover
+  return ('https://chrome-build-extract.appspot.com/_ah/api/build_json/v0/json/'
+          'recently_finished/%s/%s/120' % (
+            urllib.quote(master), urllib.quote(builder)))
+
+
 def get_build_steps(master, builder):  # pragma: no cover
-  url = ('https://chrome-build-extract.appspot.com/_ah/api/build_json/v0/json/'
-         'recently_finished/%s/%s/120' % (
-           urllib.quote(master), urllib.quote(builder)))
-  data = get_json(url, follow_redirects=False)
+  data = get_json(get_build_steps_url(master, builder), follow_redirects=False)
+  return parse_build_steps(data)
+
+
+def parse_build_steps(data):  # pragma: no cover
   result = []
   for build_json in data.get('build_jsons', []):
     build = json.loads(build_json)
@@ -227,59 +246,402 @@ def get_step_record_iterator(step, hour, end):  # pragma: no cover
 
 
 def process_statistical_calculations(record_iterator):  # pragma: no cover
-  records = [{'time': r.step_time, 'error': r.result == 2}
-      for r in record_iterator]
-
-  times =  list(r['time'] for r in records)
+  records = [(r.step_time, r.result == 2) for r in record_iterator]
 
   result = {}
   result['count'] = len(records)
   if result['count'] > 0:
-    result['median'] = numpy.percentile(times, 50)
-    result['seventyfive'] = numpy.percentile(times, 75)
-    result['ninety'] = numpy.percentile(times, 90)
-    result['ninetynine'] = numpy.percentile(times, 99)
-    result['maximum'] = max(times)
-    result['mean'] = numpy.mean(times)
-    result['stddev'] = numpy.std(times)
-
-    result['failure_count'] = len(list(e for e in records if e['error']))
+    times = numpy.array([r[0] for r in records], dtype=float)
+    errors = numpy.array([r[1] for r in records], dtype=bool)
+    (result['median'], result['seventyfive'], result['ninety'],
+        result['ninetynine']) = numpy.percentile(times, [50, 75, 90, 99])
+    result['maximum'] = times.max()
+    result['mean'] = times.mean()
+    result['stddev'] = times.std()
+
+    result['failure_count'] = int(errors.sum())
     result['failure_rate'] = (float(result['failure_count']) / float(
         result['count'])) * 100.0
 
   return result
 
 
+# Times in a StepTimeSketch are counted in buckets (GAMMA^(i-1), GAMMA^i], whose
+# representative value is within SKETCH_ACCURACY of any time in them. Times
+# which are not positive are counted in the None bucket.
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+
+def floor_hour(date):  # pragma: no cover
+  return date.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(date):  # pragma: no cover
+  hour = floor_hour(date)
+  if hour < date:
+    hour += timedelta(hours=1)
+  return hour
+
+
+def new_sketch(**kwargs):  # pragma: no cover
+  return models.StepTimeSketch(buckets={}, **kwargs)
+
+
+def add_times_to_sketch(sketch, times, errors):  # pragma: no cover
+  """Adds numpy arrays of step times and failure flags to a sketch."""
+  if not len(times):
+    return
+  sketch.count += len(times)
+  sketch.total += float(times.sum())
+  sketch.total_squares += float((times ** 2).sum())
+  sketch.minimum = min_or_value(sketch.minimum, float(times.min()))
+  sketch.maximum = max_or_value(sketch.maximum, float(times.max()))
+  sketch.failure_count += int(errors.sum())
+
+  positive = times[times > 0]
+  indices = numpy.ceil(numpy.log(positive) / SKETCH_LOG_GAMMA).astype(int)
+  counts = collections.Counter(indices.tolist())
+  if len(positive) < len(times):
+    counts[None] += len(times) - len(positive)
+  buckets = dict(sketch.buckets or {})
+  for index, count in counts.iteritems():
+    buckets[index] = buckets.get(index, 0) + count
+  sketch.buckets = buckets
+
+
+def add_records_to_sketch(sketch, record_iterator):  # pragma: no cover
+  records = [(r.step_time, r.result == 2) for r in record_iterator]
+  add_times_to_sketch(sketch,
+      numpy.array([r[0] for r in records], dtype=float),
+      numpy.array([r[1] for r in records], dtype=bool))
+
+
+def merge_sketch(sketch, other):  # pragma: no cover
+  if not other.count:
+    return
+  sketch.count += other.count
+  sketch.total += other.total
+  sketch.total_squares += other.total_squares
+  sketch.minimum = min_or_value(sketch.minimum, other.minimum)
+  sketch.maximum = max_or_value(sketch.maximum, other.maximum)
+  sketch.failure_count += other.failure_count
+  buckets = dict(sketch.buckets or {})
+  for index, count in other.buckets.iteritems():
+    buckets[index] = buckets.get(index, 0) + count
+  sketch.buckets = buckets
+
+
+def min_or_value(current, value):  # pragma: no cover
+  return value if current is None else min(current, value)
+
+
+def max_or_value(current, value):  # pragma: no cover
+  return value if current is None else max(current, value)
+
+
+def sketch_percentiles(sketch, percentiles):  # pragma: no cover
+  """Estimates percentiles the way numpy.percentile() interpolates them."""
+  # None sorts before any bucket index, like non positive times before others.
+  ordered_buckets = sorted(sketch.buckets.iteritems())
+
+  def order_statistic(rank):
+    seen = 0
+    for index, count in ordered_buckets:
+      seen += count
+      if rank < seen:
+        if index is None:
+          return sketch.minimum
+        value = 2 * SKETCH_GAMMA ** index / (SKETCH_GAMMA + 1)
+        return min(max(value, sketch.minimum), sketch.maximum)
+    return sketch.maximum
+
+  results = []
+  for percentile in percentiles:
+    rank = percentile / 100.0 * (sketch.count - 1)
+    lower = int(math.floor(rank))
+    lower_value = order_statistic(lower)
+    upper_value = order_statistic(min(lower + 1, sketch.count - 1))
+    results.append(lower_value + (upper_value - lower_value) * (rank - lower))
+  return results
+
+
+def sketch_statistics(sketch):  # pragma: no cover
+  """Returns the same statistics as process_statistical_calculations()."""
+  result = {}
+  result['count'] = sketch.count
+  if result['count'] > 0:
+    (result['median'], result['seventyfive'], result['ninety'],
+        result['ninetynine']) = sketch_percentiles(sketch, [50, 75, 90, 99])
+    result['maximum'] = sketch.maximum
+    result['mean'] = sketch.total / sketch.count
+    result['stddev'] = math.sqrt(max(
+        sketch.total_squares / sketch.count - result['mean'] ** 2, 0.0))
+
+    result['failure_count'] = sketch.failure_count
+    result['failure_rate'] = (float(result['failure_count']) / float(
+        result['count'])) * 100.0
+
+  return result
+
+
+def get_sketch_start():  # pragma: no cover
+  sketch_start = ndb.Key('StepTimeSketchStart', 'start').get()
+  return sketch_start.hour if sketch_start else None
+
+
+@ndb.transactional_tasklet
+def add_to_sketch_async(master, builder, stepname, hour,
+    step_records):  # pragma: no cover
+  key = ndb.Key('StepTimeSketch', json.dumps((
+    master,
+    builder,
+    stepname,
+    hour.isoformat(),
+  ), sort_keys=True))
+  sketch = yield key.get_async()
+  if not sketch:
+    sketch = new_sketch(key=key, master=master, builder=builder,
+        stepname=stepname, hour=hour)
+  counted = set(sketch.record_ids)
+  new_records = [r for r in step_records if r.key.id() not in counted]
+  if not new_records:
+    return
+  add_records_to_sketch(sketch, new_records)
+  sketch.record_ids.extend(r.key.id() for r in new_records)
+  yield sketch.put_async()
+
+
+def add_to_sketches(step_records):  # pragma: no cover
+  # Hours before the next one may have had records written before sketches
+  # were kept, so only the following hours are answered from sketches.
+  sketch_start = models.StepTimeSketchStart.get_or_insert('start',
+      hour=ceil_hour(datetime.now())).hour
+  grouped_records = {}
+  for record in step_records:
+    grouped_records.setdefault((
+      record.master,
+      record.builder,
+      record.stepname,
+      floor_hour(record.step_start),
+    ), []).append(record)
+  futures = [add_to_sketch_async(*(group + (records,)))
+      for group, records in grouped_records.iteritems()]
+  for future in futures:
+    future.get_result()
+  ndb.put_multi([
+      models.StepHourRollupPending(
+          key=ndb.Key('StepHourRollupPending', rollup_key_id(stepname, hour)),
+          stepname=stepname,
+          hour=hour)
+      for stepname, hour in set(
+          (group[2], group[3]) for group in grouped_records)
+      # The sketches of earlier hours may be missing records, so those hours
+      # are not rolled up.
+      if hour >= sketch_start])
+
+
+def get_step_sketch(step, start, end, master=None,
+    builder=None):  # pragma: no cover
+  """Returns a sketch of the step times in [start, end).
+
+  Whole hours are merged from their StepTimeSketches. The partial hours at the
+  edges of the window, and hours from before sketches were kept, are read from
+  the BuildStepRecords.
+  """
+  sketch = new_sketch()
+  sketch_start = get_sketch_start()
+  first_hour = max(ceil_hour(start), sketch_start or end)
+  last_hour = floor_hour(end)
+  if first_hour < last_hour:
+    query = models.StepTimeSketch.query().filter(
+        models.StepTimeSketch.stepname == step).filter(
+            models.StepTimeSketch.hour >= first_hour).filter(
+                models.StepTimeSketch.hour < last_hour)
+    if builder:
+      query = query.filter(models.StepTimeSketch.builder == builder)
+    if master:
+      query = query.filter(models.StepTimeSketch.master == master)
+    for hour_sketch in query:
+      merge_sketch(sketch, hour_sketch)
+    raw_ranges = [(start, first_hour), (last_hour, end)]
+  else:
+    raw_ranges = [(start, end)]
+
+  for raw_start, raw_end in raw_ranges:
+    if raw_start >= raw_end:
+      continue
+    record_iterator = get_step_record_iterator(step, raw_start, raw_end)
+    if builder:
+      record_iterator = record_iterator.filter(
+          models.BuildStepRecord.builder == builder)
+    if master:
+      record_iterator = record_iterator.filter(
+          models.BuildStepRecord.master == master)
+    add_records_to_sketch(sketch, record_iterator)
+  return sketch
+
+
+ROLLUP_COLUMNS = (
+  'master',
+  'builder',
+  'count',
+  'total',
+  'total_squares',
+  'minimum',
+  'maximum',
+  'failure_count',
+  'buckets',
+)
+
+
+def rollup_key_id(step, hour):  # pragma: no cover
+  return json.dumps((step, hour.isoformat()))
+
+
+def rollup_step_hour(step, hour):  # pragma: no cover
+  """Writes the StepHourRollup of a step and hour from its sketches."""
+  columns = dict((name, []) for name in ROLLUP_COLUMNS)
+  with disable_internal_cache():
+    for sketch in models.StepTimeSketch.query().filter(
+        models.StepTimeSketch.stepname == step).filter(
+            models.StepTimeSketch.hour == hour):
+      for name in ROLLUP_COLUMNS:
+        columns[name].append(getattr(sketch, name))
+    models.StepHourRollup(
+        key=ndb.Key('StepHourRollup', rollup_key_id(step, hour)),
+        stepname=step,
+        hour=hour,
+        provisional=hour >= (datetime.now() - FINALIZE_DELAY),
+        columns=columns).put()
+
+
+@ndb.transactional
+def delete_rollup_pending(key, updated):  # pragma: no cover
+  # The sketches changed again if the marker was updated during the rollup.
+  pending = key.get()
+  if pending and pending.updated == updated:
+    key.delete()
+
+
+def rollup_step_hours():  # pragma: no cover
+  """Writes the StepHourRollups whose sketches changed.
+
+  Provisional rows are written once more when their hour is finalized.
+  """
+  with disable_internal_cache():
+    for pending in models.StepHourRollupPending.query():
+      rollup_step_hour(pending.stepname, pending.hour)
+      delete_rollup_pending(pending.key, pending.updated)
+    for row in models.StepHourRollup.query().filter(
+        models.StepHourRollup.provisional == True).filter(
+            models.StepHourRollup.hour < (datetime.now() - FINALIZE_DELAY)):
+      rollup_step_hour(row.stepname, row.hour)
+
+
+def rollup_sketch(row, master=None, builder=None):  # pragma: no cover
+  """Merges the columns of a StepHourRollup, optionally of one builder."""
+  sketch = new_sketch()
+  columns = row.columns
+  for i in xrange(len(columns['master'])):
+    if master and columns['master'][i] != master:
+      continue
+    if builder and columns['builder'][i] != builder:
+      continue
+    merge_sketch(sketch, models.StepTimeSketch(
+        **dict((name, columns[name][i]) for name in ROLLUP_COLUMNS)))
+  return sketch
+
+
+def get_hour_sketches(step, hours, master=None,
+    builder=None):  # pragma: no cover
+  """Returns a sketch of the step times of each of the given hours.
+
+  Hours are read from their StepHourRollups with a single batch get. Hours
+  from before sketches were kept, whose rows would be missing records, and
+  recent hours whose rows may not be written yet are computed by
+  get_step_sketch().
+  """
+  with disable_internal_cache():
+    rows = ndb.get_multi([ndb.Key('StepHourRollup', rollup_key_id(step, hour))
+                          for hour in hours])
+  sketch_start = get_sketch_start()
+  recent = datetime.now() - FINALIZE_DELAY
+  sketches = []
+  for hour, row in zip(hours, rows):
+    if row and sketch_start and hour >= sketch_start:
+      sketches.append(rollup_sketch(row, master=master, builder=builder))
+    elif not sketch_start or hour < sketch_start or hour >= recent:
+      sketches.append(get_step_sketch(step, hour, hour + timedelta(hours=1),
+          master=master, builder=builder))
+    else:
+      sketches.append(new_sketch())
+  return sketches
+
+
+def get_rolled_up_step_records(record, step, hour, master=None,
+    builder=None):  # pragma: no cover
+  """Returns the BuildStatisticRecord of an hour from its StepHourRollup.
+
+  None if the hour has not been rolled up, or is from before sketches were
+  kept, as its row would be missing records.
+  """
+  sketch_start = get_sketch_start()
+  if not sketch_start or hour < sketch_start:
+    return None
+  with disable_internal_cache():
+    row = ndb.Key('StepHourRollup', rollup_key_id(step, hour)).get()
+  if not row:
+    return None
+  return models.BuildStatisticRecord(
+      start_time=hour,
+      end_time_exclusive=hour + timedelta(hours=1),
+      record=record,
+      stats=models.BuildStepStatistic(**sketch_statistics(
+          rollup_sketch(row, master=master, builder=builder))))
+
+
 def get_step_records_for_hour(step, hour):  # pragma: no cover
+  rolled_up = get_rolled_up_step_records(step, step, hour)
+  if rolled_up:
+    return rolled_up
   end = hour + timedelta(hours=1)
   record_iterator = get_step_record_iterator(step, hour, end)
   return get_step_records_internal(step, hour, end, record_iterator)
 
 
 def get_step_records_for_master_hour(master, step, hour):  # pragma: no cover
+  record = '%s-%s' % (master, step)
+  rolled_up = get_rolled_up_step_records(record, step, hour, master=master)
+  if rolled_up:
+    return rolled_up
   end = hour + timedelta(hours=1)
   record_iterator = get_step_master_iterator(master, step, hour, end)
-  return get_step_records_internal('%s-%s' % (master, step),
-      hour, end, record_iterator)
+  return get_step_records_internal(record, hour, end, record_iterator)
 
 
 def get_step_records_for_master_builder_hour(
     master, builder, step, hour):  # pragma: no cover
+  record = '%s-%s-%s' % (master, builder, step)
+  rolled_up = get_rolled_up_step_records(record, step, hour, master=master,
+      builder=builder)
+  if rolled_up:
+    return rolled_up
   end = hour + timedelta(hours=1)
   record_iterator = get_step_builder_iterator(master, builder, step, hour, end)
-  return get_step_records_internal('%s-%s-%s' % (master, builder, step),
-      hour, end, record_iterator)
+  return get_step_records_internal(record, hour, end, record_iterator)
 
 
 CACHE_THRESH = 10
+FINALIZE_DELAY = timedelta(hours=24, minutes=10)
 
 
 def get_step_records_internal(record, hour, end, record_iterator,
     finalize=True):  # pragma: no cover
   # Since steps and builds might take up to 24 hours, don't write summaries
   # until we know all the data has trickled in.
-  finalize = (finalize and
-      hour < (datetime.now() - timedelta(hours=24, minutes=10)))
+  finalize = (finalize and hour < (datetime.now() - FINALIZE_DELAY))
 
   record_key = ndb.Key(
       'BuildStatisticRecord', record + '---' + str(hour) +
@@ -429,20 +791,47 @@ def submit_chunks(steps):  # pragma: no cover
 
     in_db = zip(ndb.get_multi(keys), step_models)
     new_builds = filter(lambda x: x[0] is None, in_db)
+    # Sketches skip the records they already counted, so they are written
+    # first: if they fail, the records are not written and are retried.
+    add_to_sketches(x[1] for x in new_builds)
     ndb.put_multi(x[1] for x in new_builds)
 
 
-def process_builder(master, builder):  # pragma: no cover
+def update_step_builders(master, builder, step_names):  # pragma: no cover
+  step_keys = [ndb.Key('Step', step_name) for step_name in sorted(step_names)]
+  changed_steps = []
+  for step_key, step_obj in zip(step_keys, ndb.get_multi(step_keys)):
+    if step_obj:
+      if step_obj.builders:
+        if builder not in step_obj.builders.get(master, []):
+          step_obj.builders.setdefault(master, []).append(builder)
+          changed_steps.append(step_obj)
+      else:
+        step_obj.builders = {master: [builder]}
+        changed_steps.append(step_obj)
+    else:
+      changed_steps.append(models.Step(
+          name=step_key.id(),
+          key=step_key,
+          builders={master: [builder]}))
+  ndb.put_multi(changed_steps)
+
+
+def process_builder(master, builder_obj, builds):  # pragma: no cover
+  """Writes the steps of the builds not seen by the last crawl of a builder."""
+  builder = builder_obj.key.id()
   saw = 0
   wrote = 0
   batch_factor = 1000
   step_chunks = []
+  step_names = set()
+  seen_buildnumbers = set(builder_obj.seen_buildnumbers)
   logging.info('checking %s: %s' % (master, builder))
   with disable_internal_cache():
     worth_it = [s[0] for s in get_worth_it_steps()]
-    builder_obj = ndb.Key('Master', master, 'Builder', builder).get()
-    need_to_update_builder = False
-    for build in get_build_steps(master, builder):
+    for build in builds:
+      if build['number'] in seen_buildnumbers:
+        continue
       for step_dict in build['steps'].itervalues():
         saw = saw + 1
         if (step_dict['starttime'] + timedelta(seconds=step_dict['time'])) < (
@@ -450,30 +839,12 @@ def process_builder(master, builder):  # pragma: no cover
           continue
 
         wrote = wrote + 1
-        step_key = ndb.Key('Step', step_dict['name'])
-        step_obj = step_key.get()
-        if step_obj:
-          if step_obj.builders:
-            if builder not in step_obj.builders.get(master, []):
-              step_obj.builders.setdefault(master, []).append(builder)
-              step_obj.put()
-          else:
-            step_obj.builders = {master: [builder]}
-            step_obj.put()
-        else:
-          models.Step(
-              name=step_dict['name'],
-              key=step_key,
-              builders={master: [builder]}).put()
-
-        if builder_obj:
-          step = step_dict['name']
-          if step in worth_it:
-            if not builder_obj.steps:
-              builder_obj.steps = set()
-            if step not in builder_obj.steps:
-              builder_obj.steps.add(step)
-              need_to_update_builder = True
+        step = step_dict['name']
+        step_names.add(step)
+        if step in worth_it:
+          if not builder_obj.steps:
+            builder_obj.steps = set()
+          builder_obj.steps.add(step)
         step_chunks.append({
           'master': master,
           'builder': builder,
@@ -495,37 +866,77 @@ def process_builder(master, builder):  # pragma: no cover
           _target='stats-backend')
     logging.info('wrote %d out of %d' % (wrote, saw))
 
-    if need_to_update_builder:
-      builder_obj.put()
+    update_step_builders(master, builder, step_names)
+    # Builds can finish out of order, so all the build numbers returned are
+    # remembered instead of only the highest one.
+    builder_obj.seen_buildnumbers = sorted(
+        set(build['number'] for build in builds))
+    builder_obj.put()
+
+
+MAX_CONCURRENT_BUILDER_FETCHES = 10
+
+
+def fetch_build_steps(master, builders):  # pragma: no cover
+  """Yields (builder, builds) for each builder of a master.
+
+  Up to MAX_CONCURRENT_BUILDER_FETCHES builders are fetched at once. builds is
+  None if the builds of a builder could not be fetched.
+  """
+  pending = collections.deque()
+
+  def finish_fetch():
+    builder, url, rpc = pending.popleft()
+    try:
+      return builder, parse_build_steps(get_json_result(url, rpc.get_result()))
+    except Exception:
+      logging.exception('failed to fetch builds for %s/%s' % (master, builder))
+      return builder, None
+
+  for builder in builders:
+    if len(pending) >= MAX_CONCURRENT_BUILDER_FETCHES:
+      yield finish_fetch()
+    url = get_build_steps_url(master, builder)
+    pending.append((builder, url, get_json_async(url, follow_redirects=False)))
+  while pending:
+    yield finish_fetch()
+
+
+def get_or_create_builders(master, builders):  # pragma: no cover
+  builder_keys = [ndb.Key('Master', master, 'Builder', builder)
+                  for builder in builders]
+  builder_objs = ndb.get_multi(builder_keys)
+  new_builder_objs = []
+  for i, builder_key in enumerate(builder_keys):
+    if not builder_objs[i]:
+      builder_objs[i] = models.Builder(
+          name=builder_key.id(),
+          key=builder_key,
+      )
+      new_builder_objs.append(builder_objs[i])
+  ndb.put_multi(new_builder_objs)
+  return builder_objs
 
 
 def process_a_master(master):  # pragma: no cover
   logging.info('getting builders for %s' % master)
-  builders = get_master_json(master)
+  builders = sorted(get_master_json(master))
   with disable_internal_cache():
-    for builder in builders:
-      builder_key = ndb.Key('Master', master, 'Builder', builder)
-      if not builder_key.get():
-        builder_model = models.Builder(
-            name=builder,
-            key=builder_key,
-        )
-        builder_model.put()
-      logging.info('getting builds for %s/%s' % (master, builder))
-      deferred.defer(process_builder, master, builder, _queue='builder-crawl',
-          _target='stats-backend')
+    builder_objs = dict(zip(builders, get_or_create_builders(master, builders)))
+    for builder, builds in fetch_build_steps(master, builders):
+      if builds is not None:
+        process_builder(master, builder_objs[builder], builds)
 
 
 def process_all_masters():  # pragma: no cover
-  for master in masters:
-    master_key = ndb.Key('Master', master)
-    if not master_key.get():
-      master_model = models.Master(
-          name=master,
-          key=master_key,
-      )
-      master_model.put()
+  master_keys = [ndb.Key('Master', master) for master in masters]
+  ndb.put_multi([
+      models.Master(name=master_key.id(), key=master_key)
+      for master_key, master_obj in zip(master_keys,
+                                        ndb.get_multi(master_keys))
+      if not master_obj])
 
+  for master in masters:
     deferred.defer(process_a_master, master, _queue='master-crawl',
         _target='stats-backend')
 
@@ -661,14 +1072,8 @@ class TimeAggregate(pipeline.Pipeline):
         if result:
           return result.pop()
         start = end - timedelta(seconds=window)
-        record_iterator = get_step_record_iterator(step, start, end)
-        if builder:
-          record_iterator = record_iterator.filter(
-              models.BuildStepRecord.builder == builder)
-        if master:
-          record_iterator = record_iterator.filter(
-              models.BuildStepRecord.master == master)
-        results = process_statistical_calculations(record_iterator)
+        results = sketch_statistics(get_step_sketch(
+            step, start, end, master=master, builder=builder))
         results['step'] = hybrid_step
         results['generated'] = datetime.now()
         results['start'] = str(end - timedelta(seconds=(window)))
@@ -14,6 +14,8 @@ class Builder(ndb.Model):
   name = ndb.StringProperty()
   generated = ndb.DateTimeProperty(auto_now_add=True)
   steps = ndb.PickleProperty()
+  # Build numbers returned by the last crawl, whose steps were already written.
+  seen_buildnumbers = ndb.IntegerProperty(repeated=True, indexed=False)
 
 
 class Step(ndb.Model):
@@ -53,3 +55,47 @@ class BuildStatisticRecord(ndb.Model):
   record = ndb.StringProperty()
   stats = ndb.StructuredProperty(BuildStepStatistic)
   generated = ndb.DateTimeProperty(auto_now_add=True)
+
+
+# Mergeable summary of the times of one step of one builder in one hour,
+# updated as BuildStepRecords are written. Times are counted in logarithmic
+# buckets, see controller.add_times_to_sketch().
+class StepTimeSketch(ndb.Model):
+  master = ndb.StringProperty()
+  builder = ndb.StringProperty()
+  stepname = ndb.StringProperty()
+  hour = ndb.DateTimeProperty()
+  count = ndb.IntegerProperty(default=0)
+  total = ndb.FloatProperty(default=0.0, indexed=False)
+  total_squares = ndb.FloatProperty(default=0.0, indexed=False)
+  minimum = ndb.FloatProperty(indexed=False)
+  maximum = ndb.FloatProperty(indexed=False)
+  failure_count = ndb.IntegerProperty(default=0, indexed=False)
+  buckets = ndb.PickleProperty(compressed=True)
+  # Ids of the BuildStepRecords counted in the sketch, so that records which
+  # are ingested more than once are only counted once.
+  record_ids = ndb.StringProperty(repeated=True, indexed=False)
+
+
+# The first hour whose BuildStepRecords are all counted in StepTimeSketches.
+class StepTimeSketchStart(ndb.Model):
+  hour = ndb.DateTimeProperty()
+
+
+# The statistics of one step in one hour, with one column entry per builder
+# which ran it, built from the StepTimeSketches of that hour. Rows of hours
+# whose data may still trickle in are provisional.
+class StepHourRollup(ndb.Model):
+  stepname = ndb.StringProperty()
+  hour = ndb.DateTimeProperty()
+  provisional = ndb.BooleanProperty()
+  # Maps the StepTimeSketch property names to lists of per builder values.
+  columns = ndb.PickleProperty(compressed=True)
+  generated = ndb.DateTimeProperty(auto_now=True)
+
+
+# Marks a StepHourRollup whose StepTimeSketches changed since it was written.
+class StepHourRollupPending(ndb.Model):
+  stepname = ndb.StringProperty()
+  hour = ndb.DateTimeProperty()
+  updated = ndb.DateTimeProperty(auto_now=True)
@@ -351,10 +351,13 @@ class StatsApi(remote.Service):
     hour = self._date_parser(request.hour)
     hour = hour.replace(minute=0, second=0, microsecond=0)
     end = hour + timedelta(hours=1)
-    record_iterator = (convert_record_from_ndb(r) for r in
-        controller.get_step_record_iterator(request.step, hour, end))
-    stat_ndb = controller.get_step_records_internal(request.step, hour, end,
-        record_iterator)
+    stat_ndb = controller.get_rolled_up_step_records(request.step,
+        request.step, hour)
+    if not stat_ndb:
+      record_iterator = (convert_record_from_ndb(r) for r in
+          controller.get_step_record_iterator(request.step, hour, end))
+      stat_ndb = controller.get_step_records_internal(request.step, hour, end,
+          record_iterator)
     stat_obj = statistic_from_ndb(stat_ndb)
     stat_obj.step = request.step
     stat_obj.generated = datetime.now()
@@ -389,11 +392,15 @@ class StatsApi(remote.Service):
     hour = self._date_parser(request.hour)
     hour = hour.replace(minute=0, second=0, microsecond=0)
     end = hour + timedelta(hours=1)
-    record_iterator = (convert_record_from_ndb(r) for r in
-        controller.get_step_master_iterator(request.master,
-          request.step, hour, end))
-    stat_ndb = controller.get_step_records_internal('/'.join(
-      [request.master, request.step]), hour, end, record_iterator)
+    record = '/'.join([request.master, request.step])
+    stat_ndb = controller.get_rolled_up_step_records(record, request.step,
+        hour, master=request.master)
+    if not stat_ndb:
+      record_iterator = (convert_record_from_ndb(r) for r in
+          controller.get_step_master_iterator(request.master,
+            request.step, hour, end))
+      stat_ndb = controller.get_step_records_internal(record, hour, end,
+          record_iterator)
     stat_obj = statistic_from_ndb(stat_ndb)
     stat_obj.step = '%s/%s' % (request.master, request.step)
     stat_obj.generated = datetime.now()
@@ -430,12 +437,15 @@ class StatsApi(remote.Service):
     hour = self._date_parser(request.hour)
     hour = hour.replace(minute=0, second=0, microsecond=0)
     end = hour + timedelta(hours=1)
-    record_iterator = (convert_record_from_ndb(r) for r in
-        controller.get_step_builder_iterator(request.master,
-          request.builder, request.step, hour, end))
-    stat_ndb = controller.get_step_records_internal('/'.join(
-      [request.master, request.builder, request.step]),
-      hour, end, record_iterator)
+    record = '/'.join([request.master, request.builder, request.step])
+    stat_ndb = controller.get_rolled_up_step_records(record, request.step,
+        hour, master=request.master, builder=request.builder)
+    if not stat_ndb:
+      record_iterator = (convert_record_from_ndb(r) for r in
+          controller.get_step_builder_iterator(request.master,
+            request.builder, request.step, hour, end))
+      stat_ndb = controller.get_step_records_internal(record, hour, end,
+          record_iterator)
     stat_obj = statistic_from_ndb(stat_ndb)
     stat_obj.step = '%s/%s/%s' % (request.master, request.builder, request.step)
     stat_obj.generated = datetime.now()
@@ -468,9 +478,51 @@ class StatsApi(remote.Service):
                     path='aggregate/{step}', http_method='GET',
                     name='aggregate.get')
   # pylint: disable=R0201
-  # Unused argument - pylint: disable=W0613
   def get_aggregate(self, request):
-    raise endpoints.InternalServerErrorException('Not yet implemented')
+    if request.aggregate_type != AggregateType.TIME:
+      raise endpoints.InternalServerErrorException('Not yet implemented')
+    window_hours = request.window / (60 * 60.0)
+    slide_hours = request.slide / (60 * 60.0)
+    if (window_hours < 1 or window_hours != int(window_hours) or
+        slide_hours < 1 or slide_hours != int(slide_hours)):
+      raise endpoints.BadRequestException(
+          'window and slide must be whole numbers of hours')
+    window_hours = int(window_hours)
+    slide_hours = int(slide_hours)
+    if request.end:
+      end = controller.ceil_hour(self._date_parser(request.end))
+    else:
+      end = controller.ceil_hour(datetime.now())
+
+    # Every hour of every window is read from its StepHourRollup at once.
+    first = end - timedelta(
+        hours=(request.limit - 1) * slide_hours + window_hours)
+    hours = [first + timedelta(hours=i) for i in xrange(
+        int((end - first).total_seconds()) / (60 * 60))]
+    hour_sketches = controller.get_hour_sketches(request.step, hours,
+        master=request.master, builder=request.builder)
+
+    hybrid_step = request.step
+    if request.builder:
+      hybrid_step = request.builder + '/' + hybrid_step
+    if request.master:
+      hybrid_step = request.master + '/' + hybrid_step
+    result = StatisticList(generated=datetime.now())
+    for i in xrange(request.limit):
+      window_end = len(hours) - i * slide_hours
+      sketch = controller.new_sketch()
+      for hour_sketch in hour_sketches[window_end - window_hours:window_end]:
+        controller.merge_sketch(sketch, hour_sketch)
+      stat_obj = Statistic(**controller.sketch_statistics(sketch))
+      stat_obj.step = hybrid_step
+      stat_obj.generated = result.generated
+      stat_obj.start = str(hours[window_end - window_hours])
+      stat_obj.center = str(hours[window_end - window_hours] +
+          timedelta(hours=window_hours / 2.0))
+      stat_obj.aggregation_range = request.window
+      stat_obj.aggregate_type = AggregateType.TIME
+      result.statistics.append(stat_obj)
+    return result
 
 
 APPLICATION = endpoints.api_server([StatsApi])
@@ -0,0 +1,71 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import numpy
+
+from testing_utils import testing
+import controller
+
+
+class TestSketches(testing.AppengineTestCase):
+  def setUp(self):
+    super(TestSketches, self).setUp()
+    random = numpy.random.RandomState(0)
+    self.times = random.lognormal(mean=3.0, sigma=1.5, size=1000)
+    self.errors = random.random_sample(1000) < 0.1
+
+  def test_add_times_to_sketch(self):
+    sketch = controller.new_sketch()
+    controller.add_times_to_sketch(
+        sketch, numpy.array([0.0, -1.0, 1.0, 1.5, 100.0]),
+        numpy.array([False, True, False, True, False]))
+    self.assertEquals(5, sketch.count)
+    self.assertEquals(2, sketch.failure_count)
+    self.assertEquals(-1.0, sketch.minimum)
+    self.assertEquals(100.0, sketch.maximum)
+    self.assertAlmostEquals(101.5, sketch.total)
+    self.assertEquals(2, sketch.buckets[None])
+    for time in (1.0, 1.5, 100.0):
+      index = int(numpy.ceil(numpy.log(time) / controller.SKETCH_LOG_GAMMA))
+      self.assertEquals(1, sketch.buckets[index])
+      self.assertLess(controller.SKETCH_GAMMA ** (index - 1), time)
+      self.assertLessEqual(time, controller.SKETCH_GAMMA ** index * (1 + 1e-9))
+
+  def test_merge_sketch(self):
+    whole = controller.new_sketch()
+    controller.add_times_to_sketch(whole, self.times, self.errors)
+    merged = controller.new_sketch()
+    for part in range(0, 1000, 300):
+      sketch = controller.new_sketch()
+      controller.add_times_to_sketch(sketch, self.times[part:part + 300],
+                                     self.errors[part:part + 300])
+      controller.merge_sketch(merged, sketch)
+    self.assertEquals(whole.buckets, merged.buckets)
+    self.assertEquals(whole.count, merged.count)
+    self.assertEquals(whole.failure_count, merged.failure_count)
+    self.assertEquals(whole.minimum, merged.minimum)
+    self.assertEquals(whole.maximum, merged.maximum)
+    self.assertAlmostEquals(whole.total, merged.total)
+
+  def test_sketch_percentiles(self):
+    percentiles = [0, 1, 25, 50, 75, 90, 99, 100]
+    sketch = controller.new_sketch()
+    controller.add_times_to_sketch(sketch, self.times, self.errors)
+    for estimate, exact in zip(
+        controller.sketch_percentiles(sketch, percentiles),
+        numpy.percentile(self.times, percentiles)):
+      self.assertLessEqual(abs(estimate - exact),
+                           exact * controller.SKETCH_ACCURACY)
+
+  def test_sketch_statistics(self):
+    sketch = controller.new_sketch()
+    controller.add_times_to_sketch(sketch, self.times, self.errors)
+    statistics = controller.sketch_statistics(sketch)
+    self.assertEquals(1000, statistics['count'])
+    self.assertEquals(self.times.max(), statistics['maximum'])
+    self.assertAlmostEquals(self.times.mean(), statistics['mean'])
+    self.assertAlmostEquals(self.times.std(), statistics['stddev'], places=5)
+    self.assertEquals(int(self.errors.sum()), statistics['failure_count'])
+    self.assertEquals({'count': 0},
+                      controller.sketch_statistics(controller.new_sketch()))
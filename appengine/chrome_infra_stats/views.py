@@ -225,3 +225,10 @@ class CullOldSteps(BaseHandler):  # pragma: no cover
     deferred.defer(controller.step_cleanup, _queue='step-operations',
     _target='stats-backend')
     self.response.out.write('steps cleaned')
+
+
+class RollupStepHours(BaseHandler):  # pragma: no cover
+  def get(self):
+    deferred.defer(controller.rollup_step_hours, _queue='step-operations',
+    _target='stats-backend')
+    self.response.out.write('step hours rolled up')
@@ -193,6 +193,10 @@ class Row(db.Model):
   status = db.TextProperty()
   comment = db.TextProperty()
   details = db.TextProperty()
+  # Structured fields, parsed once by parse_master for console_merger.
+  revlink = db.TextProperty()
+  # JSON list of the status table of each category.
+  statuses = db.TextProperty()
 
 
 def get_or_create_row(localpath, revision):
@@ -222,6 +226,50 @@ def get_and_cache_rowdata(localpath):
     logging.debug('get_and_cache_rowdata(\'%s\'): no matching localpath in '
         'datastore' % localpath)
     return {}
+  row_data = get_rowdata(row)
+  logging.debug('content for %s found in datastore' % localpath)
+  put_data_into_cache(localpath, row_data)
+  return row_data
+
+
+def get_and_cache_rowdata_multi(localpaths):
+  """Returns a list of row_data dicts, one for each of the localpaths.
+
+  Like get_and_cache_rowdata, but rows are looked up in the cache with a single
+  batch get, and those not found there are fetched from the datastore with a
+  single batch get.  Missing rows are returned as empty dicts.
+
+  Here we assume the localpaths are already unquoted.
+  """
+  memcache_data = memcache.get_multi(localpaths)
+  rows_data = {}
+  uncached_localpaths = []
+  for localpath in localpaths:
+    row_data = None
+    if localpath in memcache_data:
+      row_data = json.loads(memcache_data[localpath])
+    if row_data and type(row_data) == type({}):
+      rows_data[localpath] = row_data
+    else:
+      uncached_localpaths.append(localpath)
+  if uncached_localpaths:
+    rows = Row.get_by_key_name(uncached_localpaths)
+    new_memcache_data = {}
+    for localpath, row in zip(uncached_localpaths, rows):
+      if not row:
+        continue
+      rows_data[localpath] = get_rowdata(row)
+      new_memcache_data[localpath] = json.dumps(rows_data[localpath],
+                                                default=dtdumper)
+    logging.debug('content for %d rows found in datastore' % (
+        len(new_memcache_data)))
+    if memcache.set_multi(new_memcache_data, time=2*60):
+      logging.error('get_and_cache_rowdata_multi(): memcache.set_multi() '
+                    'failed')
+  return [rows_data.get(localpath, {}) for localpath in localpaths]
+
+
+def get_rowdata(row):
   row_data = {}
   row_data['rev'] = row.revision
   row_data['name'] = row.name
@@ -230,8 +278,8 @@ def get_and_cache_rowdata(localpath):
   row_data['details'] = row.details
   row_data['rev_number'] = row.rev_number
   row_data['fetch_timestamp'] = row.fetch_timestamp
-  logging.debug('content for %s found in datastore' % localpath)
-  put_data_into_cache(localpath, row_data)
+  row_data['revlink'] = row.revlink
+  row_data['statuses'] = json.loads(row.statuses) if row.statuses else None
   return row_data
 
 
@@ -252,6 +300,8 @@ def save_row(row_data, localpath):
     row.status = row_data['status']
     row.comment = row_data['comment']
     row.details = row_data['details']
+    row.revlink = row_data.get('revlink')
+    row.statuses = json.dumps(row_data.get('statuses'))
     # E1103:967,4:save_row.tx_row: Instance of 'list' has no 'put' member
     # (but some types could not be inferred)
     # pylint: disable=E1103
@@ -358,6 +408,21 @@ class ConsoleData(object):
     self.category_count += 1
 
   def AddRow(self, row):
+    if row.get('statuses') is None:
+      self.AddUnparsedRow(row)
+      return
+    self.SawRevision(row['rev'], row['rev_number'])
+    self.SetLink(row['revlink'])
+    self.SetName(row['name'])
+    for category, status in zip(self.category_order[self.lastMasterSeen],
+                                row['statuses']):
+      self.SetStatus(category, status)
+    self.SetComment(row['comment'])
+    if row['details']:
+      self.SetDetail(row['details'])
+
+  def AddUnparsedRow(self, row):
+    """Adds a row saved without its structured fields by parsing its HTML."""
     self.SawRevision(row['rev'], row['rev_number'])
     revlink = BeautifulSoup(row['rev']).a['href']
     self.SetLink(revlink)
@@ -414,12 +479,9 @@ def console_merger(localpath, remoteurl, page_data,
   masters_to_merge = masters_to_merge or DEFAULT_MASTERS_TO_MERGE
   num_rows_to_merge = num_rows_to_merge or 25
   console_data = ConsoleData()
-  surroundings = get_and_cache_pagedata(
-                     '%s/console/surroundings' % masters_to_merge[0])
-  merged_page = BeautifulSoup(surroundings['content'])
-  merged_tag = merged_page.find('table', 'ConsoleData')
-  if merged_tag is None:
-    msg = 'console_merger("%s", "%s", "%s"): merged_tag cannot be None.' % (
+  surroundings = get_and_cache_consoledata(masters_to_merge[0])
+  if surroundings is None:
+    msg = 'console_merger("%s", "%s", "%s"): surroundings cannot be None.' % (
           localpath, remoteurl, page_data)
     logging.error(msg)
     raise Exception(msg)
@@ -430,54 +492,33 @@ def console_merger(localpath, remoteurl, page_data,
                       localpath, remoteurl, page_data))
     return
   fetch_timestamp = datetime.datetime.now()
+  masters_data = []
   for master in masters_to_merge:
-    # Fetch the summary one-box-per-builder for the master.
+    # Fetch the structured console of the master.
     # If we don't get it, something is wrong, skip the master entirely.
-    master_summary = get_and_cache_pagedata('%s/console/summary' % master)
-    if not master_summary['content']:
-      continue
+    master_data = get_and_cache_consoledata(master)
+    if master_data is not None:
+      masters_data.append((master, master_data))
+
+  # Fetch all of the rows that we need, for all of the masters at once.
+  rows_data = get_merger_rowdata([master for master, _ in masters_data],
+                                 latest_rev, num_rows_to_merge)
+  for master, master_data in masters_data:
     console_data.SawMaster(master)
-    # Get the categories for this builder. If the builder doesn't have any
-    # categories, just use the default empty-string category.
-    category_list = []
-    master_categories = get_and_cache_pagedata('%s/console/categories' % master)
-    if not master_categories['content']:
-      category_list.append('')
-    else:
-      category_row = BeautifulSoup(master_categories['content'])
-      category_list = [c.text for c in category_row.findAll('td', 'DevStatus')]
-    # Get the corresponding summary box(es).
-    summary_row = BeautifulSoup(master_summary['content'])
-    summary_list = summary_row.findAll('table')
-    for category, summary in zip(category_list, summary_list):
+    for category, summary in zip(master_data['categories'],
+                                 master_data['summaries']):
       console_data.AddCategory(category, summary)
-
-    # Fetch all of the rows that we need.
-    rows_fetched = 0
-    revs_skipped = 0
-    current_rev = latest_rev
-    while rows_fetched < num_rows_to_merge and current_rev >= 0:
-      # Don't get stuck looping backwards forever into data we don't have.
-      # How hard we try scales with how many rows the person wants.
-      if revs_skipped > max(num_rows_to_merge, 10):
-        break
-      row_data = get_and_cache_rowdata('%s/console/%s' % (master, current_rev))
-      if not row_data:
-        current_rev -= 1
-        revs_skipped += 1
-        continue
+    for row_data in rows_data[master]:
       console_data.AddRow(row_data)
-      current_rev -= 1
-      revs_skipped = 0
-      rows_fetched += 1
 
   # Convert the merged content into console content.
   console_data.Finish()
   template_environment = Environment()
   template_environment.loader = FileSystemLoader('.')
   def notstarted(builder_status):
-    """Convert a BeautifulSoup Tag from builder status to a notstarted line."""
-    builder_status = re.sub(r'DevSlaveBox', 'DevStatusBox', str(builder_status))
+    """Convert builder status HTML to a notstarted line."""
+    builder_status = re.sub(r'DevSlaveBox', 'DevStatusBox',
+                            unicode(builder_status))
     builder_status = re.sub(r'class=\'([^\']*)\' target=',
                             'class=\'DevStatusBox notstarted\' target=',
                             builder_status)
@@ -493,22 +534,10 @@ def console_merger(localpath, remoteurl, page_data,
   # import code
   # code.interact(local=locals())
 
-  # Place merged console at |merged_tag|'s location in |merged_page|, and put
-  # the result in |merged_content|.
-  merged_tag.replaceWith(merged_console)
-  merged_content = utf8_convert(merged_page)
-  merged_content = re.sub(
-      r'\'\<a href="\'', '\'<a \' + attributes + \' href="\'', merged_content)
-  merged_content = re.sub(
-      r'\'\<table\>\'', r"'<table ' + attributes + '>'", merged_content)
-  merged_content = re.sub(
-      r'\'\<div\>\'', r"'<div ' + attributes + '>'", merged_content)
-  merged_content = re.sub(
-      r'\'\<td\>\'', r"'<td ' + attributes + '>'", merged_content)
-  merged_content = re.sub(
-      r'\<iframe\>\</iframe\>',
-      '<iframe \' + attributes + \' src="\' + url + \'"></iframe>',
-      merged_content)
+  # Place merged console between the surroundings of the first master.
+  merged_content = u''.join([surroundings['surroundings_head'],
+                             merged_console,
+                             surroundings['surroundings_tail']])
 
   # Update the merged console page.
   merged_page = get_or_create_page(localpath, None, maxage=30)
@@ -522,6 +551,56 @@ def console_merger(localpath, remoteurl, page_data,
   return
 
 
+def get_and_cache_consoledata(master):
+  """Returns the structured console of a master saved by parse_master.
+
+  None if the master's console hasn't been parsed yet.
+  """
+  console_page = get_and_cache_pagedata('%s/console/data' % master)
+  if not console_page['content']:
+    return None
+  return json.loads(console_page['content'])
+
+
+def get_merger_rowdata(masters, latest_rev, num_rows_to_merge):
+  """Returns the row_data dicts to merge, by master, newest first.
+
+  Each master's rows are looked up walking backwards from latest_rev.  Rows of
+  all of the masters are fetched together, num_rows_to_merge revisions of each
+  master at a time.
+  """
+  # Don't get stuck looping backwards forever into data we don't have.
+  # How hard we try scales with how many rows the person wants.
+  max_revs_skipped = max(num_rows_to_merge, 10)
+  rows_data = dict((master, []) for master in masters)
+  current_revs = dict((master, latest_rev) for master in masters)
+  revs_skipped = dict((master, 0) for master in masters)
+  def done(master):
+    return (len(rows_data[master]) >= num_rows_to_merge or
+            current_revs[master] < 0 or
+            revs_skipped[master] > max_revs_skipped)
+  masters_left = [master for master in masters if not done(master)]
+  while masters_left:
+    revisions = [(master, rev) for master in masters_left
+                 for rev in xrange(current_revs[master],
+                                   max(current_revs[master] -
+                                       num_rows_to_merge, -1),
+                                   -1)]
+    batch_rows_data = get_and_cache_rowdata_multi(
+        ['%s/console/%s' % revision for revision in revisions])
+    for (master, _), row_data in zip(revisions, batch_rows_data):
+      if done(master):
+        continue
+      current_revs[master] -= 1
+      if row_data:
+        rows_data[master].append(row_data)
+        revs_skipped[master] = 0
+      else:
+        revs_skipped[master] += 1
+    masters_left = [master for master in masters_left if not done(master)]
+  return rows_data
+
+
 def console_handler(unquoted_localpath, remoteurl, page_data=None):
   page_data = page_data or {}
   content = page_data.get('content')
@@ -741,6 +820,29 @@ def parse_master(localpath, remoteurl, page_data=None):
   summary_data['content'] = utf8_convert(summary)
   save_page(summary_page, localpath + '/summary', ts, summary_data)
 
+  # Save the structured console used by console_merger: the surroundings
+  # before and after the console table, and the category names and summary
+  # box of each category.
+  surroundings_head, _, surroundings_tail = (
+      surroundings_data['content'].partition(utf8_convert(new_data)))
+  console_data = {}
+  console_data['surroundings_head'] = fix_surroundings(surroundings_head)
+  console_data['surroundings_tail'] = fix_surroundings(surroundings_tail)
+  if categories:
+    console_data['categories'] = [c.text for c in
+                                  categories.findAll('td', 'DevStatus')]
+  else:
+    # If the master doesn't have any categories, just use the default
+    # empty-string category.
+    console_data['categories'] = ['']
+  console_data['summaries'] = [utf8_convert(table) for table in
+                               summary.findAll('table')]
+  console_page = get_or_create_page(localpath + '/data', None, maxage=30)
+  console_page_data = {}
+  console_page_data['title'] = 'Console data for ' + localpath
+  console_page_data['content'] = json.dumps(console_data)
+  save_page(console_page, localpath + '/data', ts, console_page_data)
+
   curr_row = {}
   # Each table row is either a status row with a revision, name, and status,
   # a comment row with the commit message, a details row with flakiness info,
@@ -755,10 +857,12 @@ def parse_master(localpath, remoteurl, page_data=None):
     elif row.find('td', 'DevStatus'):
       curr_row['rev'] = ''.join(utf8_convert(tag).strip()
                                 for tag in row.find('td', 'DevRev').contents)
+      curr_row['revlink'] = row.find('td', 'DevRev').a['href']
       curr_row['name'] = ''.join(utf8_convert(tag).strip()
                                  for tag in row.find('td', 'DevName').contents)
-      curr_row['status'] = ''.join(utf8_convert(box.table).strip()
-                                   for box in row.findAll('td', 'DevStatus'))
+      curr_row['statuses'] = [utf8_convert(box.table).strip()
+                              for box in row.findAll('td', 'DevStatus')]
+      curr_row['status'] = ''.join(curr_row['statuses'])
     else:
       if 'details' not in curr_row:
         curr_row['details'] = ''
@@ -770,6 +874,23 @@ def parse_master(localpath, remoteurl, page_data=None):
   return page_data
 
 
+def fix_surroundings(content):
+  """Restores the JavaScript-generated tags mangled by BeautifulSoup."""
+  content = re.sub(
+      r'\'\<a href="\'', '\'<a \' + attributes + \' href="\'', content)
+  content = re.sub(
+      r'\'\<table\>\'', r"'<table ' + attributes + '>'", content)
+  content = re.sub(
+      r'\'\<div\>\'', r"'<div ' + attributes + '>'", content)
+  content = re.sub(
+      r'\'\<td\>\'', r"'<td ' + attributes + '>'", content)
+  content = re.sub(
+      r'\<iframe\>\</iframe\>',
+      '<iframe \' + attributes + \' src="\' + url + \'"></iframe>',
+      content)
+  return content
+
+
 def one_box_handler(unquoted_localpath, remoteurl, page_data=None):
   page_data = page_data or {}
   content = page_data.get('content')
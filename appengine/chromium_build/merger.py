@@ -2,17 +2,27 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import copy
 import datetime
+import hashlib
+import json
 import logging
 import jinja2
 import webapp2
 
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
 import app
 import base_page
 import utils
 
 from third_party.BeautifulSoup.BeautifulSoup import BeautifulSoup
 
+# Memcache key of the version of the last persisted MergerData.
+MERGER_VERSION_KEY = 'merger_version'
+
+
 class BuildData(object):
   """Represents a single build in the waterfall.
 
@@ -48,19 +58,68 @@ class RowData(object):
     # Per-builder status stored at self.status[master][category][builder].
     self.status = {}
     self.timestamp = datetime.datetime.now()
+    # Ring buffer slot of the row, see MergerData.add_row().
+    self.slot = None
+    # Hash of the status HTML each master's statuses were parsed from.
+    self.status_hashes = {}
+    # MergerData version in which each master's statuses last changed.
+    self.status_versions = {}
 
   def purge_unicode(self, enc='ascii', err='replace'):
     self.committer = self.committer.encode(enc, err)
     self.comment = self.comment.encode(enc, err)
     self.details = self.details.encode(enc, err)
 
+
+class MergerHeader(ndb.Model):
+  """The state of MergerData besides its rows.
+
+  A single entity, keyed by 'merger'.
+  """
+  version = ndb.IntegerProperty(indexed=False)
+  state = ndb.PickleProperty(compressed=True)
+
+
+class MergerRowSlot(ndb.Model):
+  """A slot of the MergerData ring buffer of rows.
+
+  Keyed by slot number + 1, as ids can't be 0.
+  """
+  # MergerData version in which the row last changed.
+  version = ndb.IntegerProperty(indexed=False)
+  row = ndb.PickleProperty(compressed=True)
+
+
 class MergerData(object):
   """Persistent data storage class.
 
   Holds all of the data we have about the last 100 revisions.
   Keeps it organized and can render it upon request.
+
+  The rows are kept in a ring buffer of SIZE slots, persisted one
+  MergerRowSlot entity per slot.  Each update that changes anything
+  increments the version; only the rows it changed are persisted again, and
+  other instances load only the slots newer than their own version.
+
+  Requests share a MergerData without locking, so it is never modified once
+  it serves requests: updates and refreshes make a new one, see get_data().
   """
 
+  # Attributes persisted in the MergerHeader.
+  HEADER_ATTRIBUTES = (
+      'ordered_categories',
+      'ordered_builders',
+      'latest_rev',
+      'status',
+      'failures',
+      'version',
+      'summary_hashes',
+      'master_versions',
+      'slot_revs',
+      'slot_versions',
+      'next_slot',
+  )
+
   def __init__(self):
     self.SIZE = 100
     # Straight list of masters to display.
@@ -73,49 +132,25 @@ class MergerData(object):
     self.rows = {}
     self.status = {}
     self.failures = {}
+    self.version = 0
+    # Hash of the category and summary HTML each master was parsed from.
+    self.summary_hashes = {}
+    # Version in which each master's categories, builders or status changed.
+    self.master_versions = {}
+    # Revision of the row in each slot, and the slot for the next new row.
+    self.slot_revs = [None] * self.SIZE
+    self.next_slot = 0
+    # Version in which the row in each slot last changed.
+    self.slot_versions = [0] * self.SIZE
+    # Pre-rendered HTML fragments, see render_fragment().
+    self.fragments = {}
 
   def bootstrap(self):
     """Fills an empty MergerData with 100 rows of data."""
+    self.version += 1
     # Populate the categories, masters, status, and failures data.
     for m in self.ordered_masters:
-      for d in (self.ordered_builders,
-                self.ordered_categories,
-                self.status,
-                self.failures):
-        d.setdefault(m, {})
-      # Get the category data and construct the list of categories
-      # for this master.
-      category_data = app.get_and_cache_pagedata('%s/console/categories' % m)
-      if not category_data['content']:
-        category_list = [u'default']
-      else:
-        category_soup = BeautifulSoup(category_data['content'])
-        category_list = [tag.string.strip() for tag in
-                         category_soup.findAll('td', 'DevStatus')]
-      self.ordered_categories[m] = category_list
-      # Get the builder status data.
-      builder_data = app.get_and_cache_pagedata('%s/console/summary' % m)
-      if not builder_data['content']:
-        continue
-      builder_soup = BeautifulSoup(builder_data['content'])
-      builders_by_category = builder_soup.tr.findAll('td', 'DevSlave',
-                                                     recursive=False)
-      # Construct the list of builders for this category.
-      for i, c in enumerate(self.ordered_categories[m]):
-        self.ordered_builders[m].setdefault(c, {})
-        builder_list = [tag['title'] for tag in
-                        builders_by_category[i].findAll('a', 'DevSlaveBox')]
-        self.ordered_builders[m][c] = builder_list
-      # Fill in the status data for all of this master's builders.
-      update_status(m, builder_data['content'], self.status)
-      # Copy that status data over into the failures dictionary too.
-      for c in self.ordered_categories[m]:
-        self.failures[m].setdefault(c, {})
-        for b in self.ordered_builders[m][c]:
-          if self.status[m][c][b] not in ('success', 'running', 'notstarted'):
-            self.failures[m][c][b] = True
-          else:
-            self.failures[m][c][b] = False
+      self.update_master(m, self.version)
     # Populate the individual row data, saving status info in the same
     # master/category/builder tree format constructed above.
     latest_rev = int(app.get_and_cache_rowdata('latest_rev')['rev_number'])
@@ -124,28 +159,251 @@ class MergerData(object):
       return
     n = latest_rev
     num_rows_saved = num_rows_skipped = 0
+    rows = []
     while num_rows_saved < self.SIZE and num_rows_skipped < 10:
       curr_row = RowData()
       for m in self.ordered_masters:
-        update_row(n, m, curr_row)
+        update_row(self, m, curr_row, app.get_and_cache_rowdata(
+            '%s/console/%s' % (m, n)), self.version)
       # If we didn't get any data, that revision doesn't exist, so skip on.
       if not curr_row.revision:
         num_rows_skipped += 1
         n -= 1
         continue
-      self.rows[n] = curr_row
+      rows.append(curr_row)
       num_rows_skipped = 0
       num_rows_saved += 1
       n -= 1
+    # The oldest row goes in first, so that it is the first one replaced.
+    for row in reversed(rows):
+      self.add_row(row)
     self.latest_rev = max(self.rows.keys())
-
-
-def update_row(revision, master, row):
-  """Fetches a row from the datastore and puts it in a RowData object."""
-  # Fetch the relevant data from the datastore / cache.
-  row_data = app.get_and_cache_rowdata('%s/console/%s' % (master, revision))
+    self.save(self.rows.keys())
+
+  def update_master(self, master, version):
+    """Updates the categories, builders and status of a master.
+
+    Does nothing if the category and summary HTML didn't change since they
+    were last parsed.  Returns whether anything changed.
+    """
+    for d in (self.ordered_builders,
+              self.ordered_categories,
+              self.status,
+              self.failures):
+      d.setdefault(master, {})
+    category_data = app.get_and_cache_pagedata(
+        '%s/console/categories' % master)
+    builder_data = app.get_and_cache_pagedata('%s/console/summary' % master)
+    summary_hash = hashlib.sha1(json.dumps(
+        [category_data['content'], builder_data['content']])).hexdigest()
+    if self.summary_hashes.get(master) == summary_hash:
+      return False
+    self.summary_hashes[master] = summary_hash
+    self.master_versions[master] = version
+    old_builders = self.ordered_builders[master]
+    # Construct the list of categories for this master.
+    if not category_data['content']:
+      category_list = [u'default']
+    else:
+      category_soup = BeautifulSoup(category_data['content'])
+      category_list = [tag.string.strip() for tag in
+                       category_soup.findAll('td', 'DevStatus')]
+    self.ordered_categories[master] = category_list
+    # Get the builder status data.
+    if not builder_data['content']:
+      return True
+    builder_soup = BeautifulSoup(builder_data['content'])
+    builders_by_category = builder_soup.tr.findAll('td', 'DevSlave',
+                                                   recursive=False)
+    # Construct the list of builders for this category.
+    self.ordered_builders[master] = {}
+    for i, c in enumerate(self.ordered_categories[master]):
+      builder_list = [tag['title'] for tag in
+                      builders_by_category[i].findAll('a', 'DevSlaveBox')]
+      self.ordered_builders[master][c] = builder_list
+    # Statuses of the rows were parsed by builder position, so they need to
+    # be parsed again if the builders changed.
+    if self.ordered_builders[master] != old_builders:
+      for row in self.rows.itervalues():
+        row.status_hashes.pop(master, None)
+    # Fill in the status data for all of this master's builders.
+    self.status[master] = {}
+    update_status(self, master, builder_data['content'], self.status)
+    # Copy that status data over into the failures dictionary too.
+    self.failures[master] = {}
+    for c in self.ordered_categories[master]:
+      self.failures[master].setdefault(c, {})
+      for b in self.ordered_builders[master][c]:
+        if self.status[master][c][b] not in ('success', 'running',
+                                             'notstarted'):
+          self.failures[master][c][b] = True
+        else:
+          self.failures[master][c][b] = False
+    return True
+
+  def add_row(self, row):
+    """Adds the row of a new revision, replacing the oldest row when full.
+
+    Rows must be added in increasing revision order.
+    """
+    old_rev = self.slot_revs[self.next_slot]
+    if old_rev is not None:
+      del self.rows[old_rev]
+    row.slot = self.next_slot
+    self.slot_revs[self.next_slot] = row.revision
+    self.rows[row.revision] = row
+    self.next_slot = (self.next_slot + 1) % self.SIZE
+
+  def update(self):
+    """Pulls the data gathered by the cronjob into the stored rows.
+
+    New rows are added, and rows and builders whose status changed since the
+    last update are updated.  Returns whether anything changed.
+    """
+    latest_rev = int(app.get_and_cache_rowdata('latest_rev')['rev_number'])
+    version = self.version + 1
+    masters_changed = False
+    for m in self.ordered_masters:
+      masters_changed = self.update_master(m, version) or masters_changed
+    # Fetch the data of all of the masters for both the rows we may be
+    # missing and the rows we have at once.
+    new_revs = range(max(self.latest_rev + 1, latest_rev - self.SIZE + 1),
+                     latest_rev + 1)
+    keys = [(m, n) for n in new_revs + self.rows.keys()
+            for m in self.ordered_masters]
+    rows_data = dict(zip(keys, app.get_and_cache_rowdata_multi(
+        ['%s/console/%s' % key for key in keys])))
+    changed_revs = set()
+    # Update the status of the rows we have.
+    for n, curr_row in self.rows.iteritems():
+      for m in self.ordered_masters:
+        if update_row(self, m, curr_row, rows_data[(m, n)], version):
+          changed_revs.add(n)
+    # We may have brand new rows, so store them.
+    for n in new_revs:
+      curr_row = RowData()
+      for m in self.ordered_masters:
+        update_row(self, m, curr_row, rows_data[(m, n)], version)
+      # If we didn't get any data, that revision doesn't exist, so skip on.
+      if not curr_row.revision:
+        continue
+      self.add_row(curr_row)
+      changed_revs.add(n)
+    if not masters_changed and not changed_revs:
+      return False
+    # Update our stored latest_rev to reflect the new data.
+    self.latest_rev = max(self.rows.keys())
+    self.version = version
+    self.save(changed_revs & set(self.rows))
+    self.prune_fragments()
+    return True
+
+  def save(self, revisions):
+    """Persists the header and the rows of the given revisions."""
+    for n in revisions:
+      self.slot_versions[self.rows[n].slot] = self.version
+    ndb.put_multi([MergerRowSlot(id=self.rows[n].slot + 1,
+                                 version=self.version,
+                                 row=self.rows[n])
+                   for n in revisions])
+    # The header goes last, so that the rows it refers to are there.
+    MergerHeader(id='merger', version=self.version,
+                 state=dict((attribute, getattr(self, attribute))
+                            for attribute in self.HEADER_ATTRIBUTES)).put()
+    memcache.set(MERGER_VERSION_KEY, self.version)
+
+  def copy(self):
+    """Returns a copy of the data, to be modified instead of this one."""
+    copied = MergerData()
+    for attribute, value in self.__dict__.iteritems():
+      if attribute != 'fragments':
+        setattr(copied, attribute, copy.deepcopy(value))
+    copied.fragments = dict(self.fragments)
+    return copied
+
+  def refreshed(self):
+    """Returns the data with what was persisted since our version.
+
+    The data itself if nothing was, or None if no data was ever persisted.
+    Rows are only read for the slots that changed since our version.
+    """
+    if self.version and memcache.get(MERGER_VERSION_KEY) == self.version:
+      return self
+    header = MergerHeader.get_by_id('merger')
+    if not header:
+      return None
+    if header.version == self.version:
+      return self
+    refreshed = MergerData()
+    for attribute, value in header.state.iteritems():
+      setattr(refreshed, attribute, value)
+    rows_by_slot = dict((row.slot, row) for row in self.rows.itervalues())
+    changed_slots = [
+        slot for slot, n in enumerate(refreshed.slot_revs)
+        if n is not None and (refreshed.slot_versions[slot] > self.version or
+                              slot not in rows_by_slot or
+                              rows_by_slot[slot].revision != n)]
+    row_slots = ndb.get_multi([ndb.Key(MergerRowSlot, slot + 1)
+                               for slot in changed_slots])
+    for slot, row_slot in zip(changed_slots, row_slots):
+      rows_by_slot.pop(slot, None)
+      if not row_slot:
+        logging.error('MergerData.refreshed(): slot %d is missing' % slot)
+      else:
+        rows_by_slot[slot] = row_slot.row
+    for slot, n in enumerate(refreshed.slot_revs):
+      if n is None:
+        continue
+      if slot not in rows_by_slot or rows_by_slot[slot].revision != n:
+        # The slot was replaced by an update saved after the header we read.
+        # The next refresh will pick it up, with that update's header.
+        refreshed.slot_revs[slot] = None
+        continue
+      refreshed.rows[n] = rows_by_slot[slot]
+    refreshed.fragments = self.fragments
+    refreshed.prune_fragments()
+    return refreshed
+
+  def render_fragment(self, master, row=None, extraclass=''):
+    """Returns the HTML of a master's cells in a row of the console.
+
+    The builder status cells if row is None.  Fragments are rendered once,
+    and again only after the statuses they show changed.
+    """
+    if row is None:
+      key = (master,)
+      fragment_version = self.master_versions.get(master)
+    else:
+      key = (master, row, extraclass)
+      fragment_version = (self.master_versions.get(master),
+                          self.rows[row].status_versions.get(master))
+    if key in self.fragments and self.fragments[key][0] == fragment_version:
+      return self.fragments[key][1]
+    fragments = template_environment.get_template(
+        'merger_b_fragments.html').module
+    if row is None:
+      fragment = fragments.summary_cells(self, master)
+    else:
+      fragment = fragments.status_cells(self, master, self.rows[row],
+                                        extraclass)
+    self.fragments[key] = (fragment_version, fragment)
+    return fragment
+
+  def prune_fragments(self):
+    """Drops the fragments of the rows no longer in the ring buffer."""
+    self.fragments = dict((key, fragment)
+                          for key, fragment in self.fragments.iteritems()
+                          if len(key) == 1 or key[1] in self.rows)
+
+
+def update_row(merger_data, master, row, row_data, version):
+  """Puts a row's data from the datastore / cache in a RowData object.
+
+  The statuses are only parsed again if they changed since they were last
+  parsed.  Returns whether they changed.
+  """
   if not row_data:
-    return
+    return False
   # Only grab the common data from the main master.
   if master == 'chromium.main':
     row.revision = int(row_data['rev_number'])
@@ -153,15 +411,27 @@ def update_row(revision, master, row):
     row.committer = row_data['name']
     row.comment = row_data['comment']
     row.details = row_data['details']
+    row.purge_unicode()
+  status_hash = hashlib.sha1(row_data['status'].encode('utf-8')).hexdigest()
+  if row.status_hashes.get(master) == status_hash:
+    return False
+  row.status_hashes[master] = status_hash
   row.status.setdefault(master, {})
-  update_status(master, row_data['status'], row.status)
+  if not update_status(merger_data, master, row_data['status'], row.status):
+    return False
+  row.status_versions[master] = version
+  return True
+
 
+def update_status(merger_data, master, status_html, status_dict):
+  """Parses build status information and saves it to a status dictionary.
 
-def update_status(master, status_html, status_dict):
-  """Parses build status information and saves it to a status dictionary."""
+  Returns whether any builder's status changed.
+  """
+  changed = False
   builder_soup = BeautifulSoup(status_html)
   builders_by_category = builder_soup.findAll('table')
-  for i, c in enumerate(data.ordered_categories[master]):
+  for i, c in enumerate(merger_data.ordered_categories[master]):
     status_dict[master].setdefault(c, {})
     statuses_by_builder = builders_by_category[i].findAll('td',
                                                           'DevStatusBox')
@@ -170,10 +440,13 @@ def update_status(master, status_html, status_dict):
     if not statuses_by_builder:
       statuses_by_builder = builders_by_category[i].findAll('td',
                                                             'DevSlaveBox')
-    for j, b in enumerate(data.ordered_builders[master][c]):
+    for j, b in enumerate(merger_data.ordered_builders[master][c]):
       # Save the whole link as the status to keep ETA and build number info.
       status = unicode(statuses_by_builder[j].a)
-      status_dict[master][c][b] = status
+      if status_dict[master][c].get(b) != status:
+        status_dict[master][c][b] = status
+        changed = True
+  return changed
 
 
 def notstarted(status):
@@ -190,38 +463,11 @@ class MergerUpdateAction(base_page.BasePage):
   """
 
   def get(self):
-    latest_rev = int(app.get_and_cache_rowdata('latest_rev')['rev_number'])
-    # We may have brand new rows, so store them.
-    if latest_rev not in data.rows:
-      for n in xrange(data.latest_rev + 1, latest_rev + 1):
-        curr_row = RowData()
-        for m in data.ordered_masters:
-          update_row(n, m, curr_row)
-        # If we didn't get any data, that revision doesn't exist, so skip on.
-        if not curr_row.revision:
-          continue
-        data.rows[n] = curr_row
-    # Update our stored latest_rev to reflect the new data.
-    data.latest_rev = max(data.rows.keys())
-    # Now update the status of the rest of the rows.
-    offset = 0
-    while offset < data.SIZE:
-      n = data.latest_rev - offset
-      if n not in data.rows:
-        offset += 1
-        continue
-      curr_row = data.rows[n]
-      for m in data.ordered_masters:
-        row_data = app.get_and_cache_rowdata('%s/console/%s' % (m, n))
-        if not row_data:
-          continue
-        update_status(m, row_data['status'], curr_row.status)
-      offset += 1
-    # Finally delete any extra rows that we don't want to keep around.
-    if len(data.rows) > data.SIZE:
-      old_revs = sorted(data.rows.keys(), reverse=True)[data.SIZE:]
-      for rev in old_revs:
-        del data.rows[rev]
+    global data
+    updated = get_data().copy()
+    if updated.update():
+      data = updated
+      logging.info('MergerUpdateAction: updated to version %d' % data.version)
     self.response.out.write('Update completed (rows %s - %s).' %
                             (min(data.rows.keys()), max(data.rows.keys())))
 
@@ -234,26 +480,49 @@ class MergerRenderAction(base_page.BasePage):
         self.ordered_rows = sorted(rhs.rows.keys(), reverse=True)[:numrevs]
         self.ordered_masters = rhs.ordered_masters
         self.ordered_categories = rhs.ordered_categories
-        self.ordered_builders = rhs.ordered_builders
-        self.status = rhs.status
-        self.rows = {}
-        for row in self.ordered_rows:
-          self.rows[row] = rhs.rows[row].purge_unicode()
+        self.rows = rhs.rows
         self.category_count = sum([len(self.ordered_categories[master])
                                    for master in self.ordered_masters])
+        self.summary_cells = u''.join(rhs.render_fragment(master)
+                                      for master in self.ordered_masters)
+        self.row_cells = {}
+        for i, row in enumerate(self.ordered_rows):
+          extraclass = ('', 'Alt')[i % 2]
+          self.row_cells[row] = u''.join(
+              rhs.render_fragment(master, row, extraclass)
+              for master in self.ordered_masters)
     num_revs = self.request.get('numrevs')
     if num_revs:
       num_revs = utils.clean_int(num_revs, -1)
     if not num_revs or num_revs <= 0:
       num_revs = 25
-    out = TemplateData(data, num_revs)
+    out = TemplateData(get_data(), num_revs)
     template = template_environment.get_template('merger_b.html')
     self.response.out.write(template.render(data=out))
 
 
-# Summon our persistent data model into existence.
-data = MergerData()
-data.bootstrap()
+# The MergerData requests are served from, see get_data().
+data = None
+
+
+def get_data():
+  """Returns the latest MergerData.
+
+  Picks up the data persisted by other instances, or bootstraps it if there
+  is none yet.  A refreshed MergerData replaces the current one with a single
+  assignment, so that concurrent requests keep using a consistent one.
+  """
+  global data
+  current = data or MergerData()
+  refreshed = current.refreshed()
+  if refreshed is None:
+    # Summon our persistent data model into existence.
+    refreshed = MergerData()
+    refreshed.bootstrap()
+  data = refreshed
+  return refreshed
+
+
 template_environment = jinja2.Environment()
 template_environment.loader = jinja2.FileSystemLoader('templates')
 template_environment.filters['notstarted'] = notstarted
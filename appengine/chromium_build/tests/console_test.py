@@ -3,6 +3,8 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import datetime
+
 import app
 
 from tests import cb
@@ -126,6 +128,31 @@ class ConsoleTestCase(cb.CbTestCase):
     self.assertEquals(exp_row, act_row, 'Unexpected row data found')
     self.assertEquals(exp_summary, summary, 'Unexpected build summary found')
 
+  def test_get_and_cache_rowdata_multi(self):
+    for rev_number in ['1', '3']:
+      app.save_row({
+          'rev': '<a href="rev%s">%s</a>' % (rev_number, rev_number),
+          'revlink': 'rev%s' % rev_number,
+          'name': 'name',
+          'statuses': ['<table>a</table>', '<table>b</table>'],
+          'status': '<table>a</table><table>b</table>',
+          'comment': 'comment',
+          'details': '',
+          'rev_number': rev_number,
+          'fetch_timestamp': datetime.datetime.now(),
+        }, 'chromium/console/%s' % rev_number)
+    # Row 3 is only found in the datastore.
+    app.memcache.delete('chromium/console/3')
+    rows_data = app.get_and_cache_rowdata_multi(
+        ['chromium/console/%s' % rev_number for rev_number in '123'])
+    self.assertEquals(['1', None, '3'], [row_data.get('rev_number')
+                                         for row_data in rows_data])
+    self.assertEquals({}, rows_data[1])
+    for row_data in (rows_data[0], rows_data[2]):
+      self.assertEquals(['<table>a</table>', '<table>b</table>'],
+                        row_data['statuses'])
+    self.assertEquals('rev3', rows_data[2]['revlink'])
+
   def test_console_merger(self):
     for master in ['linux', 'mac']:
       page_data = {'content': self.read_file('in_%s.html' % master)}
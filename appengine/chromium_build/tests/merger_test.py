@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import datetime
+
+import app
+import merger
+
+from tests import cb
+
+
+SUMMARY = ('<tr><td class="DevSlave"><table><tr>'
+           '<td class="DevSlaveBox">'
+           '<a class="DevSlaveBox success" title="b1"></a></td>'
+           '<td class="DevSlaveBox">'
+           '<a class="DevSlaveBox success" title="b2"></a></td>'
+           '</tr></table></td></tr>')
+
+
+def status_html(status1, status2):
+  return ('<table><tr>'
+          '<td class="DevStatusBox">'
+          '<a class="DevStatusBox %s" title="b1"></a></td>'
+          '<td class="DevStatusBox">'
+          '<a class="DevStatusBox %s" title="b2"></a></td>'
+          '</tr></table>' % (status1, status2))
+
+
+class MergerTestCase(cb.CbTestCase):
+  def setUp(self):
+    super(MergerTestCase, self).setUp()
+    self.mock(app, 'DEFAULT_MASTERS_TO_MERGE', ['chromium.main'])
+    self.save_page(localpath='chromium.main/console/summary',
+                   content=SUMMARY)
+
+  @staticmethod
+  def save_row(rev_number, status1='success', status2='success'):
+    app.save_row({
+        'rev': '<a href="rev%d">%d</a>' % (rev_number, rev_number),
+        'revlink': 'rev%d' % rev_number,
+        'name': 'name',
+        'statuses': None,
+        'status': status_html(status1, status2),
+        'comment': 'comment',
+        'details': '',
+        'rev_number': str(rev_number),
+        'fetch_timestamp': datetime.datetime.now(),
+      }, 'chromium.main/console/%d' % rev_number)
+
+  @staticmethod
+  def get_status(data, rev_number, builder):
+    return data.rows[rev_number].status['chromium.main']['default'][builder]
+
+  def test_add_row_wraparound(self):
+    data = merger.MergerData()
+    data.SIZE = 3
+    data.slot_revs = [None] * data.SIZE
+    data.slot_versions = [0] * data.SIZE
+    for rev_number in range(1, 6):
+      row = merger.RowData()
+      row.revision = rev_number
+      data.add_row(row)
+    self.assertEquals([3, 4, 5], sorted(data.rows))
+    self.assertEquals([4, 5, 3], data.slot_revs)
+    self.assertEquals(2, data.next_slot)
+    self.assertEquals([0, 1, 2], [data.rows[n].slot for n in (4, 5, 3)])
+
+  def test_update_saves_changed_slots(self):
+    for rev_number in (1, 2):
+      self.save_row(rev_number)
+    data = merger.MergerData()
+    data.bootstrap()
+    self.assertEquals(1, data.version)
+    self.assertFalse(data.update())
+
+    self.save_row(2, status2='failure')
+    self.save_row(3)
+    self.assertTrue(data.update())
+    self.assertEquals(2, data.version)
+    self.assertEquals([1, 2, 3], sorted(data.rows))
+    self.assertIn('failure', self.get_status(data, 2, 'b2'))
+    self.assertEquals([1, 2, 2], data.slot_versions[:3])
+    self.assertEquals(
+        [1, 2, 2], [merger.MergerRowSlot.get_by_id(slot).version
+                    for slot in (1, 2, 3)])
+
+  def test_refreshed_loads_other_instance_version(self):
+    for rev_number in (1, 2):
+      self.save_row(rev_number)
+    data = merger.MergerData()
+    data.bootstrap()
+    other = merger.MergerData().refreshed()
+    self.assertEquals(1, other.version)
+    self.assertEquals([1, 2], sorted(other.rows))
+    self.assertIs(other, other.refreshed())
+
+    # The statuses of a row change without a new revision.
+    self.save_row(1, status1='failure')
+    updated = data.copy()
+    self.assertTrue(updated.update())
+    self.assertNotIn('failure', self.get_status(data, 1, 'b1'))
+
+    refreshed = other.refreshed()
+    self.assertIsNot(other, refreshed)
+    self.assertEquals(2, refreshed.version)
+    self.assertIn('failure', self.get_status(refreshed, 1, 'b1'))
+    self.assertIs(other.rows[2], refreshed.rows[2])
+    self.assertNotIn('failure', self.get_status(other, 1, 'b1'))
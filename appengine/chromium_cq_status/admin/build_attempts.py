@@ -0,0 +1,32 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from google.appengine.datastore.datastore_query import Cursor
+
+from model.record import Record
+from shared.utils import enqueue_admin_task
+from stats.attempts import update_attempts
+
+BUILD_ATTEMPTS_BATCH_SIZE = 100
+
+def get(handler): # pragma: no cover
+  handler.response.write(open('templates/build_attempts.html').read())
+
+def post(handler): # pragma: no cover
+  enqueue_admin_task('build-attempts')
+  handler.response.write('Building Attempts in tasks.\n')
+
+def run_batch(cursor): # pragma: no cover
+  """Adds a batch of Records to Attempts in timestamp order.
+
+  Returns the cursor of the next batch, or None when all Records were added.
+  """
+  records, next_cursor, more = Record.query().order(
+      Record.timestamp).fetch_page(BUILD_ATTEMPTS_BATCH_SIZE,
+          start_cursor=Cursor(urlsafe=cursor))
+  for record in records:
+    update_attempts(record)
+  if more and next_cursor:
+    return next_cursor.urlsafe()
+  return None
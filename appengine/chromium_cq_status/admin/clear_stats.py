@@ -2,7 +2,9 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-from model.cq_stats import CQStats
+from google.appengine.ext import ndb
+
+from model.cq_stats import CQStats, CQStatsPartial
 
 def get(handler): # pragma: no cover
   handler.response.write(open('templates/clear_stats.html').read())
@@ -10,6 +12,8 @@ def get(handler): # pragma: no cover
 def post(handler): # pragma: no cover
   if handler.request.get('all'):
     stats_list = CQStats.query()
+    # Stats are then rebuilt from attempts, not from stored analyzers.
+    ndb.delete_multi(CQStatsPartial.query().fetch(keys_only=True))
   else:
     stats_list = []
     for key in handler.request.get('keys').split(','):
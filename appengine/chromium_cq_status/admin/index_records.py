@@ -0,0 +1,34 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from model.record import Record, set_record_index_complete
+from shared.utils import enqueue_admin_task
+
+INDEX_RECORDS_BATCH_SIZE = 500
+
+def get(handler): # pragma: no cover
+  handler.response.write(open('templates/index_records.html').read())
+
+def post(handler): # pragma: no cover
+  enqueue_admin_task('index-records')
+  handler.response.write('Re-indexing Records in tasks.\n')
+
+def run_batch(cursor): # pragma: no cover
+  """Re-indexes the query fields of a batch of Records, keeping timestamps.
+
+  Returns the cursor of the next batch, or None when all Records were
+  re-indexed and /query can rely on the index.
+  """
+  records, next_cursor, more = Record.query().fetch_page(
+      INDEX_RECORDS_BATCH_SIZE, start_cursor=Cursor(urlsafe=cursor))
+  for record in records:
+    record.keep_timestamp = True
+  ndb.put_multi(records)
+  if more and next_cursor:
+    return next_cursor.urlsafe()
+  set_record_index_complete()
+  return None
@@ -6,10 +6,13 @@ import webapp2
 
 from google.appengine.api import users
 
-from admin import clear_stats, set_bot_password
+from admin import build_attempts, clear_stats, index_records, set_bot_password
+from shared.utils import enqueue_admin_task, queue_task
 
 commands = {
+  'build-attempts': build_attempts,
   'clear-stats': clear_stats,
+  'index-records': index_records,
   'set-bot-password': set_bot_password,
 }
 
@@ -26,3 +29,15 @@ class AdminDispatch(webapp2.RequestHandler): # pragma: no cover
       return
     self.response.headers.add_header('Content-Type', 'text/plain')
     commands[command].post(self)
+
+class AdminTask(webapp2.RequestHandler): # pragma: no cover
+  """Runs a batch of an admin command in a task, then enqueues the next one.
+
+  Commands run in tasks have a run_batch(cursor) function returning the cursor
+  of the next batch, or None when done.
+  """
+  @queue_task
+  def post(self, command):
+    cursor = commands[command].run_batch(self.request.get('cursor') or None)
+    if cursor:
+      enqueue_admin_task(command, cursor)
@@ -7,6 +7,7 @@ import logging
 import traceback
 
 from google.appengine.api import users
+from google.appengine.ext import ndb
 import webapp2
 
 from shared import utils
@@ -19,6 +20,7 @@ from shared.parsing import (
 )
 from model.password import Password
 from model.record import Record
+from stats.attempts import enqueue_update_attempts
 
 def update_record(key=None, tags=None, fields=None): # pragma: no cover
   tags = tags or []
@@ -33,7 +35,12 @@ def update_record(key=None, tags=None, fields=None): # pragma: no cover
   record = Record(id=key)
   record.tags = list(set(tags))
   record.fields = fields
+  put_record(record)
+
+@ndb.transactional
+def put_record(record): # pragma: no cover
   record.put()
+  enqueue_update_attempts(record)
 
 class Post(webapp2.RequestHandler): # pragma: no cover
   def get(self):
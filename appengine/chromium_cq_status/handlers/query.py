@@ -2,14 +2,18 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-from datetime import datetime
 import logging
 import traceback
 
 from google.appengine.datastore.datastore_query import Cursor
 import webapp2
 
-from model.record import Record
+from model.record import Record, is_record_index_complete
+from shared.config import (
+  AUTO_TAGGED_FIELDS,
+  QUERY_CURSOR_CACHE_SECONDS,
+  QUERY_INDEXED_FIELDS,
+)
 from shared.parsing import (
   parse_cursor,
   parse_url_tags,
@@ -22,15 +26,17 @@ from shared.parsing import (
 )
 from shared import utils
 
-def has_end_timestamp(
-      cache_timestamp, # pylint: disable=W0613
-      kwargs): # pragma: no cover
+def is_cache_valid(cache_timestamp, kwargs): # pragma: no cover
   end = kwargs.get('end')
-  return end and end < datetime.utcnow()
+  if end and utils.to_unix_timestamp(end) < cache_timestamp:
+    return True
+  # New Records come before the cursor, older ones rarely change.
+  return bool(kwargs.get('cursor')) and (
+      utils.timestamp_now() - cache_timestamp < QUERY_CURSOR_CACHE_SECONDS)
 
-@utils.memcachize(cache_check=has_end_timestamp)
-def execute_query(
-    key, begin, end, tags, fields, count, cursor): # pragma: no cover
+@utils.memcachize(cache_check=is_cache_valid)
+def execute_query(key, begin, end, tags, fields, projection, count,
+    cursor): # pragma: no cover
   records = []
   next_cursor = ''
   if key and count > 0:
@@ -43,35 +49,71 @@ def execute_query(
       records.append(record)
     more = False
   else:
+    query, unindexed_fields = plan_query(begin, end, tags, fields)
     more = True
     while more and len(records) < count:
-      filters = []
-      if begin:
-        filters.append(Record.timestamp >= begin)
-      if end:
-        filters.append(Record.timestamp <= end)
-      for tag in tags:
-        filters.append(Record.tags == tag)
-      query = Record.query().filter(*filters).order(-Record.timestamp)
       page_records, next_cursor, more = query.fetch_page(count - len(records),
           start_cursor=Cursor(urlsafe=next_cursor or cursor))
       next_cursor = next_cursor.urlsafe() if next_cursor else ''
       for record in page_records:
-        if matches_fields(fields, record):
+        if matches_fields(unindexed_fields, record):
           records.append(record)
 
   return {
-    'results': [record.to_dict() for record in records],
+    'results': [project_fields(record.to_dict(), projection)
+                for record in records],
     'cursor': next_cursor,
     'more': more,
   }
 
+def plan_query(begin, end, tags, fields): # pragma: no cover
+  """Returns a Record query for the filters and the fields it does not filter.
+
+  Filters on QUERY_INDEXED_FIELDS are exact and done by the datastore. Filters
+  on AUTO_TAGGED_FIELDS are narrowed down by the datastore with their tags, but
+  tags do not tell apart values with the same string form so they are matched
+  again on the fetched Records, along with the remaining fields.
+
+  Until the index-records admin command has re-indexed all Records, filters on
+  QUERY_INDEXED_FIELDS are matched on the fetched Records instead, since
+  Records put before the index existed are missing from it.
+  """
+  filters = []
+  if begin:
+    filters.append(Record.timestamp >= begin)
+  if end:
+    filters.append(Record.timestamp <= end)
+  tags = set(tags)
+  unindexed_fields = {}
+  use_index = bool(fields) and is_record_index_complete()
+  for field, value in sorted(fields.items()):
+    if use_index and field in QUERY_INDEXED_FIELDS:
+      filters.append(
+          Record.indexed_fields == Record.indexed_field(field, value))
+      continue
+    if field in AUTO_TAGGED_FIELDS and is_taggable(value):
+      tags.add('%s=%s' % (field, value))
+    unindexed_fields[field] = value
+  for tag in sorted(tags):
+    filters.append(Record.tags == tag)
+  return (Record.query().filter(*filters).order(-Record.timestamp),
+          unindexed_fields)
+
+def is_taggable(value): # pragma: no cover
+  return isinstance(value, (basestring, int, long)) and (
+      not isinstance(value, bool))
+
 def matches_fields(fields, record): # pragma: no cover
   for field, value in fields.items():
     if not field in record.fields or record.fields[field] != value:
       return False
   return True
 
+def project_fields(result, projection): # pragma: no cover
+  if projection:
+    result['fields'] = utils.filter_dict(result['fields'], projection)
+  return result
+
 class Query(webapp2.RequestHandler): # pragma: no cover
   @utils.cross_origin_json
   def get(self, url_tags): # pylint: disable=W0221
@@ -82,10 +124,14 @@ class Query(webapp2.RequestHandler): # pragma: no cover
         'key': parse_record_key,
         'tags': parse_strings,
         'fields': parse_fields,
+        'projection': parse_strings,
         'count':  parse_query_count,
         'cursor': parse_cursor,
       })
       params['tags'].extend(parse_url_tags(url_tags))
+      # Equivalent queries share their memcache entries.
+      params['tags'] = sorted(set(params['tags']))
+      params['projection'] = sorted(set(params['projection']))
       return execute_query(**params)
     except ValueError as e:
       logging.warning(traceback.format_exc())
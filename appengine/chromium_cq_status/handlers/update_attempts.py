@@ -0,0 +1,20 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from google.appengine.ext import ndb
+import webapp2
+
+from shared.utils import queue_task
+from stats.attempts import update_attempts
+
+class UpdateAttempts(webapp2.RequestHandler): # pragma: no cover
+  """Adds a posted Record to Attempts, see enqueue_update_attempts.
+
+  Failures are retried by the task queue.
+  """
+  @queue_task
+  def post(self):
+    record = ndb.Key(urlsafe=self.request.get('key')).get()
+    if record:
+      update_attempts(record)
@@ -4,7 +4,7 @@
 
 import webapp2
 
-from handlers.admin_dispatch import AdminDispatch
+from handlers.admin_dispatch import AdminDispatch, AdminTask
 from handlers.builder_timeline_data import BuilderTimelineData
 from handlers.index import Index
 from handlers.patch_status import PatchStatus
@@ -14,10 +14,12 @@ from handlers.patch_timeline_data import PatchTimelineData
 from handlers.post import Post
 from handlers.stats_viewer import StatsViewer
 from handlers.stats_data_points import StatsDataPoints
+from handlers.update_attempts import UpdateAttempts
 
 handlers = [
   (r'/', Index),
   (r'/admin/(.*)', AdminDispatch),
+  (r'/admin-task/(.*)', AdminTask),
   (r'/builder-timeline-data/(.*)/(.*)/(.*)/(.*)', BuilderTimelineData),
   (r'/patchset/(.*)/(.*)', PatchStatus),  # Legacy URL for old links.
   (r'/patch-status/(.*)/(.*)', PatchStatus),
@@ -27,6 +29,7 @@ handlers = [
   (r'/post', Post),
   (r'/stats/(highest|lowest)/(.*)/(.*)', StatsDataPoints),
   (r'/stats/(.*)/(.*)', StatsViewer),
+  (r'/tasks/update-attempts', UpdateAttempts),
 ]
 
 app = webapp2.WSGIApplication(handlers, debug=True)
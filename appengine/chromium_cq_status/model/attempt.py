@@ -0,0 +1,69 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from google.appengine.ext import ndb
+
+# The part of a Record used by stats analyzers.
+AttemptRecord = namedtuple('AttemptRecord', 'timestamp fields')
+
+epoch = datetime.utcfromtimestamp(0)
+
+def to_microseconds(timestamp): # pragma: no cover
+  delta = timestamp - epoch
+  return ((delta.days * 24 * 60 * 60 + delta.seconds) * 1000000 +
+          delta.microseconds)
+
+class AttemptPatchset(ndb.Model): # pragma: no cover
+  """All Records of a patchset added to its Attempts, in timestamp order.
+
+  The parent of the patchset's Attempts, see Attempt.patchset_key(). Attempts
+  are assembled again from these records when a Record is added out of order.
+  """
+  # List of [microseconds since epoch, fields used by stats analyzers,
+  # is start, is stop].
+  records = ndb.JsonProperty(compressed=True)
+  # Key ids of the Records added, so that Records posted again are skipped.
+  record_ids = ndb.GenericProperty(repeated=True, indexed=False)
+
+  def add_record(self, record_id, timestamp, fields, is_start, is_stop):
+    """Inserts a record by timestamp and returns its index."""
+    microseconds = to_microseconds(timestamp)
+    index = len(self.records)
+    while index and self.records[index - 1][0] > microseconds:
+      index -= 1
+    self.records.insert(index, [microseconds, fields, is_start, is_stop])
+    self.record_ids.insert(index, record_id)
+    return index
+
+class Attempt(ndb.Model): # pragma: no cover
+  """A CQ attempt assembled from the Records of a patchset as they are posted.
+
+  Attempts of a patchset share the parent key returned by patchset_key().
+  """
+  project = ndb.StringProperty()
+  issue = ndb.GenericProperty()
+  patchset = ndb.GenericProperty()
+  begin = ndb.DateTimeProperty()
+  # None while the attempt is in progress.
+  end = ndb.DateTimeProperty()
+  # List of [microseconds since epoch, fields used by stats analyzers].
+  records = ndb.JsonProperty(compressed=True)
+
+  @staticmethod
+  def patchset_key(project, issue, patchset):
+    return ndb.Key('AttemptPatchset', '%s/%s/%s' % (project, issue, patchset))
+
+  @property
+  def duration(self):
+    return (self.end - self.begin).total_seconds()
+
+  def add_record(self, microseconds, fields):
+    self.records.append([microseconds, fields])
+
+  def get_records(self):
+    return [AttemptRecord(epoch + timedelta(microseconds=microseconds), fields)
+            for microseconds, fields in self.records]
@@ -130,3 +130,22 @@ class CQStats(ndb.Model): # pragma: no cover
   @staticmethod
   def stats_matches_names(stats, names):
     return any(fnmatch(stats.name, name) for name in names)
+
+class CQStatsPartial(ndb.Model): # pragma: no cover
+  """The analyzers of all projects run over an interval.
+
+  Analyzers of consecutive intervals are merged to build the stats of longer
+  intervals.
+  """
+  interval_minutes = ndb.IntegerProperty(required=True)
+  begin = ndb.DateTimeProperty(required=True)
+  end = ndb.DateTimeProperty(required=True)
+  # PARTIAL_FORMAT_VERSION of the analyzers, see stats.analysis.
+  format_version = ndb.IntegerProperty()
+  analyzer_names = ndb.StringProperty(repeated=True)
+  # Dict from project to AnalyzerGroup.
+  project_analyzers = ndb.PickleProperty(compressed=True)
+
+  @staticmethod
+  def key_id(begin):
+    return begin.isoformat()
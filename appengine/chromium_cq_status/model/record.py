@@ -2,14 +2,41 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import json
+
 from google.appengine.ext import ndb
 
-from shared.utils import to_unix_timestamp
+from shared.config import QUERY_INDEXED_FIELDS
+from shared.utils import compressed_separators, to_unix_timestamp
+
+class PostTimestampProperty(ndb.DateTimeProperty): # pragma: no cover
+  """Set to the current time whenever a Record is put, like auto_now.
+
+  Records being re-indexed keep their timestamp.
+  """
+  def _prepare_for_put(self, entity):
+    if not entity.keep_timestamp or not self._has_value(entity):
+      self._store_value(entity, self._now())
 
 class Record(ndb.Model): # pragma: no cover
-  timestamp = ndb.DateTimeProperty(auto_now=True)
+  timestamp = PostTimestampProperty()
   tags = ndb.StringProperty(repeated=True)
   fields = ndb.JsonProperty(default={})
+  # Values of the QUERY_INDEXED_FIELDS in fields, see indexed_field().
+  indexed_fields = ndb.ComputedProperty(
+      lambda self: self.get_indexed_fields(), repeated=True)
+
+  # Set to put a Record without updating its timestamp.
+  keep_timestamp = False
+
+  @staticmethod
+  def indexed_field(field, value):
+    return '%s=%s' % (field, json.dumps(value, sort_keys=True,
+        separators=compressed_separators))
+
+  def get_indexed_fields(self):
+    return [self.indexed_field(field, self.fields[field])
+            for field in QUERY_INDEXED_FIELDS if field in self.fields]
 
   def to_dict(self):
     return {
@@ -18,3 +45,20 @@ class Record(ndb.Model): # pragma: no cover
       'tags': self.tags,
       'fields': self.fields,
     }
+
+class RecordIndexStatus(ndb.Model): # pragma: no cover
+  """Set once Records put before indexed_fields existed were re-indexed.
+
+  Until then /query checks QUERY_INDEXED_FIELDS on fetched Records, see
+  admin/index_records.py.
+  """
+  complete = ndb.BooleanProperty(default=False)
+
+RECORD_INDEX_STATUS_ID = 'record_index'
+
+def is_record_index_complete(): # pragma: no cover
+  status = RecordIndexStatus.get_by_id(RECORD_INDEX_STATUS_ID)
+  return bool(status and status.complete)
+
+def set_record_index_complete(): # pragma: no cover
+  RecordIndexStatus(id=RECORD_INDEX_STATUS_ID, complete=True).put()
@@ -16,6 +16,16 @@ LAST_CQ_STATS_INTERVAL_CHANGE_KEY = 'last_cqstats_interval_minutes_%s_change'
 LAST_CQ_STATS_CHANGE_KEY = 'last_cqstats_change'
 DEFAULT_QUERY_SIZE = 100
 MAXIMUM_QUERY_SIZE = 1000
+# Fields of Records indexed for /query filters in addition to the auto tagged
+# ones. Records posted before a field was added here need to be re-indexed with
+# the index-records admin command.
+QUERY_INDEXED_FIELDS = (
+  'action',
+  'verifier',
+)
+# Pages of /query results after a cursor only hold older Records, these are
+# cached for this long even if the query has no end timestamp.
+QUERY_CURSOR_CACHE_SECONDS = 5 * 60
 # This mapping matches PatchSet.try_job_results() in the chromium_rietveld repo.
 JOB_STATE = {
   'JOB_NOT_TRIGGERED': 'running',
@@ -9,6 +9,7 @@ import json
 import logging
 
 from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.api import users
 
 from shared.config import VALID_EMAIL_RE
@@ -23,6 +24,17 @@ def cronjob(cronjob_handler): # pragma: no cover
     cronjob_handler(self, *args)
   return checked_cronjob_handler
 
+def queue_task(queue_task_handler): # pragma: no cover
+  def checked_queue_task_handler(self, *args):
+    assert self.request.headers.get('X-AppEngine-QueueName')
+    queue_task_handler(self, *args)
+  return checked_queue_task_handler
+
+def enqueue_admin_task(command, cursor=None): # pragma: no cover
+  """Enqueues a batch of an admin command run in tasks, see AdminTask."""
+  taskqueue.add(url='/admin-task/%s' % command,
+      params={'cursor': cursor or ''})
+
 def cross_origin_json(handler): # pragma: no cover
   def headered_json_handler(self, *args):
     self.response.headers.add_header("Access-Control-Allow-Origin", "*")
@@ -41,14 +53,21 @@ def is_valid_user(): # pragma: no cover
   user = users.get_current_user()
   return user and VALID_EMAIL_RE.match(user.email())
 
+def memcache_key(f, kwargs): # pragma: no cover
+  """Returns a memcache key for a call of f which is stable across processes.
+
+  The arguments are serialised as canonical JSON and hashed, which keeps keys
+  within the memcache key size limit for long arguments such as cursors.
+  """
+  arguments = json.dumps(kwargs, sort_keys=True,
+      separators=compressed_separators, default=str)
+  return '%s.%s:%s' % (f.__module__, f.__name__,
+      hashlib.sha1(arguments).hexdigest())
+
 def memcachize(cache_check): # pragma: no cover
   def decorator(f):
     def memcachized(**kwargs):
-      key = '%s.%s(%s)' % (
-        f.__module__,
-        f.__name__,
-        ', '.join('%s=%r' % i for i in sorted(kwargs.items())),
-      )
+      key = memcache_key(f, kwargs)
       cache = memcache.get(key)
       if cache is not None and cache_check(cache['timestamp'], kwargs):
         logging.debug('Memcache hit: ' + key)
@@ -8,29 +8,34 @@ import logging
 import math
 
 from google.appengine.api import memcache
-from google.appengine.ext import ndb
 
+from model.attempt import Attempt
 from model.cq_stats import (
   CountStats,
   CQStats,
+  CQStatsPartial,
   ListStats,
 )
-from model.record import Record
 from shared.config import (
   LAST_CQ_STATS_INTERVAL_CHANGE_KEY,
   LAST_CQ_STATS_CHANGE_KEY,
   STATS_START_TIMESTAMP,
-  TAG_START,
-  TAG_STOP,
-  TAG_PROJECT,
-  TAG_ISSUE,
-  TAG_PATCHSET,
 )
 from shared.utils import timestamp_now
 from stats.analyzer import AnalyzerGroup
 
 PatchsetReference = namedtuple('PatchsetReference', 'issue patchset')
 stats_start = datetime.utcfromtimestamp(STATS_START_TIMESTAMP)
+# Length of the intervals analyzed from attempts, longer intervals which are
+# multiples of it are rolled up from them.
+FINE_INTERVAL_MINUTES = 15
+# Version of the pickled analyzers stored in CQStatsPartials. Must be bumped
+# whenever an analyzer, or any object it keeps, changes its attributes, so that
+# stored analyzers are not merged with analyzers of the new format.
+PARTIAL_FORMAT_VERSION = 1
+# Time after the end of a fine interval after which its analyzers are stored.
+# Attempts finished in the interval are still being added until then.
+PARTIAL_SETTLE_DELAY = timedelta(hours=2)
 
 def intervals_in_range(minutes, begin, end): # pragma: no cover
   """Return all analysis intervals of length <minutes> that lie inside
@@ -50,58 +55,85 @@ def update_interval(minutes, begin, end, analyzer_classes): # pragma: no cover
   """
   logging.debug('Updating stats from %s to %s using analyzers: %s.' % (
       begin, end, analyzer_classes))
-  stats = analyze_attempts(attempts_for_interval(begin, end), analyzer_classes)
+  project_analyzers = rolled_up_analyzers(minutes, begin, end, analyzer_classes)
+  stats = build_project_stats(project_analyzers)
   logging.debug('Analyzed stats.')
   update_cq_stats(stats, minutes, begin, end)
   logging.debug('Saved stats.')
-  begin = begin + timedelta(minutes=minutes)
-  end = end + timedelta(minutes=minutes)
+
+def rolled_up_analyzers(minutes, begin, end,
+    analyzer_classes): # pragma: no cover
+  """Returns the analyzers of each project over the given interval, merged from
+  the analyzers of the fine intervals in it.
+
+  Analyzers of fine intervals are stored, so every attempt is analyzed once for
+  all interval lengths.
+  """
+  if minutes % FINE_INTERVAL_MINUTES != 0:
+    return analyze_attempts(attempts_for_interval(begin, end), analyzer_classes)
+  project_analyzers = {}
+  for fine_begin, fine_end in intervals_in_range(
+      FINE_INTERVAL_MINUTES, begin, end):
+    fine_project_analyzers = fine_interval_analyzers(
+        fine_begin, fine_end, analyzer_classes)
+    for project, analyzer in fine_project_analyzers.iteritems():
+      if project not in project_analyzers:
+        project_analyzers[project] = AnalyzerGroup(*analyzer_classes)
+      project_analyzers[project].merge(analyzer)
+  return project_analyzers
+
+def fine_interval_analyzers(begin, end, analyzer_classes): # pragma: no cover
+  """Returns the analyzers of each project over a fine interval, analyzing its
+  attempts only if they are not stored yet.
+
+  Analyzers are only stored PARTIAL_SETTLE_DELAY after the end of the
+  interval. Attempts of the interval which are added later, e.g. by the
+  build-attempts admin command, are missing from the stats of the longer
+  intervals rolled up from stored analyzers until these are cleared with the
+  clear-stats admin command.
+  """
+  analyzer_names = [cls.__name__ for cls in analyzer_classes]
+  partial = CQStatsPartial.get_by_id(CQStatsPartial.key_id(begin))
+  if (partial and partial.format_version == PARTIAL_FORMAT_VERSION and
+      partial.analyzer_names == analyzer_names):
+    return partial.project_analyzers
+  project_analyzers = analyze_attempts(
+      attempts_for_interval(begin, end), analyzer_classes)
+  if end + PARTIAL_SETTLE_DELAY <= datetime.utcnow():
+    CQStatsPartial(
+      id=CQStatsPartial.key_id(begin),
+      interval_minutes=FINE_INTERVAL_MINUTES,
+      begin=begin,
+      end=end,
+      format_version=PARTIAL_FORMAT_VERSION,
+      analyzer_names=analyzer_names,
+      project_analyzers=project_analyzers,
+    ).put()
+  return project_analyzers
 
 def attempts_for_interval(begin, end): # pragma: no cover
-  finished_in_interval = Record.query().filter(
-      Record.tags == TAG_STOP,
-      Record.timestamp >= begin,
-      Record.timestamp < end)
-  finish_timestamps = {}
-  for record in finished_in_interval:
-    if all(i in record.fields for i in ('project', 'issue', 'patchset')):
-      key = (
-        record.fields['project'],
-        record.fields['issue'],
-        record.fields['patchset'],
-      )
-      finish_timestamps.setdefault(key, []).append(record.timestamp)
-  for key in finish_timestamps:
-    # NDB seems to cache records beyond the soft memory limit.
-    # Force a cache clear between each patchset analysis run to avoid getting
-    # terminated by Appengine.
-    ndb.get_context().clear_cache()
-
-    last_finish_timestamp = max(finish_timestamps[key])
-    project, issue, patchset = key
-    interval_query = Record.query().order(Record.timestamp).filter(
-        Record.timestamp <= last_finish_timestamp,
-        Record.tags == TAG_PROJECT % project,
-        Record.tags == TAG_ISSUE % issue,
-        Record.tags == TAG_PATCHSET % patchset)
-    all_attempts = []
-    interval_attempts = []
-    attempt = None
-    for record in interval_query:
-      if TAG_START in record.tags:
-        attempt = []
-      if attempt != None:
-        attempt.append(record)
-        if TAG_STOP in record.tags:
-          if record.timestamp >= begin:
-            interval_attempts.append(attempt)
-          all_attempts.append(attempt)
-          attempt = None
-    if len(all_attempts) == 0:
-      logging.warning('No attempts found for %s issue %s patchset %s at %s' %
-          (project, issue, patchset, begin))
-      continue
-    yield project, issue, patchset, all_attempts, interval_attempts
+  """Yields the attempts of each patchset with attempts finished in the
+  interval, using the Attempts assembled as Records are posted."""
+  finished_in_interval = Attempt.query().filter(
+      Attempt.end >= begin,
+      Attempt.end < end)
+  last_finished_attempts = {}
+  for attempt in finished_in_interval:
+    parent = attempt.key.parent()
+    last_attempt = last_finished_attempts.get(parent)
+    if not last_attempt or last_attempt.end < attempt.end:
+      last_finished_attempts[parent] = attempt
+  for parent, last_attempt in last_finished_attempts.iteritems():
+    # The attempt in progress has no end, and null sorts before any end.
+    attempts = [attempt for attempt in Attempt.query(
+        Attempt.end <= last_attempt.end, ancestor=parent)
+        if attempt.end is not None]
+    attempts.sort(key=lambda attempt: attempt.begin)
+    all_attempts = [attempt.get_records() for attempt in attempts]
+    interval_attempts = [attempt.get_records() for attempt in attempts
+                         if attempt.end >= begin]
+    yield (last_attempt.project, last_attempt.issue, last_attempt.patchset,
+           all_attempts, interval_attempts)
 
 def analyze_attempts(attempts_iterator, analyzer_classes): # pragma: no cover
   """Split attempts by project and feed to project specific analyzer instances.
@@ -112,6 +144,9 @@ def analyze_attempts(attempts_iterator, analyzer_classes): # pragma: no cover
       project_analyzers[project] = AnalyzerGroup(*analyzer_classes)
     project_analyzers[project].new_attempts(project,
         PatchsetReference(issue, patchset), all_attempts, interval_attempts)
+  return project_analyzers
+
+def build_project_stats(project_analyzers): # pragma: no cover
   project_stats = {}
   for project, analyzer in project_analyzers.iteritems():
     project_stats[project] = analyzer.build_stats()
@@ -18,10 +18,28 @@ class Analyzer(object):
   def build_stats(self):
     raise NotImplementedError()
 
+  def merge(self, other):
+    """Merges in an analyzer of the same type run over the following interval.
+
+    The result is the same as running this analyzer over both intervals.
+    """
+    raise NotImplementedError()
+
 
 class CountAnalyzer(Analyzer): # pylint: disable=W0223
   def __init__(self):  # pragma: no cover
-    self.tally = defaultdict(lambda: 0)
+    self.tally = defaultdict(int)
+
+  def merge(self, other):  # pragma: no cover
+    for reference, count in other.tally.iteritems():
+      if reference in self.tally:
+        count = self.merge_counts(self.tally[reference], count)
+      self.tally[reference] = count
+
+  @staticmethod
+  def merge_counts(count, later_count):  # pragma: no cover
+    """Combines the counts of a reference over consecutive intervals."""
+    return count + later_count
 
   def build_stats(self):  # pragma: no cover
     count_stats = CountStats(
@@ -48,10 +66,33 @@ class ListAnalyzer(Analyzer): # pylint: disable=W0223
     list_stats.set_from_points(self.points)
     return (list_stats,)
 
+  def merge(self, other):  # pragma: no cover
+    self.points.extend(other.points)
+
   def _get_name(self):  # pragma: no cover
     return dashed_class_name(self)
 
 
+class ReferenceListAnalyzer(ListAnalyzer): # pylint: disable=W0223
+  """A ListAnalyzer adding at most one point per reference and interval."""
+  def merge(self, other):  # pragma: no cover
+    indices = dict((reference, i)
+        for i, (_, reference) in enumerate(self.points))
+    for value, reference in other.points:
+      if reference in indices:
+        i = indices[reference]
+        self.points[i] = (
+            self.merge_values(self.points[i][0], value), reference)
+      else:
+        indices[reference] = len(self.points)
+        self.points.append((value, reference))
+
+  @staticmethod
+  def merge_values(value, later_value):  # pragma: no cover
+    """Combines the points of a reference over consecutive intervals."""
+    return value + later_value
+
+
 class AnalyzerGroup(Analyzer):  # pragma: no cover
   def __init__(self, *analyzer_classes):
     self.analyzers = [cls() for cls in analyzer_classes]
@@ -63,6 +104,11 @@ class AnalyzerGroup(Analyzer):  # pragma: no cover
   def build_stats(self):
     return chain(*(analyzer.build_stats() for analyzer in self.analyzers))
 
+  def merge(self, other):
+    for analyzer, other_analyzer in zip(self.analyzers, other.analyzers):
+      assert type(analyzer) == type(other_analyzer)
+      analyzer.merge(other_analyzer)
+
 def dashed_class_name(obj):  # pragma: no cover
   name = type(obj).__name__
   name = re.sub(r'([a-z])([A-Z])', r'\1-\2', name)
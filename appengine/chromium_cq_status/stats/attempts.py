@@ -0,0 +1,126 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from datetime import timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from model.attempt import Attempt, AttemptPatchset, epoch
+from shared.config import (
+  TAG_START,
+  TAG_STOP,
+)
+from stats.trybot_stats import (
+  tryjob_fail_status,
+  tryjob_pass_status,
+  tryjob_update_action,
+)
+
+UPDATE_ATTEMPTS_URL = '/tasks/update-attempts'
+
+def enqueue_update_attempts(record): # pragma: no cover
+  """Enqueues adding a Record to Attempts, see UpdateAttempts.
+
+  Must be called in the transaction that puts the Record, so that every
+  Record put is added to Attempts, with retries if adding it fails.
+  """
+  taskqueue.add(url=UPDATE_ATTEMPTS_URL,
+      params={'key': record.key.urlsafe()}, transactional=True)
+
+def update_attempts(record): # pragma: no cover
+  """Adds a posted Record to the Attempts of its patchset.
+
+  A start record begins a new attempt and abandons any attempt in progress, a
+  stop record finishes the attempt in progress. Records outside of an attempt
+  are ignored, and Records already added are skipped. Records are kept in
+  timestamp order, a Record older than those already added is inserted and
+  the patchset's Attempts are assembled again.
+  """
+  fields = record.fields
+  if not all(i in fields for i in ('project', 'issue', 'patchset')):
+    return
+  add_to_attempts(fields['project'], fields['issue'], fields['patchset'],
+      record.key.id(), record.timestamp, compact_fields(fields),
+      TAG_START in record.tags, TAG_STOP in record.tags)
+
+@ndb.transactional
+def add_to_attempts(project, issue, patchset, record_id, timestamp, fields,
+    is_start, is_stop): # pragma: no cover
+  parent = Attempt.patchset_key(project, issue, patchset)
+  attempt_patchset = parent.get() or AttemptPatchset(key=parent, records=[])
+  # The Record was posted again, after being added.
+  if record_id in attempt_patchset.record_ids:
+    return
+  index = attempt_patchset.add_record(
+      record_id, timestamp, fields, is_start, is_stop)
+  attempts = Attempt.query(ancestor=parent).fetch()
+  if index == len(attempt_patchset.records) - 1:
+    in_progress = [attempt for attempt in attempts if attempt.end is None]
+    current = None
+    if in_progress:
+      current = max(in_progress, key=lambda attempt: attempt.begin)
+    attempt = add_record_to_attempt(parent, project, issue, patchset, current,
+        attempt_patchset.records[index])
+    if attempt is not current:
+      # A start record abandons the attempts in progress.
+      ndb.delete_multi([abandoned.key for abandoned in in_progress])
+    if attempt:
+      attempt.put()
+  else:
+    ndb.delete_multi([attempt.key for attempt in attempts])
+    assembled = []
+    current = None
+    for record in attempt_patchset.records:
+      attempt = add_record_to_attempt(parent, project, issue, patchset,
+          current, record)
+      if attempt is not current:
+        if current:
+          assembled.pop()
+        assembled.append(attempt)
+      current = attempt if attempt and attempt.end is None else None
+    ndb.put_multi(assembled)
+  attempt_patchset.put()
+
+def add_record_to_attempt(parent, project, issue, patchset, attempt,
+    record): # pragma: no cover
+  """Adds the next record of a patchset to its attempt in progress.
+
+  Returns the attempt the record was added to: a new one for a start record,
+  |attempt| for other records, or None if no attempt is in progress.
+  """
+  microseconds, fields, is_start, is_stop = record
+  timestamp = epoch + timedelta(microseconds=microseconds)
+  if is_start:
+    attempt = Attempt(parent=parent, project=project, issue=issue,
+        patchset=patchset, begin=timestamp, records=[])
+  if attempt:
+    attempt.add_record(microseconds, fields)
+    if is_stop:
+      attempt.end = timestamp
+  return attempt
+
+def compact_fields(fields): # pragma: no cover
+  """Returns the part of the fields of a Record used by stats analyzers."""
+  compact = {}
+  action = fields.get('action')
+  if action:
+    compact['action'] = action
+  if 'verifier' in fields:
+    compact['verifier'] = fields['verifier']
+  if action == 'patch_failed':
+    reason = fields.get('reason') or {}
+    if reason.get('fail_type'):
+      compact['reason'] = {'fail_type': reason['fail_type']}
+    if fields.get('message'):
+      compact['message'] = fields['message']
+  if action == tryjob_update_action:
+    compact['jobs'] = {}
+    for job_result, builds in fields.get('jobs', {}).iteritems():
+      if job_result in (tryjob_pass_status, tryjob_fail_status):
+        compact['jobs'][job_result] = [{
+          'master': build.get('master'),
+          'builder': build.get('builder'),
+        } for build in builds]
+  return compact
@@ -11,6 +11,7 @@ from stats.analyzer import (
   AnalyzerGroup,
   CountAnalyzer,
   ListAnalyzer,
+  ReferenceListAnalyzer,
 )
 
 IssueReference = namedtuple('IssueReference', 'issue')
@@ -58,6 +59,7 @@ class AttemptDurations(ListAnalyzer):  # pragma: no cover
 class AttemptFalseRejectCount(CountAnalyzer):  # pragma: no cover
   description = ('Number of failed attempts on a committed patch that passed '
                  'presubmit, had all LGTMs and were not manually cancelled.')
+  merge_counts = staticmethod(max)
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     if has_any_actions(all_attempts, ('patch_committed',)):
       self.tally[reference] = sum(1
@@ -68,6 +70,7 @@ class AttemptFalseRejectCount(CountAnalyzer):  # pragma: no cover
 
 class AttemptFalseRejectCommitCount(CountAnalyzer):  # pragma: no cover
   description = ('Number of failed commit attempts on a committed patch.')
+  merge_counts = staticmethod(max)
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     if has_any_actions(all_attempts, ('patch_committed',)):
       self.tally[reference] = sum(1
@@ -78,6 +81,7 @@ class AttemptFalseRejectCommitCount(CountAnalyzer):  # pragma: no cover
 
 class AttemptFalseRejectCQPresubmitCount(CountAnalyzer):  # pragma: no cover
   description = ('Number of failed CQ presubmit checks on a committed patch.')
+  merge_counts = staticmethod(max)
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     if has_any_actions(all_attempts, ('patch_committed',)):
       self.tally[reference] = sum(1
@@ -88,6 +92,7 @@ class AttemptFalseRejectCQPresubmitCount(CountAnalyzer):  # pragma: no cover
 
 class AttemptFalseRejectTriggerCount(CountAnalyzer):  # pragma: no cover
   description = ('Number of failed job trigger attempts on a committed patch.')
+  merge_counts = staticmethod(max)
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     if has_any_actions(all_attempts, ('patch_committed',)):
       self.tally[reference] = sum(1
@@ -98,6 +103,7 @@ class AttemptFalseRejectTriggerCount(CountAnalyzer):  # pragma: no cover
 
 class AttemptFalseRejectTryjobCount(CountAnalyzer):  # pragma: no cover
   description = ('Number of failed job attempts on a committed patch.')
+  merge_counts = staticmethod(max)
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     if has_any_actions(all_attempts, ('patch_committed',)):
       self.tally[reference] = sum(1
@@ -106,7 +112,7 @@ class AttemptFalseRejectTryjobCount(CountAnalyzer):  # pragma: no cover
           if is_failure_record('failed_jobs', record))
 
 
-class BlockedOnClosedTreeDurations(ListAnalyzer):  # pragma: no cover
+class BlockedOnClosedTreeDurations(ReferenceListAnalyzer):  # pragma: no cover
   description = 'Time spent per committed patchset blocked on a closed tree.'
   unit = 'seconds'
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
@@ -116,7 +122,7 @@ class BlockedOnClosedTreeDurations(ListAnalyzer):  # pragma: no cover
       self.points.append((duration, reference))
 
 
-class BlockedOnThrottledTreeDurations(ListAnalyzer):  # pragma: no cover
+class BlockedOnThrottledTreeDurations(ReferenceListAnalyzer):  # pragma: no cover # pylint: disable=C0301
   description = 'Time spent per committed patchset blocked on a throttled tree.'
   unit = 'seconds'
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
@@ -128,6 +134,8 @@ class BlockedOnThrottledTreeDurations(ListAnalyzer):  # pragma: no cover
 
 class IssueCount(CountAnalyzer):  # pragma: no cover
   description = 'Number of issues processed by the CQ.'
+  merge_counts = staticmethod(max)
+
   def __init__(self):
     super(IssueCount, self).__init__()
     self.seen_issues = set()
@@ -139,7 +147,7 @@ class IssueCount(CountAnalyzer):  # pragma: no cover
       self.tally[IssueReference(issue)] += 1
 
 
-class PatchsetAttempts(ListAnalyzer):  # pragma: no cover
+class PatchsetAttempts(ReferenceListAnalyzer):  # pragma: no cover
   description = 'Number of CQ attempts per patchset.'
   unit = 'attempts'
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
@@ -148,6 +156,8 @@ class PatchsetAttempts(ListAnalyzer):  # pragma: no cover
 
 class PatchsetCount(CountAnalyzer):  # pragma: no cover
   description = 'Number of patchsets processed by the CQ.'
+  merge_counts = staticmethod(max)
+
   def __init__(self):
     super(PatchsetCount, self).__init__()
     self.seen_patchsets = set()
@@ -160,12 +170,13 @@ class PatchsetCount(CountAnalyzer):  # pragma: no cover
 
 class PatchsetCommitCount(CountAnalyzer):  # pragma: no cover
   description = 'Number of patchsets committed by the CQ.'
+  merge_counts = staticmethod(max)
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     if has_any_actions(interval_attempts, ('patch_committed',)):
       self.tally[reference] += 1
 
 
-class PatchsetCommitDurations(ListAnalyzer):  # pragma: no cover
+class PatchsetCommitDurations(ReferenceListAnalyzer):  # pragma: no cover
   description = 'Time taken by the CQ to land a patch after passing all checks.'
   unit = 'seconds'
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
@@ -174,7 +185,7 @@ class PatchsetCommitDurations(ListAnalyzer):  # pragma: no cover
     if duration != None:
       self.points.append((duration, reference))
 
-class PatchsetDurations(ListAnalyzer):  # pragma: no cover
+class PatchsetDurations(ReferenceListAnalyzer):  # pragma: no cover
   description = ('Total time spent in the CQ per patchset, '
                  'counts multiple CQ attempts as one.')
   unit = 'seconds'
@@ -189,22 +200,43 @@ class PatchsetDurations(ListAnalyzer):  # pragma: no cover
 class PatchsetFalseRejectCount(CountAnalyzer):  # pragma: no cover
   description = ('Number of patchsets rejected by the trybots '
                  'that eventually passed.')
+  def __init__(self):
+    super(PatchsetFalseRejectCount, self).__init__()
+    # Maps references to whether they were (rejected, passed).
+    self.outcomes = {}
+
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
-    if (has_any_actions(interval_attempts, ('verifier_retry', 'verifier_fail'))
-        and has_any_actions(interval_attempts, ('verifier_pass',))):
-      self.tally[reference] += 1
+    self.add_outcome(reference,
+        has_any_actions(interval_attempts, ('verifier_retry', 'verifier_fail')),
+        has_any_actions(interval_attempts, ('verifier_pass',)))
+
+  def add_outcome(self, reference, rejected, passed):
+    if not rejected and not passed:
+      return
+    was_rejected, was_passed = self.outcomes.get(reference, (False, False))
+    rejected = rejected or was_rejected
+    passed = passed or was_passed
+    self.outcomes[reference] = (rejected, passed)
+    if rejected and passed:
+      self.tally[reference] = 1
+
+  def merge(self, other):
+    for reference, (rejected, passed) in other.outcomes.iteritems():
+      self.add_outcome(reference, rejected, passed)
 
 
 class PatchsetRejectCount(CountAnalyzer):  # pragma: no cover
   description = 'Number of patchsets rejected by the trybots at least once.'
+  merge_counts = staticmethod(max)
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     if has_any_actions(interval_attempts, ('verifier_retry', 'verifier_fail')):
       self.tally[reference] += 1
 
 
-class PatchsetTotalCommitQueueDurations(ListAnalyzer):  # pragma: no cover
+class PatchsetTotalCommitQueueDurations(ReferenceListAnalyzer):  # pragma: no cover # pylint: disable=C0301
   description = 'Total time spent in the CQ per patch.'
   unit = 'seconds'
+  merge_values = staticmethod(max)
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     duration = 0
     for attempt in all_attempts:
@@ -212,9 +244,10 @@ class PatchsetTotalCommitQueueDurations(ListAnalyzer):  # pragma: no cover
     self.points.append((duration, reference))
 
 
-class PatchsetTotalWallTimeDurations(ListAnalyzer):  # pragma: no cover
+class PatchsetTotalWallTimeDurations(ReferenceListAnalyzer):  # pragma: no cover
   description = 'Total time per patch since their commit box was checked.'
   unit = 'seconds'
+  merge_values = staticmethod(max)
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     assert len(all_attempts) > 0
     first_start = all_attempts[0][0]
@@ -19,9 +19,9 @@ TrybotReference = namedtuple('TrybotReference', 'master builder')
 
 class TrybotAnalyzer(Analyzer):  # pragma: no cover
   def __init__(self):
-    self.false_rejects = {'total': TrybotFalseRejectCount(None)}
-    self.passes = {'total': TrybotPassCount(None)}
-    self.failures = {'total': TrybotFailCount(None)}
+    # Maps patchset references to dicts from (master, builder) to
+    # [pass count, fail count].
+    self.patchset_counts = {}
 
   def new_attempts(self, project, reference, all_attempts, interval_attempts):
     # counts maps from (master, builder) to [pass count, fail count].
@@ -54,30 +54,51 @@ class TrybotAnalyzer(Analyzer):  # pragma: no cover
               count_key = 1
               failed_builders.add(count_builder)
             counts[count_builder][count_key] += 1
+    self.add_counts(reference, counts)
 
-    for (master, builder), (pass_count, fail_count) in counts.iteritems():
-      if (master, builder) not in self.false_rejects:
-        self.false_rejects[(master, builder)] = TrybotFalseRejectCount(builder)
-      if (master, builder) not in self.passes:
-        self.passes[(master, builder)] = TrybotPassCount(builder)
-      if (master, builder) not in self.failures:
-        self.failures[(master, builder)] = TrybotFailCount(builder)
-
-      trybotReference = TrybotReference(master, builder)
-      self.passes[(master, builder)].tally[reference] += pass_count
-      self.passes['total'].tally[trybotReference] += pass_count
-      self.failures[(master, builder)].tally[reference] += fail_count
-      self.failures['total'].tally[trybotReference] += fail_count
-      if pass_count > 0 and fail_count > 0:
-        self.false_rejects[(master, builder)].tally[reference] += fail_count
-        self.false_rejects['total'].tally[trybotReference] += fail_count
+  def add_counts(self, reference, counts):
+    patchset_counts = self.patchset_counts.setdefault(reference, {})
+    for count_builder, (pass_count, fail_count) in counts.iteritems():
+      if count_builder not in patchset_counts:
+        patchset_counts[count_builder] = [pass_count, fail_count]
+        continue
+      builder_counts = patchset_counts[count_builder]
+      # Builds are not counted after a successful one, as above.
+      if builder_counts[0] == 0:
+        builder_counts[0] = pass_count
+        builder_counts[1] += fail_count
+
+  def merge(self, other):
+    for reference, counts in other.patchset_counts.iteritems():
+      self.add_counts(reference, counts)
 
   def build_stats(self):
+    false_rejects = {'total': TrybotFalseRejectCount(None)}
+    passes = {'total': TrybotPassCount(None)}
+    failures = {'total': TrybotFailCount(None)}
+    for reference, counts in self.patchset_counts.iteritems():
+      for (master, builder), (pass_count, fail_count) in counts.iteritems():
+        if (master, builder) not in false_rejects:
+          false_rejects[(master, builder)] = TrybotFalseRejectCount(builder)
+        if (master, builder) not in passes:
+          passes[(master, builder)] = TrybotPassCount(builder)
+        if (master, builder) not in failures:
+          failures[(master, builder)] = TrybotFailCount(builder)
+
+        trybotReference = TrybotReference(master, builder)
+        passes[(master, builder)].tally[reference] += pass_count
+        passes['total'].tally[trybotReference] += pass_count
+        failures[(master, builder)].tally[reference] += fail_count
+        failures['total'].tally[trybotReference] += fail_count
+        if pass_count > 0 and fail_count > 0:
+          false_rejects[(master, builder)].tally[reference] += fail_count
+          false_rejects['total'].tally[trybotReference] += fail_count
+
     stats = []
     analyzers = chain(
-        self.false_rejects.itervalues(),
-        self.passes.itervalues(),
-        self.failures.itervalues())
+        false_rejects.itervalues(),
+        passes.itervalues(),
+        failures.itervalues())
     for analyzer in analyzers:
       stats.extend(analyzer.build_stats())
     return stats
@@ -0,0 +1,145 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from datetime import timedelta
+
+# StatsTest must be imported first in order to get proper ndb monkeypatching.
+from tests.stats_test import StatsTest, stats_start
+from model.attempt import Attempt, AttemptRecord
+from stats.attempts import compact_fields, update_attempts
+
+class AttemptsTest(StatsTest):
+  def add_records(self, *record_params_list):
+    self.clear_all()
+    for record_params in record_params_list:
+      self.add_record(*record_params)
+
+  @staticmethod
+  def get_attempts():
+    return sorted(Attempt.query(), key=lambda attempt: attempt.begin)
+
+  def test_attempt_assembled(self):
+    self.add_records(
+      (1, {'issue': 1, 'patchset': 1, 'action': 'patch_start'}),
+      (2, {'issue': 1, 'patchset': 1, 'action': 'verifier_start'}),
+      (3, {'issue': 1, 'patchset': 1, 'action': 'patch_stop'}),
+    )
+    attempts = self.get_attempts()
+    self.assertEquals(1, len(attempts))
+    attempt = attempts[0]
+    self.assertEquals(('test', 1, 1),
+        (attempt.project, attempt.issue, attempt.patchset))
+    self.assertEquals(stats_start + timedelta(hours=1), attempt.begin)
+    self.assertEquals(stats_start + timedelta(hours=3), attempt.end)
+    self.assertEquals(2 * 60 * 60, attempt.duration)
+    self.assertEquals([
+        AttemptRecord(stats_start + timedelta(hours=1),
+            {'action': 'patch_start'}),
+        AttemptRecord(stats_start + timedelta(hours=2),
+            {'action': 'verifier_start', 'verifier': 'try job'}),
+        AttemptRecord(stats_start + timedelta(hours=3),
+            {'action': 'patch_stop'}),
+      ], attempt.get_records())
+
+  def test_attempt_in_progress(self):
+    self.add_records(
+      (1, {'issue': 1, 'patchset': 1, 'action': 'patch_start'}),
+      (2, {'issue': 1, 'patchset': 1, 'action': 'verifier_start'}),
+    )
+    attempts = self.get_attempts()
+    self.assertEquals(1, len(attempts))
+    self.assertEquals(None, attempts[0].end)
+    self.assertEquals(2, len(attempts[0].records))
+
+  def test_attempt_restarted(self):
+    self.add_records(
+      (1, {'issue': 1, 'patchset': 1, 'action': 'patch_start'}),
+      (2, {'issue': 1, 'patchset': 1, 'action': 'patch_start'}),
+      (3, {'issue': 1, 'patchset': 1, 'action': 'patch_stop'}),
+      (4, {'issue': 2, 'patchset': 1, 'action': 'patch_start'}),
+      (5, {'issue': 2, 'patchset': 1, 'action': 'patch_stop'}),
+    )
+    attempts = self.get_attempts()
+    self.assertEquals([(1, 2, 3), (2, 4, 5)], [(
+        attempt.issue,
+        (attempt.begin - stats_start).total_seconds() / 60 / 60,
+        (attempt.end - stats_start).total_seconds() / 60 / 60,
+      ) for attempt in attempts])
+
+  def test_records_outside_attempts_ignored(self):
+    self.add_records(
+      (1, {'issue': 1, 'patchset': 1, 'action': 'patch_stop'}),
+      (2, {'issue': 1, 'patchset': 1, 'action': 'verifier_start'}),
+      (3, {'issue': 1, 'action': 'patch_start'}),
+    )
+    self.assertEquals([], self.get_attempts())
+
+  def test_records_posted_again_skipped(self):
+    self.clear_all()
+    start = self.add_record(1, {'issue': 1, 'patchset': 1,
+        'action': 'patch_start'})
+    stop = self.add_record(2, {'issue': 1, 'patchset': 1,
+        'action': 'patch_stop'})
+    update_attempts(start)
+    update_attempts(stop)
+    attempts = self.get_attempts()
+    self.assertEquals(1, len(attempts))
+    self.assertEquals(2, len(attempts[0].records))
+    self.assertEquals([start.key.id(), stop.key.id()],
+        Attempt.patchset_key('test', 1, 1).get().record_ids)
+
+  def test_records_out_of_order_inserted(self):
+    self.clear_all()
+    # The stop record is added after a later record.
+    self.add_record(1, {'issue': 1, 'patchset': 1, 'action': 'patch_start'})
+    self.add_record(3, {'issue': 1, 'patchset': 1, 'action': 'patch_start'})
+    self.add_record(2, {'issue': 1, 'patchset': 1, 'action': 'patch_stop'})
+    # The start record is added after a later record.
+    self.add_record(5, {'issue': 1, 'patchset': 1, 'action': 'verifier_start'})
+    self.add_record(4, {'issue': 1, 'patchset': 1, 'action': 'patch_start'})
+    self.add_record(6, {'issue': 1, 'patchset': 1, 'action': 'patch_stop'})
+    self.assertEquals([(1, 2, 2), (4, 6, 3)], [(
+        (attempt.begin - stats_start).total_seconds() / 60 / 60,
+        (attempt.end - stats_start).total_seconds() / 60 / 60,
+        len(attempt.records),
+      ) for attempt in self.get_attempts()])
+
+  def test_attempt_in_progress_after_out_of_order_record(self):
+    self.clear_all()
+    self.add_record(2, {'issue': 1, 'patchset': 1, 'action': 'patch_start'})
+    self.add_record(1, {'issue': 1, 'patchset': 1, 'action': 'patch_stop'})
+    self.add_record(3, {'issue': 1, 'patchset': 1, 'action': 'patch_stop'})
+    self.assertEquals([(2, 3, 2)], [(
+        (attempt.begin - stats_start).total_seconds() / 60 / 60,
+        (attempt.end - stats_start).total_seconds() / 60 / 60,
+        len(attempt.records),
+      ) for attempt in self.get_attempts()])
+
+  def test_compact_fields(self):
+    self.assertEquals({
+        'action': 'patch_failed',
+        'reason': {'fail_type': 'failed_jobs'},
+        'message': 'Try jobs failed',
+      }, compact_fields({
+        'project': 'test',
+        'issue': 1,
+        'patchset': 1,
+        'action': 'patch_failed',
+        'reason': {'fail_type': 'failed_jobs', 'fail_details': ['a', 'b']},
+        'message': 'Try jobs failed',
+      }))
+    self.assertEquals({
+        'action': 'verifier_jobs_update',
+        'verifier': 'try job',
+        'jobs': {
+          'JOB_FAILED': [{'master': 'm', 'builder': 'b'}],
+        },
+      }, compact_fields({
+        'action': 'verifier_jobs_update',
+        'verifier': 'try job',
+        'jobs': {
+          'JOB_FAILED': [{'master': 'm', 'builder': 'b', 'url': 'u'}],
+          'JOB_RUNNING': [{'master': 'm', 'builder': 'c', 'url': 'v'}],
+        },
+      }))
@@ -5,8 +5,20 @@
 import itertools
 
 # StatsTest must be imported first in order to get proper ndb monkeypatching.
-from tests.stats_test import StatsTest, hours
-from stats.analysis import PatchsetReference
+from tests.stats_test import (
+  StatsTest,
+  hours,
+  stats_start,
+  test_analysis_end,
+)
+from handlers import update_stats
+from model.cq_stats import CQStats, CQStatsPartial
+from stats.analysis import (
+  PatchsetReference,
+  analyze_attempts,
+  attempts_for_interval,
+  build_project_stats,
+)
 from stats.patchset_stats import IssueReference
 
 class PatchsetStatsTest(StatsTest):
@@ -448,3 +460,16 @@ class PatchsetStatsTest(StatsTest):
         (hours(5), PatchsetReference(1, 3)),
       ),
     ), self.get_stats('patchset-total-wall-time-durations'))
+
+  def test_rolled_up_stats_match_direct_analysis(self):
+    self.analyze_records(*self.attempt_records)
+    self.assertIsNotNone(CQStatsPartial.get_by_id(
+        CQStatsPartial.key_id(stats_start)))
+    project_stats = build_project_stats(analyze_attempts(
+        attempts_for_interval(stats_start, test_analysis_end),
+        update_stats.analyzer_classes))['test']
+    cq_stats = CQStats.query(CQStats.begin == stats_start).get()
+    self.assertEquals(
+        sorted(stats.to_dict() for stats in project_stats),
+        sorted(stats.to_dict()
+               for stats in cq_stats.count_stats + cq_stats.list_stats))
@@ -7,8 +7,9 @@ import json
 
 from tests.testing_utils import testing
 
+from admin.index_records import run_batch
 import highend
-from model.record import Record
+from model.record import Record, is_record_index_complete
 
 
 class TestQuery(testing.AppengineTestCase):
@@ -357,6 +358,113 @@ class TestQuery(testing.AppengineTestCase):
     }, _parse_body(response))
 
 
+  def test_query_indexed_fields(self):
+    _clear_records()
+    Record(id='match', fields={
+      'action': 'verifier_start',
+      'verifier': 'try job',
+    }).put()
+    Record(id='wrong_action', fields={
+      'action': 'verifier_pass',
+      'verifier': 'try job',
+    }).put()
+    Record(id='wrong_type', fields={
+      'action': 'verifier_start',
+      'verifier': ['try job'],
+    }).put()
+    Record(id='missing_field', fields={'action': 'verifier_start'}).put()
+    self.assertEquals(['action="verifier_start"', 'verifier="try job"'],
+        sorted(Record.get_by_id('match').indexed_fields))
+    response = self.test_app.get('/query', params={
+      'fields': json.dumps({
+        'action': 'verifier_start',
+        'verifier': 'try job',
+    })})
+    self.assertEquals({
+      'more': False,
+      'results': [{
+        'key': 'match',
+        'tags': [],
+        'fields': {
+          'action': 'verifier_start',
+          'verifier': 'try job',
+        },
+      }],
+    }, _parse_body(response))
+
+  def test_query_indexed_fields_after_reindex(self):
+    _clear_records()
+    Record(id='match', fields={'action': 'verifier_start'}).put()
+    Record(id='wrong_type', fields={'action': ['verifier_start']}).put()
+    self.assertFalse(is_record_index_complete())
+    run_batch(None)
+    self.assertTrue(is_record_index_complete())
+    response = self.test_app.get('/query', params={
+      'fields': json.dumps({'action': 'verifier_start'}),
+    })
+    self.assertEquals({
+      'more': False,
+      'results': [{
+        'key': 'match',
+        'tags': [],
+        'fields': {'action': 'verifier_start'},
+      }],
+    }, _parse_body(response))
+
+  def test_query_auto_tagged_fields(self):
+    _clear_records()
+    Record(id='match', tags=['issue=1'], fields={'issue': 1}).put()
+    Record(id='wrong_type', tags=['issue=1'], fields={'issue': '1'}).put()
+    Record(id='wrong_value', tags=['issue=2'], fields={'issue': 2}).put()
+    response = self.test_app.get('/query', params={
+      'fields': json.dumps({'issue': 1}),
+    })
+    self.assertEquals({
+      'more': False,
+      'results': [{
+        'key': 'match',
+        'tags': ['issue=1'],
+        'fields': {'issue': 1},
+      }],
+    }, _parse_body(response))
+
+  def test_query_projection(self):
+    _clear_records()
+    Record(id='match', fields={
+      'action': 'patch_start',
+      'issue': 1,
+      'message': 'Started',
+    }).put()
+    response = self.test_app.get('/query', params={
+      'projection': 'issue,action,missing',
+    })
+    self.assertEquals({
+      'more': False,
+      'results': [{
+        'key': 'match',
+        'tags': [],
+        'fields': {
+          'action': 'patch_start',
+          'issue': 1,
+        },
+      }],
+    }, _parse_body(response))
+
+  def test_reindexed_record_keeps_timestamp(self):
+    _clear_records()
+    self.mock_now(datetime.utcfromtimestamp(5))
+    Record(id='record', fields={'verifier': 'try job'}).put()
+    self.mock_now(datetime.utcfromtimestamp(10))
+    record = Record.get_by_id('record')
+    record.keep_timestamp = True
+    record.put()
+    self.assertEquals(datetime.utcfromtimestamp(5),
+        Record.get_by_id('record').timestamp)
+    Record.get_by_id('record').put()
+    self.assertEquals(datetime.utcfromtimestamp(10),
+        Record.get_by_id('record').timestamp)
+
+
 def _clear_records(): # pragma: no cover
   for record in Record.query():
     record.key.delete()
@@ -7,11 +7,13 @@ from datetime import datetime, timedelta
 from tests.testing_utils import testing
 
 import main
+from model.attempt import Attempt, AttemptPatchset
 from model.record import Record
-from model.cq_stats import CountStats, CQStats, ListStats
+from model.cq_stats import CountStats, CQStats, CQStatsPartial, ListStats
 from shared.config import STATS_START_TIMESTAMP
 from shared.utils import minutes_per_day
 from handlers import update_stats
+from stats.attempts import update_attempts
 
 stats_start = datetime.utcfromtimestamp(STATS_START_TIMESTAMP)
 test_analysis_end = stats_start + timedelta(days=1)
@@ -26,10 +28,13 @@ class StatsTest(testing.AppengineTestCase): # pragma: no cover
       tagged_fields.setdefault('verifier', 'try job')
     self.mock_now(datetime.utcfromtimestamp(STATS_START_TIMESTAMP) +
         timedelta(hours=hours_from_start))
-    Record(
+    record = Record(
       tags=['%s=%s' % (k, v) for k, v in tagged_fields.items()],
       fields=tagged_fields,
-    ).put()
+    )
+    record.put()
+    update_attempts(record)
+    return record
 
   def analyze_records(self, *record_params_list):
     self.clear_all()
@@ -42,12 +47,21 @@ class StatsTest(testing.AppengineTestCase): # pragma: no cover
     for record in Record.query():
       record.key.delete()
     assert Record.query().count() == 0
+    for attempt in Attempt.query():
+      attempt.key.delete()
+    assert Attempt.query().count() == 0
+    for attempt_patchset in AttemptPatchset.query():
+      attempt_patchset.key.delete()
+    assert AttemptPatchset.query().count() == 0
 
   @staticmethod
   def clear_cq_stats():
     for cq_stats in CQStats.query():
       cq_stats.key.delete()
     assert CQStats.query().count() == 0
+    for partial in CQStatsPartial.query():
+      partial.key.delete()
+    assert CQStatsPartial.query().count() == 0
 
   def clear_all(self):
     self.clear_records()
@@ -130,6 +130,23 @@ class TestUtils(testing.AppengineTestCase):
     use_cache = False
     self.assertEquals(test(a=1, b=2), 4)
 
+  def test_memcache_key(self):
+    def test(): # pragma: no cover
+      pass
+    key = utils.memcache_key(test, {
+      'fields': {'a': 1, 'b': 2},
+      'begin': datetime.utcfromtimestamp(100),
+    })
+    self.assertEquals(key, utils.memcache_key(test, {
+      'begin': datetime.utcfromtimestamp(100),
+      'fields': {'b': 2, 'a': 1},
+    }))
+    self.assertNotEqual(key, utils.memcache_key(test, {
+      'begin': datetime.utcfromtimestamp(100),
+      'fields': {'a': 1, 'b': 3},
+    }))
+    self.assertTrue(len(utils.memcache_key(test, {'cursor': 'c' * 1000})) < 250)
+
   def test_memcachize_limit(self):
     large_value = '0' * long(2e6)
     @utils.memcachize(cache_check=None)
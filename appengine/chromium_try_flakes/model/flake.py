@@ -43,6 +43,15 @@ class Flake(ndb.Model):
   count_all = ndb.IntegerProperty(default=0)
   last_time_seen = ndb.DateTimeProperty()
 
+  # Number of occurrences per hour in the longest counted time range, as a list
+  # of [hours since epoch, count] pairs ordered by hour. The counters above are
+  # kept up to date by adding occurrences to these buckets and subtracting the
+  # buckets which leave a time range, see status.cq_status.
+  hour_buckets = ndb.JsonProperty(default=[])
+  # The hour (since epoch) which the counters were last updated for. None if the
+  # buckets have not been built from the occurrences yet.
+  counters_hour = ndb.IntegerProperty(indexed=False)
+
   # This is needed to allow the query in update_flake_date_flags to be fast.
   last_hour = ndb.BooleanProperty(default=False)
   last_day = ndb.BooleanProperty(default=False)
@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import bisect
+import collections
 import datetime
 import logging
 import json
@@ -20,22 +22,27 @@ from model.flake import FlakeOccurance
 from model.flake import FlakyRun
 from status import build_result
 
-@ndb.transactional
-def get_patchset_builder_runs(issue, patchset, master, builder):
-  patchset_builder_runs_id = PatchsetBuilderRuns.getId(issue, patchset, master,
-                                                       builder)
-
-  patchset_builder_runs = PatchsetBuilderRuns.get_by_id(
-      patchset_builder_runs_id)
-  if not patchset_builder_runs:
-    patchset_builder_runs = PatchsetBuilderRuns(issue=issue,
-                                                patchset=patchset,
-                                                master=master,
-                                                builder=builder,
-                                                id=patchset_builder_runs_id)
-    patchset_builder_runs.put()
-
-  return patchset_builder_runs
+# Makes sure PatchsetBuilderRuns exist for the given (issue, patchset, master,
+# builder) tuples. Entities are looked up with a single batch get and the
+# missing ones are written with a single batch put.
+def create_patchset_builder_runs(patchset_builders):
+  keys = [ndb.Key(PatchsetBuilderRuns, PatchsetBuilderRuns.getId(*pb))
+          for pb in patchset_builders]
+  missing_runs = []
+  for key, patchset_builder, patchset_builder_runs in zip(
+      keys, patchset_builders, ndb.get_multi(keys)):
+    if patchset_builder_runs:
+      continue
+    issue, patchset, master, builder = patchset_builder
+    # Concurrent writers of the same entity write the same values, so this
+    # does not need a transaction.
+    missing_runs.append(PatchsetBuilderRuns(issue=issue,
+                                            patchset=patchset,
+                                            master=master,
+                                            builder=builder,
+                                            id=key.id()))
+  ndb.put_multi(missing_runs)
+  return keys
 
 
 def is_last_hour(date):
@@ -54,28 +61,54 @@ def is_last_month(date):
   return (datetime.datetime.now() - date) < datetime.timedelta(days=31)
 
 
-# Updates a Flake object, which spans all the instances of one flake, with the
-# time of an occurance of that flake.
-def add_occurance_time_to_flake(flake, occurance_time):
+# Time ranges of the Flake counters, in hours. An occurrence is counted in a
+# time range while its hour bucket is at most that many hours before the
+# current hour, i.e. for up to an hour longer than the time range itself.
+FLAKE_COUNTER_HOURS = (
+  ('hour', 1),
+  ('day', 24),
+  ('week', 24 * 7),
+  ('month', 24 * 31),
+)
+MAX_FLAKE_COUNTER_HOURS = FLAKE_COUNTER_HOURS[-1][1]
+
+
+def get_hour(date):
+  return int((date - datetime.datetime(1970, 1, 1)).total_seconds() // 3600)
+
+
+def is_in_time_range(bucket_hour, current_hour, hours):
+  return bucket_hour >= current_hour - hours
+
+
+# Adds an occurance of a flake to the hour buckets and counters of the Flake
+# object, which are up to date for current_hour.
+def count_occurance(flake, occurance_time, current_hour):
   if occurance_time > flake.last_time_seen:
     flake.last_time_seen = occurance_time
-  if is_last_hour(occurance_time):
-    flake.count_hour += 1
-    flake.last_hour = True
-  if is_last_day(occurance_time):
-    flake.count_day += 1
-    flake.last_day = True
-  if is_last_week(occurance_time):
-    flake.count_week += 1
-    flake.last_week = True
-  if is_last_month(occurance_time):
-    flake.count_month += 1
-    flake.last_month = True
   flake.count_all += 1
 
+  hour = get_hour(occurance_time)
+  for name, hours in FLAKE_COUNTER_HOURS:
+    if is_in_time_range(hour, current_hour, hours):
+      setattr(flake, 'count_' + name, getattr(flake, 'count_' + name) + 1)
+      setattr(flake, 'last_' + name, True)
 
-# Calculate the counters for a Flake object.
-def update_flake_counters(flake):
+  if not is_in_time_range(hour, current_hour, MAX_FLAKE_COUNTER_HOURS):
+    return
+  # Copied so that the default value of the property is never modified.
+  hour_buckets = list(flake.hour_buckets)
+  index = bisect.bisect_left(hour_buckets, [hour])
+  if index < len(hour_buckets) and hour_buckets[index][0] == hour:
+    hour_buckets[index] = [hour, hour_buckets[index][1] + 1]
+  else:
+    hour_buckets.insert(index, [hour, 1])
+  flake.hour_buckets = hour_buckets
+
+
+# Calculates the hour buckets and counters of a Flake object from all of its
+# occurrences. Only needed once for Flakes created before the hour buckets.
+def build_flake_counters(flake, current_hour):
   occurrences = ndb.get_multi(flake.occurrences)
   flake.count_hour = 0
   flake.count_day = 0
@@ -87,33 +120,132 @@ def update_flake_counters(flake):
   flake.last_week = False
   flake.last_month = False
   flake.last_time_seen = datetime.datetime.min
+  flake.hour_buckets = []
+  flake.counters_hour = current_hour
   for o in occurrences:
-    add_occurance_time_to_flake(flake, o.failure_run_time_finished)
+    count_occurance(flake, o.failure_run_time_finished, current_hour)
+
+
+# Moves the counters of a Flake object to current_hour by subtracting the hour
+# buckets which left each time range since the counters were last updated, and
+# drops the buckets which left all of them. Returns whether the Flake changed.
+def roll_flake_counters(flake, current_hour):
+  if flake.counters_hour is None:
+    build_flake_counters(flake, current_hour)
+    return True
+  if flake.counters_hour >= current_hour:
+    return False
+
+  for name, hours in FLAKE_COUNTER_HOURS:
+    expired = sum(
+        count for bucket_hour, count in flake.hour_buckets
+        if is_in_time_range(bucket_hour, flake.counters_hour, hours) and
+           not is_in_time_range(bucket_hour, current_hour, hours))
+    count = getattr(flake, 'count_' + name) - expired
+    setattr(flake, 'count_' + name, count)
+    setattr(flake, 'last_' + name, count > 0)
+  flake.hour_buckets = [
+      bucket for bucket in flake.hour_buckets
+      if is_in_time_range(bucket[0], current_hour, MAX_FLAKE_COUNTER_HOURS)]
+  flake.counters_hour = current_hour
+  return True
+
+
+# Updates a Flake object, which spans all the instances of one flake, with the
+# time of an occurance of that flake.
+def add_occurance_time_to_flake(flake, occurance_time):
+  current_hour = get_hour(datetime.datetime.now())
+  # Counters of Flakes without hour buckets are recalculated from all of their
+  # occurrences by the cron jobs, which can't be read in this transaction.
+  if flake.counters_hour is not None:
+    roll_flake_counters(flake, current_hour)
+  count_occurance(flake, occurance_time, current_hour)
+
+
+@ndb.transactional
+def roll_flake_counters_by_key(flake_key, current_hour):
+  flake = flake_key.get()
+  if roll_flake_counters(flake, current_hour):
+    flake.put()
+
+
+FLAKE_COUNTER_PROPERTIES = (
+    ['count_' + name for name, _ in FLAKE_COUNTER_HOURS] +
+    ['last_' + name for name, _ in FLAKE_COUNTER_HOURS] +
+    ['count_all', 'last_time_seen', 'hour_buckets', 'counters_hour'])
+
+
+# Saves the counters built from the given occurrences of a Flake, unless
+# occurrences were added since. Returns whether the Flake is up to date.
+@ndb.transactional
+def save_built_flake_counters(built_flake, occurrences, current_hour):
+  flake = built_flake.key.get()
+  if flake.counters_hour is not None:
+    # Built concurrently, only needs to be moved to the current hour.
+    if roll_flake_counters(flake, current_hour):
+      flake.put()
+    return True
+  if flake.occurrences != occurrences:
+    return False
+  for name in FLAKE_COUNTER_PROPERTIES:
+    setattr(flake, name, getattr(built_flake, name))
   flake.put()
+  return True
+
+
+# Number of times the counters of a Flake are built from its occurrences when
+# occurrences keep being added meanwhile. The next cron job tries again.
+MAX_BUILD_FLAKE_COUNTERS_ATTEMPTS = 3
+
+
+# Builds the counters of a Flake without hour buckets from its occurrences,
+# which are outside of the Flake entity group and so are read outside of the
+# transaction saving the counters.
+def build_flake_counters_by_key(flake_key, current_hour):
+  for _ in xrange(MAX_BUILD_FLAKE_COUNTERS_ATTEMPTS):
+    flake = flake_key.get()
+    if flake.counters_hour is not None:
+      roll_flake_counters_by_key(flake_key, current_hour)
+      return
+    occurrences = list(flake.occurrences)
+    build_flake_counters(flake, current_hour)
+    if save_built_flake_counters(flake, occurrences, current_hour):
+      return
+  logging.warning('Occurrences of %s keep changing, counters not built',
+                  flake_key.id())
+
+
+# Updates the counters of the given Flakes for the current hour. Only Flakes
+# whose counters are behind are written, in a transaction so that occurrences
+# added concurrently are not lost.
+def update_flake_counters(flakes):
+  current_hour = get_hour(datetime.datetime.now())
+  for flake in flakes:
+    if flake.counters_hour is None:
+      build_flake_counters_by_key(flake.key, current_hour)
+    elif flake.counters_hour < current_hour:
+      roll_flake_counters_by_key(flake.key, current_hour)
 
 
 # The following four functions are cron jobs which update the counters for
 # flakes. To speed things up, we don't update last month/week/day as often as we
-# update hourly counters.
+# update hourly counters. Counters only change when the hour rolls over.
 def update_flake_hour_counter():
   query = Flake.query().filter(Flake.last_hour == True)
-  for flake in query:
-    update_flake_counters(flake)
+  update_flake_counters(query)
 
 
 def update_flake_day_counter():
   query = Flake.query().filter(Flake.last_day == True,
                                Flake.last_hour == False)
-  for flake in query:
-    update_flake_counters(flake)
+  update_flake_counters(query)
 
 
 def update_flake_week_counter():
   query = Flake.query().filter(Flake.last_week == True,
                                Flake.last_day == False,
                                Flake.last_hour == False)
-  for flake in query:
-    update_flake_counters(flake)
+  update_flake_counters(query)
 
 
 def update_flake_month_counter():
@@ -121,15 +253,15 @@ def update_flake_month_counter():
                                Flake.last_week == False,
                                Flake.last_day == False,
                                Flake.last_hour == False)
-  for flake in query:
-    update_flake_counters(flake)
+  update_flake_counters(query)
 
 
 @ndb.transactional(xg=True)  # pylint: disable=no-value-for-parameter
 def add_failure_to_flake(name, flaky_run):
   flake = Flake.get_by_id(name)
   if not flake:
-    flake = Flake(name=name, id=name, last_time_seen=datetime.datetime.min)
+    flake = Flake(name=name, id=name, last_time_seen=datetime.datetime.min,
+                  counters_hour=get_hour(datetime.datetime.now()))
     flake.put()
 
   flake.occurrences.append(flaky_run.key)
@@ -265,9 +397,11 @@ def get_int_value(properties, key):
   return int(value)
 
 
-# Parses the json which we get from chromium-cq-status.
-def parse_cq_data(json_data):
-  logging_output = []
+# Returns the finished try jobs in the json which we get from
+# chromium-cq-status, in order, as tuples of
+# ((issue, patchset, master, builder), buildnumber, result, timestamp).
+def get_finished_jobs(json_data):
+  jobs = []
   for result in json_data['results']:
     fields = result['fields']
     if not 'action' in fields:
@@ -306,62 +440,88 @@ def parse_cq_data(json_data):
         if build_result.isResultPending(result):
           continue
 
-        # At this point, only success or failure.
-        success = build_result.isResultSuccess(result)
-
-        patchset_builder_runs = get_patchset_builder_runs(issue=issue,
-                                                          patchset=patchset,
-                                                          master=master,
-                                                          builder=builder)
-
-        build_run = BuildRun(parent=patchset_builder_runs.key,
-                             buildnumber=buildnumber,
-                             result=result,
-                             time_finished=timestamp)
-
-        previous_runs = BuildRun.query(
-            ancestor=patchset_builder_runs.key).fetch()
-
-        duplicate = False
-        for previous_run in previous_runs:
-          # We saw this build run already or there are multiple green runs,
-          # in which case we ignore subsequent ones to avoid showing failures
-          # multiple times.
-          if (previous_run.buildnumber == buildnumber) or \
-             (build_run.is_success and previous_run.is_success) :
-            duplicate = True
-            break
-
-        if duplicate:
-          continue
+        jobs.append(((issue, patchset, master, builder), buildnumber, result,
+                     timestamp))
+  return jobs
+
+
+# Parses the json which we get from chromium-cq-status.
+#
+# Jobs are grouped by their PatchsetBuilderRuns, whose BuildRuns are all loaded
+# at once with parallel ancestor queries. Duplicates are then found in memory
+# and the new entities are written in batches, so the number of datastore round
+# trips does not grow with the number of jobs.
+def parse_cq_data(json_data):
+  logging_output = []
+  jobs = get_finished_jobs(json_data)
+
+  patchset_builders = list(collections.OrderedDict.fromkeys(
+      patchset_builder for patchset_builder, _, _, _ in jobs))
+  parent_keys = create_patchset_builder_runs(patchset_builders)
+  runs_futures = [BuildRun.query(ancestor=key).fetch_async()
+                  for key in parent_keys]
+  parent_keys = dict(zip(patchset_builders, parent_keys))
+  # Holds the BuildRuns seen so far for each PatchsetBuilderRuns.
+  previous_runs_by_parent = dict(zip(
+      patchset_builders, [future.get_result() for future in runs_futures]))
+
+  new_build_runs = []
+  # Tuples of (failure BuildRun, success BuildRun, builder).
+  flaky_build_runs = []
+  for patchset_builder, buildnumber, result, timestamp in jobs:
+    # At this point, only success or failure.
+    success = build_result.isResultSuccess(result)
+
+    build_run = BuildRun(parent=parent_keys[patchset_builder],
+                         buildnumber=buildnumber,
+                         result=result,
+                         time_finished=timestamp)
+
+    previous_runs = previous_runs_by_parent[patchset_builder]
+
+    duplicate = False
+    for previous_run in previous_runs:
+      # We saw this build run already or there are multiple green runs,
+      # in which case we ignore subsequent ones to avoid showing failures
+      # multiple times.
+      if (previous_run.buildnumber == buildnumber) or \
+         (build_run.is_success and previous_run.is_success) :
+        duplicate = True
+        break
+
+    if duplicate:
+      continue
 
-        build_run.put()
-
-        for previous_run in previous_runs:
-          if previous_run.is_success == build_run.is_success:
-            continue
-          if success:
-            # We saw the flake and then the pass.
-            flaky_run = FlakyRun(
-                failure_run=previous_run.key,
-                failure_run_time_finished=previous_run.time_finished,
-                success_run=build_run.key)
-            flaky_run.put()
-            logging_output.append(previous_run.key.parent().get().builder +
-                                  str(previous_run.buildnumber))
-          else:
-            # We saw the pass and then the failure. Could happen when fetching
-            # historical data.
-            flaky_run = FlakyRun(
-                failure_run=build_run.key,
-                failure_run_time_finished=build_run.time_finished,
-                success_run=previous_run.key)
-            flaky_run.put()
-            logging_output.append(build_run.key.parent().get().builder +
-                                  str(build_run.buildnumber))
-
-          # Queue a task to fetch the error of this failure.
-          deferred.defer(get_flaky_run_reason, flaky_run.key)
+    builder = patchset_builder[3]
+    for previous_run in previous_runs:
+      if previous_run.is_success == build_run.is_success:
+        continue
+      if success:
+        # We saw the flake and then the pass.
+        flaky_build_runs.append((previous_run, build_run, builder))
+      else:
+        # We saw the pass and then the failure. Could happen when fetching
+        # historical data.
+        flaky_build_runs.append((build_run, previous_run, builder))
+
+    previous_runs.append(build_run)
+    new_build_runs.append(build_run)
+
+  # BuildRuns need their keys before FlakyRuns can refer to them.
+  ndb.put_multi(new_build_runs)
+
+  flaky_runs = []
+  for failure_run, success_run, builder in flaky_build_runs:
+    flaky_runs.append(FlakyRun(
+        failure_run=failure_run.key,
+        failure_run_time_finished=failure_run.time_finished,
+        success_run=success_run.key))
+    logging_output.append(builder + str(failure_run.buildnumber))
+  ndb.put_multi(flaky_runs)
+
+  for flaky_run in flaky_runs:
+    # Queue a task to fetch the error of this failure.
+    deferred.defer(get_flaky_run_reason, flaky_run.key)
 
   return logging_output
 
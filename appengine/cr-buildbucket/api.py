@@ -230,31 +230,34 @@ class BuildBucketApi(remote.Service):
       path='builds/batch', http_method='PUT')
   def put_batch(self, request):
     """Creates builds."""
-    build_futures = [
-        self.service.add_async(
-            bucket=put_req.bucket,
-            tags=put_req.tags,
-            parameters=parse_json(put_req.parameters_json, 'parameters_json'),
-            lease_expiration_date=parse_datetime(put_req.lease_expiration_ts),
-            client_operation_id=put_req.client_operation_id,
-        )
+    results = self.service.add_batch([
+        {
+            'bucket': put_req.bucket,
+            'tags': put_req.tags,
+            'parameters': parse_json(
+                put_req.parameters_json, 'parameters_json'),
+            'lease_expiration_date': parse_datetime(
+                put_req.lease_expiration_ts),
+            'client_operation_id': put_req.client_operation_id,
+        }
         for put_req in request.builds
-    ]
+    ])
 
     res = self.PutBatchResponseMessage()
 
-    def to_msg(req, build_future):
+    def to_msg(req, (build, ex)):
       one_res = res.OneResult(client_operation_id=req.client_operation_id)
-      try:
-        build = build_future.get_result()
+      if ex is None:
         one_res.build = build_to_message(build, include_lease_key=True)
-      except errors.Error as ex:
+      elif isinstance(ex, errors.Error):
         one_res.error = exception_to_error_message(ex)
+      else:
+        raise ex
       return one_res
 
     res.results = [
-        to_msg(req, build)
-        for req, build in zip(request.builds, build_futures)]
+        to_msg(req, result)
+        for req, result in zip(request.builds, results)]
     return res
 
   ##################################  SEARCH   #################################
@@ -349,6 +352,34 @@ class BuildBucketApi(remote.Service):
     assert build.lease_key is not None
     return build_to_response_message(build, include_lease_key=True)
 
+  ###############################  LEASE_MANY  #################################
+
+  class LeaseManyRequestMessage(messages.Message):
+    buckets = messages.StringField(1, repeated=True)
+    max_builds = messages.IntegerField(2, variant=messages.Variant.INT32)
+    lease_expiration_ts = messages.IntegerField(3)
+
+  class LeaseManyResponseMessage(messages.Message):
+    builds = messages.MessageField(BuildMessage, 1, repeated=True)
+    error = messages.MessageField(ErrorMessage, 2)
+
+  @buildbucket_api_method(
+      LeaseManyRequestMessage, LeaseManyResponseMessage,
+      path='builds/lease', http_method='POST')
+  def lease_many(self, request):
+    """Leases available builds in any of the buckets.
+
+    Concurrent callers mostly get disjoint sets of builds.
+    """
+    builds = self.service.lease_many(
+        request.buckets,
+        max_builds=request.max_builds,
+        lease_expiration_date=parse_datetime(request.lease_expiration_ts),
+    )
+    return self.LeaseManyResponseMessage(builds=[
+        build_to_message(b, include_lease_key=True) for b in builds
+    ])
+
   #################################  RESET  ####################################
 
   @buildbucket_api_method(
@@ -479,6 +510,59 @@ class BuildBucketApi(remote.Service):
     )
     return build_to_response_message(build)
 
+  ##############################  COMPLETE_BATCH  ##############################
+
+  class CompleteBatchRequestMessage(messages.Message):
+    class OneCompletion(messages.Message):
+      build_id = messages.IntegerField(1, required=True)
+      lease_key = messages.IntegerField(2)
+      result = messages.EnumField(model.BuildResult, 3, required=True)
+      result_details_json = messages.StringField(4)
+      failure_reason = messages.EnumField(model.FailureReason, 5)
+      url = messages.StringField(6)
+    builds = messages.MessageField(OneCompletion, 1, repeated=True)
+
+  class CompleteBatchResponseMessage(messages.Message):
+    class OneResult(messages.Message):
+      build_id = messages.IntegerField(1, required=True)
+      build = messages.MessageField(BuildMessage, 2)
+      error = messages.MessageField(ErrorMessage, 3)
+    results = messages.MessageField(OneResult, 1, repeated=True)
+    error = messages.MessageField(ErrorMessage, 2)
+
+  @buildbucket_api_method(
+      CompleteBatchRequestMessage, CompleteBatchResponseMessage,
+      path='builds/complete', http_method='POST')
+  def complete_batch(self, request):
+    """Marks builds as succeeded or failed."""
+    completions = []
+    for c in request.builds:
+      if c.result not in (model.BuildResult.SUCCESS, model.BuildResult.FAILURE):
+        raise errors.InvalidInputError(
+            'Build %s: result must be SUCCESS or FAILURE' % c.build_id)
+      completions.append({
+          'build_id': c.build_id,
+          'lease_key': c.lease_key,
+          'result': c.result,
+          'result_details': parse_json(
+              c.result_details_json, 'result_details_json'),
+          'failure_reason': c.failure_reason,
+          'url': c.url,
+      })
+
+    def to_msg((build_id, build, ex)):
+      one_res = self.CompleteBatchResponseMessage.OneResult(build_id=build_id)
+      if build:
+        one_res.build = build_to_message(build)
+      elif isinstance(ex, errors.Error):
+        one_res.error = exception_to_error_message(ex)
+      else:
+        raise ex
+      return one_res
+
+    results = self.service.complete_batch(completions)
+    return self.CompleteBatchResponseMessage(results=map(to_msg, results))
+
   ##################################  CANCEL  ##################################
 
   @buildbucket_api_method(
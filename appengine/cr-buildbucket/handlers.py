@@ -31,6 +31,40 @@ class CronResetExpiredBuilds(webapp2.RequestHandler):
     create_service().reset_expired_builds()
 
 
+class AdminStartFillReadyQueues(webapp2.RequestHandler):  # pragma: no cover
+  """Starts the one-off fill of ready queues with existing builds.
+
+  Only admins can reach /internal URLs, see module-backend.yaml.
+  """
+  def get(self):
+    service.enqueue_fill_ready_queues()
+    self.response.write('Ready queue fill started.')
+
+
+class TaskFillReadyQueues(webapp2.RequestHandler):  # pragma: no cover
+  """Adds a page of builds to ready queues, chaining the next page."""
+  @decorators.require_taskqueue('default')
+  def post(self):
+    create_service().fill_ready_queues(self.request.get('cursor') or None)
+
+
+class AdminStartTagIndexBackfill(webapp2.RequestHandler):  # pragma: no cover
+  """Starts the one-off backfill of tag index entries of existing builds.
+
+  Only admins can reach /internal URLs, see module-backend.yaml.
+  """
+  def get(self):
+    service.enqueue_tag_index_backfill()
+    self.response.write('Tag index backfill started.')
+
+
+class TaskBackfillTagIndex(webapp2.RequestHandler):  # pragma: no cover
+  """Adds tag index entries of a page of builds, chaining the next page."""
+  @decorators.require_taskqueue('default')
+  def post(self):
+    create_service().backfill_tag_index()
+
+
 class CronSendMetrics(webapp2.RequestHandler):  # pragma: no cover
   """Resets expired builds."""
   @decorators.require_cronjob
@@ -38,6 +72,13 @@ class CronSendMetrics(webapp2.RequestHandler):  # pragma: no cover
     metrics.send_all_metrics()
 
 
+class CronReconcileBuildCounts(webapp2.RequestHandler):  # pragma: no cover
+  """Fixes drift of bucket build counters."""
+  @decorators.require_cronjob
+  def get(self):
+    metrics.reconcile_all_build_counts()
+
+
 class CronUpdateBuckets(webapp2.RequestHandler):  # pragma: no cover
   """Updates buckets from configs."""
   @decorators.require_cronjob
@@ -64,9 +105,24 @@ def get_backend_routes():
       webapp2.Route(
           r'/internal/cron/buildbucket/reset_expired_builds',
           CronResetExpiredBuilds),
+      webapp2.Route(
+          r'/internal/admin/buildbucket/fill_ready_queues',
+          AdminStartFillReadyQueues),
+      webapp2.Route(
+          service.FILL_READY_QUEUES_URL,
+          TaskFillReadyQueues),
+      webapp2.Route(
+          r'/internal/admin/buildbucket/backfill_tag_index',
+          AdminStartTagIndexBackfill),
+      webapp2.Route(
+          service.TAG_INDEX_BACKFILL_URL,
+          TaskBackfillTagIndex),
       webapp2.Route(
           r'/internal/cron/buildbucket/send_metrics',
           CronSendMetrics),
+      webapp2.Route(
+          r'/internal/cron/buildbucket/reconcile_build_counts',
+          CronReconcileBuildCounts),
       webapp2.Route(
           r'/internal/cron/buildbucket/update_buckets',
           CronUpdateBuckets),
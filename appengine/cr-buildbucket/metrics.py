@@ -3,6 +3,7 @@
 # found in the LICENSE file.
 
 import logging
+import random
 
 from google.appengine.ext import ndb
 
@@ -26,28 +27,125 @@ METRIC_RUNNING_BUILDS = metrics.Descriptor(
     description='Number of running builds',
     labels=COMMON_LABELS,
 )
+BUILD_STATUS_METRICS = [
+    (METRIC_PENDING_BUILDS, model.BuildStatus.SCHEDULED),
+    (METRIC_RUNNING_BUILDS, model.BuildStatus.STARTED),
+]
 
 
 @ndb.tasklet
-def send_build_status_metric(buf, bucket, metric, status):
-  q = model.Build.query(
-      model.Build.bucket == bucket,
-      model.Build.status == status)
-  value = yield q.count_async()
-  logging.info('Bucket %s: %s = %d', bucket, metric.name, value)
-  buf.set_gauge(metric, value, {LABEL_BUCKET: bucket})
+def update_build_count_async(bucket, old_status, new_status, count=1):
+  """Moves |count| builds from |old_status| to |new_status| in bucket counters.
+
+  Must be called in a cross-group transaction that updates the builds.
+  |old_status| is None for new builds.
+  """
+  assert ndb.in_transaction()
+  if old_status == new_status:  # pragma: no cover
+    return
+  keys = model.build_count_shard_keys(bucket)
+  key = random.choice(keys)
+  shard = yield key.get_async()
+  shard = shard or model.BuildCountShard(key=key, bucket=bucket)
+  shard.add(old_status, -count)
+  shard.add(new_status, count)
+  yield shard.put_async()
+
+
+@ndb.tasklet
+def get_build_counts_async(bucket):
+  """Returns a dict {status: number of builds} of counted statuses."""
+  shards = yield ndb.get_multi_async(model.build_count_shard_keys(bucket))
+  counts = dict.fromkeys(model.BuildCountShard.STATUS_PROPERTIES, 0)
+  for shard in shards:
+    if shard:
+      for status in counts:
+        counts[status] += shard.count(status)
+  raise ndb.Return(counts)
+
+
+@ndb.tasklet
+def reconcile_build_counts_async(bucket):
+  """Fixes drift of bucket counters using count queries.
+
+  Count queries are eventually consistent and are not atomic with reading the
+  counters, so builds changing status meanwhile show up as transient drift.
+  Drift is fixed only if the previous run saw drift of the same sign, and only
+  by the smaller of the two amounts. The rest is stored in a BuildCountDrift
+  for the next run.
+
+  The fix is a transaction on one random shard, same as a build status change,
+  so it contends with status changes of builds in the bucket as one more of
+  them, once per run at most.
+  """
+  statuses = model.BuildCountShard.STATUS_PROPERTIES.keys()
+  actual_futures = [
+      model.Build.query(
+          model.Build.bucket == bucket,
+          model.Build.status == status).count_async()
+      for status in statuses
+  ]
+  drift_key = ndb.Key(model.BuildCountDrift, bucket)
+  last_drift_future = drift_key.get_async()
+  counts = yield get_build_counts_async(bucket)
+  actual = yield actual_futures
+  actual = dict(zip(statuses, actual))
+  last_drift = yield last_drift_future
+  last_drift = last_drift or model.BuildCountDrift(key=drift_key, bucket=bucket)
+
+  fixes = {}
+  new_drift = model.BuildCountDrift(key=drift_key, bucket=bucket)
+  for status in statuses:
+    drift = actual[status] - counts[status]
+    last = last_drift.count(status)
+    fix = 0
+    if drift * last > 0:
+      fix = min(abs(drift), abs(last)) * (1 if drift > 0 else -1)
+      logging.warning(
+          'Bucket %s: fixing %s counter by %d', bucket, status, fix)
+      fixes[status] = fix
+    new_drift.add(status, drift - fix)
+
+  @ndb.transactional_tasklet
+  def fix_async():
+    key = random.choice(model.build_count_shard_keys(bucket))
+    shard = yield key.get_async()
+    shard = shard or model.BuildCountShard(key=key, bucket=bucket)
+    for status, fix in fixes.iteritems():
+      shard.add(status, fix)
+    yield shard.put_async()
+
+  if fixes:
+    yield fix_async()
+  yield new_drift.put_async()
+
+
+def reconcile_all_build_counts():
+  """Fixes drift of counters of all buckets."""
+  futures = [
+      reconcile_build_counts_async(b.name)
+      for b in config.get_buckets_async().get_result()
+  ]
+  ndb.Future.wait_all(futures)
+  for f in futures:
+    f.check_success()
+
+
+@ndb.tasklet
+def send_bucket_metrics(buf, bucket):
+  counts = yield get_build_counts_async(bucket)
+  for metric, status in BUILD_STATUS_METRICS:
+    value = counts[status]
+    logging.info('Bucket %s: %s = %d', bucket, metric.name, value)
+    buf.set_gauge(metric, value, {LABEL_BUCKET: bucket})
 
 
 def send_all_metrics():
   buf = metrics.Buffer()
-  futures = []
-  for b in config.get_buckets_async().get_result():
-    futures.extend([
-        send_build_status_metric(
-            buf, b.name, METRIC_PENDING_BUILDS, model.BuildStatus.SCHEDULED),
-        send_build_status_metric(
-            buf, b.name, METRIC_RUNNING_BUILDS, model.BuildStatus.STARTED),
-    ])
+  futures = [
+      send_bucket_metrics(buf, b.name)
+      for b in config.get_buckets_async().get_result()
+  ]
   ndb.Future.wait_all(futures)
   buf.flush()
   for f in futures:
@@ -172,3 +172,187 @@ def new_build_id():
   inverted_now = ~now & ((1 << 43) - 1)
   suffix = random.getrandbits(16)
   return int((inverted_now << 20) | (suffix << 4))
+
+
+# Number of shards of a ready queue of a bucket. See ReadyBuild.
+READY_QUEUE_SHARDS = 16
+
+
+class ReadyBuild(ndb.Model):
+  """An entry of a ready queue: a build that is available for leasing.
+
+  Exists if and only if the parent Build is SCHEDULED and not leased. The parent
+  is the Build itself, so the entry is updated in the same transaction as the
+  build. Entity id is always 1.
+
+  A ready queue of each bucket is split into READY_QUEUE_SHARDS shards. Pollers
+  that start from a random shard mostly get disjoint sets of builds, so they do
+  not collide on leasing the same oldest builds.
+
+  Attributes:
+    bucket (string): bucket of the build.
+    shard (int): shard of the bucket's ready queue, see ready_queue_shard.
+    create_time (datetime): creation time of the build.
+  """
+  bucket = ndb.StringProperty(required=True)
+  shard = ndb.IntegerProperty(required=True)
+  create_time = ndb.DateTimeProperty(required=True)
+
+  @property
+  def build_id(self):
+    return self.key.parent().id()
+
+
+def ready_build_key(build_key):
+  """Returns ndb.Key of ReadyBuild for a build with |build_key|."""
+  return ndb.Key(ReadyBuild, 1, parent=build_key)
+
+
+def ready_queue_shard(build_id):
+  """Returns a ready queue shard for a build.
+
+  Uses random bits of build id, see Build docstring.
+  """
+  return (build_id >> 4) % READY_QUEUE_SHARDS
+
+
+def ready_build_for(build):
+  """Returns ReadyBuild entity for |build| or None if it is not ready."""
+  if build.status != BuildStatus.SCHEDULED or build.is_leased:
+    return None
+  return ReadyBuild(
+      key=ready_build_key(build.key),
+      bucket=build.bucket,
+      shard=ready_queue_shard(build.key.id()),
+      create_time=build.create_time or utils.utcnow())
+
+
+# Number of shards of a build counter of a bucket. See BuildCountShard.
+BUILD_COUNT_SHARDS = 10
+
+
+class BuildCountShard(ndb.Model):
+  """A shard of a counter of pending and running builds in a bucket.
+
+  Updated in the same transaction as a build changing its status, so the
+  number of builds in a bucket is a sum of BUILD_COUNT_SHARDS entities,
+  regardless of how many builds there are. A transaction updates a random
+  shard, so a single shard value may be negative.
+
+  Entity key: id is "<bucket>:<shard index>". No parent.
+
+  Attributes:
+    bucket (string): bucket of the counted builds.
+    scheduled (int): number of SCHEDULED builds.
+    started (int): number of STARTED builds.
+  """
+  bucket = ndb.StringProperty(required=True)
+  scheduled = ndb.IntegerProperty(default=0, indexed=False)
+  started = ndb.IntegerProperty(default=0, indexed=False)
+
+  # Maps a counted build status to a property name.
+  STATUS_PROPERTIES = {
+      BuildStatus.SCHEDULED: 'scheduled',
+      BuildStatus.STARTED: 'started',
+  }
+
+  def add(self, status, delta):
+    """Adds |delta| to the counter of |status| if it is counted."""
+    name = self.STATUS_PROPERTIES.get(status)
+    if name:
+      setattr(self, name, getattr(self, name) + delta)
+
+  def count(self, status):
+    """Returns the counter value of a counted |status|."""
+    return getattr(self, self.STATUS_PROPERTIES[status])
+
+
+def build_count_shard_keys(bucket):
+  """Returns keys of all BuildCountShard entities of a |bucket|."""
+  return [
+      ndb.Key(BuildCountShard, '%s:%d' % (bucket, i))
+      for i in xrange(BUILD_COUNT_SHARDS)
+  ]
+
+
+class BuildCountDrift(BuildCountShard):
+  """Drift of counters of a bucket seen by the last reconciliation.
+
+  Only drift that persists across two reconciliations is fixed, see
+  metrics.reconcile_build_counts_async. Has the same properties as
+  BuildCountShard, where a counter is the number of builds that the count
+  queries saw and the shards did not.
+
+  Entity key: id is bucket name. No parent.
+  """
+
+
+# Keys of tags that have a TagIndexEntry.
+INDEXED_TAG_KEYS = frozenset(['buildset'])
+
+
+class TagIndexEntry(ndb.Model):
+  """An entry of a tag index: a build has an indexed tag.
+
+  Exists for each tag of a build with a key in INDEXED_TAG_KEYS. The parent is
+  the Build, so entries are put in the same transaction as the build. Entity
+  id is the tag.
+
+  Entries of a tag ordered by key are ordered by build id, same as builds.
+  A search by an indexed tag pages through entries using the last build id as
+  a cursor, and does not look at builds without the tag or in other buckets.
+
+  Attributes:
+    tag (string): the tag, "<key>:<value>".
+    bucket (string): bucket of the build.
+  """
+  tag = ndb.StringProperty(required=True)
+  bucket = ndb.StringProperty(required=True)
+
+
+def is_indexed_tag(tag):
+  """True if |tag| has TagIndexEntry entities."""
+  return tag.split(':', 1)[0] in INDEXED_TAG_KEYS
+
+
+def tag_index_entry_key(build_key, tag):
+  """Returns ndb.Key of TagIndexEntry of a build with |build_key|."""
+  return ndb.Key(TagIndexEntry, tag, parent=build_key)
+
+
+def tag_index_entries_for(build):
+  """Returns TagIndexEntry entities for indexed tags of |build|."""
+  return [
+      TagIndexEntry(
+          key=tag_index_entry_key(build.key, t), tag=t, bucket=build.bucket)
+      for t in sorted(set(build.tags or []))
+      if is_indexed_tag(t)
+  ]
+
+
+class TagIndexBackfill(ndb.Model):
+  """Progress of the backfill of TagIndexEntry entities of existing builds.
+
+  Builds created before the tag index was introduced do not have entries, so
+  searches by an indexed tag do not use the index until the backfill is
+  complete.
+
+  Entity key: TAG_INDEX_BACKFILL_KEY.
+
+  Attributes:
+    tag_key (string): tag key of the builds being backfilled.
+    cursor (string): urlsafe cursor to resume the builds query from.
+    complete (bool): True if builds of all INDEXED_TAG_KEYS were backfilled.
+  """
+  tag_key = ndb.StringProperty(indexed=False)
+  cursor = ndb.StringProperty(indexed=False)
+  complete = ndb.BooleanProperty(default=False, indexed=False)
+
+
+TAG_INDEX_BACKFILL_KEY = ndb.Key(TagIndexBackfill, 'tag_index')
+
+
+def is_tag_index_complete():
+  """True if all builds with indexed tags have TagIndexEntry entities."""
+  backfill = TAG_INDEX_BACKFILL_KEY.get()
+  return bool(backfill and backfill.complete)
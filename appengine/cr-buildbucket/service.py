@@ -2,20 +2,24 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
 import datetime
 import itertools
 import json
 import logging
+import random
 import urlparse
 
 from components import auth
 from components import utils
+from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import db
 from google.appengine.ext import ndb
 
 import acl
 import errors
+import metrics
 import model
 
 
@@ -23,6 +27,13 @@ MAX_RETURN_BUILDS = 100
 MAX_LEASE_DURATION = datetime.timedelta(hours=2)
 DEFAULT_LEASE_DURATION = datetime.timedelta(minutes=1)
 BUILD_TIMEOUT = datetime.timedelta(days=1)
+# Prefix of search cursors returned by searches by an indexed tag.
+TAG_INDEX_CURSOR_PREFIX = 'tag_index:'
+# URL of the tag index backfill task, see backfill_tag_index.
+TAG_INDEX_BACKFILL_URL = '/internal/task/buildbucket/backfill_tag_index'
+TAG_INDEX_BACKFILL_PAGE_SIZE = 500
+FILL_READY_QUEUES_URL = '/internal/task/buildbucket/fill_ready_queues'
+FILL_READY_QUEUES_PAGE_SIZE = 500
 
 
 validate_bucket_name = errors.validate_bucket_name
@@ -83,6 +94,51 @@ def validate_tags(tags):
       raise errors.InvalidInputError('Invalid tag "%s": does not contain ":"')
 
 
+def validate_add_request(
+    bucket, tags=None, parameters=None, lease_expiration_date=None,
+    client_operation_id=None):
+  """Validates parameters of BuildBucketService.add_async."""
+  if client_operation_id is not None:
+    if not isinstance(client_operation_id, basestring):  # pragma: no cover
+      raise errors.InvalidInputError('client_operation_id must be string')
+    if '/' in client_operation_id:  # pragma: no cover
+      raise errors.InvalidInputError('client_operation_id must not contain /')
+  validate_bucket_name(bucket)
+  if parameters is not None and not isinstance(parameters, dict):
+    raise errors.InvalidInputError('parameters must be a dict or None')
+  validate_lease_expiration_date(lease_expiration_date)
+  validate_tags(tags)
+
+
+def client_operation_cache_key(identity, client_operation_id):
+  """Returns a memcache key of a build id added by a client operation."""
+  return 'client_op/%s/%s/add_build' % (
+      identity.to_bytes(), client_operation_id)
+
+
+def new_build(
+    bucket, tags=None, parameters=None, lease_expiration_date=None,
+    client_operation_id=None):
+  """Returns a new SCHEDULED Build created by the current identity.
+
+  Does not validate or put it. |client_operation_id| is ignored.
+  """
+  identity = auth.get_current_identity()
+  build = model.Build(
+      id=model.new_build_id(),
+      bucket=bucket,
+      tags=tags or [],
+      parameters=parameters,
+      status=model.BuildStatus.SCHEDULED,
+      created_by=identity,
+  )
+  if lease_expiration_date is not None:
+    build.lease_expiration_date = lease_expiration_date
+    build.leasee = identity
+    build.regenerate_lease_key()
+  return build
+
+
 def current_identity_cannot(action_format, *args):
   action = action_format % args
   msg = 'User %s cannot %s' % (auth.get_current_identity().to_bytes(), action)
@@ -90,6 +146,44 @@ def current_identity_cannot(action_format, *args):
   raise auth.AuthorizationError(msg)
 
 
+@ndb.tasklet
+def put_build_async(build, old_status, update_count=True):
+  """Puts |build| and updates its ready queue entry and bucket counters.
+
+  Must be used instead of build.put_async() when a build may change its status
+  or become available or unavailable for leasing. Must be called in a
+  cross-group transaction. Also puts tag index entries of a new build.
+
+  Args:
+    build (model.Build): build to put.
+    old_status (model.BuildStatus): status of the build before the change,
+      or None if the build is new.
+    update_count (bool): if False, the caller updates bucket counters.
+  """
+  ready = model.ready_build_for(build)
+  if ready:
+    ready_future = ready.put_async()
+  else:
+    ready_future = model.ready_build_key(build.key).delete_async()
+  futures = [build.put_async(), ready_future]
+  if old_status is None:
+    futures.extend(ndb.put_multi_async(model.tag_index_entries_for(build)))
+  if update_count and old_status != build.status:
+    futures.append(metrics.update_build_count_async(
+        build.bucket, old_status, build.status))
+  yield futures
+
+
+def enqueue_tag_index_backfill():
+  """Enqueues a task to backfill the next page of the tag index."""
+  taskqueue.add(url=TAG_INDEX_BACKFILL_URL)
+
+
+def enqueue_fill_ready_queues(cursor=None):
+  """Enqueues a task to fill ready queues from the page at |cursor|."""
+  taskqueue.add(url=FILL_READY_QUEUES_URL, params={'cursor': cursor or ''})
+
+
 class BuildBucketService(object):
   @ndb.tasklet
   def add_async(
@@ -114,17 +208,8 @@ class BuildBucketService(object):
     Returns:
       A new Build.
     """
-    if client_operation_id is not None:
-      if not isinstance(client_operation_id, basestring):  # pragma: no cover
-        raise errors.InvalidInputError('client_operation_id must be string')
-      if '/' in client_operation_id:  # pragma: no cover
-        raise errors.InvalidInputError('client_operation_id must not contain /')
-    validate_bucket_name(bucket)
-    if parameters is not None and not isinstance(parameters, dict):
-      raise errors.InvalidInputError('parameters must be a dict or None')
-    validate_lease_expiration_date(lease_expiration_date)
-    validate_tags(tags)
-    tags = tags or []
+    validate_add_request(
+        bucket, tags, parameters, lease_expiration_date, client_operation_id)
 
     ctx = ndb.get_context()
     identity = auth.get_current_identity()
@@ -132,39 +217,132 @@ class BuildBucketService(object):
       raise current_identity_cannot('add builds to bucket %s', bucket)
 
     if client_operation_id is not None:
-      client_operation_cache_key = (
-          'client_op/%s/%s/add_build' % (
-              identity.to_bytes(), client_operation_id))
-      build_id = yield ctx.memcache_get(client_operation_cache_key)
+      cache_key = client_operation_cache_key(identity, client_operation_id)
+      build_id = yield ctx.memcache_get(cache_key)
       if build_id:
         build = yield model.Build.get_by_id_async(build_id)
         if build:  # pragma: no branch
           raise ndb.Return(build)
 
-    build = model.Build(
-        id=model.new_build_id(),
-        bucket=bucket,
-        tags=tags,
-        parameters=parameters,
-        status=model.BuildStatus.SCHEDULED,
-        created_by=identity,
-    )
-    if lease_expiration_date is not None:
-      build.lease_expiration_date = lease_expiration_date
-      build.leasee = auth.get_current_identity()
-      build.regenerate_lease_key()
-    yield build.put_async()
+    build = new_build(bucket, tags, parameters, lease_expiration_date)
+    yield ndb.transaction_async(
+        lambda: put_build_async(build, None), xg=True)
     logging.info(
         'Build %s was created by %s', build.key.id(), identity.to_bytes())
 
     if client_operation_id is not None:
-      yield ctx.memcache_set(client_operation_cache_key, build.key.id(), 60)
+      yield ctx.memcache_set(cache_key, build.key.id(), 60)
     raise ndb.Return(build)
 
   def add(self, *args, **kwargs):
     """Sync version of add_async."""
     return self.add_async(*args, **kwargs).get_result()
 
+  def add_batch(self, build_requests):
+    """Adds builds in a batch.
+
+    Unlike calling add_async for each build, checks ACLs once per bucket,
+    looks up client operation ids with one memcache call and puts all builds
+    with one datastore call. Builds are not put in a transaction with bucket
+    counters, so a failure may leave counters off until they are reconciled.
+
+    Args:
+      build_requests (list of dict): builds to add. Each dict is kwargs for
+        add_async() method. Requests with the same client_operation_id
+        result in the same build.
+
+    Returns:
+      List of (build, exception) tuples in the order of |build_requests|.
+    """
+    identity = auth.get_current_identity()
+    results = [None] * len(build_requests)
+
+    valid = []
+    for i, req in enumerate(build_requests):
+      try:
+        validate_add_request(**req)
+        valid.append(i)
+      except errors.Error as ex:
+        results[i] = (None, ex)
+
+    acl_futures = {}
+    for i in valid:
+      bucket = build_requests[i]['bucket']
+      if bucket not in acl_futures:
+        acl_futures[bucket] = acl.can_add_build_async(bucket)
+    allowed = []
+    for i in valid:
+      bucket = build_requests[i]['bucket']
+      if acl_futures[bucket].get_result():
+        allowed.append(i)
+        continue
+      try:
+        current_identity_cannot('add builds to bucket %s', bucket)
+      except auth.AuthorizationError as ex:
+        results[i] = (None, ex)
+
+    cache_keys = {}
+    for i in allowed:
+      op_id = build_requests[i].get('client_operation_id')
+      if op_id is not None:
+        cache_keys[i] = client_operation_cache_key(identity, op_id)
+    cached_ids = {}
+    if cache_keys:
+      cached_ids = memcache.get_multi(list(set(cache_keys.values())))
+    builds_by_cache_key = {}
+    if cached_ids:
+      cached_builds = ndb.get_multi([
+          ndb.Key(model.Build, build_id) for build_id in cached_ids.values()])
+      builds_by_cache_key = {
+          cache_key: build
+          for cache_key, build in zip(cached_ids, cached_builds)
+          if build
+      }
+
+    created = []
+    new_cached_ids = {}
+    for i in allowed:
+      cache_key = cache_keys.get(i)
+      build = builds_by_cache_key.get(cache_key)
+      if not build:
+        build = new_build(**build_requests[i])
+        created.append(build)
+        if cache_key:
+          builds_by_cache_key[cache_key] = build
+          new_cached_ids[cache_key] = build.key.id()
+      results[i] = (build, None)
+
+    if created:
+      entities = list(created)
+      entities.extend(filter(None, map(model.ready_build_for, created)))
+      for b in created:
+        entities.extend(model.tag_index_entries_for(b))
+      put_futures = ndb.put_multi_async(entities)
+
+      def update_count_async(bucket, count):
+        return ndb.transaction_async(
+            lambda: metrics.update_build_count_async(
+                bucket, None, model.BuildStatus.SCHEDULED, count=count))
+
+      counts = collections.Counter(b.bucket for b in created)
+      count_futures = [
+          update_count_async(bucket, count)
+          for bucket, count in counts.iteritems()
+      ]
+      ndb.Future.wait_all(put_futures + count_futures)
+      for f in put_futures:
+        f.check_success()
+      for f in count_futures:
+        if f.get_exception():  # pragma: no cover
+          logging.warning(
+              'Could not update build counters: %s', f.get_exception())
+      for b in created:
+        logging.info(
+            'Build %s was created by %s', b.key.id(), identity.to_bytes())
+      if new_cached_ids:
+        memcache.set_multi(new_cached_ids, time=60)
+    return results
+
   def get(self, build_id):
     """Gets a build by |build_id|.
 
@@ -205,6 +383,51 @@ class BuildBucketService(object):
       next_cursor_str = query_iter.cursor_after().urlsafe()
     return entities, next_cursor_str
 
+  def _fetch_page_by_tag(
+      self, tag, buckets, page_size, start_cursor, predicate=None):
+    """Returns a page of builds with an indexed |tag|, see model.TagIndexEntry.
+
+    Builds are ordered by key, same as in _fetch_page. The cursor is the id of
+    the last examined build prefixed with TAG_INDEX_CURSOR_PREFIX.
+    """
+    assert model.is_indexed_tag(tag)
+    assert isinstance(page_size, int)
+    q = model.TagIndexEntry.query(model.TagIndexEntry.tag == tag)
+    if buckets:
+      q = q.filter(model.TagIndexEntry.bucket.IN(sorted(buckets)))
+    if start_cursor:
+      build_id = None
+      if start_cursor.startswith(TAG_INDEX_CURSOR_PREFIX):
+        try:
+          build_id = int(start_cursor[len(TAG_INDEX_CURSOR_PREFIX):])
+        except ValueError:
+          pass
+      if build_id is None:
+        msg = 'Bad cursor "%s"' % start_cursor
+        logging.warning(msg)
+        raise errors.InvalidInputError(msg)
+      last_key = model.tag_index_entry_key(ndb.Key(model.Build, build_id), tag)
+      q = q.filter(model.TagIndexEntry.key > last_key)
+    q = q.order(model.TagIndexEntry.key)
+
+    query_iter = q.iter(keys_only=True, batch_size=page_size)
+    builds = []
+    last_build_id = None
+    while len(builds) < page_size and query_iter.has_next():
+      # Never fetch more than needed, so all fetched entries are examined and
+      # the next page starts after the last one.
+      entry_keys = itertools.islice(query_iter, page_size - len(builds))
+      build_keys = [k.parent() for k in entry_keys]
+      for key, build in zip(build_keys, ndb.get_multi(build_keys)):
+        last_build_id = key.id()
+        if build and (predicate is None or predicate(build)):
+          builds.append(build)
+
+    next_cursor_str = None
+    if query_iter.has_next():
+      next_cursor_str = '%s%d' % (TAG_INDEX_CURSOR_PREFIX, last_build_id)
+    return builds, next_cursor_str
+
   def _check_search_acls(self, buckets):
     if not buckets:
       raise errors.InvalidInputError('No buckets specified')
@@ -264,10 +487,36 @@ class BuildBucketService(object):
       buckets = set(buckets)
     assert buckets is None or buckets
 
+    indexed_tag = next((t for t in tags if model.is_indexed_tag(t)), None)
+    use_tag_index = False
+    if indexed_tag:
+      if start_cursor:
+        # A search pages the way it started, so cursors returned before the
+        # tag index backfill completed keep paging through builds.
+        use_tag_index = start_cursor.startswith(TAG_INDEX_CURSOR_PREFIX)
+      else:
+        # Builds created before the tag index may not have entries yet.
+        use_tag_index = model.is_tag_index_complete()
+    if use_tag_index:
+      def matches(build):
+        if not all(t in build.tags for t in tags):
+          return False
+        for name, value in (
+            ('status', status),
+            ('result', result),
+            ('failure_reason', failure_reason),
+            ('cancelation_reason', cancelation_reason),
+            ('created_by', created_by)):
+          if value is not None and getattr(build, name) != value:
+            return False
+        return True
+      return self._fetch_page_by_tag(
+          indexed_tag, buckets, max_builds, start_cursor, predicate=matches)
+
     check_buckets_locally = False
     q = model.Build.query()
     for t in tags:
-      if t.startswith('buildset:'):
+      if model.is_indexed_tag(t):
         check_buckets_locally = True
       q = q.filter(model.Build.tags == t)
     filter_if = lambda p, v: q if v is None else q.filter(p == v)
@@ -370,13 +619,103 @@ class BuildBucketService(object):
       build.lease_expiration_date = lease_expiration_date
       build.regenerate_lease_key()
       build.leasee = auth.get_current_identity()
-      build.put()
+      put_build_async(build, build.status).get_result()
       logging.info(
           'Build %s was leased by %s', build.key.id(), build.leasee.to_bytes())
       return True, build
 
     return try_lease()
 
+  @ndb.transactional_tasklet
+  def _lease_if_ready_async(self, build_id, lease_expiration_date):
+    """Leases a build if it is still available.
+
+    Does not check ACLs. Removes stale ready queue entries.
+
+    Returns:
+      Leased Build as Future, or None if the build is not available.
+    """
+    build = yield model.Build.get_by_id_async(build_id)
+    if build is None:  # pragma: no cover
+      yield model.ready_build_key(ndb.Key(model.Build, build_id)).delete_async()
+      raise ndb.Return(None)
+    if build.status != model.BuildStatus.SCHEDULED or build.is_leased:
+      yield put_build_async(build, build.status)
+      raise ndb.Return(None)
+    build.lease_expiration_date = lease_expiration_date
+    build.regenerate_lease_key()
+    build.leasee = auth.get_current_identity()
+    yield put_build_async(build, build.status)
+    logging.info(
+        'Build %s was leased by %s', build.key.id(), build.leasee.to_bytes())
+    raise ndb.Return(build)
+
+  def lease_many(self, buckets, max_builds=None, lease_expiration_date=None):
+    """Leases up to |max_builds| builds available in |buckets|.
+
+    Unlike peek+lease, does not look at the oldest builds of all buckets.
+    Instead, it goes through shards of bucket ready queues starting from
+    a random one (see model.ReadyBuild), so concurrent pollers mostly get
+    disjoint sets of builds. Within a shard, older builds are leased first.
+
+    Args:
+      buckets (list of string): lease only builds in any of |buckets|.
+      max_builds (int): maximum number of builds to lease. Defaults to 10.
+      lease_expiration_date (datetime.datetime): lease expiration date.
+        Defaults to DEFAULT_LEASE_DURATION from now.
+
+    Returns:
+      List of leased builds.
+    """
+    if not buckets:
+      raise errors.InvalidInputError('No buckets specified')
+    for bucket in buckets:
+      validate_bucket_name(bucket)
+    max_builds = fix_max_builds(max_builds)
+    validate_lease_expiration_date(lease_expiration_date)
+    if lease_expiration_date is None:
+      lease_expiration_date = utils.utcnow() + DEFAULT_LEASE_DURATION
+    acl_futures = [
+        acl.can_async(b, acl.Action.LEASE_BUILD) for b in buckets]
+    for bucket, can_future in zip(buckets, acl_futures):
+      if not can_future.get_result():
+        raise current_identity_cannot('lease builds in bucket %s', bucket)
+
+    first_shard = random.randrange(model.READY_QUEUE_SHARDS)
+    queues = [
+        (bucket, (first_shard + i) % model.READY_QUEUE_SHARDS)
+        for i in xrange(model.READY_QUEUE_SHARDS)
+        for bucket in buckets
+    ]
+    # Query all queues in parallel, so that an idle poll costs one round trip.
+    key_futures = []
+    for bucket, shard in queues:
+      q = model.ReadyBuild.query(
+          model.ReadyBuild.bucket == bucket,
+          model.ReadyBuild.shard == shard)
+      q = q.order(model.ReadyBuild.create_time)
+      key_futures.append(q.fetch_async(max_builds, keys_only=True))
+    candidates = []
+    for f in key_futures:
+      candidates.extend(f.get_result())
+
+    leased = []
+    while candidates and len(leased) < max_builds:
+      needed = max_builds - len(leased)
+      keys, candidates = candidates[:needed], candidates[needed:]
+      futures = [
+          self._lease_if_ready_async(k.parent().id(), lease_expiration_date)
+          for k in keys
+      ]
+      for f in futures:
+        if f.get_exception():  # pragma: no cover
+          # Most likely a transaction collision with another poller.
+          logging.warning('Could not lease a build: %s', f.get_exception())
+          continue
+        if f.get_result():
+          leased.append(f.get_result())
+    return leased
+
   def _check_lease(self, build, lease_key):
     if lease_key != build.lease_key:
       raise errors.LeaseExpiredError(
@@ -389,7 +728,7 @@ class BuildBucketService(object):
     build.lease_expiration_date = None
     build.leasee = None
 
-  @ndb.transactional
+  @ndb.transactional(xg=True)
   def reset(self, build_id):
     """Forcibly unleases the build and resets its state. Idempotent.
 
@@ -403,11 +742,12 @@ class BuildBucketService(object):
       raise current_identity_cannot('reset build %s', build.key.id())
     if build.status == model.BuildStatus.COMPLETED:
       raise errors.BuildIsCompletedError('Cannot reset a completed build')
+    old_status = build.status
     build.status = model.BuildStatus.SCHEDULED
     build.status_changed_time = utils.utcnow()
     self._clear_lease(build)
     build.url = None
-    build.put()
+    put_build_async(build, old_status).get_result()
     logging.info(
         'Build %s was reset by %s',
         build.key.id(), auth.get_current_identity().to_bytes())
@@ -431,7 +771,7 @@ class BuildBucketService(object):
       add_kwargs['queue_name'] = build.callback.queue_name
     task.add(transactional=True, **add_kwargs)
 
-  @ndb.transactional
+  @ndb.transactional(xg=True)
   def start(self, build_id, lease_key, url=None):
     """Marks build as STARTED. Idempotent.
 
@@ -460,7 +800,7 @@ class BuildBucketService(object):
     build.status = model.BuildStatus.STARTED
     build.status_changed_time = utils.utcnow()
     build.url = url
-    build.put()
+    put_build_async(build, model.BuildStatus.SCHEDULED).get_result()
     logging.info('Build %s was started. URL: %s', build.key.id(), url)
     self._enqueue_callback_task_if_needed(build)
     return build
@@ -521,26 +861,40 @@ class BuildBucketService(object):
 
     return [get_result(h, f) for h, f in futures]
 
-  @ndb.transactional
-  def _complete(
-        self, build_id, lease_key, result, result_details, failure_reason=None,
-        url=None):
-    """Marks a build as completed. Used by succeed and fail methods."""
+  @ndb.transactional_tasklet(xg=True)
+  def _complete_async(
+        self, build_id, lease_key, result, result_details=None,
+        failure_reason=None, url=None, check_acl=True, status_changes=None):
+    """Marks a build as completed. Used by succeed, fail and complete_batch.
+
+    If |status_changes| dict is given, bucket counters are not updated.
+    Instead, the status of the build before completion is stored in it by
+    build id, for the caller to update the counters.
+
+    Returns:
+      The completed Build as Future.
+    """
     validate_lease_key(lease_key)
     validate_url(url)
     assert result in (model.BuildResult.SUCCESS, model.BuildResult.FAILURE)
-    build = self._get_leasable_build(build_id)
+    build = yield model.Build.get_by_id_async(build_id)
+    if build is None:
+      raise errors.BuildNotFoundError()
+    if check_acl:
+      if not (yield acl.can_async(build.bucket, acl.Action.LEASE_BUILD)):
+        raise current_identity_cannot('lease build %s', build.key.id())
 
     if build.status == model.BuildStatus.COMPLETED:
       if (build.result == result and
           build.failure_reason == failure_reason and
           build.result_details == result_details and
           build.url == url):
-        return build
+        raise ndb.Return(build)
       raise errors.BuildIsCompletedError(
           'Build %s has already completed' % build_id)
     self._check_lease(build, lease_key)
 
+    old_status = build.status
     build.status = model.BuildStatus.COMPLETED
     build.status_changed_time = utils.utcnow()
     build.complete_time = utils.utcnow()
@@ -550,12 +904,20 @@ class BuildBucketService(object):
     build.result_details = result_details
     build.failure_reason = failure_reason
     self._clear_lease(build)
-    build.put()
+    if status_changes is None:
+      yield put_build_async(build, old_status)
+    else:
+      status_changes[build_id] = old_status
+      yield put_build_async(build, old_status, update_count=False)
     logging.info(
         'Build %s was completed. Status: %s. Result: %s',
         build.key.id(), build.status, build.result)
     self._enqueue_callback_task_if_needed(build)
-    return build
+    raise ndb.Return(build)
+
+  def _complete(self, *args, **kwargs):
+    """Sync version of _complete_async."""
+    return self._complete_async(*args, **kwargs).get_result()
 
   def succeed(self, build_id, lease_key, result_details=None, url=None):
     """Marks a build as succeeded. Idempotent.
@@ -591,7 +953,83 @@ class BuildBucketService(object):
         build_id, lease_key, model.BuildResult.FAILURE, result_details,
         failure_reason, url=url)
 
-  @ndb.transactional
+  def complete_batch(self, completions):
+    """Marks builds as succeeded or failed in a batch. Idempotent.
+
+    Fetches all builds with one datastore call and checks ACLs once per
+    bucket. Each build is still completed in its own transaction, but the
+    transactions run concurrently. Bucket counters are updated after that,
+    with one transaction per bucket and old status, so the concurrent
+    transactions do not collide on counter shards. A failure to update them
+    leaves counters off until they are reconciled.
+
+    Args:
+      completions (list of dict): builds to complete. Each dict has build_id,
+        lease_key and result (model.BuildResult.SUCCESS or FAILURE) keys
+        and optional result_details, failure_reason and url keys. See
+        succeed() and fail() methods.
+
+    Returns:
+      List of (build_id, build, exception) tuples.
+    """
+    builds = ndb.get_multi([
+        ndb.Key(model.Build, c['build_id']) for c in completions])
+    acl_futures = {}
+    for b in builds:
+      if b and b.bucket not in acl_futures:
+        acl_futures[b.bucket] = acl.can_async(
+            b.bucket, acl.Action.LEASE_BUILD)
+
+    @ndb.tasklet
+    def complete_async(completion, build):
+      if build is None:
+        raise errors.BuildNotFoundError()
+      if not (yield acl_futures[build.bucket]):
+        raise current_identity_cannot('lease build %s', build.key.id())
+      kwargs = dict(completion)
+      if kwargs['result'] == model.BuildResult.FAILURE:
+        kwargs['failure_reason'] = (
+            kwargs.get('failure_reason') or
+            model.FailureReason.BUILD_FAILURE)
+      build = yield self._complete_async(
+          check_acl=False, status_changes=status_changes, **kwargs)
+      raise ndb.Return(build)
+
+    status_changes = {}
+    futures = [complete_async(c, b) for c, b in zip(completions, builds)]
+    ndb.Future.wait_all(futures)
+
+    def update_count_async(bucket, old_status, count):
+      return ndb.transaction_async(
+          lambda: metrics.update_build_count_async(
+              bucket, old_status, model.BuildStatus.COMPLETED, count=count))
+
+    counts = collections.Counter(
+        (f.get_result().bucket, status_changes[f.get_result().key.id()])
+        for f in futures
+        if not f.get_exception() and
+        f.get_result().key.id() in status_changes)
+    count_futures = [
+        update_count_async(bucket, old_status, count)
+        for (bucket, old_status), count in counts.iteritems()
+    ]
+    ndb.Future.wait_all(count_futures)
+    for f in count_futures:
+      if f.get_exception():  # pragma: no cover
+        logging.warning(
+            'Could not update build counters: %s', f.get_exception())
+
+    def get_result(completion, future):
+      build_id = completion['build_id']
+      exc = future.get_exception()
+      if not exc:
+        return build_id, future.get_result(), None
+      else:
+        return build_id, None, exc
+
+    return [get_result(c, f) for c, f in zip(completions, futures)]
+
+  @ndb.transactional(xg=True)
   def cancel(self, build_id):
     """Cancels build. Does not require a lease key.
 
@@ -610,18 +1048,19 @@ class BuildBucketService(object):
       if build.result == model.BuildResult.CANCELED:
         return build
       raise errors.BuildIsCompletedError('Cannot cancel a completed build')
+    old_status = build.status
     build.status = model.BuildStatus.COMPLETED
     build.status_changed_time = utils.utcnow()
     build.result = model.BuildResult.CANCELED
     build.cancelation_reason = model.CancelationReason.CANCELED_EXPLICITLY
     self._clear_lease(build)
-    build.put()
+    put_build_async(build, old_status).get_result()
     logging.info(
         'Build %s was cancelled by %s', build.key.id(),
         auth.get_current_identity().to_bytes())
     return build
 
-  @ndb.transactional_tasklet
+  @ndb.transactional_tasklet(xg=True)
   def _reset_expired_build_async(self, build_id):
     build = yield model.Build.get_by_id_async(build_id)
     if not build or build.lease_expiration_date is None:  # pragma: no cover
@@ -633,24 +1072,26 @@ class BuildBucketService(object):
     assert build.status != model.BuildStatus.COMPLETED, (
         'Completed build is leased')
     self._clear_lease(build)
+    old_status = build.status
     build.status = model.BuildStatus.SCHEDULED
     build.status_changed_time = utils.utcnow()
     build.url = None
-    yield build.put_async()
+    yield put_build_async(build, old_status)
     logging.info('Expired build %s was reset', build_id)
 
-  @ndb.transactional_tasklet
+  @ndb.transactional_tasklet(xg=True)
   def _timeout_async(self, build_id):
     build = yield model.Build.get_by_id_async(build_id)
     if not build or build.status == model.BuildStatus.COMPLETED:
       return  # pragma: no cover
 
     self._clear_lease(build)
+    old_status = build.status
     build.status = model.BuildStatus.COMPLETED
     build.status_changed_time = utils.utcnow()
     build.result = model.BuildResult.CANCELED
     build.cancelation_reason = model.CancelationReason.TIMEOUT
-    yield build.put_async()
+    yield put_build_async(build, old_status)
     logging.info('Build %s: timeout', build_id)
 
   def reset_expired_builds(self):
@@ -675,3 +1116,83 @@ class BuildBucketService(object):
       futures.append(self._timeout_async(key.id()))
 
     ndb.Future.wait_all(futures)
+
+  def backfill_tag_index(self):
+    """Adds tag index entries of a page of builds with indexed tags.
+
+    Builds created before the tag index was introduced do not have entries.
+    Entries are idempotent, so existing ones are overwritten. The progress is
+    kept in model.TagIndexBackfill: each call resumes from its cursor and
+    enqueues a task for the next page, until all builds were visited and the
+    backfill is marked complete.
+    """
+    backfill = model.TAG_INDEX_BACKFILL_KEY.get()
+    if backfill is None:
+      backfill = model.TagIndexBackfill(key=model.TAG_INDEX_BACKFILL_KEY)
+    if backfill.complete:
+      return
+    tag_keys = sorted(model.INDEXED_TAG_KEYS)
+    tag_key = backfill.tag_key or tag_keys[0]
+    q = model.Build.query(
+        model.Build.tags >= tag_key + ':',
+        model.Build.tags < tag_key + ';',
+        projection=[model.Build.tags, model.Build.bucket])
+    curs = None
+    if backfill.cursor:
+      curs = ndb.Cursor(urlsafe=backfill.cursor)
+    builds, next_curs, more = q.fetch_page(
+        TAG_INDEX_BACKFILL_PAGE_SIZE, start_cursor=curs)
+    entries = []
+    for build in builds:
+      entries.extend(model.tag_index_entries_for(build))
+    ndb.put_multi(entries)
+
+    if more:
+      backfill.tag_key = tag_key
+      backfill.cursor = next_curs.urlsafe()
+    else:
+      later_tag_keys = [k for k in tag_keys if k > tag_key]
+      backfill.tag_key = later_tag_keys[0] if later_tag_keys else None
+      backfill.cursor = None
+      backfill.complete = not later_tag_keys
+    backfill.put()
+    logging.info(
+        'Backfilled %d tag index entries, complete: %s',
+        len(entries), backfill.complete)
+    if not backfill.complete:
+      enqueue_tag_index_backfill()
+
+  def fill_ready_queues(self, cursor=None):
+    """Adds missing ready queue entries for a page of builds.
+
+    Builds available for leasing that were created before ready queues were
+    introduced do not have entries. This is a one-off backfill: each call
+    handles the page of builds at urlsafe |cursor| and enqueues a task for the
+    next page, if any.
+    """
+    q = model.Build.query(
+        model.Build.status == model.BuildStatus.SCHEDULED,
+        model.Build.is_leased == False,
+    )
+    curs = ndb.Cursor(urlsafe=cursor) if cursor else None
+    keys, next_curs, more = q.fetch_page(
+        FILL_READY_QUEUES_PAGE_SIZE, start_cursor=curs, keys_only=True)
+    ready_keys = [model.ready_build_key(k) for k in keys]
+    missing = [
+        k.id() for k, ready in zip(keys, ndb.get_multi(ready_keys))
+        if ready is None
+    ]
+
+    @ndb.transactional_tasklet
+    def fix_async(build_id):
+      build = yield model.Build.get_by_id_async(build_id)
+      if build:  # pragma: no branch
+        ready = model.ready_build_for(build)
+        if ready:  # pragma: no branch
+          yield ready.put_async()
+
+    futures = [fix_async(build_id) for build_id in missing]
+    ndb.Future.wait_all(futures)
+    logging.info('Added %d builds to ready queues', len(missing))
+    if more:
+      enqueue_fill_ready_queues(next_curs.urlsafe())
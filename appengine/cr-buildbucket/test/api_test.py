@@ -9,7 +9,6 @@ import mock
 
 from components import auth
 from components import utils
-from google.appengine.ext import ndb
 from google.appengine.ext import testbed
 from protorpc import messages
 from testing_utils import testing
@@ -134,18 +133,13 @@ class BuildBucketApiTest(testing.EndpointsTestCase):
 
   def test_put_batch(self):
     self.test_build.tags = ['owner:ivan']
-    build1_future = ndb.Future()
-    build1_future.set_result(self.test_build)
-
     build2 = model.Build(id=2, bucket='v8')
-    build2_future = ndb.Future()
-    build2_future.set_result(build2)
-
-    bad_build_future = ndb.Future()
-    bad_build_future.set_exception(errors.InvalidInputError('Just bad'))
 
-    self.service.add_async.side_effect = [
-        build1_future, build2_future, bad_build_future]
+    self.service.add_batch.return_value = [
+        (self.test_build, None),
+        (build2, None),
+        (None, errors.InvalidInputError('Just bad')),
+    ]
     req = {
         'builds': [
             {
@@ -164,20 +158,22 @@ class BuildBucketApiTest(testing.EndpointsTestCase):
         ],
     }
     resp = self.call_api('put_batch', req).json_body
-    self.service.add_async.assert_any_call(
-        bucket=self.test_build.bucket,
-        tags=self.test_build.tags,
-        parameters=None,
-        lease_expiration_date=None,
-        client_operation_id='0',
-    )
-    self.service.add_async.assert_any_call(
-        bucket=build2.bucket,
-        tags=[],
-        parameters=None,
-        lease_expiration_date=None,
-        client_operation_id='1',
-    )
+    build_requests = self.service.add_batch.call_args[0][0]
+    self.assertEqual(len(build_requests), 3)
+    self.assertEqual(build_requests[0], {
+        'bucket': self.test_build.bucket,
+        'tags': self.test_build.tags,
+        'parameters': None,
+        'lease_expiration_date': None,
+        'client_operation_id': '0',
+    })
+    self.assertEqual(build_requests[1], {
+        'bucket': build2.bucket,
+        'tags': [],
+        'parameters': None,
+        'lease_expiration_date': None,
+        'client_operation_id': '1',
+    })
 
     res0 = resp['results'][0]
     self.assertEqual(res0['client_operation_id'], '0')
@@ -266,6 +262,26 @@ class BuildBucketApiTest(testing.EndpointsTestCase):
         res['build']['lease_expiration_ts'],
         req['lease_expiration_ts'])
 
+  def test_lease_many(self):
+    self.test_build.lease_expiration_date = self.future_date
+    self.test_build.lease_key = 42
+    self.service.lease_many.return_value = [self.test_build]
+
+    req = {
+        'buckets': [self.test_build.bucket],
+        'max_builds': 5,
+        'lease_expiration_ts': self.future_ts,
+    }
+    res = self.call_api('lease_many', req).json_body
+    self.service.lease_many.assert_called_once_with(
+        [self.test_build.bucket],
+        max_builds=5,
+        lease_expiration_date=self.future_date,
+    )
+    self.assertEqual(len(res['builds']), 1)
+    self.assertEqual(res['builds'][0]['id'], str(self.test_build.key.id()))
+    self.assertEqual(res['builds'][0]['lease_key'], '42')
+
   def test_lease_with_negative_expiration_date(self):
     req = {
         'id': self.test_build.key.id(),
@@ -421,6 +437,65 @@ class BuildBucketApiTest(testing.EndpointsTestCase):
     self.assertEqual(
             res['build']['result_details_json'], req['result_details_json'])
 
+  ############################### COMPLETE_BATCH ###############################
+
+  def test_complete_batch(self):
+    build2 = model.Build(id=2, bucket='chromium')
+    self.service.complete_batch.return_value = [
+        (self.test_build.key.id(), self.test_build, None),
+        (build2.key.id(), None, errors.LeaseExpiredError()),
+    ]
+    req = {
+        'builds': [{
+            'build_id': self.test_build.key.id(),
+            'lease_key': 42,
+            'result': 'SUCCESS',
+            'result_details_json': json.dumps({'x': 1}),
+        }, {
+            'build_id': build2.key.id(),
+            'lease_key': 42,
+            'result': 'FAILURE',
+            'failure_reason': 'INFRA_FAILURE',
+        }],
+    }
+    res = self.call_api('complete_batch', req).json_body
+    self.service.complete_batch.assert_called_once_with([
+        {
+            'build_id': self.test_build.key.id(),
+            'lease_key': 42,
+            'result': model.BuildResult.SUCCESS,
+            'result_details': {'x': 1},
+            'failure_reason': None,
+            'url': None,
+        },
+        {
+            'build_id': build2.key.id(),
+            'lease_key': 42,
+            'result': model.BuildResult.FAILURE,
+            'result_details': None,
+            'failure_reason': model.FailureReason.INFRA_FAILURE,
+            'url': None,
+        },
+    ])
+
+    res0 = res['results'][0]
+    self.assertEqual(int(res0['build_id']), self.test_build.key.id())
+    self.assertEqual(int(res0['build']['id']), self.test_build.key.id())
+    res1 = res['results'][1]
+    self.assertEqual(int(res1['build_id']), build2.key.id())
+    self.assertEqual(res1['error']['reason'], 'LEASE_EXPIRED')
+
+  def test_complete_batch_with_canceled_result(self):
+    req = {
+        'builds': [{
+            'build_id': self.test_build.key.id(),
+            'lease_key': 42,
+            'result': 'CANCELED',
+        }],
+    }
+    self.expect_error('complete_batch', req, 'INVALID_INPUT')
+    self.assertFalse(self.service.complete_batch.called)
+
   #################################### FAIL ####################################
 
   def test_infra_failure(self):
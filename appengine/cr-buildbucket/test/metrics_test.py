@@ -25,22 +25,99 @@ import model
 
 
 class MerticsTest(testing.AppengineTestCase):
-  def test_send_build_status_metric(self):
-    buf = mock.Mock()
+  def update_count(self, bucket, old_status, new_status):
+    ndb.transaction(
+        lambda: metrics.update_build_count_async(
+            bucket, old_status, new_status).get_result(),
+        xg=True)
+
+  def get_counts(self, bucket):
+    return metrics.get_build_counts_async(bucket).get_result()
+
+  def test_update_build_count(self):
+    self.update_count('chromium', None, model.BuildStatus.SCHEDULED)
+    self.update_count('chromium', None, model.BuildStatus.SCHEDULED)
+    self.update_count(
+        'chromium', model.BuildStatus.SCHEDULED, model.BuildStatus.STARTED)
+    self.update_count('v8', None, model.BuildStatus.SCHEDULED)
+    self.update_count(
+        'v8', model.BuildStatus.SCHEDULED, model.BuildStatus.COMPLETED)
+
+    self.assertEqual(self.get_counts('chromium'), {
+        model.BuildStatus.SCHEDULED: 1,
+        model.BuildStatus.STARTED: 1,
+    })
+    self.assertEqual(self.get_counts('v8'), {
+        model.BuildStatus.SCHEDULED: 0,
+        model.BuildStatus.STARTED: 0,
+    })
 
+  def test_reconcile_build_counts(self):
     ndb.put_multi([
         model.Build(bucket='chromium', status=model.BuildStatus.SCHEDULED),
         model.Build(bucket='chromium', status=model.BuildStatus.SCHEDULED),
-        model.Build(bucket='v8', status=model.BuildStatus.SCHEDULED),
         model.Build(bucket='chromium', status=model.BuildStatus.STARTED),
+        model.Build(bucket='v8', status=model.BuildStatus.SCHEDULED),
     ])
-    send_future = metrics.send_build_status_metric(
-        buf, 'chromium', metrics.METRIC_PENDING_BUILDS,
-        model.BuildStatus.SCHEDULED)
-    send_future.get_result()
-    buf.set_gauge.assert_called_once_with(
+    self.update_count('chromium', None, model.BuildStatus.STARTED)
+    self.update_count('chromium', None, model.BuildStatus.STARTED)
+
+    # The first run only records the drift.
+    metrics.reconcile_build_counts_async('chromium').get_result()
+    self.assertEqual(self.get_counts('chromium'), {
+        model.BuildStatus.SCHEDULED: 0,
+        model.BuildStatus.STARTED: 2,
+    })
+
+    metrics.reconcile_build_counts_async('chromium').get_result()
+    self.assertEqual(self.get_counts('chromium'), {
+        model.BuildStatus.SCHEDULED: 2,
+        model.BuildStatus.STARTED: 1,
+    })
+    drift = model.BuildCountDrift.get_by_id('chromium')
+    self.assertEqual(drift.scheduled, 0)
+    self.assertEqual(drift.started, 0)
+
+  def test_reconcile_build_counts_transient_drift(self):
+    model.Build(bucket='chromium', status=model.BuildStatus.SCHEDULED).put()
+    metrics.reconcile_build_counts_async('chromium').get_result()
+
+    # The counter catches up before the next run.
+    self.update_count('chromium', None, model.BuildStatus.SCHEDULED)
+    metrics.reconcile_build_counts_async('chromium').get_result()
+    self.assertEqual(self.get_counts('chromium'), {
+        model.BuildStatus.SCHEDULED: 1,
+        model.BuildStatus.STARTED: 0,
+    })
+
+  def test_reconcile_build_counts_partial_drift(self):
+    model.Build(bucket='chromium', status=model.BuildStatus.SCHEDULED).put()
+    model.Build(bucket='chromium', status=model.BuildStatus.SCHEDULED).put()
+    metrics.reconcile_build_counts_async('chromium').get_result()
+
+    # Only one build of the drift persists, so only it is fixed.
+    self.update_count('chromium', None, model.BuildStatus.SCHEDULED)
+    metrics.reconcile_build_counts_async('chromium').get_result()
+    self.assertEqual(self.get_counts('chromium'), {
+        model.BuildStatus.SCHEDULED: 2,
+        model.BuildStatus.STARTED: 0,
+    })
+    self.assertEqual(model.BuildCountDrift.get_by_id('chromium').scheduled, 0)
+
+  def test_send_bucket_metrics(self):
+    buf = mock.Mock()
+    for _ in xrange(2):
+      self.update_count('chromium', None, model.BuildStatus.SCHEDULED)
+    self.update_count('chromium', None, model.BuildStatus.STARTED)
+    self.update_count('v8', None, model.BuildStatus.SCHEDULED)
+
+    metrics.send_bucket_metrics(buf, 'chromium').get_result()
+    buf.set_gauge.assert_any_call(
         metrics.METRIC_PENDING_BUILDS, 2,
         {metrics.LABEL_BUCKET: 'chromium'})
+    buf.set_gauge.assert_any_call(
+        metrics.METRIC_RUNNING_BUILDS, 1,
+        {metrics.LABEL_BUCKET: 'chromium'})
 
   def test_send_all_metrics(self):
     buf = mock.Mock()
@@ -50,11 +127,10 @@ class MerticsTest(testing.AppengineTestCase):
     config.get_buckets_async.return_value = future([
       project_config_pb2.Bucket(name='x')
     ])
-    self.mock(metrics, 'send_build_status_metric', mock.Mock())
+    self.mock(metrics, 'send_bucket_metrics', mock.Mock())
+    metrics.send_bucket_metrics.return_value = future(None)
 
     metrics.send_all_metrics()
 
-    metrics.send_build_status_metric.assert_any_call(
-        buf, 'x', metrics.METRIC_PENDING_BUILDS, model.BuildStatus.SCHEDULED)
-    metrics.send_build_status_metric.assert_any_call(
-        buf, 'x', metrics.METRIC_RUNNING_BUILDS, model.BuildStatus.STARTED)
+    metrics.send_bucket_metrics.assert_called_once_with(buf, 'x')
+    buf.flush.assert_called_once_with()
@@ -15,6 +15,7 @@ import mock
 from test import future
 import acl
 import errors
+import metrics
 import model
 import service
 
@@ -48,6 +49,11 @@ class BuildBucketServiceTest(testing.AppengineTestCase):
     self.mock(acl, 'can_async', lambda *_: future(True))
     self.mock(utils, 'utcnow', lambda: datetime.datetime(2015, 1, 1))
 
+  @staticmethod
+  def complete_tag_index_backfill():
+    model.TagIndexBackfill(
+        key=model.TAG_INDEX_BACKFILL_KEY, complete=True).put()
+
   def put_many_builds(self):
     for _ in xrange(100):
       b = model.Build(bucket=self.test_build.bucket)
@@ -105,6 +111,55 @@ class BuildBucketServiceTest(testing.AppengineTestCase):
     with self.assertRaises(errors.InvalidInputError):
       self.service.add('bucket', parameters=[])
 
+  ################################# ADD_BATCH ##################################
+
+  def test_add_batch(self):
+    results = self.service.add_batch([
+        {'bucket': 'chromium', 'tags': ['a:b']},
+        {'bucket': 'v8', 'client_operation_id': '1'},
+        {'bucket': 'chromium as'},
+        {'bucket': 'v8', 'client_operation_id': '1'},
+    ])
+    self.assertEqual(len(results), 4)
+    build1, ex1 = results[0]
+    self.assertIsNone(ex1)
+    self.assertEqual(build1.tags, ['a:b'])
+    self.assertEqual(build1.status, model.BuildStatus.SCHEDULED)
+    self.assertIsNotNone(build1.key.get())
+    self.assertIsNotNone(model.ready_build_key(build1.key).get())
+
+    build2, ex2 = results[1]
+    self.assertIsNone(ex2)
+    self.assertEqual(build2.bucket, 'v8')
+    self.assertEqual(results[3], (build2, None))
+
+    self.assertIsNone(results[2][0])
+    self.assertIsInstance(results[2][1], errors.InvalidInputError)
+
+    counts = metrics.get_build_counts_async('v8').get_result()
+    self.assertEqual(counts[model.BuildStatus.SCHEDULED], 1)
+
+  def test_add_batch_with_cached_client_operation_id(self):
+    build = self.service.add(bucket='chromium', client_operation_id='1')
+    results = self.service.add_batch([
+        {'bucket': 'chromium', 'client_operation_id': '1'},
+        {'bucket': 'chromium', 'client_operation_id': '2'},
+    ])
+    self.assertEqual(results[0], (build, None))
+    self.assertNotEqual(results[1][0].key, build.key)
+    build2 = self.service.add(bucket='chromium', client_operation_id='2')
+    self.assertEqual(build2.key, results[1][0].key)
+
+  def test_add_batch_with_auth_error(self):
+    self.mock_cannot(acl.Action.ADD_BUILD)
+    results = self.service.add_batch([
+        {'bucket': 'chromium'},
+        {'bucket': 'chromium'},
+    ])
+    for build, ex in results:
+      self.assertIsNone(build)
+      self.assertIsInstance(ex, auth.AuthorizationError)
+
   #################################### GET #####################################
 
   def test_get(self):
@@ -212,20 +267,125 @@ class BuildBucketServiceTest(testing.AppengineTestCase):
     self.assertEqual(builds, [self.test_build])
 
   def test_search_by_buildset(self):
+    self.complete_tag_index_backfill()
+    self.test_build = self.service.add(
+        bucket=self.test_build.bucket, tags=['buildset:x'])
+    self.service.add(bucket='secret.bucket', tags=['buildset:x'])
+    self.service.add(bucket=self.test_build.bucket, tags=['buildset:y'])
+
+    get_available_buckets = mock.Mock(return_value=[self.test_build.bucket])
+    self.mock(acl, 'get_available_buckets', get_available_buckets)
+    builds, _ = self.service.search(tags=['buildset:x'])
+    self.assertEqual(builds, [self.test_build])
+
+  def test_search_by_buildset_and_other_filters(self):
+    self.complete_tag_index_backfill()
+    build1 = self.service.add(
+        bucket='chromium', tags=['buildset:x', 'important:true'])
+    self.service.add(bucket='chromium', tags=['buildset:x'])
+    self.service.cancel(
+        self.service.add(bucket='chromium', tags=['buildset:x']).key.id())
+
+    builds, _ = self.service.search(
+        buckets=['chromium'], tags=['buildset:x', 'important:true'])
+    self.assertEqual(builds, [build1])
+    builds, _ = self.service.search(
+        buckets=['chromium'], tags=['buildset:x'],
+        result=model.BuildResult.CANCELED)
+    self.assertEqual(len(builds), 1)
+    self.assertEqual(builds[0].result, model.BuildResult.CANCELED)
+
+  def test_search_by_buildset_pages(self):
+    self.complete_tag_index_backfill()
+    added = [
+        self.service.add(bucket='chromium', tags=['buildset:x'])
+        for _ in xrange(5)
+    ]
+    self.service.add(bucket='v8', tags=['buildset:x'])
+    expected = sorted(b.key for b in added)
+
+    found = []
+    cursor = None
+    pages = 0
+    while True:
+      builds, cursor = self.service.search(
+          buckets=['chromium'], tags=['buildset:x'], max_builds=2,
+          start_cursor=cursor)
+      self.assertLessEqual(len(builds), 2)
+      found.extend(b.key for b in builds)
+      pages += 1
+      if not cursor:
+        break
+      self.assertTrue(cursor.startswith(service.TAG_INDEX_CURSOR_PREFIX))
+    self.assertEqual(found, expected)
+    self.assertEqual(pages, 3)
+
+  def test_search_by_buildset_with_bad_cursor(self):
+    self.complete_tag_index_backfill()
+    with self.assertRaises(errors.InvalidInputError):
+      self.service.search(
+          buckets=['chromium'], tags=['buildset:x'], start_cursor='abc')
+    with self.assertRaises(errors.InvalidInputError):
+      self.service.search(
+          buckets=['chromium'], tags=['buildset:x'],
+          start_cursor=service.TAG_INDEX_CURSOR_PREFIX + 'abc')
+
+  def test_search_by_buildset_before_tag_index_backfill(self):
     self.test_build.tags = ['buildset:x']
     self.test_build.put()
+    model.Build(bucket='secret.bucket', tags=['buildset:x']).put()
 
-    build2 = model.Build(
-        bucket='secret.bucket',
-        tags=self.test_build.tags,  # only one of two tags.
-    )
+    builds, _ = self.service.search(
+        buckets=[self.test_build.bucket], tags=['buildset:x'])
+    self.assertEqual(builds, [self.test_build])
+
+  def test_search_by_buildset_with_cursor_from_before_backfill(self):
+    for _ in xrange(3):
+      model.Build(bucket='chromium', tags=['buildset:x']).put()
+    builds, cursor = self.service.search(
+        buckets=['chromium'], tags=['buildset:x'], max_builds=2)
+    self.assertEqual(len(builds), 2)
+    self.assertFalse(cursor.startswith(service.TAG_INDEX_CURSOR_PREFIX))
+
+    # The search keeps paging through builds after the backfill completes.
+    self.complete_tag_index_backfill()
+    builds, _ = self.service.search(
+        buckets=['chromium'], tags=['buildset:x'], max_builds=2,
+        start_cursor=cursor)
+    self.assertEqual(len(builds), 1)
+
+  def test_backfill_tag_index(self):
+    self.mock(service, 'TAG_INDEX_BACKFILL_PAGE_SIZE', 1)
+    self.test_build.tags = ['buildset:x', 'important:true']
+    self.test_build.put()
+    build2 = model.Build(bucket='chromium', tags=['buildset:y'])
     build2.put()
+    self.assertFalse(model.is_tag_index_complete())
 
-    get_available_buckets = mock.Mock(return_value=[self.test_build.bucket])
-    self.mock(acl, 'get_available_buckets', get_available_buckets)
-    builds, _ = self.service.search(tags=['buildset:x'])
+    self.service.backfill_tag_index()
+    self.assertFalse(model.is_tag_index_complete())
+    taskq = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    tasks = taskq.GetTasks('default')
+    self.assertEqual(
+        [t['url'] for t in tasks], [service.TAG_INDEX_BACKFILL_URL])
+    while not model.is_tag_index_complete():
+      self.service.backfill_tag_index()
+
+    entry = model.tag_index_entry_key(self.test_build.key, 'buildset:x').get()
+    self.assertEqual(entry.bucket, self.test_build.bucket)
+    self.assertIsNotNone(
+        model.tag_index_entry_key(build2.key, 'buildset:y').get())
+    self.assertIsNone(
+        model.tag_index_entry_key(self.test_build.key, 'important:true').get())
+    builds, _ = self.service.search(
+        buckets=[self.test_build.bucket], tags=['buildset:x'])
     self.assertEqual(builds, [self.test_build])
 
+    # A complete backfill does nothing.
+    model.tag_index_entry_key(build2.key, 'buildset:y').delete()
+    self.service.backfill_tag_index()
+    self.assertIsNone(model.tag_index_entry_key(build2.key, 'buildset:y').get())
+
   def test_search_bucket(self):
     self.test_build.put()
     build2 = model.Build(
@@ -358,6 +518,90 @@ class BuildBucketServiceTest(testing.AppengineTestCase):
     builds, _ = self.service.peek([self.test_build.bucket], max_builds=200)
     self.assertTrue(len(builds) <= 100)
 
+  ################################# LEASE_MANY #################################
+
+  def add_many_builds(self, count, bucket='chromium'):
+    return [self.service.add(bucket=bucket) for _ in xrange(count)]
+
+  def test_add_puts_build_to_ready_queue(self):
+    build = self.service.add(bucket='chromium')
+    ready = model.ready_build_key(build.key).get()
+    self.assertIsNotNone(ready)
+    self.assertEqual(ready.bucket, 'chromium')
+    self.assertEqual(ready.shard, model.ready_queue_shard(build.key.id()))
+
+  def test_add_leased_build_is_not_ready(self):
+    build = self.service.add(
+        bucket='chromium',
+        lease_expiration_date=utils.utcnow() + datetime.timedelta(minutes=1))
+    self.assertIsNone(model.ready_build_key(build.key).get())
+
+  def test_lease_many(self):
+    added = self.add_many_builds(5)
+    leased = self.service.lease_many(['chromium'], max_builds=3)
+    self.assertEqual(3, len(leased))
+    self.assertTrue(all(b.is_leased for b in leased))
+    self.assertTrue(all(b.leasee == self.current_identity for b in leased))
+
+    leased_more = self.service.lease_many(['chromium'], max_builds=10)
+    self.assertEqual(2, len(leased_more))
+    self.assertEqual(
+        set(b.key for b in added),
+        set(b.key for b in leased + leased_more))
+    self.assertEqual([], self.service.lease_many(['chromium']))
+
+  def test_lease_many_removes_leased_builds_from_ready_queue(self):
+    build = self.service.add(bucket='chromium')
+    self.assertTrue(self.service.lease(build.key.id())[0])
+    self.assertIsNone(model.ready_build_key(build.key).get())
+    self.assertEqual([], self.service.lease_many(['chromium']))
+
+  def test_lease_many_skips_stale_entries(self):
+    build = self.service.add(bucket='chromium')
+    build.status = model.BuildStatus.STARTED
+    build.put()
+    self.assertEqual([], self.service.lease_many(['chromium']))
+    self.assertIsNone(model.ready_build_key(build.key).get())
+
+  def test_lease_many_other_bucket(self):
+    self.add_many_builds(2, bucket='v8')
+    self.assertEqual([], self.service.lease_many(['chromium']))
+    self.assertEqual(2, len(self.service.lease_many(['chromium', 'v8'])))
+
+  def test_lease_many_with_auth_error(self):
+    self.mock_cannot(acl.Action.LEASE_BUILD)
+    with self.assertRaises(auth.AuthorizationError):
+      self.service.lease_many(['chromium'])
+
+  def test_lease_many_without_buckets(self):
+    with self.assertRaises(errors.InvalidInputError):
+      self.service.lease_many([])
+
+  def test_reset_and_cancel_update_ready_queue(self):
+    build = self.service.add(bucket='chromium')
+    self.service.lease(build.key.id())
+    self.service.reset(build.key.id())
+    self.assertIsNotNone(model.ready_build_key(build.key).get())
+    self.service.cancel(build.key.id())
+    self.assertIsNone(model.ready_build_key(build.key).get())
+
+  def test_fill_ready_queues(self):
+    self.mock(service, 'FILL_READY_QUEUES_PAGE_SIZE', 1)
+    self.test_build.put()
+    build2 = model.Build(bucket='chromium')
+    build2.put()
+    self.assertEqual([], self.service.lease_many(['chromium']))
+
+    cursors = []
+    self.mock(service, 'enqueue_fill_ready_queues', cursors.append)
+    self.service.fill_ready_queues()
+    self.assertEqual(1, len(cursors))
+    self.assertEqual(1, len(self.service.lease_many(['chromium'])))
+
+    self.service.fill_ready_queues(cursors[0])
+    self.assertEqual(1, len(cursors))
+    self.assertEqual(1, len(self.service.lease_many(['chromium'])))
+
   #################################### LEASE ###################################
 
   def lease(self, lease_expiration_date=None):
@@ -598,6 +842,20 @@ class BuildBucketServiceTest(testing.AppengineTestCase):
     self.assertEqual(self.test_build.result, model.BuildResult.SUCCESS)
     self.assertIsNotNone(self.test_build.complete_time)
 
+  def test_status_changes_update_build_counts(self):
+    def counts():
+      res = metrics.get_build_counts_async('chromium').get_result()
+      return res[model.BuildStatus.SCHEDULED], res[model.BuildStatus.STARTED]
+
+    self.test_build = self.service.add(bucket='chromium')
+    self.service.add(bucket='chromium')
+    self.assertEqual(counts(), (2, 0))
+    self.lease()
+    self.start()
+    self.assertEqual(counts(), (1, 1))
+    self.succeed()
+    self.assertEqual(counts(), (1, 0))
+
   def test_succeed_timed_out_build(self):
     self.test_build.status = model.BuildStatus.COMPLETED
     self.test_build.result = model.BuildResult.CANCELED
@@ -650,6 +908,79 @@ class BuildBucketServiceTest(testing.AppengineTestCase):
     with self.callback_test():
       self.succeed()
 
+  def test_complete_batch(self):
+    self.lease()
+    self.start()
+    build2 = self.service.add(bucket='chromium')
+    self.assertTrue(self.service.lease(build2.key.id())[0])
+    build2 = build2.key.get()
+
+    results = self.service.complete_batch([
+        {
+            'build_id': self.test_build.key.id(),
+            'lease_key': self.test_build.lease_key,
+            'result': model.BuildResult.SUCCESS,
+        },
+        {
+            'build_id': build2.key.id(),
+            'lease_key': build2.lease_key,
+            'result': model.BuildResult.FAILURE,
+        },
+        {
+            'build_id': 42,
+            'lease_key': 1,
+            'result': model.BuildResult.SUCCESS,
+        },
+    ])
+    build_id, build, ex = results[0]
+    self.assertEqual(build_id, self.test_build.key.id())
+    self.assertIsNone(ex)
+    self.assertEqual(build.result, model.BuildResult.SUCCESS)
+
+    build_id, build, ex = results[1]
+    self.assertIsNone(ex)
+    self.assertEqual(build.result, model.BuildResult.FAILURE)
+    self.assertEqual(build.failure_reason, model.FailureReason.BUILD_FAILURE)
+
+    build_id, build, ex = results[2]
+    self.assertEqual(build_id, 42)
+    self.assertIsInstance(ex, errors.BuildNotFoundError)
+
+  def test_complete_batch_updates_build_counts(self):
+    def counts():
+      res = metrics.get_build_counts_async('chromium').get_result()
+      return res[model.BuildStatus.SCHEDULED], res[model.BuildStatus.STARTED]
+
+    completions = []
+    for i in xrange(3):
+      build = self.service.add(bucket='chromium')
+      success, build = self.service.lease(build.key.id())
+      self.assertTrue(success)
+      if i == 0:
+        build = self.service.start(build.key.id(), build.lease_key)
+      completions.append({
+          'build_id': build.key.id(),
+          'lease_key': build.lease_key,
+          'result': model.BuildResult.SUCCESS,
+      })
+    self.assertEqual(counts(), (2, 1))
+
+    self.service.complete_batch(completions)
+    self.assertEqual(counts(), (0, 0))
+    # Completing again changes nothing.
+    self.service.complete_batch(completions)
+    self.assertEqual(counts(), (0, 0))
+
+  def test_complete_batch_with_auth_error(self):
+    self.lease()
+    self.mock_cannot(acl.Action.LEASE_BUILD)
+    results = self.service.complete_batch([{
+        'build_id': self.test_build.key.id(),
+        'lease_key': self.test_build.lease_key,
+        'result': model.BuildResult.SUCCESS,
+    }])
+    self.assertIsInstance(results[0][2], auth.AuthorizationError)
+
   ########################## RESET EXPIRED BUILDS ##############################
 
   def test_reschedule_expired_builds(self):
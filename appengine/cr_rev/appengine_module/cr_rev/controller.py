@@ -7,13 +7,15 @@
 # W0221: Arguments number differs from %s method
 # pylint: disable=R0201,W0223,W0221
 
+import collections
 import copy
 from datetime import datetime
+from datetime import timedelta
 import json
 import logging
 import numpy
-import random
 import re
+import threading
 import time
 
 from google.appengine.api import memcache
@@ -61,6 +63,19 @@ def calculate_repo_url(repo_obj):
   }
 
 
+# Urls of repositories computed by this instance, keyed by (project, repo).
+REPO_URLS = {}
+
+
+def get_repo_url(project, repo):
+  """Returns the url of a repository, computed once per instance."""
+  key = (project, repo)
+  if key not in REPO_URLS:
+    repo_obj = models.Repo.get_key_by_id(project, repo).get()
+    REPO_URLS[key] = calculate_repo_url(repo_obj)
+  return REPO_URLS[key]
+
+
 def get_active_repos(project):
   """Get the repos that are active (have code, weren't deleted)."""
   included_repos = []
@@ -76,9 +91,10 @@ def get_active_repos(project):
 def make_gitiles_json_call(url, n=1000):
   """Make a JSON call to gitiles and decode the result.
 
-  This makes a gitiles call with exponential backoff in the case of 429s. When
-  it gets a result, it decodes and returns the resulting object. If the
-  exponential backoff times out, it raises pipeline.PipelineUserError.
+  When it gets a result, it decodes and returns the resulting object. If gitiles
+  throttles the request with a 429, it raises pipeline.Retry instead of sleeping
+  in the request, so that the pipeline is retried later with backoff. For other
+  errors, it raises pipeline.PipelineUserError.
 
   Args:
     url (str): the url to query
@@ -86,29 +102,28 @@ def make_gitiles_json_call(url, n=1000):
   """
   full_url = url + '?format=json&n=%d' % n
 
-  backoff = 10
-  attempts = 4
-  for i in range(attempts):
-    logging.info('scanning %s', full_url)
-    result = urlfetch.fetch(full_url, deadline=60)
-    if result.status_code == 200:
-      # Gitiles serves JSONP, so we strip it out here.
-      assert result.content[0:5] == ')]}\'\n'
-      return json.loads(result.content[5:])
-    elif result.status_code != 429:
-      raise pipeline.PipelineUserError(
-          'urlfetch returned %d' % result.status_code)
-
-    sleep = backoff  * (2 ** i)
-    logging.info('got 429, sleeping %d secs...', sleep)
-    time.sleep(sleep + random.random())
+  logging.info('scanning %s', full_url)
+  result = urlfetch.fetch(full_url, deadline=60)
+  if result.status_code == 200:
+    # Gitiles serves JSONP, so we strip it out here.
+    assert result.content[0:5] == ')]}\'\n'
+    return json.loads(result.content[5:])
+  elif result.status_code == 429:
+    raise pipeline.Retry('urlfetch returned 429 for %s' % full_url)
   raise pipeline.PipelineUserError(
-      'urlfetch returned 429 after %d attempts, timing out!' % attempts)
+      'urlfetch returned %d' % result.status_code)
+
 
+def crawl_log(repo_url, start='master', until=None, since=None, n=1000):
+  """Crawls the commit log of a specific branch of a repository.
 
-def crawl_log(repo_url, start='master', until=None, n=1000):
-  """Crawls the commit log of a specific branch of a repository."""
-  crawl_url = repo_url + '+log/%s' % start
+  If since is given, only the commits reachable from start but not from since
+  are crawled, using the since..start range syntax of gitiles.
+  """
+  if since:
+    crawl_url = repo_url + '+log/%s..%s' % (since, start)
+  else:
+    crawl_url = repo_url + '+log/%s' % start
   crawl_json = make_gitiles_json_call(crawl_url, n=n)
   commits = []
   finished = False
@@ -123,6 +138,40 @@ def crawl_log(repo_url, start='master', until=None, n=1000):
   return commits, finished
 
 
+def crawl_pages(repo_url, start, since=None):
+  """Crawls the commit log page by page until the bottom or since.
+
+  Returns:
+    A list of (first commit, number of commits) of the crawled pages, and the
+    lowest crawled commit.
+  """
+  pages = []
+  lowest_commit = None
+  finished = False
+  while not finished:
+    commits, finished = crawl_log(repo_url, start=start, since=since)
+    if not commits or commits[-1]['commit'] == lowest_commit:
+      break
+    pages.append((commits[0]['commit'], len(commits)))
+    lowest_commit = start = commits[-1]['commit']
+  return pages, lowest_commit
+
+
+MASTER_REF = 'refs/heads/master'
+# Refs whose commits are crawled.
+CRAWLED_REF_PREFIXES = ('refs/heads/', 'refs/branch-heads/')
+# Maximum number of changed refs other than master crawled in one repo scan.
+MAX_REFS_PER_SCAN = 50
+
+
+def get_ref_heads(repo_url):
+  """Returns a dict {ref: commit} of the heads of crawled refs of a repo."""
+  refs_json = make_gitiles_json_call(repo_url + '+refs')
+  return dict((ref, ref_json['value'])
+              for ref, ref_json in refs_json.iteritems()
+              if ref.startswith(CRAWLED_REF_PREFIXES) and 'value' in ref_json)
+
+
 GIT_SVN_ID_REGEX = re.compile(r'git-svn-id: (.*)@(\d+) ')
 GIT_COMMIT_POSITION_REGEX = re.compile(r'Cr-Commit-Position: (.*)@{#(\d+)}')
 
@@ -193,8 +242,7 @@ def convert_commit_json_to_commit(project, repo, commit_json):
   commit_pos = None
   git_svn_pos = None
 
-  repo_obj = models.Repo.get_key_by_id(project, repo).get()
-  redirect_url = calculate_repo_url(repo_obj)
+  redirect_url = get_repo_url(project, repo)
   redirect_url = redirect_url + '+/%s' % commit_json['commit']
 
   numberings = parse_commit_message(commit_json['message'], project, repo)
@@ -240,6 +288,7 @@ def write_commits_to_db(commits, project, repo, batch=100):
   """
 
   futures = []
+  number_redirects = {}
   # Batch our writes so we don't blow our memory limit.
   for chunk in (commits[i:i+batch] for i in range(0, len(commits), batch)):
     converted_tuples = [convert_commit_json_to_commit(project, repo, c)
@@ -250,8 +299,12 @@ def write_commits_to_db(commits, project, repo, batch=100):
     futures.extend(ndb.put_multi_async(commit_objs))
     logging.info('%d commits dispatched for write' % len(commit_objs))
     ndb.get_context().clear_cache()
+    number_redirects.update(get_default_number_redirects(commit_objs))
 
   ndb.Future.wait_all(futures)
+  # Warm the redirect caches for the new commits, which are the most requested.
+  if number_redirects:
+    cache_number_redirects(number_redirects, NUMBER_REDIRECT_EXPIRATION)
   logging.info('all set.')
 
 
@@ -305,6 +358,8 @@ class ProjectScanningPipeline(pipelines.AppenginePipeline):
           crawl_url = repo_url + '+log/master'
           make_gitiles_json_call(crawl_url, n=1)
           repo_obj.real = True
+        except pipeline.Retry:  # pragma: no cover
+          raise
         except pipeline.PipelineUserError:
           pass
         repo_obj.put()
@@ -326,8 +381,8 @@ class RepoWritingPipeline(pipelines.AppenginePipeline):
   def description(self):  # pragma: no cover
     return 'repo writing'
 
-  def run(self, project, repo, repo_url, start, n):
-    crawled_commits, _ = crawl_log(repo_url, start=start, n=n)
+  def run(self, project, repo, repo_url, start, n, since=None):
+    crawled_commits, _ = crawl_log(repo_url, start=start, since=since, n=n)
     write_commits_to_db(crawled_commits, project, repo)
     return True
 
@@ -390,19 +445,64 @@ def release_repo_scan_lock(project, repo, pipeline_id):  # pragma: no cover
       return
 
 
+# Bounds of the number of seconds between scans of a repo. The interval is
+# halved after a scan finding new commits and doubled otherwise, so that active
+# repos are scanned often and idle ones rarely.
+MIN_SCAN_INTERVAL = 60
+MAX_SCAN_INTERVAL = 60 * 60
+
+
+def calculate_scan_interval(scan_interval, found_new_commits):
+  """Returns the number of seconds until the next scan of a repo."""
+  scan_interval = scan_interval or MIN_SCAN_INTERVAL
+  if found_new_commits:
+    return max(MIN_SCAN_INTERVAL, scan_interval / 2)
+  return min(MAX_SCAN_INTERVAL, scan_interval * 2)
+
+
+@ndb.transactional
+def back_off_repo_scan(project, repo):
+  """Postpones the next scan of a repo after a failed scan.
+
+  Failed scans are retried like scans finding no new commits, so the interval
+  doubles up to MAX_SCAN_INTERVAL while the scans keep failing.
+  """
+  repo_obj = models.Repo.get_key_by_id(project, repo).get()
+  if not repo_obj:  # pragma: no cover
+    return
+  repo_obj.scan_interval = calculate_scan_interval(
+      repo_obj.scan_interval, False)
+  repo_obj.next_scan = datetime.now() + timedelta(
+      seconds=repo_obj.scan_interval)
+  repo_obj.put()
+
+
 class FinalizeRepoObjPipeline(pipelines.AppenginePipeline):
   @property
   def description(self):  # pragma: no cover
     return 'repo finalization'
 
   def run(self, _finalize, project, repo, latest_commit, # pylint: disable=R0201
-          first_commit, root_commit_scanned):
+          first_commit, root_commit_scanned, ref_heads=None,
+          new_commit_count=0):
     repo_obj = models.Repo.get_key_by_id(project, repo).get()
     repo_obj.latest_commit = latest_commit
     repo_obj.first_commit = first_commit
     repo_obj.root_commit_scanned = root_commit_scanned
     repo_obj.last_scanned = datetime.now()
-    repo_obj.put()
+    if root_commit_scanned:
+      repo_obj.scan_interval = calculate_scan_interval(
+          repo_obj.scan_interval, new_commit_count > 0)
+    else:
+      # Keep loading the history of the repo.
+      repo_obj.scan_interval = MIN_SCAN_INTERVAL
+    repo_obj.next_scan = repo_obj.last_scanned + timedelta(
+        seconds=repo_obj.scan_interval)
+    entities = [repo_obj]
+    if ref_heads is not None:
+      entities.append(models.RepoRefHeads(
+          heads=ref_heads, id=models.Repo.repo_id(project, repo)))
+    ndb.put_multi(entities)
 
 
 class RepoScanningPipeline(pipelines.AppenginePipeline):
@@ -411,6 +511,8 @@ class RepoScanningPipeline(pipelines.AppenginePipeline):
     return 'repo scanning'
 
   def finalized(self):
+    if self.was_aborted:  # pragma: no cover
+      back_off_repo_scan(self.args[0], self.args[1])
     release_repo_scan_lock(self.args[0], self.args[1], self.root_pipeline_id)
 
   def run(self, project, repo):
@@ -427,73 +529,70 @@ class RepoScanningPipeline(pipelines.AppenginePipeline):
             models.RepoScanPipeline, models.Repo.repo_id(project, repo))).put()
 
 
-    # TODO(stip): change to use commit..commit syntax like gitilespoller.
-    repo_obj = models.Repo.get_key_by_id(project, repo).get()
+    repo_obj, ref_heads_obj = ndb.get_multi([
+        models.Repo.get_key_by_id(project, repo),
+        ndb.Key(models.RepoRefHeads, models.Repo.repo_id(project, repo))])
     repo_url = calculate_repo_url(repo_obj)
+    scanned_ref_heads = dict((ref_heads_obj and ref_heads_obj.heads) or {})
+    ref_heads = get_ref_heads(repo_url)
 
     child_pipelines = []
-
-    crawled_commits, finished = crawl_log(
-        repo_url, until=repo_obj.latest_commit)
-
-    # Crawl master, keep writing commits until we hit the last crawled commit
-    # we've seen (if we've seen one, otherwise keep going until we hit the
-    # bottom).
-    if crawled_commits:
-      new_latest_commit = crawled_commits[0]['commit']
-      top_level_lowest = crawled_commits[-1]['commit']
-
-      writer = yield RepoWritingPipeline(
-          project, repo, repo_url, new_latest_commit,
-          len(crawled_commits))
-      child_pipelines.append(writer)
-
-      while crawled_commits and not finished:
-        crawled_commits, finished = crawl_log(
-            repo_url, start=top_level_lowest,
-            until=repo_obj.latest_commit)
-        # TODO(stip): write tests for this or consolidate code
-        if crawled_commits:  # pragma: no cover
+    new_commit_count = 0
+
+    # Crawl master since the last crawled commit we've seen (if we've seen one,
+    # otherwise keep going until we hit the bottom). Nothing is crawled if
+    # master hasn't moved.
+    master_head = ref_heads.get(MASTER_REF)
+    if master_head and master_head != repo_obj.latest_commit:
+      pages, top_level_lowest = crawl_pages(
+          repo_url, master_head, since=repo_obj.latest_commit)
+      for start, n in pages:
+        writer = yield RepoWritingPipeline(
+            project, repo, repo_url, start, n, repo_obj.latest_commit)
+        child_pipelines.append(writer)
+        new_commit_count += n
+
+      if pages:
+        repo_obj.latest_commit = pages[0][0]
+        if not repo_obj.first_commit:
+          repo_obj.first_commit = top_level_lowest
+
+    # Crawl other refs which moved since the last scan, since their last seen
+    # heads or master for new refs.
+    if repo_obj.latest_commit:
+      changed_refs = sorted(
+          ref for ref, head in ref_heads.iteritems()
+          if ref != MASTER_REF and scanned_ref_heads.get(ref) != head)
+      for ref in changed_refs[:MAX_REFS_PER_SCAN]:
+        since = scanned_ref_heads.get(ref) or repo_obj.latest_commit
+        pages, _ = crawl_pages(repo_url, ref_heads[ref], since=since)
+        for start, n in pages:
           writer = yield RepoWritingPipeline(
-              project, repo, repo_url, crawled_commits[0]['commit'],
-              len(crawled_commits))
+              project, repo, repo_url, start, n, since)
           child_pipelines.append(writer)
-          top_level_lowest = crawled_commits[-1]['commit']
-
-      repo_obj.latest_commit = new_latest_commit
-      if not repo_obj.first_commit:
-        repo_obj.first_commit = top_level_lowest
+          new_commit_count += n
+        scanned_ref_heads[ref] = ref_heads[ref]
+    for ref in scanned_ref_heads.keys():
+      if ref not in ref_heads:
+        del scanned_ref_heads[ref]
 
     # If we have top level commits but haven't seen the bottom, keep crawling
     # down until we hit it.
     if not repo_obj.root_commit_scanned and repo_obj.first_commit:
-      crawled_commits, finished = crawl_log(
-          repo_url, start=repo_obj.first_commit)
-      # TODO(stip): write tests for this or consolidate code
-      if crawled_commits: # pragma: no cover
-        writer = yield RepoWritingPipeline(
-            project, repo, repo_url, crawled_commits[0]['commit'],
-            len(crawled_commits))
+      pages, lowest_commit = crawl_pages(repo_url, repo_obj.first_commit)
+      for start, n in pages:
+        writer = yield RepoWritingPipeline(project, repo, repo_url, start, n)
         child_pipelines.append(writer)
-        repo_obj.first_commit = crawled_commits[-1]['commit']
-        while crawled_commits and not finished:
-          crawled_commits, finished = crawl_log(
-              repo_url, start=repo_obj.first_commit)
-          writer = yield RepoWritingPipeline(
-              project, repo, repo_url, crawled_commits[0]['commit'],
-              len(crawled_commits))
-          child_pipelines.append(writer)
-          repo_obj.first_commit = crawled_commits[-1]['commit']
-        # TODO(stip) write tests for this or consolidate code
-        if finished:  # pragma: no cover
-          repo_obj.root_commit_scanned = True
+      if lowest_commit:
+        repo_obj.first_commit = lowest_commit
+      repo_obj.root_commit_scanned = True
 
     all_writers_succeeded = True
     if child_pipelines:
       all_writers_succeeded = yield common.All(*child_pipelines)
     yield FinalizeRepoObjPipeline(all_writers_succeeded, project, repo,
         repo_obj.latest_commit, repo_obj.first_commit,
-        repo_obj.root_commit_scanned)
+        repo_obj.root_commit_scanned, scanned_ref_heads, new_commit_count)
 
 
 def scan_projects_for_repos():
@@ -502,20 +601,59 @@ def scan_projects_for_repos():
   return spawn_pipelines(ProjectScanningPipeline, project_name_args)
 
 
-def scan_repos():
-  urls = []
+# Maximum number of repo scans started by one scan_repos call.
+MAX_REPO_SCANS_PER_RUN = 500
+
+
+# Seconds a repo is not rescanned after its scan is started. The scan sets the
+# actual next scan time when it finishes or fails, so this only matters for
+# scans which never finish.
+REPO_SCAN_LEASE_SECONDS = MEMCACHE_REPO_SCAN_EXPIRATION
+
+
+def get_due_repos(repos, now):
+  """Returns the repos whose next scan is due, the most overdue ones first."""
+  due_repos = [r for r in repos if not r.next_scan or r.next_scan <= now]
+  return sorted(due_repos, key=lambda r: r.next_scan or datetime.min)
+
+
+@ndb.transactional_tasklet
+def lease_repo_scan_async(repo_key, now):
+  """Pushes the next scan of a repo forward if it is due.
+
+  Returns True if the repo was due, so the caller should scan it.
+  """
+  repo_obj = yield repo_key.get_async()
+  if not repo_obj or (repo_obj.next_scan and repo_obj.next_scan > now):
+    raise ndb.Return(False)
+  repo_obj.next_scan = now + timedelta(seconds=REPO_SCAN_LEASE_SECONDS)
+  yield repo_obj.put_async()
+  raise ndb.Return(True)
+
+
+def scan_repos(now=None):
+  now = now or datetime.now()
+  due_repos = []
   projects = get_projects()
   for project in projects:
-    active_repo_objs = get_active_repos(project.name)
-    scanned_repos = [r for r in active_repo_objs if r.root_commit_scanned]
-    unscanned_repos = [r for r in active_repo_objs if not r.root_commit_scanned]
-    scanned_repo_name_args = [[project.name, r.repo] for r in scanned_repos]
-    urls.extend(spawn_pipelines(RepoScanningPipeline, scanned_repo_name_args))
-    unscanned_repo_name_args = [[project.name, r.repo] for r in unscanned_repos]
-    urls.extend(spawn_pipelines(
-      RepoScanningPipeline,
-      unscanned_repo_name_args,
-      target='bulk-load-backend'))
+    due_repos.extend(get_due_repos(get_active_repos(project.name), now))
+  # Bound the number of concurrent scans, repos left out are the least overdue
+  # and will be scanned by the next call.
+  due_repos = get_due_repos(due_repos, now)[:MAX_REPO_SCANS_PER_RUN]
+  # Lease the repos, so that they are not scanned again while being scanned.
+  leases = [lease_repo_scan_async(r.key, now) for r in due_repos]
+  due_repos = [r for r, lease in zip(due_repos, leases) if lease.get_result()]
+
+  urls = []
+  scanned_repo_name_args = [
+      [r.project, r.repo] for r in due_repos if r.root_commit_scanned]
+  urls.extend(spawn_pipelines(RepoScanningPipeline, scanned_repo_name_args))
+  unscanned_repo_name_args = [
+      [r.project, r.repo] for r in due_repos if not r.root_commit_scanned]
+  urls.extend(spawn_pipelines(
+    RepoScanningPipeline,
+    unscanned_repo_name_args,
+    target='bulk-load-backend'))
   return urls
 
 
@@ -538,11 +676,16 @@ SHORT_GIT_SHA = re.compile(r'[a-fA-F0-9]{6,39}')
 FULL_GIT_SHA = re.compile(r'[a-fA-F0-9]{40}')
 
 
+DEFAULT_PROJECT = 'chromium'
+DEFAULT_REPO = 'chromium/src'
+DEFAULT_REF = 'refs/heads/master'
+
+
 def fetch_default_number(number):
   """Fetch the 'default' number from chromium/src (or svn.chromium.org)."""
   git_match = fetch_by_number(number, models.NumberingType.COMMIT_POSITION,
-      repo='chromium/src',
-      project='chromium', ref='refs/heads/master')
+      repo=DEFAULT_REPO,
+      project=DEFAULT_PROJECT, ref=DEFAULT_REF)
   if git_match:
     return git_match
 
@@ -560,29 +703,123 @@ def fetch_default_number(number):
   return None
 
 
+# Redirects of numbers are cached in memcache and in a LRU cache of the
+# instance, as recent commit positions get most of the requests. A scanned
+# number always maps to the same commit, but numbers which are not scanned yet
+# are cached only briefly.
+MEMCACHE_NUMBER_REDIRECT = 'number-redirect-%s'
+NUMBER_REDIRECT_EXPIRATION = 24 * 60 * 60
+NUMBER_REDIRECT_LOCAL_EXPIRATION = 10 * 60
+NUMBER_NOT_FOUND_EXPIRATION = 60
+NUMBER_REDIRECT_LOCAL_CACHE_SIZE = 10000
+# Cached for numbers without a commit.
+NUMBER_NOT_FOUND = 'not-found'
+
+# {number: (expiration time, redirect)} in least recently used order.
+NUMBER_REDIRECT_CACHE = collections.OrderedDict()
+# Guards NUMBER_REDIRECT_CACHE, which is shared by the request threads.
+NUMBER_REDIRECT_CACHE_LOCK = threading.Lock()
+
+
+def clear_local_caches():
+  """Clears the caches of this instance."""
+  REPO_URLS.clear()
+  with NUMBER_REDIRECT_CACHE_LOCK:
+    NUMBER_REDIRECT_CACHE.clear()
+
+
+def _get_local_number_redirect(number):
+  now = time.time()
+  with NUMBER_REDIRECT_CACHE_LOCK:
+    entry = NUMBER_REDIRECT_CACHE.pop(number, None)
+    if not entry or entry[0] < now:
+      return None
+    # Keep the entry as the most recently used one.
+    NUMBER_REDIRECT_CACHE[number] = entry
+    return entry[1]
+
+
+def _set_local_number_redirect(number, redirect, expiration):
+  expiration_time = time.time() + expiration
+  with NUMBER_REDIRECT_CACHE_LOCK:
+    NUMBER_REDIRECT_CACHE.pop(number, None)
+    NUMBER_REDIRECT_CACHE[number] = (expiration_time, redirect)
+    while len(NUMBER_REDIRECT_CACHE) > NUMBER_REDIRECT_LOCAL_CACHE_SIZE:
+      NUMBER_REDIRECT_CACHE.popitem(last=False)
+
+
+def cache_number_redirects(number_redirects, expiration):
+  """Caches redirects of numbers, a dict {number: redirect fields}."""
+  memcache.set_multi(
+      dict((MEMCACHE_NUMBER_REDIRECT % number, redirect)
+           for number, redirect in number_redirects.iteritems()),
+      time=expiration)
+  local_expiration = min(expiration, NUMBER_REDIRECT_LOCAL_EXPIRATION)
+  for number, redirect in number_redirects.iteritems():
+    _set_local_number_redirect(number, redirect, local_expiration)
+
+
+def get_default_number_redirects(commits):
+  """Returns {number: redirect fields} of the default numbers of commits."""
+  number_redirects = {}
+  for commit in commits:
+    if commit.project != DEFAULT_PROJECT or commit.repo != DEFAULT_REPO:
+      continue
+    for numbering in commit.numberings:
+      if (numbering.numbering_type == models.NumberingType.COMMIT_POSITION and
+          numbering.numbering_identifier == DEFAULT_REF):
+        number_redirects[str(numbering.number)] = {
+            'redirect_url': commit.redirect_url,
+            'project': commit.project,
+            'repo': commit.repo,
+            'git_sha': commit.git_sha,
+            'repo_url': get_repo_url(commit.project, commit.repo),
+        }
+  return number_redirects
+
+
+def get_number_redirect(number):
+  """Returns the redirect fields of a number, or NUMBER_NOT_FOUND."""
+  redirect = _get_local_number_redirect(number)
+  if redirect:
+    return redirect
+
+  redirect = memcache.get(MEMCACHE_NUMBER_REDIRECT % number)
+  if redirect:
+    _set_local_number_redirect(
+        number, redirect, NUMBER_REDIRECT_LOCAL_EXPIRATION
+        if redirect != NUMBER_NOT_FOUND else NUMBER_NOT_FOUND_EXPIRATION)
+    return redirect
+
+  numbering = fetch_default_number(number)
+  if numbering:
+    redirect = {
+        'redirect_url': numbering.redirect_url,
+        'project': numbering.project,
+        'repo': numbering.repo,
+        'git_sha': numbering.git_sha,
+        'repo_url': get_repo_url(numbering.project, numbering.repo),
+    }
+    cache_number_redirects({number: redirect}, NUMBER_REDIRECT_EXPIRATION)
+  else:
+    redirect = NUMBER_NOT_FOUND
+    cache_number_redirects({number: redirect}, NUMBER_NOT_FOUND_EXPIRATION)
+  return redirect
+
+
 def calculate_redirect(arg):
   """Given a query, return a redirect URL depending on a fixed set of rules."""
   if NUMBER_REGEX.match(arg):
-    numbering = fetch_default_number(arg)
-    if numbering:
-      repo_obj = models.Repo.get_key_by_id(
-          numbering.project, numbering.repo).get()
-      repo_url = calculate_repo_url(repo_obj)
+    redirect = get_number_redirect(arg)
+    if redirect != NUMBER_NOT_FOUND:
       return models.Redirect(
           redirect_type=models.RedirectType.GIT_FROM_NUMBER,
-          redirect_url=numbering.redirect_url,
-          project=numbering.project,
-          repo=numbering.repo,
-          git_sha=numbering.git_sha,
-          repo_url=repo_url,
-          )
+          **redirect)
 
   if FULL_GIT_SHA.match(arg):
     revision_map = ndb.Key(models.RevisionMap, arg).get()
     if revision_map:
-      repo_obj = models.Repo.get_key_by_id(
-          revision_map.project, revision_map.repo).get()
-      repo_url = calculate_repo_url(repo_obj)
+      repo_url = get_repo_url(revision_map.project, revision_map.repo)
       return models.Redirect(
           redirect_type=models.RedirectType.GIT_FULL,
           redirect_url=revision_map.redirect_url,
@@ -640,6 +877,14 @@ def calculate_lag_stats(generated=None):
       lag_stats.min = numpy.min(scan_lag)
       lag_stats.most_lagging_repo = scan_lag_with_repo[lag_stats.max]
 
+    # Repos are scanned at adaptive intervals, so lag since the last scan is
+    # expected for idle repos. Scans behind their schedule are real lag.
+    overdue = [(now - r.next_scan).total_seconds() for r in repos
+               if r.next_scan and r.next_scan < now]
+    lag_stats.overdue_repos = len(overdue)
+    if overdue:
+      lag_stats.max_overdue = max(overdue)
+
     stats.append(lag_stats)
 
   return models.ProjectLagList(projects=stats, generated=now)
@@ -91,6 +91,9 @@ class Repo(EndpointsModel):
   active = ndb.BooleanProperty()
   real = ndb.BooleanProperty()
   excluded = ndb.BooleanProperty()
+  # Seconds between scans, adapted to the commit rate of the repo.
+  scan_interval = ndb.IntegerProperty()
+  next_scan = ndb.DateTimeProperty()
 
   @classmethod
   def get_key_by_id(cls, project, repo):
@@ -106,6 +109,15 @@ class Repo(EndpointsModel):
     self.key = ndb.Key(Repo, self.__class__.repo_id(self.project, self.repo))
 
 
+class RepoRefHeads(ndb.Model):
+  """The heads of the refs of a repo as of its last scan.
+
+  The entity has the same id as the Repo.
+  """
+  # A dict {ref: commit}.
+  heads = ndb.JsonProperty()
+
+
 class RevisionMap(EndpointsModel):
   numberings = ndb.StructuredProperty(NumberingMap, repeated=True)
   number = ndb.IntegerProperty()
@@ -160,6 +172,8 @@ class ProjectLagStats(EndpointsModel):
   max = ndb.FloatProperty()
   min = ndb.FloatProperty()
   most_lagging_repo = ndb.StringProperty()
+  overdue_repos = ndb.IntegerProperty()
+  max_overdue = ndb.FloatProperty()
 
 
 class ProjectLagList(EndpointsModel):
@@ -5,6 +5,9 @@
 import datetime
 import json
 
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
 from appengine_module.testing_utils import testing
 
 from appengine_module.cr_rev import controller
@@ -21,6 +24,10 @@ from appengine_module.cr_rev.test import model_helpers
 class TestController(testing.AppengineTestCase):
   app_module = handlers._APP  # pylint: disable=W0212
 
+  def setUp(self):
+    super(TestController, self).setUp()
+    controller.clear_local_caches()
+
   @staticmethod
   def _gitiles_json(data):
     """Return json-encoded data with a gitiles header."""
@@ -46,6 +53,7 @@ class TestController(testing.AppengineTestCase):
             repos_with_root=0,
             scanned_repos=0,
             unscanned_repos=0,
+            overdue_repos=0,
             generated=generated_time,
           ),
         ],
@@ -72,11 +80,13 @@ class TestController(testing.AppengineTestCase):
   def test_calculate_lag_stats(self):
     model_helpers.create_project().put()
     my_repo = model_helpers.create_repo()
+    my_repo.next_scan = datetime.datetime(1970, 01, 01, 12)
     my_repo.put()
     second_repo = model_helpers.create_repo()
     second_repo.repo = 'cooler'
     second_repo.root_commit_scanned = True
     second_repo.last_scanned = None
+    second_repo.next_scan = datetime.datetime(1970, 01, 03)
     second_repo.put()
 
     generated_time = datetime.datetime(1970, 01, 02)
@@ -90,6 +100,8 @@ class TestController(testing.AppengineTestCase):
             repos_with_root=1,
             scanned_repos=1,
             unscanned_repos=1,
+            overdue_repos=1,
+            max_overdue=float(12 * 60 * 60),
             generated=generated_time,
             most_lagging_repo='%s:%s' % (my_repo.project, my_repo.repo),
             max=float(24 * 60 * 60),
@@ -155,6 +167,70 @@ class TestController(testing.AppengineTestCase):
     generated = controller.calculate_redirect('101')
     self.assertEqual(generated, None)
 
+  def test_redirect_number_cached(self):
+    my_repo = model_helpers.create_repo()
+    my_repo.put()
+    my_commit = model_helpers.create_commit()
+    my_commit.put()
+    my_numberings = model_helpers.create_numberings()
+    my_numberings[0].numbering_identifier = 'svn://svn.chromium.org/chrome'
+    for numbering in my_numberings:
+      numbering.put()
+
+    expected = controller.calculate_redirect('100')
+    self.assertIsNotNone(expected)
+    ndb.delete_multi([numbering.key for numbering in my_numberings])
+
+    self.assertEqual(expected, controller.calculate_redirect('100'))
+    controller.clear_local_caches()
+    self.assertEqual(expected, controller.calculate_redirect('100'))
+    controller.clear_local_caches()
+    memcache.flush_all()
+    self.assertIsNone(controller.calculate_redirect('100'))
+
+  def test_redirect_number_not_found_cached_until_written(self):
+    my_repo = model_helpers.create_repo()
+    my_repo.project = 'chromium'
+    my_repo.repo = 'chromium/src'
+    my_repo.put()
+
+    self.assertIsNone(controller.calculate_redirect('298664'))
+    self.assertEqual(
+        controller.NUMBER_NOT_FOUND,
+        memcache.get(controller.MEMCACHE_NUMBER_REDIRECT % '298664'))
+
+    commit_json = {
+        'commit': 'deadbeef' * 5,
+        'message': 'Cr-Commit-Position: refs/heads/master@{#298664}',
+    }
+    controller.write_commits_to_db([commit_json], 'chromium', 'chromium/src')
+    ndb.delete_multi(list(models.NumberingMap.query().iter(keys_only=True)))
+
+    expected = models.Redirect(
+        redirect_type=models.RedirectType.GIT_FROM_NUMBER,
+        redirect_url=(
+            'https://chromium.googlesource.com/chromium/src/+/%s' % (
+                'deadbeef' * 5,)),
+        repo='chromium/src',
+        project='chromium',
+        git_sha='deadbeef' * 5,
+        repo_url='https://chromium.googlesource.com/chromium/src/',
+    )
+    self.assertEqual(expected, controller.calculate_redirect('298664'))
+    controller.clear_local_caches()
+    self.assertEqual(expected, controller.calculate_redirect('298664'))
+
+  def test_number_redirect_local_cache_evicts_least_recently_used(self):
+    self.mock(controller, 'NUMBER_REDIRECT_LOCAL_CACHE_SIZE', 2)
+    not_found = controller.NUMBER_NOT_FOUND
+    expiration = controller.NUMBER_REDIRECT_EXPIRATION
+    controller.cache_number_redirects({'1': not_found}, expiration)
+    controller.cache_number_redirects({'2': not_found}, expiration)
+    self.assertEqual(not_found, controller.get_number_redirect('1'))
+    controller.cache_number_redirects({'3': not_found}, expiration)
+
+    self.assertEqual(['1', '3'], controller.NUMBER_REDIRECT_CACHE.keys())
+
   def test_redirect_git_numbering(self):
     my_repo = model_helpers.create_repo()
     my_repo.project = 'chromium'
@@ -341,6 +417,63 @@ class TestController(testing.AppengineTestCase):
     _, finished = controller.crawl_log(gitiles_base_url)
     self.assertFalse(finished)
 
+  def test_crawl_log_since(self):
+    gitiles_base_url = 'https://chromium.definitely_real_gitiles.com/'
+    log_data = {u'log': [
+        {u'commit': u'deadbeef' * 5},
+        {u'commit': u'deadbb0b' * 5},
+    ]}
+    with self.mock_urlfetch() as urlfetch:
+      urlfetch.register_handler(
+          gitiles_base_url + '+log/%s..master?format=json&n=1000' % (
+              'dead3b0b' * 5,),
+          self._gitiles_json(log_data))
+
+    commits, finished = controller.crawl_log(
+        gitiles_base_url, since='dead3b0b' * 5)
+    self.assertTrue(finished)
+    self.assertEqual(log_data['log'], commits)
+
+  def test_crawl_pages(self):
+    gitiles_base_url = 'https://chromium.definitely_real_gitiles.com/'
+    first_page = {
+        u'log': [{u'commit': u'deadbeef' * 5}, {u'commit': u'deadbb0b' * 5}],
+        u'next': u'deadbb0b' * 5,
+    }
+    second_page = {
+        u'log': [{u'commit': u'deadbb0b' * 5}, {u'commit': u'dead3b0b' * 5}],
+    }
+    with self.mock_urlfetch() as urlfetch:
+      urlfetch.register_handler(
+          gitiles_base_url + '+log/%s?format=json&n=1000' % ('deadbeef' * 5,),
+          self._gitiles_json(first_page))
+      urlfetch.register_handler(
+          gitiles_base_url + '+log/%s?format=json&n=1000' % ('deadbb0b' * 5,),
+          self._gitiles_json(second_page))
+
+    pages, lowest_commit = controller.crawl_pages(
+        gitiles_base_url, 'deadbeef' * 5)
+    self.assertEqual([('deadbeef' * 5, 2), ('deadbb0b' * 5, 2)], pages)
+    self.assertEqual('dead3b0b' * 5, lowest_commit)
+
+  def test_get_ref_heads(self):
+    gitiles_base_url = 'https://chromium.definitely_real_gitiles.com/'
+    refs_data = {
+        'HEAD': {'value': 'deadbeef' * 5},
+        'refs/heads/master': {'value': 'deadbeef' * 5},
+        'refs/branch-heads/2311': {'value': 'deadbb0b' * 5},
+        'refs/tags/1.0': {'value': 'dead3b0b' * 5},
+    }
+    with self.mock_urlfetch() as urlfetch:
+      urlfetch.register_handler(
+          gitiles_base_url + '+refs?format=json&n=1000',
+          self._gitiles_json(refs_data))
+
+    self.assertEqual({
+        'refs/heads/master': 'deadbeef' * 5,
+        'refs/branch-heads/2311': 'deadbb0b' * 5,
+    }, controller.get_ref_heads(gitiles_base_url))
+
   def test_conversion_to_commit(self):
     my_repo = model_helpers.create_repo()
     my_repo.put()
@@ -521,10 +654,19 @@ class TestController(testing.AppengineTestCase):
                        'Cr-Commit-Position: refs/heads/master@{#301813}',
         },
     ]}
+    refs_data = {'refs/heads/master': {'value': 'deadbeef' * 5}}
+    range_url = base_url + 'cool_src/+log/%s..%s' % (
+        'b0b1beef' * 5, 'deadbeef' * 5)
 
     with self.mock_urlfetch() as urlfetch:
       urlfetch.register_handler(
-          base_url + 'cool_src/+log/master?format=json&n=1000',
+          base_url + 'cool_src/+refs?format=json&n=1000',
+          self._gitiles_json(refs_data))
+      urlfetch.register_handler(
+          range_url + '?format=json&n=1000',
+          self._gitiles_json(log_data))
+      urlfetch.register_handler(
+          range_url + '?format=json&n=1',
           self._gitiles_json(log_data))
       urlfetch.register_handler(
           base_url + 'cool_src/+log/%s?format=json&n=1000' % ('deadbeef' * 5,),
@@ -540,6 +682,11 @@ class TestController(testing.AppengineTestCase):
         models.RevisionMap.query().fetch()[0].git_sha)
     self.assertEqual(4, len(list(models.NumberingMap.query())))
 
+    my_repo = models.Repo.get_key_by_id(my_project.name, my_repo.repo).get()
+    self.assertEqual('deadbeef' * 5, my_repo.latest_commit)
+    self.assertTrue(my_repo.root_commit_scanned)
+    self.assertEqual(controller.MIN_SCAN_INTERVAL, my_repo.scan_interval)
+    self.assertIsNotNone(my_repo.next_scan)
 
   def test_repo_scan_for_new_commits(self):
     """Test all forms of new commits, before and after what has been seen."""
@@ -548,6 +695,8 @@ class TestController(testing.AppengineTestCase):
     my_repo = model_helpers.create_repo()
     my_repo.put()
     base_url = my_project.canonical_url_template % {'project': my_project.name}
+    refs_url = base_url + 'cool_src/+refs?format=json&n=1000'
+    now = datetime.datetime.now()
 
     commits = [
         {
@@ -579,14 +728,25 @@ class TestController(testing.AppengineTestCase):
             'message': '',
         },
     ]
+    branch_commit = {
+        'commit': 'b4a2beef' * 5,
+        'message': '',
+    }
 
+    refs_data = {'refs/heads/master': {'value': 'deadbeef' * 5}}
     log_data = {u'log': [
         commits[3],
     ]}
+    range_url = base_url + 'cool_src/+log/%s..%s' % (
+        'b0b1beef' * 5, 'deadbeef' * 5)
 
     with self.mock_urlfetch() as urlfetch:
+      urlfetch.register_handler(refs_url, self._gitiles_json(refs_data))
+      urlfetch.register_handler(
+          range_url + '?format=json&n=1000',
+          self._gitiles_json(log_data))
       urlfetch.register_handler(
-          base_url + 'cool_src/+log/master?format=json&n=1000',
+          range_url + '?format=json&n=1',
           self._gitiles_json(log_data))
       urlfetch.register_handler(
           base_url + 'cool_src/+log/%s?format=json&n=1000' % ('deadbeef' * 5,),
@@ -595,83 +755,88 @@ class TestController(testing.AppengineTestCase):
           base_url + 'cool_src/+log/%s?format=json&n=1' % ('deadbeef' * 5,),
           self._gitiles_json(log_data))
 
-    controller.scan_repos()
+    controller.scan_repos(now=now)
     self.execute_queued_tasks()
 
-    log_data = {u'log': [
-        commits[3],
-    ]}
-
+    # Nothing is crawled when no ref has moved.
     with self.mock_urlfetch() as urlfetch:
-      urlfetch.register_handler(
-          base_url + 'cool_src/+log/master?format=json&n=1000',
-          self._gitiles_json(log_data))
-      urlfetch.register_handler(
-          base_url + 'cool_src/+log/%s?format=json&n=1000' % ('deadbeef' * 5,),
-          self._gitiles_json(log_data))
-      urlfetch.register_handler(
-          base_url + 'cool_src/+log/%s?format=json&n=1' % ('deadbeef' * 5,),
-          self._gitiles_json(log_data))
+      urlfetch.register_handler(refs_url, self._gitiles_json(refs_data))
 
-    controller.scan_repos()
+    controller.scan_repos(now=now + datetime.timedelta(hours=2))
     self.execute_queued_tasks()
 
     my_repo = models.Repo.get_key_by_id(my_project.name, my_repo.repo).get()
+    self.assertEqual(controller.MIN_SCAN_INTERVAL * 2, my_repo.scan_interval)
     my_repo.root_commit_scanned = False
     my_repo.first_commit = None
     my_repo.put()
 
-    log_data = {
+    refs_data = {
+        'refs/heads/master': {'value': 'f007beef' * 5},
+        'refs/branch-heads/1': {'value': 'b4a2beef' * 5},
+    }
+    since_deadbeef_url = base_url + 'cool_src/+log/%s..' % ('deadbeef' * 5,)
+    since_f007beef_url = base_url + 'cool_src/+log/%s..' % ('f007beef' * 5,)
+    f007beef_data = {
         u'log': commits[0:2],
-        'next': '000fbeef' * 5,
+        'next': '700fbeef' * 5,
     }
     ooofbeef_data = {
         u'log': commits[1:3],
-        'next': 'deadbeef',
+    }
+    toofbeef_data = {
+        u'log': commits[2:4],
+        'next': 'feedbeef' * 5,
     }
     deadbeef_data = {
         u'log': commits[3:5],
-        'next': 'feedbeef' * 5,
+        'next': 'f00fbeef' * 5,
     }
     feedbeef_data = {
         u'log':  commits[-3:-1],
-        'next': 'f00fbeef' * 5,
-    }
-    toofbeef_data = {
-        u'log': commits[2:4],
-        'next': 'feedbeef' * 5,
+        'next': 'f33dbeef' * 5,
     }
     foofbeef_data = {
         u'log': commits[-2:],
     }
+    branch_data = {
+        u'log': [branch_commit],
+    }
     with self.mock_urlfetch() as urlfetch:
+      urlfetch.register_handler(refs_url, self._gitiles_json(refs_data))
+      # New commits on master.
       urlfetch.register_handler(
-          base_url + 'cool_src/+log/master?format=json&n=1000',
-          self._gitiles_json(log_data))
+          since_deadbeef_url + '%s?format=json&n=1000' % ('f007beef' * 5,),
+          self._gitiles_json(f007beef_data))
       urlfetch.register_handler(
-          base_url + 'cool_src/+log/%s?format=json&n=2' % ('f007beef' * 5,),
-          self._gitiles_json(log_data))
+          since_deadbeef_url + '%s?format=json&n=2' % ('f007beef' * 5,),
+          self._gitiles_json(f007beef_data))
       urlfetch.register_handler(
-          base_url + 'cool_src/+log/%s?format=json&n=1000' % ('000fbeef' * 5,),
+          since_deadbeef_url + '%s?format=json&n=1000' % ('000fbeef' * 5,),
           self._gitiles_json(ooofbeef_data))
       urlfetch.register_handler(
-          base_url + 'cool_src/+log/%s?format=json&n=2' % ('000fbeef' * 5,),
+          since_deadbeef_url + '%s?format=json&n=2' % ('000fbeef' * 5,),
           self._gitiles_json(ooofbeef_data))
+      # A new branch.
       urlfetch.register_handler(
-          base_url + 'cool_src/+log/%s?format=json&n=1000' % ('deadbeef' * 5,),
-          self._gitiles_json(deadbeef_data))
+          since_f007beef_url + '%s?format=json&n=1000' % ('b4a2beef' * 5,),
+          self._gitiles_json(branch_data))
       urlfetch.register_handler(
-          base_url + 'cool_src/+log/%s?format=json&n=2' % ('deadbeef' * 5,),
-          self._gitiles_json(deadbeef_data))
+          since_f007beef_url + '%s?format=json&n=1' % ('b4a2beef' * 5,),
+          self._gitiles_json(branch_data))
+      # Old commits down to the root.
       urlfetch.register_handler(
           base_url + 'cool_src/+log/%s?format=json&n=1000' % ('700fbeef' * 5,),
           self._gitiles_json(toofbeef_data))
-      urlfetch.register_handler(
-          base_url + 'cool_src/+log/%s?format=json&n=1' % ('700fbeef' * 5,),
-          self._gitiles_json(toofbeef_data))
       urlfetch.register_handler(
           base_url + 'cool_src/+log/%s?format=json&n=2' % ('700fbeef' * 5,),
           self._gitiles_json(toofbeef_data))
+      urlfetch.register_handler(
+          base_url + 'cool_src/+log/%s?format=json&n=1000' % ('deadbeef' * 5,),
+          self._gitiles_json(deadbeef_data))
+      urlfetch.register_handler(
+          base_url + 'cool_src/+log/%s?format=json&n=2' % ('deadbeef' * 5,),
+          self._gitiles_json(deadbeef_data))
       urlfetch.register_handler(
           base_url + 'cool_src/+log/%s?format=json&n=1000' % ('feedbeef' * 5,),
           self._gitiles_json(feedbeef_data))
@@ -684,9 +849,79 @@ class TestController(testing.AppengineTestCase):
       urlfetch.register_handler(
           base_url + 'cool_src/+log/%s?format=json&n=2' % ('f00fbeef' * 5,),
           self._gitiles_json(foofbeef_data))
-    controller.scan_repos()
+    controller.scan_repos(now=now + datetime.timedelta(hours=4))
     self.execute_queued_tasks()
 
-    self.assertEqual(7, len(list(models.RevisionMap.query())))
+    self.assertEqual(8, len(list(models.RevisionMap.query())))
     my_repo = models.Repo.get_key_by_id(my_project.name, my_repo.repo).get()
     self.assertTrue(my_repo.root_commit_scanned)
+    self.assertEqual('f007beef' * 5, my_repo.latest_commit)
+    self.assertEqual('f33dbeef' * 5, my_repo.first_commit)
+    ref_heads = models.RepoRefHeads.get_by_id(
+        models.Repo.repo_id(my_project.name, my_repo.repo))
+    self.assertEqual({'refs/branch-heads/1': 'b4a2beef' * 5}, ref_heads.heads)
+
+  def test_scan_repos_skips_repos_not_due(self):
+    my_project = model_helpers.create_project()
+    my_project.put()
+    now = datetime.datetime(1970, 01, 02)
+    my_repo = model_helpers.create_repo()
+    my_repo.next_scan = now + datetime.timedelta(seconds=1)
+    my_repo.put()
+
+    self.assertEqual([], controller.scan_repos(now=now))
+
+  def test_scan_repos_leases_repos(self):
+    my_project = model_helpers.create_project()
+    my_project.put()
+    now = datetime.datetime(1970, 01, 02)
+    my_repo = model_helpers.create_repo()
+    my_repo.put()
+
+    self.assertEqual(1, len(controller.scan_repos(now=now)))
+    my_repo = models.Repo.get_key_by_id(my_project.name, my_repo.repo).get()
+    self.assertEqual(
+        now + datetime.timedelta(seconds=controller.REPO_SCAN_LEASE_SECONDS),
+        my_repo.next_scan)
+    # The repo is not scanned again while its scan is running.
+    self.assertEqual([], controller.scan_repos(now=now))
+
+  def test_back_off_repo_scan(self):
+    my_project = model_helpers.create_project()
+    my_project.put()
+    my_repo = model_helpers.create_repo()
+    my_repo.scan_interval = controller.MIN_SCAN_INTERVAL
+    my_repo.put()
+
+    controller.back_off_repo_scan(my_project.name, my_repo.repo)
+    my_repo = models.Repo.get_key_by_id(my_project.name, my_repo.repo).get()
+    self.assertEqual(controller.MIN_SCAN_INTERVAL * 2, my_repo.scan_interval)
+    self.assertGreater(my_repo.next_scan, datetime.datetime.now())
+
+  def test_get_due_repos(self):
+    now = datetime.datetime(1970, 01, 02)
+    never_scanned = model_helpers.create_repo()
+    overdue = model_helpers.create_repo()
+    overdue.next_scan = now - datetime.timedelta(minutes=1)
+    due = model_helpers.create_repo()
+    due.next_scan = now
+    not_due = model_helpers.create_repo()
+    not_due.next_scan = now + datetime.timedelta(minutes=1)
+
+    self.assertEqual(
+        [never_scanned, overdue, due],
+        controller.get_due_repos([due, not_due, overdue, never_scanned], now))
+
+  def test_calculate_scan_interval(self):
+    self.assertEqual(
+        controller.MIN_SCAN_INTERVAL,
+        controller.calculate_scan_interval(None, True))
+    self.assertEqual(
+        controller.MIN_SCAN_INTERVAL * 2,
+        controller.calculate_scan_interval(None, False))
+    self.assertEqual(600, controller.calculate_scan_interval(1200, True))
+    self.assertEqual(2400, controller.calculate_scan_interval(1200, False))
+    self.assertEqual(
+        controller.MAX_SCAN_INTERVAL,
+        controller.calculate_scan_interval(
+            controller.MAX_SCAN_INTERVAL, False))
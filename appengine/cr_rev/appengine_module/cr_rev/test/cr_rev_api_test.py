@@ -16,6 +16,10 @@ class TestCrRevApi(testing.AppengineTestCase):
   app_module = endpoints.api_server(
       [cr_rev_api.CrRevApi], restricted=False)
 
+  def setUp(self):
+    super(TestCrRevApi, self).setUp()
+    controller.clear_local_caches()
+
   def _make_api_call(self, funcname, params=None, status=None):
     params = params or {}
     response = self.test_app.post_json(
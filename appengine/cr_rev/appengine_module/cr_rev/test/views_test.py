@@ -4,12 +4,17 @@
 
 from appengine_module.testing_utils import testing
 from appengine_module.cr_rev import app
+from appengine_module.cr_rev import controller
 from appengine_module.cr_rev.test import model_helpers
 
 
 class TestViews(testing.AppengineTestCase):
   app_module = app.app
 
+  def setUp(self):
+    super(TestViews, self).setUp()
+    controller.clear_local_caches()
+
   def test_main_page(self):
     """Test that the root page renders."""
     response = self.test_app.get('/')
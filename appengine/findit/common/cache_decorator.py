@@ -34,12 +34,18 @@
       d2.Download('path')  # Returned the cached downloaded data.
 """
 
+import collections
+import cPickle
 import functools
 import hashlib
 import inspect
 import pickle
+import threading
+import time
+import zlib
 
 from google.appengine.api import memcache
+from google.appengine.ext import ndb
 
 
 class Cacher(object):
@@ -66,6 +72,23 @@ class Cacher(object):
     """
     raise NotImplementedError()
 
+  def GetMulti(self, keys):
+    """Returns a dict {key: data} of the cached data for the given keys.
+
+    Keys without cached data are not in the returned dict.
+    """
+    result = {}
+    for key in keys:
+      data = self.Get(key)
+      if data is not None:
+        result[key] = data
+    return result
+
+  def SetMulti(self, data_by_key, expire_time=0):
+    """Caches each data of the given dict {key: data}."""
+    for key, data in data_by_key.iteritems():
+      self.Set(key, data, expire_time=expire_time)
+
 
 class MemCacher(Cacher):
   """An memcache-backed implementation of the interface Cacher.
@@ -78,6 +101,252 @@ class MemCacher(Cacher):
   def Set(self, key, data, expire_time=0):
     memcache.set(key, data, time=expire_time)
 
+  def GetMulti(self, keys):
+    return memcache.get_multi(keys)
+
+  def SetMulti(self, data_by_key, expire_time=0):
+    memcache.set_multi(data_by_key, time=expire_time)
+
+
+class CompressedMemCacher(Cacher):
+  """A memcache-backed implementation of the interface Cacher for big data.
+
+  The data is pickled and compressed. If it is still over the size limit of a
+  memcache value, it is split into chunks stored under separate keys. So big
+  data like blame or DEPS of a big repo is cached instead of being dropped by
+  memcache. The data to be cached should be picklable.
+  """
+  # A memcache value is limited to 1 MB, leave some room for the key.
+  CHUNK_SIZE = 1000 * 1000
+
+  # Do not cache data that needs more chunks than this after compression.
+  MAX_CHUNKS = 32
+
+  # Keep the keys apart from those of MemCacher, as the values differ.
+  KEY_PREFIX = 'compressed-'
+
+  @classmethod
+  def _HeadKey(cls, key):
+    return cls.KEY_PREFIX + key
+
+  @classmethod
+  def _ChunkKey(cls, key, index):
+    return '%s%s-chunk-%d' % (cls.KEY_PREFIX, key, index)
+
+  def Get(self, key):
+    return self.GetMulti([key]).get(key)
+
+  def Set(self, key, data, expire_time=0):
+    self.SetMulti({key: data}, expire_time=expire_time)
+
+  def GetMulti(self, keys):
+    # The value of a key is (chunk count, first chunk), the other chunks are
+    # under their own keys.
+    heads = memcache.get_multi(keys, key_prefix=self.KEY_PREFIX)
+    chunk_keys = []
+    for key, (chunk_count, _) in heads.iteritems():
+      chunk_keys.extend(
+          self._ChunkKey(key, index) for index in xrange(1, chunk_count))
+    chunks = memcache.get_multi(chunk_keys) if chunk_keys else {}
+
+    result = {}
+    for key, (chunk_count, first_chunk) in heads.iteritems():
+      blob = [first_chunk]
+      for index in xrange(1, chunk_count):
+        chunk = chunks.get(self._ChunkKey(key, index))
+        if chunk is None:
+          break
+        blob.append(chunk)
+      if len(blob) != chunk_count:
+        continue
+
+      try:
+        # Chunks from two racing Set calls are caught by the zlib checksum.
+        result[key] = cPickle.loads(zlib.decompress(''.join(blob)))
+      except zlib.error:  # pragma: no cover
+        pass
+    return result
+
+  def SetMulti(self, data_by_key, expire_time=0):
+    values = {}
+    for key, data in data_by_key.iteritems():
+      blob = zlib.compress(cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL))
+      chunks = [blob[i:i + self.CHUNK_SIZE]
+                for i in xrange(0, len(blob), self.CHUNK_SIZE)]
+      if len(chunks) > self.MAX_CHUNKS:
+        continue
+      values[self._HeadKey(key)] = (len(chunks), chunks[0])
+      for index in xrange(1, len(chunks)):
+        values[self._ChunkKey(key, index)] = chunks[index]
+    if values:
+      memcache.set_multi(values, time=expire_time)
+
+
+class TieredCacher(Cacher):
+  """An implementation of the interface Cacher with an in-process LRU cache in
+  front of another cacher, by default a CompressedMemCacher.
+
+  Hot data is then returned without a memcache round trip. Data is kept in the
+  local cache pickled, so callers could modify the returned objects safely.
+  Because other instances could update the data in the remote cacher, data is
+  kept locally for at most ``local_expire_time`` seconds.
+  """
+  def __init__(self, remote_cacher=None, max_local_size=16 * 1024 * 1024,
+               local_expire_time=10 * 60):
+    """
+    Args:
+      remote_cacher (Cacher): The cacher behind the local cache.
+      max_local_size (int): Total size of pickled data in the local cache in
+          bytes, least recently used data is evicted beyond that.
+      local_expire_time (int): Max number of seconds to keep data locally.
+    """
+    self._remote_cacher = remote_cacher or CompressedMemCacher()
+    self._max_local_size = max_local_size
+    self._local_expire_time = local_expire_time
+    self._lock = threading.Lock()
+    # Map a key to (expiration timestamp, pickled data), in LRU order.
+    self._local_cache = collections.OrderedDict()
+    self._local_size = 0
+
+  def ClearLocal(self):
+    """Drops all data in the local cache of the current instance."""
+    with self._lock:
+      self._local_cache.clear()
+      self._local_size = 0
+
+  def _GetLocal(self, key):
+    with self._lock:
+      entry = self._local_cache.pop(key, None)
+      if entry is None:
+        return None
+      expire_at, pickled_data = entry
+      if expire_at <= time.time():
+        self._local_size -= len(pickled_data)
+        return None
+      self._local_cache[key] = entry  # Make it the most recently used.
+    return cPickle.loads(pickled_data)
+
+  def _SetLocal(self, key, data, expire_time):
+    pickled_data = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+    if len(pickled_data) > self._max_local_size:
+      return
+    if expire_time:
+      expire_time = min(expire_time, self._local_expire_time)
+    else:
+      expire_time = self._local_expire_time
+
+    with self._lock:
+      old_entry = self._local_cache.pop(key, None)
+      if old_entry is not None:
+        self._local_size -= len(old_entry[1])
+      self._local_cache[key] = (time.time() + expire_time, pickled_data)
+      self._local_size += len(pickled_data)
+      while self._local_size > self._max_local_size:
+        _, (_, evicted_data) = self._local_cache.popitem(last=False)
+        self._local_size -= len(evicted_data)
+
+  def Get(self, key):
+    return self.GetMulti([key]).get(key)
+
+  def Set(self, key, data, expire_time=0):
+    self.SetMulti({key: data}, expire_time=expire_time)
+
+  def GetMulti(self, keys):
+    result = {}
+    missing_keys = []
+    for key in keys:
+      data = self._GetLocal(key)
+      if data is None:
+        missing_keys.append(key)
+      else:
+        result[key] = data
+
+    if missing_keys:
+      found = self._remote_cacher.GetMulti(missing_keys)
+      for key, data in found.iteritems():
+        self._SetLocal(key, data, 0)
+      result.update(found)
+    return result
+
+  def SetMulti(self, data_by_key, expire_time=0):
+    for key, data in data_by_key.iteritems():
+      self._SetLocal(key, data, expire_time)
+    self._remote_cacher.SetMulti(data_by_key, expire_time=expire_time)
+
+
+class _PersistentCacheEntry(ndb.Model):
+  """Data cached by PersistentCacher. The entity id is the cache key."""
+  data = ndb.PickleProperty(compressed=True)
+
+
+class PersistentCacher(Cacher):
+  """A memcache-backed implementation of the interface Cacher, which keeps
+  the data in datastore as well.
+
+  Data is never evicted from datastore, and ``expire_time`` only applies to
+  memcache. So it should be used for data that never changes once created,
+  like the change log of a git revision. The data to be cached should be
+  picklable.
+  """
+  def Get(self, key):
+    return self.GetMulti([key]).get(key)
+
+  def Set(self, key, data, expire_time=0):
+    self.SetMulti({key: data}, expire_time=expire_time)
+
+  def GetMulti(self, keys):
+    result = memcache.get_multi(keys)
+    missing_keys = [key for key in keys if key not in result]
+    if missing_keys:
+      entities = ndb.get_multi(
+          [ndb.Key(_PersistentCacheEntry, key) for key in missing_keys])
+      found = dict((entity.key.id(), entity.data)
+                   for entity in entities if entity)
+      if found:
+        memcache.set_multi(found)
+      result.update(found)
+    return result
+
+  def SetMulti(self, data_by_key, expire_time=0):
+    ndb.put_multi([_PersistentCacheEntry(id=key, data=data)
+                   for key, data in data_by_key.iteritems()])
+    memcache.set_multi(data_by_key, time=expire_time)
+
+
+# Map a function to its argument names and default values, or None if its
+# arguments are not supported by _GetCallArgs.
+_ARG_SPECS = {}
+
+
+def _GetCallArgs(func, args, kwargs):
+  """Returns the same as inspect.getcallargs(func, *args, **kwargs).
+
+  Calls with positional arguments only are handled without inspecting the
+  function again, as inspect.getcallargs is slow.
+  """
+  if func not in _ARG_SPECS:
+    spec = inspect.getargspec(func)
+    if (spec.varargs or spec.keywords or
+        not all(isinstance(arg, str) for arg in spec.args)):
+      _ARG_SPECS[func] = None
+    else:
+      _ARG_SPECS[func] = (spec.args, spec.defaults or ())
+  arg_spec = _ARG_SPECS[func]
+
+  if kwargs or arg_spec is None:
+    return inspect.getcallargs(func, *args, **kwargs)
+
+  arg_names, defaults = arg_spec
+  num_defaults_needed = len(arg_names) - len(args)
+  if num_defaults_needed < 0 or num_defaults_needed > len(defaults):
+    # Let inspect.getcallargs raise the TypeError for wrong arguments.
+    return inspect.getcallargs(func, *args, **kwargs)
+
+  params = dict(zip(arg_names, args))
+  if num_defaults_needed:
+    params.update(zip(arg_names[len(args):], defaults[-num_defaults_needed:]))
+  return params
+
 
 def _DefaultKeyGenerator(func, args, kwargs):
   """Generates a key from the function and arguments passed to it.
@@ -90,7 +359,7 @@ def _DefaultKeyGenerator(func, args, kwargs):
   Returns:
     A string to represent a call to the given function with the given arguments.
   """
-  params = inspect.getcallargs(func, *args, **kwargs)
+  params = _GetCallArgs(func, args, kwargs)
   for var_name in params:
     if not hasattr(params[var_name], 'identifier'):
       continue
@@ -103,6 +372,19 @@ def _DefaultKeyGenerator(func, args, kwargs):
   return hashlib.md5(pickle.dumps(params)).hexdigest()
 
 
+# Map a namespace to the number of hits and misses of Cached functions in it.
+_STATS = collections.defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+
+def GetStats():
+  """Returns a dict {namespace: {'hits': int, 'misses': int}}.
+
+  The stats are of Cached functions in the current instance since it started.
+  """
+  return dict((namespace, dict(stats))
+              for namespace, stats in _STATS.iteritems())
+
+
 def Cached(namespace=None,
            expire_time=0,
            key_generator=_DefaultKeyGenerator,
@@ -132,7 +414,8 @@ def Cached(namespace=None,
     key_generator (function): A function to generate a key to represent a call
         to the decorated function. Defaults to :func:`_DefaultKeyGenerator`.
     cacher (Cacher): An instance of an implementation of interface `Cacher`.
-        Defaults to one of `MemCacher` which is based on memcache.
+        Defaults to one of `MemCacher` which is based on memcache. Use a shared
+        `TieredCacher` for hot or big data.
 
   Returns:
     The cached results or the results of a new run of the decorated function.
@@ -149,8 +432,10 @@ def Cached(namespace=None,
 
       result = cacher.Get(key)
       if result is not None:
+        _STATS[prefix]['hits'] += 1
         return result
 
+      _STATS[prefix]['misses'] += 1
       result = func(*args, **kwargs)
       if result:
         cacher.Set(key, result, expire_time=expire_time)
@@ -7,10 +7,13 @@ from datetime import datetime
 from datetime import timedelta
 import json
 import re
+import threading
 
 from common.blame import Blame
 from common.blame import Region
 from common.cache_decorator import Cached
+from common.cache_decorator import PersistentCacher
+from common.cache_decorator import TieredCacher
 from common.change_log import ChangeLog
 from common.change_log import FileChangeInfo
 from common import diff
@@ -24,6 +27,21 @@ COMMIT_POSITION_PATTERN = re.compile(
 CODE_REVIEW_URL_PATTERN = re.compile('^Review URL: (.*)$')
 TIMEZONE_PATTERN = re.compile('[-+]\d{4}$')
 
+# Maximum number of concurrent requests to gitiles made by GetChangeLogs.
+MAX_CONCURRENT_REQUESTS = 10
+# Maximum number of commits requested in one gitiles +log query.
+MAX_LOG_PAGE_SIZE = 100
+
+# Change logs are cached by revision and shared by all analyses. A change log
+# of a commit never changes, so it is also kept in datastore.
+CHANGE_LOG_CACHER = PersistentCacher()
+CHANGE_LOG_CACHE_EXPIRE_TIME = 24 * 60 * 60
+
+# Responses of gitiles, like blame and DEPS, are read again and again by
+# analyses of the same builds. They could be big, and are kept in the instance
+# too.
+GITILES_CACHER = TieredCacher()
+
 
 class GitRepository(Repository):
   """Represents a git repository on https://chromium.googlesource.com."""
@@ -39,12 +57,14 @@ class GitRepository(Repository):
   def identifier(self):
     return self.repo_url
 
-  @Cached(namespace='Gitiles-json-view', expire_time=24*60*60)
-  def _SendRequestForJsonResponse(self, url):
+  @Cached(namespace='Gitiles-json-view', expire_time=24*60*60,
+          cacher=GITILES_CACHER)
+  def _SendRequestForJsonResponse(self, url, params=None):
     # Gerrit prepends )]}' to json-formatted response.
     prefix = ')]}\'\n'
 
-    status_code, content = self.http_client.Get(url, {'format': 'json'})
+    status_code, content = self.http_client.Get(
+        url, [('format', 'json')] + (params or []))
     if status_code != 200:
       return None
     elif not content or not content.startswith(prefix):
@@ -52,7 +72,8 @@ class GitRepository(Repository):
 
     return json.loads(content[len(prefix):])
 
-  @Cached(namespace='Gitiles-text-view', expire_time=24*60*60)
+  @Cached(namespace='Gitiles-text-view', expire_time=24*60*60,
+          cacher=GITILES_CACHER)
   def _SendRequestForTextResponse(self, url):
     status_code, content = self.http_client.Get(url, {'format': 'text'})
     if status_code != 200:
@@ -118,13 +139,12 @@ class GitRepository(Repository):
 
     return datetime.strptime(datetime_string, date_format)
 
-  def GetChangeLog(self, revision):
-    url = '%s/+/%s' % (self.repo_url, revision)
-
-    data = self._SendRequestForJsonResponse(url)
-    if not data:
-      return None
+  def _ChangeLogCacheKey(self, revision):
+    return 'Gitiles-change-log-%s/+/%s' % (self.repo_url, revision)
 
+  def _ParseChangeLog(self, data):
+    """Returns a ChangeLog from the json of a commit returned by gitiles."""
+    url = '%s/+/%s' % (self.repo_url, data['commit'])
     commit_position, code_review_url = (
         self.ExtractCommitPositionAndCodeReviewUrl(data['message']))
 
@@ -148,6 +168,133 @@ class GitRepository(Repository):
         committer_time, data['commit'], commit_position,
         data['message'], touched_files, url, code_review_url)
 
+  def _FetchChangeLog(self, revision):
+    url = '%s/+/%s' % (self.repo_url, revision)
+
+    data = self._SendRequestForJsonResponse(url)
+    if not data:
+      return None
+    return self._ParseChangeLog(data)
+
+  def _FetchChangeLogsInRange(self, head_revision, count):
+    """Returns change logs of up to ``count`` commits back from
+    ``head_revision``, inclusive, using gitiles +log queries."""
+    change_logs = []
+    commit_count = 0
+    next_revision = head_revision
+    while next_revision and commit_count < count:
+      url = '%s/+log/%s' % (self.repo_url, next_revision)
+      page_size = min(count - commit_count, MAX_LOG_PAGE_SIZE)
+      data = self._SendRequestForJsonResponse(
+          url, [('n', page_size), ('name-status', 1)])
+      if not data:
+        break
+
+      commits = data.get('log', [])
+      commit_count += len(commits)
+      for commit in commits:
+        if 'tree_diff' in commit:  # pragma: no branch
+          change_logs.append(self._ParseChangeLog(commit))
+      next_revision = data.get('next') if commits else None
+
+    return change_logs
+
+  def _FetchChangeLogsConcurrently(self, revisions, max_concurrency):
+    """Returns a dict {revision: ChangeLog} of the given revisions.
+
+    At most ``max_concurrency`` requests are sent at a time. If fetching any
+    of the change logs raises an exception, it is re-raised.
+    """
+    pending = list(revisions)
+    change_logs = {}
+    exceptions = []
+    lock = threading.Lock()
+
+    def Worker():
+      while True:
+        with lock:
+          if not pending or exceptions:
+            return
+          revision = pending.pop()
+
+        try:
+          change_log = self._FetchChangeLog(revision)
+        except Exception as e:  # pylint: disable=W0703
+          with lock:
+            exceptions.append(e)
+          return
+
+        if change_log:
+          with lock:
+            change_logs[revision] = change_log
+
+    threads = [threading.Thread(target=Worker)
+               for _ in range(min(max_concurrency, len(pending)))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    if exceptions:
+      raise exceptions[0]
+    return change_logs
+
+  def GetChangeLog(self, revision):
+    cached_data = CHANGE_LOG_CACHER.Get(self._ChangeLogCacheKey(revision))
+    if cached_data:
+      return ChangeLog.FromDict(cached_data)
+
+    change_log = self._FetchChangeLog(revision)
+    if change_log:
+      CHANGE_LOG_CACHER.Set(
+          self._ChangeLogCacheKey(change_log.revision), change_log.ToDict(),
+          expire_time=CHANGE_LOG_CACHE_EXPIRE_TIME)
+    return change_log
+
+  def GetChangeLogs(self, revisions, head_revision=None,
+                    max_concurrency=MAX_CONCURRENT_REQUESTS):
+    """Returns change logs of the given revisions.
+
+    Cached change logs are used first. If ``head_revision`` is given, the
+    missing ones are looked up in the history ending at ``head_revision`` with
+    +log queries, which finds all of them when ``revisions`` is a contiguous
+    range of commits like a blame list of a build. The rest are fetched one by
+    one, with at most ``max_concurrency`` concurrent requests.
+
+    Args:
+      revisions (list): Git hashes of the revisions.
+      head_revision (str): The newest of the revisions, if known.
+      max_concurrency (int): The maximum number of concurrent requests.
+
+    Returns:
+      A dict {revision: ChangeLog}. Revisions whose change log is not found are
+      not in the dict.
+    """
+    revisions = list(set(revisions))
+    cache_keys = dict((self._ChangeLogCacheKey(r), r) for r in revisions)
+    change_logs = dict(
+        (cache_keys[key], ChangeLog.FromDict(data))
+        for key, data in CHANGE_LOG_CACHER.GetMulti(cache_keys.keys()).items())
+
+    missing_revisions = set(revisions) - set(change_logs)
+    fetched = {}
+    if missing_revisions and head_revision:
+      for change_log in self._FetchChangeLogsInRange(
+          head_revision, len(revisions) + 1):
+        if change_log.revision in missing_revisions:
+          fetched[change_log.revision] = change_log
+
+    fetched.update(self._FetchChangeLogsConcurrently(
+        missing_revisions - set(fetched), max_concurrency))
+
+    if fetched:
+      CHANGE_LOG_CACHER.SetMulti(
+          dict((self._ChangeLogCacheKey(revision), change_log.ToDict())
+               for revision, change_log in fetched.iteritems()),
+          expire_time=CHANGE_LOG_CACHE_EXPIRE_TIME)
+    change_logs.update(fetched)
+    return change_logs
+
   def GetChangeDiff(self, revision):
     """Returns the raw diff of the given revision."""
     url = '%s/+/%s%%5E%%21/' % (self.repo_url, revision)
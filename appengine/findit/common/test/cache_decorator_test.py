@@ -2,8 +2,10 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import inspect
 import pickle
 
+from google.appengine.api import memcache
 from testing_utils import testing
 
 from common import cache_decorator
@@ -30,6 +32,113 @@ class CacheDecoratorTest(testing.AppengineTestCase):
     cacher.Set('a', 'd')
     self.assertEquals('d', cacher.Get('a'))
 
+  def testMemCacherMulti(self):
+    cacher = cache_decorator.MemCacher()
+    cacher.SetMulti({'a': 'd', 'b': 'e'})
+    self.assertEquals({'a': 'd', 'b': 'e'}, cacher.GetMulti(['a', 'b', 'c']))
+
+  def testPersistentCacher(self):
+    cacher = cache_decorator.PersistentCacher()
+    cacher.Set('a', {'data': 1})
+    cacher.SetMulti({'b': 'e'})
+    memcache.flush_all()
+    self.assertEquals({'data': 1}, cacher.Get('a'))
+    self.assertIsNone(cacher.Get('c'))
+    self.assertEquals({'a': {'data': 1}, 'b': 'e'},
+                      cacher.GetMulti(['a', 'b', 'c']))
+    # Data found in datastore is put back to memcache.
+    self.assertEquals('e', memcache.get('b'))
+
+  def testCompressedMemCacher(self):
+    cacher = cache_decorator.CompressedMemCacher()
+    cacher.Set('a', {'data': 'x' * 100})
+    cacher.SetMulti({'b': 'e'})
+    self.assertEquals({'data': 'x' * 100}, cacher.Get('a'))
+    self.assertIsNone(cacher.Get('c'))
+    self.assertEquals({'a': {'data': 'x' * 100}, 'b': 'e'},
+                      cacher.GetMulti(['a', 'b', 'c']))
+    # Data is stored compressed, apart from data of MemCacher.
+    self.assertIsNone(memcache.get('a'))
+
+  def testCompressedMemCacherSplitsBigDataIntoChunks(self):
+    self.mock(cache_decorator.CompressedMemCacher, 'CHUNK_SIZE', 10)
+    cacher = cache_decorator.CompressedMemCacher()
+    data = [str(i) for i in range(100)]
+    cacher.Set('a', data)
+    self.assertEquals(data, cacher.Get('a'))
+    self.assertIsNotNone(memcache.get('compressed-a-chunk-1'))
+
+    # Data is not returned if any of its chunks was evicted.
+    memcache.delete('compressed-a-chunk-1')
+    self.assertIsNone(cacher.Get('a'))
+
+  def testCompressedMemCacherSkipsTooBigData(self):
+    self.mock(cache_decorator.CompressedMemCacher, 'CHUNK_SIZE', 10)
+    self.mock(cache_decorator.CompressedMemCacher, 'MAX_CHUNKS', 2)
+    cacher = cache_decorator.CompressedMemCacher()
+    cacher.Set('a', [str(i) for i in range(100)])
+    self.assertIsNone(cacher.Get('a'))
+
+  def testTieredCacher(self):
+    remote_cacher = _DummyCacher({})
+    cacher = cache_decorator.TieredCacher(remote_cacher=remote_cacher)
+    cacher.Set('a', {'data': 1})
+    self.assertEquals({'a': {'data': 1}}, remote_cacher.cached_data)
+
+    # Data is returned from the local cache, as a copy.
+    remote_cacher.cached_data.clear()
+    data = cacher.Get('a')
+    self.assertEquals({'data': 1}, data)
+    data['data'] = 2
+    self.assertEquals({'data': 1}, cacher.Get('a'))
+
+    # Data found in the remote cacher is kept locally.
+    remote_cacher.cached_data['b'] = 'e'
+    self.assertEquals({'a': {'data': 1}, 'b': 'e'},
+                      cacher.GetMulti(['a', 'b', 'c']))
+    remote_cacher.cached_data.clear()
+    self.assertEquals('e', cacher.Get('b'))
+
+    cacher.ClearLocal()
+    self.assertIsNone(cacher.Get('a'))
+
+  def testTieredCacherExpiresLocalData(self):
+    now = [1000]
+    self.mock(cache_decorator.time, 'time', lambda: now[0])
+    remote_cacher = _DummyCacher({})
+    cacher = cache_decorator.TieredCacher(
+        remote_cacher=remote_cacher, local_expire_time=60)
+    cacher.Set('a', 'd', expire_time=10)
+    cacher.Set('b', 'e')
+    remote_cacher.cached_data.clear()
+
+    now[0] += 30
+    self.assertIsNone(cacher.Get('a'))
+    self.assertEquals('e', cacher.Get('b'))
+    now[0] += 30
+    self.assertIsNone(cacher.Get('b'))
+
+  def testTieredCacherEvictsLeastRecentlyUsedData(self):
+    remote_cacher = _DummyCacher({})
+    data_size = len(cache_decorator.cPickle.dumps(
+        'x' * 10, cache_decorator.cPickle.HIGHEST_PROTOCOL))
+    cacher = cache_decorator.TieredCacher(
+        remote_cacher=remote_cacher, max_local_size=2 * data_size)
+    cacher.Set('a', 'a' * 10)
+    cacher.Set('b', 'b' * 10)
+    cacher.Get('a')
+    cacher.Set('c', 'c' * 10)
+    cacher.Set('d', 'd' * 1000)  # Too big to be kept locally.
+    remote_cacher.cached_data.clear()
+
+    self.assertEquals({'a': 'a' * 10, 'c': 'c' * 10},
+                      cacher.GetMulti(['a', 'b', 'c', 'd']))
+
+  def testCacherMulti(self):
+    cacher = _DummyCacher({})
+    cacher.SetMulti({'a': 'd'})
+    self.assertEquals({'a': 'd'}, cacher.GetMulti(['a', 'b']))
+
   def testDefaultKeyGenerator(self):
     expected_params = {
         'id1': 'fi',
@@ -62,6 +171,46 @@ class CacheDecoratorTest(testing.AppengineTestCase):
     key = cache_decorator._DefaultKeyGenerator(Func, args, kwargs)
     self.assertEqual(expected_key, key)
 
+  def testGetCallArgs(self):
+    # Unused parameters-pylint: disable=W0613
+    def Func(a, b, c=3, d=4):
+      pass  # pragma: no cover.
+
+    def FuncWithVarArgs(a, *args, **kwargs):
+      pass  # pragma: no cover.
+
+    cases = [
+        (Func, (1, 2), {}),
+        (Func, (1, 2, 5), {}),
+        (Func, (1, 2, 5, 6), {}),
+        (Func, (1,), {'b': 2}),
+        (FuncWithVarArgs, (1, 2), {'c': 3}),
+    ]
+    for func, args, kwargs in cases:
+      self.assertEqual(
+          inspect.getcallargs(func, *args, **kwargs),
+          cache_decorator._GetCallArgs(func, args, kwargs))
+
+    self.assertRaises(TypeError, cache_decorator._GetCallArgs, Func, (1,), {})
+    self.assertRaises(
+        TypeError, cache_decorator._GetCallArgs, Func, (1, 2, 3, 4, 5), {})
+
+  def testCachedDecoratorCountsHitsAndMisses(self):
+    cacher = _DummyCacher({})
+
+    @cache_decorator.Cached(
+        namespace='stats', key_generator=_DummyKeyGenerator, cacher=cacher)
+    def Func():
+      return 2
+
+    stats = cache_decorator.GetStats().get(
+        'stats', {'hits': 0, 'misses': 0})
+    Func()
+    Func()
+    self.assertEqual(
+        {'hits': stats['hits'] + 1, 'misses': stats['misses'] + 1},
+        cache_decorator.GetStats()['stats'])
+
   def testCachedDecoratorWhenResultIsAlreadyCached(self):
     cacher = _DummyCacher({'n-Func': 1})
 
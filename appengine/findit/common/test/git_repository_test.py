@@ -7,6 +7,7 @@ from datetime import datetime
 import json
 import re
 
+from google.appengine.api import memcache
 from testing_utils import testing
 
 from common import git_repository
@@ -230,10 +231,41 @@ EXPECTED_FILE_BLAME_JSON = {
 }
 
 
+def _CommitJson(revision):
+  return {
+      'commit': revision,
+      'tree': 'tree_%s' % revision,
+      'parents': ['parent_%s' % revision],
+      'author': {
+          'name': 'test@chromium.org',
+          'email': 'test@chromium.org',
+          'time': 'Wed Jun 11 19:35:32 2014',
+      },
+      'committer': {
+          'name': 'test@chromium.org',
+          'email': 'test@chromium.org',
+          'time': 'Wed Jun 11 19:35:32 2014',
+      },
+      'message': 'Change %s' % revision,
+      'tree_diff': [
+          {
+              'type': 'modify',
+              'old_path': 'a/%s.cc' % revision,
+              'new_path': 'a/%s.cc' % revision,
+          },
+      ],
+  }
+
+
+def _JsonResponse(data):
+  return ')]}\'\n%s' % json.dumps(data)
+
+
 class HttpClientForGit(retry_http_client.RetryHttpClient):
   def __init__(self):
     super(HttpClientForGit, self).__init__()
     self.response_for_url = {}
+    self.requested_urls = []
 
   def SetResponseForUrl(self, url, response):
     self.response_for_url[url] = response
@@ -243,6 +275,7 @@ class HttpClientForGit(retry_http_client.RetryHttpClient):
     return 0
 
   def _Get(self, url, *_):
+    self.requested_urls.append(url)
     response = self.response_for_url.get(url)
     if response is None:
       return 404, 'Not Found'
@@ -253,6 +286,7 @@ class HttpClientForGit(retry_http_client.RetryHttpClient):
 class GitRepositoryTest(testing.AppengineTestCase):
   def setUp(self):
     super(GitRepositoryTest, self).setUp()
+    git_repository.GITILES_CACHER.ClearLocal()
     self.http_client_for_git = HttpClientForGit()
     self.repo_url = 'https://repo.test'
     self.git_repo = git_repository.GitRepository(self.repo_url,
@@ -395,3 +429,77 @@ class GitRepositoryTest(testing.AppengineTestCase):
     utc_datetime = self.git_repo._GetDateTimeFromString(datetime_with_timezone)
 
     self.assertEqual(expected_datetime, utc_datetime)
+
+  def testGetChangeLogIsCachedByRevision(self):
+    revision = 'bcfd5a12eea05588aee98b7cf7e032d8cb5b58bb'
+    self.http_client_for_git.SetResponseForUrl(
+        '%s/+/%s?format=json' % (self.repo_url, revision), COMMIT_LOG)
+    self.git_repo.GetChangeLog(revision)
+
+    memcache.flush_all()
+    self.http_client_for_git.response_for_url = {}
+    change_log = self.git_repo.GetChangeLog(revision)
+    self.assertEqual(EXPECTED_CHANGE_LOG_JSON, change_log.ToDict())
+
+  def testGetChangeLogsInRange(self):
+    self.http_client_for_git.SetResponseForUrl(
+        '%s/+log/rev3?format=json&n=4&name-status=1' % self.repo_url,
+        _JsonResponse({
+            'log': [_CommitJson('rev3'), _CommitJson('rev2')],
+            'next': 'rev1',
+        }))
+    self.http_client_for_git.SetResponseForUrl(
+        '%s/+log/rev1?format=json&n=2&name-status=1' % self.repo_url,
+        _JsonResponse({
+            'log': [_CommitJson('rev1'), _CommitJson('rev0')],
+        }))
+
+    change_logs = self.git_repo.GetChangeLogs(
+        ['rev1', 'rev2', 'rev3'], head_revision='rev3')
+    self.assertEqual(['rev1', 'rev2', 'rev3'], sorted(change_logs))
+    for revision, change_log in change_logs.iteritems():
+      self.assertEqual(_CommitJson(revision)['message'], change_log.message)
+      self.assertEqual(
+          '%s/+/%s' % (self.repo_url, revision), change_log.commit_url)
+    self.assertEqual(2, len(self.http_client_for_git.requested_urls))
+
+    # Change logs are cached by revision.
+    self.http_client_for_git.requested_urls = []
+    change_logs = self.git_repo.GetChangeLogs(['rev2', 'rev3'])
+    self.assertEqual(['rev2', 'rev3'], sorted(change_logs))
+    self.assertEqual([], self.http_client_for_git.requested_urls)
+
+  def testGetChangeLogsConcurrently(self):
+    revisions = ['rev%d' % i for i in range(5)]
+    for revision in revisions:
+      self.http_client_for_git.SetResponseForUrl(
+          '%s/+/%s?format=json' % (self.repo_url, revision),
+          _JsonResponse(_CommitJson(revision)))
+
+    change_logs = self.git_repo.GetChangeLogs(
+        revisions + ['not_existing_revision'], max_concurrency=2)
+    self.assertEqual(revisions, sorted(change_logs))
+    self.assertEqual(
+        'Change rev3', change_logs['rev3'].message)
+
+  def testGetChangeLogsNotInRange(self):
+    self.http_client_for_git.SetResponseForUrl(
+        '%s/+log/rev2?format=json&n=3&name-status=1' % self.repo_url,
+        _JsonResponse({'log': [_CommitJson('rev2'), _CommitJson('rev1')]}))
+    self.http_client_for_git.SetResponseForUrl(
+        '%s/+/%s?format=json' % (self.repo_url, 'other_rev'),
+        _JsonResponse(_CommitJson('other_rev')))
+
+    change_logs = self.git_repo.GetChangeLogs(
+        ['rev2', 'other_rev'], head_revision='rev2')
+    self.assertEqual(['other_rev', 'rev2'], sorted(change_logs))
+
+  def testGetChangeLogsWithUnknownChangeType(self):
+    self.http_client_for_git.SetResponseForUrl(
+        '%s/+/%s?format=json' % (
+            self.repo_url, 'bcfd5a12eea05588aee98b7cf7e032d8cb5b58bb'),
+        COMMIT_LOG_WITH_UNKNOWN_FILE_CHANGE_TYPE)
+    self.assertRaisesRegexp(
+        Exception, 'Unknown change type "unknown_change_type"',
+        self.git_repo.GetChangeLogs,
+        ['bcfd5a12eea05588aee98b7cf7e032d8cb5b58bb'])
@@ -0,0 +1,29 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from google.appengine.ext import ndb
+
+
+class WfMasterSettings(ndb.Model):
+  """Represents settings of a master in a Chromium waterfall.
+
+  'Wf' is short for waterfall. The entity id is the master name. Settings that
+  are not set fall back to the defaults of the code using them.
+  """
+  @staticmethod
+  def _CreateKey(master_name):  # pragma: no cover
+    return ndb.Key('WfMasterSettings', master_name)
+
+  @staticmethod
+  def Create(master_name):  # pragma: no cover
+    return WfMasterSettings(key=WfMasterSettings._CreateKey(master_name))
+
+  @staticmethod
+  def Get(master_name):  # pragma: no cover
+    return WfMasterSettings._CreateKey(master_name).get()
+
+  # Downloads from the master are allowed every this number of seconds.
+  download_interval_seconds = ndb.FloatProperty(indexed=False)
+  # Number of downloads allowed at once after an idle period.
+  download_burst = ndb.IntegerProperty(indexed=False)
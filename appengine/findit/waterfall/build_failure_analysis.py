@@ -505,52 +505,177 @@ def _CheckFileInDependencyRolls(file_path_in_log, rolls, justification,
         changed_lines, roll_file_change_type)
 
 
-def _CheckFiles(failure_signal, change_log, deps_info):
-  """Checks files in the given change log of a CL against the failure signal.
+def _GetFileStem(file_path):
+  """Returns the file name with extension and common suffixes stripped.
+
+  Two files could be related by _IsRelated only if they have the same stem.
+  """
+  if file_path.endswith('.o') or file_path.endswith('.obj'):
+    file_path = _NormalizeObjectFilePath(file_path)
+  return os.path.basename(_StripExtensionAndCommonSuffix(file_path))
+
+
+def _GetDirectoryPrefixes(file_path):
+  """Returns all directory prefixes of the file path, ending with '/'.
+
+  Eg.: a/b/c.cc -> ['a/', 'a/b/']
+  """
+  prefixes = []
+  index = file_path.find('/')
+  while index >= 0:
+    prefixes.append(file_path[:index + 1])
+    index = file_path.find('/', index + 1)
+  return prefixes
+
+
+class _FilePathIndex(object):
+  """An index of the files touched and the dependencies rolled by CLs.
+
+  A touched file could be the same as a file in the failure log only if they
+  have the same base name, and related to it only if they have the same stem
+  (see _IsSameFile and _IsRelated). A dependency roll is relevant to a file in
+  the failure log only if the dependency path is a directory prefix of it.
+
+  Building the index once per analysis turns the matching of each file in the
+  failure log into a few dict lookups, instead of checking it against every
+  touched file of every CL in the blame list.
+  """
+
+  def __init__(self, change_logs, deps_info):
+    """
+    Args:
+      change_logs (list): Change logs of CLs as returned by
+          common.change_log.ChangeLog.ToDict().
+      deps_info (dict): Output of pipeline ExtractDEPSInfoPipeline.
+    """
+    # Map a base name or stem to a list of (revision, touched file index).
+    self._touched_files_by_name = collections.defaultdict(list)
+    self._touched_files_by_stem = collections.defaultdict(list)
+    # Map a dependency path to a list of (revision, roll).
+    self._rolls_by_dep_path = collections.defaultdict(list)
+    # Rolls whose dependency path is not a directory, checked for every file.
+    self._other_rolls = []
+    # Map a revision to the occurrences of each file name in its CL.
+    self._file_name_occurrences = {}
+    self._change_logs = {}
+
+    deps_rolls = deps_info.get('deps_rolls', {})
+    for change_log in change_logs:
+      revision = change_log['revision']
+      self._change_logs[revision] = change_log
+      file_name_occurrences = collections.defaultdict(int)
+      for i, touched_file in enumerate(change_log['touched_files']):
+        for changed_src_file_path in self._GetChangedPaths(touched_file):
+          file_name = os.path.basename(changed_src_file_path)
+          file_name_occurrences[file_name] += 1
+          self._touched_files_by_name[file_name].append((revision, i))
+          self._touched_files_by_stem[_GetFileStem(
+              changed_src_file_path)].append((revision, i))
+      self._file_name_occurrences[revision] = file_name_occurrences
+
+      for roll in deps_rolls.get(revision, []):
+        dep_path = _StripChromiumRootDirectory(roll['path'])
+        if dep_path.endswith('/'):
+          self._rolls_by_dep_path[dep_path].append((revision, roll))
+        else:  # pragma: no cover
+          self._other_rolls.append((revision, roll))
+
+  @staticmethod
+  def _GetChangedPaths(touched_file):
+    change_type = touched_file['change_type']
+    paths = []
+    if change_type in (ChangeType.ADD, ChangeType.COPY,
+                       ChangeType.RENAME, ChangeType.MODIFY):
+      paths.append(touched_file['new_path'])
+    if change_type in (ChangeType.DELETE, ChangeType.RENAME):
+      paths.append(touched_file['old_path'])
+    return paths
+
+  def GetFileNameOccurrences(self, revision):
+    return self._file_name_occurrences[revision]
+
+  def GetTouchedFiles(self, file_path_in_log):
+    """Returns a dict mapping revisions to touched files to check."""
+    candidates = set(self._touched_files_by_name.get(
+        os.path.basename(file_path_in_log), []))
+    candidates.update(self._touched_files_by_stem.get(
+        _GetFileStem(file_path_in_log), []))
+
+    touched_files = collections.defaultdict(list)
+    for revision, i in sorted(candidates):
+      touched_files[revision].append(
+          self._change_logs[revision]['touched_files'][i])
+    return touched_files
+
+  def GetRolls(self, file_path_in_log):
+    """Returns a dict mapping revisions to dependency rolls to check."""
+    rolls = collections.defaultdict(list)
+    for dep_path in _GetDirectoryPrefixes(file_path_in_log):
+      for revision, roll in self._rolls_by_dep_path.get(dep_path, []):
+        rolls[revision].append(roll)
+    for revision, roll in self._other_rolls:  # pragma: no cover
+      rolls[revision].append(roll)
+    return rolls
+
+
+def _CheckFilesInIndex(failure_signal, file_path_index, deps_info,
+                       revisions=None):
+  """Checks files of the indexed CLs against the failure signal.
 
   Args:
     failure_signal (FailureSignal): The failure signal of a failed step or test.
-    change_log (dict): The change log of a CL as returned by
-        common.change_log.ChangeLog.ToDict().
+    file_path_index (_FilePathIndex): The index of the CLs to check.
     deps_info (dict): Output of pipeline ExtractDEPSInfoPipeline.
+    revisions (set): If given, only CLs of these revisions are checked.
 
   Returns:
-    A dict as returned by _Justification.ToDict() if the CL is suspected for the
-    failure; otherwise None.
+    A dict mapping the revision of each suspected CL to a dict as returned by
+    _Justification.ToDict().
   """
-  # Use a dict to map each file name of the touched files to their occurrences.
-  file_name_occurrences = collections.defaultdict(int)
-  for touched_file in change_log['touched_files']:
-    change_type = touched_file['change_type']
-    if (change_type in (ChangeType.ADD, ChangeType.COPY,
-                        ChangeType.RENAME, ChangeType.MODIFY)):
-      file_name = os.path.basename(touched_file['new_path'])
-      file_name_occurrences[file_name] += 1
-
-    if change_type in (ChangeType.DELETE, ChangeType.RENAME):
-      file_name = os.path.basename(touched_file['old_path'])
-      file_name_occurrences[file_name] += 1
-
-  justification = _Justification()
+  justifications = collections.defaultdict(_Justification)
 
-  rolls = deps_info.get('deps_rolls', {}).get(change_log['revision'], [])
   repo_info = deps_info.get('deps', {}).get('src/', {})
   for file_path_in_log, line_numbers in failure_signal.files.iteritems():
     file_path_in_log = _StripChromiumRootDirectory(file_path_in_log)
 
-    for touched_file in change_log['touched_files']:
-      _CheckFile(
-          touched_file, file_path_in_log, justification,
-          file_name_occurrences, line_numbers, repo_info,
-          change_log['revision'])
+    touched_files = file_path_index.GetTouchedFiles(file_path_in_log)
+    for revision, revision_touched_files in touched_files.iteritems():
+      if revisions is not None and revision not in revisions:
+        continue
+      file_name_occurrences = file_path_index.GetFileNameOccurrences(revision)
+      for touched_file in revision_touched_files:
+        _CheckFile(
+            touched_file, file_path_in_log, justifications[revision],
+            file_name_occurrences, line_numbers, repo_info, revision)
+
+    rolls = file_path_index.GetRolls(file_path_in_log)
+    for revision, revision_rolls in rolls.iteritems():
+      if revisions is not None and revision not in revisions:
+        continue
+      _CheckFileInDependencyRolls(file_path_in_log, revision_rolls,
+                                  justifications[revision], line_numbers)
 
-    _CheckFileInDependencyRolls(file_path_in_log, rolls, justification,
-                                line_numbers)
+  return dict((revision, justification.ToDict())
+              for revision, justification in justifications.iteritems()
+              if justification.score)
 
-  if not justification.score:
-    return None
-  else:
-    return justification.ToDict()
+
+def _CheckFiles(failure_signal, change_log, deps_info):
+  """Checks files in the given change log of a CL against the failure signal.
+
+  Args:
+    failure_signal (FailureSignal): The failure signal of a failed step or test.
+    change_log (dict): The change log of a CL as returned by
+        common.change_log.ChangeLog.ToDict().
+    deps_info (dict): Output of pipeline ExtractDEPSInfoPipeline.
+
+  Returns:
+    A dict as returned by _Justification.ToDict() if the CL is suspected for the
+    failure; otherwise None.
+  """
+  justifications = _CheckFilesInIndex(
+      failure_signal, _FilePathIndex([change_log], deps_info), deps_info)
+  return justifications.get(change_log['revision'])
 
 
 def AnalyzeBuildFailure(
@@ -617,6 +742,8 @@ def AnalyzeBuildFailure(
 
   failed_steps = failure_info['failed_steps']
   builds = failure_info['builds']
+  # Index the files touched by all CLs once for all failed steps.
+  file_path_index = _FilePathIndex(change_logs.values(), deps_info)
   for step_name, step_failure_info in failed_steps.iteritems():
     failure_signal = FailureSignal.FromDict(failure_signals[step_name])
     failed_build_number = step_failure_info['current_failure']
@@ -633,10 +760,15 @@ def AnalyzeBuildFailure(
         'suspected_cls': [],
     }
 
+    revisions = set()
+    for number in range(build_number, failed_build_number + 1):
+      revisions.update(builds[str(number)]['blame_list'])
+    justifications = _CheckFilesInIndex(
+        failure_signal, file_path_index, deps_info, revisions)
+
     while build_number <= failed_build_number:
       for revision in builds[str(build_number)]['blame_list']:
-        justification_dict = _CheckFiles(
-            failure_signal, change_logs[revision], deps_info)
+        justification_dict = justifications.get(revision)
 
         if not justification_dict:
           continue
@@ -29,6 +29,13 @@ class DetectFirstFailurePipeline(BasePipeline):
   HTTP_CLIENT_LOGGING_ERRORS = HttpClient()
   HTTP_CLIENT_NO_404_ERROR = HttpClient(no_error_logging_statuses=[404])
 
+  def __init__(self, *args, **kwargs):
+    super(DetectFirstFailurePipeline, self).__init__(*args, **kwargs)
+    # Downloads from the master are deferred by retrying, see lock_util.
+    self.backoff_seconds = lock_util.DOWNLOAD_RETRY_BACKOFF_SECONDS
+    self.backoff_factor = 1
+    self.max_attempts = lock_util.DOWNLOAD_RETRY_MAX_ATTEMPTS
+
   def _BuildDataNeedUpdating(self, build):
     return (not build.data or (not build.completed and
         (datetime.utcnow() - build.last_crawled_time).total_seconds() >= 300))
@@ -47,9 +54,11 @@ class DetectFirstFailurePipeline(BasePipeline):
           self.HTTP_CLIENT_NO_404_ERROR)
 
       if build.data is None:
-        if not lock_util.WaitUntilDownloadAllowed(
-            master_name):  # pragma: no cover
-          raise pipeline.Retry('Too many download from %s' % master_name)
+        delay_seconds = lock_util.GetDownloadDelaySeconds(
+            master_name, build.key.id())
+        if delay_seconds != 0:  # pragma: no cover
+          raise pipeline.Retry(
+              'Download of build %s is deferred' % build.key.id())
 
         # Retrieve build data from build master.
         build.data = buildbot.GetBuildDataFromBuildMaster(
@@ -30,6 +30,13 @@ class ExtractSignalPipeline(BasePipeline):
   # to less than 20%. So for uncompressed data, a safe limit could 4000 KB.
   LOG_DATA_BYTE_LIMIT = 4000 * 1024
 
+  def __init__(self, *args, **kwargs):
+    super(ExtractSignalPipeline, self).__init__(*args, **kwargs)
+    # Downloads from the master are deferred by retrying, see lock_util.
+    self.backoff_seconds = lock_util.DOWNLOAD_RETRY_BACKOFF_SECONDS
+    self.backoff_factor = 1
+    self.max_attempts = lock_util.DOWNLOAD_RETRY_MAX_ATTEMPTS
+
   @staticmethod
   def _ExtractStorablePortionOfLog(log_data):
     # For the log of a failed step in a build, the error messages usually show
@@ -38,14 +45,13 @@ class ExtractSignalPipeline(BasePipeline):
     if len(log_data) <= ExtractSignalPipeline.LOG_DATA_BYTE_LIMIT:
       return log_data
 
-    lines = log_data.split('\n')
-    size = 0
-    for line_index in reversed(range(len(lines))):
-      size += len(lines[line_index]) + 1
-      if size > ExtractSignalPipeline.LOG_DATA_BYTE_LIMIT:
-        return '\n'.join(lines[line_index + 1:])
-    else:
-      return log_data  # pragma: no cover - this won't be reached.
+    # Keep the longest ending portion that starts at a line and is within the
+    # limit, including the line break before it.
+    line_break_index = log_data.find(
+        '\n', len(log_data) - ExtractSignalPipeline.LOG_DATA_BYTE_LIMIT)
+    if line_break_index < 0:  # pragma: no cover
+      return ''
+    return log_data[line_break_index + 1:]
 
   @staticmethod
   def _GetReliableTestFailureLog(gtest_result):
@@ -123,10 +129,13 @@ class ExtractSignalPipeline(BasePipeline):
           failure_log = self._GetReliableTestFailureLog(gtest_result)
 
         if gtest_result is None or failure_log == 'invalid':
-          if not lock_util.WaitUntilDownloadAllowed(
-              master_name):  # pragma: no cover
-            raise pipeline.Retry('Failed to pull log of step %s of master %s'
-                                 % (step_name, master_name))
+          step_id = '%s/%s/%s/%s' % (
+              master_name, builder_name, build_number, step_name)
+          delay_seconds = lock_util.GetDownloadDelaySeconds(
+              master_name, step_id)
+          if delay_seconds != 0:  # pragma: no cover
+            raise pipeline.Retry('Download of log of step %s is deferred'
+                                 % step_id)
           try:
             failure_log = buildbot.GetStepStdio(
                 master_name, builder_name, build_number, step_name,
@@ -10,6 +10,9 @@ class Extractor(object):
 
   def ExtractFiles(self, message_line, failure_signal):
     """Extracts files from given message line into ``failure_signal``."""
+    if not extractor_util.FILE_EXTENSION_HINT_PATTERN.search(message_line):
+      return
+
     match = (
         extractor_util.PYTHON_STACK_TRACE_FRAME_PATTERN_1.match(message_line) or
         extractor_util.PYTHON_STACK_TRACE_FRAME_PATTERN_2.match(message_line))
@@ -92,6 +92,15 @@ FILE_PATH_LINE_PATTERN = re.compile((
         FILE_EXTENSION=FILE_EXTENSION_PATTERN))
 
 
+# Match a supported file extension at the end of a file path.
+# Every match of FILE_PATH_LINE_PATTERN, PYTHON_STACK_TRACE_FRAME_PATTERN_1 and
+# PYTHON_STACK_TRACE_FRAME_PATTERN_2 contains one, so lines without it are
+# skipped without running the more expensive patterns above.
+FILE_EXTENSION_HINT_PATTERN = re.compile(
+    r'\.{FILE_EXTENSION}(?=\W|$)'.format(
+        FILE_EXTENSION=FILE_EXTENSION_PATTERN))
+
+
 # Patterns for Python stack trace frames.
 PYTHON_STACK_TRACE_FRAME_PATTERN_1 = re.compile(
     r'\s*File "(?P<file>.+\.py)", line (?P<line>[0-9]+), in (?P<function>.+)')
@@ -107,6 +116,9 @@ PYTHON_MAXIMUM_NUMBER_STACK_FRAMES = 4
 # Pattern for C++ stack trace frame.
 CPP_STACK_TRACE_FRAME_PATTERN = re.compile('.*\s+#(\d+) 0x[0-9a-fA-F]+ .*')
 
+# Substring of every C++ stack trace frame, to skip the pattern above cheaply.
+CPP_STACK_TRACE_FRAME_HINT = ' 0x'
+
 # The number of stack frames for a c++ stacktrace to extract.
 CPP_MAXIMUM_NUMBER_STACK_FRAMES = 4
 
@@ -115,6 +127,33 @@ CHROMIUM_SRC_PATTERN = re.compile(
     r'.*/build/slave/\w+[^\t\n/]*/build/src/(.*)')
 
 
+# Size of the chunks that a log is split into lines by.
+LOG_CHUNK_SIZE = 1024 * 1024
+
+
+def IterLines(text, chunk_size=LOG_CHUNK_SIZE):
+  """Yields the lines of the given str, like iter(text.splitlines()).
+
+  The text is split into lines one chunk at a time, so the list of all lines of
+  a multi-MB log is never built. Each chunk ends at a line break.
+  """
+  start = 0
+  while start < len(text):
+    end = text.find('\n', start + chunk_size)
+    if end < 0:
+      end = len(text)
+    for line in text[start:end + 1].splitlines():
+      yield line
+    start = end + 1
+
+
+def MatchCppStackTraceFrame(line):
+  """Returns the match of CPP_STACK_TRACE_FRAME_PATTERN on the line or None."""
+  if CPP_STACK_TRACE_FRAME_HINT not in line:
+    return None
+  return CPP_STACK_TRACE_FRAME_PATTERN.match(line)
+
+
 def NormalizeFilePath(file_path):
   """Normalizes the file path.
 
@@ -15,6 +15,18 @@ class GeneralExtractor(Extractor):
   It extracts file name and line numbers.
   """
 
+  GMOCK_WARNING_START = 'GMOCK WARNING'
+  # The end line in GMOCK WARNING statements.
+  GMOCK_WARNING_END = ('You can safely ignore the above warning unless this '
+                       'call should not happen.')
+
+  # States of the log scanner in Extract.
+  _IN_MESSAGE = 0
+  _IN_CPP_STACKTRACE = 1
+  _IN_PYTHON_STACKTRACE = 2
+  _AFTER_PYTHON_FRAME = 3
+  _IN_GMOCK_WARNING = 4
+
   def _ExtractCppFiles(self, cpp_stacktrace_frames, signal):
     in_expected_crash = False
     for frame in cpp_stacktrace_frames:
@@ -40,55 +52,65 @@ class GeneralExtractor(Extractor):
       self.ExtractFiles(frame, signal)
 
   def Extract(self, failure_log, *_):
-    signal = FailureSignal()
-    failure_log_lines = failure_log.splitlines()
+    """Scans the log once and extracts files from all kinds of lines.
 
-    i = 0
-    end_index = len(failure_log_lines)
+    Frames of C++ and Python stack traces are collected as they come and
+    extracted when the stack trace ends; files in other lines are extracted
+    immediately.
+    """
+    signal = FailureSignal()
+    state = self._IN_MESSAGE
+    frames = []
+
+    for line in extractor_util.IterLines(failure_log):
+      if state == self._IN_CPP_STACKTRACE:
+        if extractor_util.MatchCppStackTraceFrame(line):
+          frames.append(line)
+        else:
+          # The line ending a C++ stack trace is skipped too.
+          self._ExtractCppFiles(frames, signal)
+          state = self._IN_MESSAGE
+        continue
+      elif state == self._AFTER_PYTHON_FRAME:
+        # The source code line following a Python stack frame.
+        frames.append(line)
+        state = self._IN_PYTHON_STACKTRACE
+        continue
+      elif state == self._IN_PYTHON_STACKTRACE:
+        if (extractor_util.PYTHON_STACK_TRACE_FRAME_PATTERN_1.match(line) or
+            extractor_util.PYTHON_STACK_TRACE_FRAME_PATTERN_2.match(line)):
+          frames.append(line)
+          state = self._AFTER_PYTHON_FRAME
+        else:
+          # The line ending a Python stack trace is skipped too.
+          self._ExtractPythonFiles(frames, signal)
+          state = self._IN_MESSAGE
+        continue
+      elif state == self._IN_GMOCK_WARNING:
+        if self.GMOCK_WARNING_END in line:
+          state = self._IN_MESSAGE
+        continue
 
-    while i < end_index:
-      line = failure_log_lines[i]
-      cpp_stacktrace_match = extractor_util.CPP_STACK_TRACE_FRAME_PATTERN.match(
-          line)
-      if cpp_stacktrace_match:
+      if extractor_util.MatchCppStackTraceFrame(line):
         # Handle cpp failure stacktraces.
-        start = i
-        for line in failure_log_lines[start:]:  # pragma: no cover
-          if extractor_util.CPP_STACK_TRACE_FRAME_PATTERN.match(line):
-            i += 1
-          else:
-            break
-        end = i
-        cpp_stacktrace_frames = failure_log_lines[start:end]
-        self._ExtractCppFiles(cpp_stacktrace_frames, signal)
+        frames = [line]
+        state = self._IN_CPP_STACKTRACE
       elif line.startswith(extractor_util.PYTHON_STACK_TRACE_START_MARKER):
         # Handle python failure stacktraces.
-        i += 1
-        start = i
-        while i < end_index:  # pragma: no cover
-          line = failure_log_lines[i]
-          if (extractor_util.PYTHON_STACK_TRACE_FRAME_PATTERN_1.match(line) or
-              extractor_util.PYTHON_STACK_TRACE_FRAME_PATTERN_2.match(line)):
-            i += 2
-          else:
-            break
-        end = i
-        python_stacktrace_frames = failure_log_lines[start:end]
-        self._ExtractPythonFiles(python_stacktrace_frames, signal)
-      elif 'GMOCK WARNING' in line:
+        frames = []
+        state = self._IN_PYTHON_STACKTRACE
+      elif self.GMOCK_WARNING_START in line:
         # Ignore GMOCK WARNING statements.
-        start = i
-        for l in failure_log_lines[start:]:  # pragma: no cover
-          if ('You can safely ignore the above warning unless this call '
-              'should not happen.') in l:
-            # The end line in GMOCK WARNING statements.
-            break
-          i += 1
-      else:
-        if line and not extractor_util.ShouldIgnoreLine(line):
-          self.ExtractFiles(line, signal)
+        if self.GMOCK_WARNING_END not in line:
+          state = self._IN_GMOCK_WARNING
+      elif line and not extractor_util.ShouldIgnoreLine(line):
+        self.ExtractFiles(line, signal)
 
-      i += 1
+    # The log might end within a stack trace.
+    if state == self._IN_CPP_STACKTRACE:
+      self._ExtractCppFiles(frames, signal)
+    elif state in (self._IN_PYTHON_STACKTRACE, self._AFTER_PYTHON_FRAME):
+      self._ExtractPythonFiles(frames, signal)
 
     return signal
 
@@ -129,7 +151,7 @@ class CompileStepExtractor(Extractor):
             error_lines.append(line)
 
     else:
-      for line in failure_log.splitlines():
+      for line in extractor_util.IterLines(failure_log):
         if line.startswith(self.FAILURE_START_LINE_PREFIX):
           if not failure_started:
             failure_started = True
@@ -178,7 +200,7 @@ class CheckSizesExtractor(Extractor):
     signal = FailureSignal()
     failure_started = False
 
-    for line in failure_log.splitlines():
+    for line in extractor_util.IterLines(failure_log):
       if line.startswith(self.BEGINNING_MARKER):
         failure_started = True
         continue
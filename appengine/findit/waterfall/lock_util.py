@@ -2,53 +2,140 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-from datetime import datetime
+import collections
 import logging
-import random
 import time
 
 from google.appengine.api import memcache
 
+from model.wf_master_settings import WfMasterSettings
 
-_MEMCACHE_MASTER_DOWNLOAD_LOCK = 'master-download-lock-%s'
+
+_MEMCACHE_MASTER_DOWNLOAD_BUCKET = 'master-download-bucket-%s'
 _MEMCACHE_MASTER_DOWNLOAD_EXPIRATION_SECONDS = 60 * 60
 _DOWNLOAD_INTERVAL_SECONDS = 10
+_MAX_RESERVATION_ATTEMPTS = 10
+_MEMCACHE_DOWNLOAD_RESERVATION = 'download-reservation-%s'
+# How far ahead a download is reserved by default. This covers a queue of 9
+# reservations ahead of it, so that a burst of analyses on a master waits its
+# turn instead of using up the retries of the pipelines.
+_DEFAULT_MAX_WAIT_SECONDS = 90
+# Pipelines deferring a download retry every this number of seconds, so that
+# they run soon after their reserved download is allowed.
+DOWNLOAD_RETRY_BACKOFF_SECONDS = _DOWNLOAD_INTERVAL_SECONDS
+# Enough retries to reach a download reserved _DEFAULT_MAX_WAIT_SECONDS ahead,
+# plus the usual retries on errors.
+DOWNLOAD_RETRY_MAX_ATTEMPTS = (
+    _DEFAULT_MAX_WAIT_SECONDS / DOWNLOAD_RETRY_BACKOFF_SECONDS + 3)
+
+
+# A download from a master is allowed every ``interval_seconds`` on average,
+# and up to ``burst`` downloads are allowed at once after an idle period.
+DownloadRate = collections.namedtuple('DownloadRate',
+                                      ['interval_seconds', 'burst'])
 
+# The rate of masters without WfMasterSettings for it.
+_DEFAULT_DOWNLOAD_RATE = DownloadRate(_DOWNLOAD_INTERVAL_SECONDS, 1)
 
-def WaitUntilDownloadAllowed(
-    master_name, timeout_seconds=90):  # pragma: no cover
-  """Waits until next download from the specified master is allowed.
+
+def GetDownloadRate(master_name):
+  """Returns the DownloadRate of the specified master.
+
+  The rate is read from the WfMasterSettings of the master, and each value not
+  set there is taken from _DEFAULT_DOWNLOAD_RATE.
+  """
+  settings = WfMasterSettings.Get(master_name)
+  if not settings:
+    return _DEFAULT_DOWNLOAD_RATE
+  return DownloadRate(
+      settings.download_interval_seconds or
+      _DEFAULT_DOWNLOAD_RATE.interval_seconds,
+      settings.download_burst or _DEFAULT_DOWNLOAD_RATE.burst)
+
+
+def ReserveDownload(master_name, max_wait_seconds):
+  """Reserves the next download from the specified master.
+
+  Downloads from a master are limited by a token bucket kept in memcache as
+  the time when the bucket is drained by the downloads reserved so far. Each
+  reservation takes the next free time slot, so concurrent callers are served
+  in the order they reserve instead of racing each other.
+
+  Args:
+    master_name (str): The name of the master to download from.
+    max_wait_seconds (float): Do not reserve a download which is allowed only
+        after this number of seconds from now.
 
   Returns:
-    True if download is allowed to proceed.
-    False if download is not still allowed when the given timeout occurs.
+    The time (seconds since epoch) when the reserved download is allowed, which
+    is the current time if it is allowed right away. None if no download is
+    allowed within ``max_wait_seconds``, and nothing is reserved then.
   """
+  rate = GetDownloadRate(master_name)
   client = memcache.Client()
-  key = _MEMCACHE_MASTER_DOWNLOAD_LOCK % master_name
-
-  deadline = time.time() + timeout_seconds
-  while True:
-    info = client.gets(key)
-    if not info or time.time() - info['time'] >= _DOWNLOAD_INTERVAL_SECONDS:
-      new_info = {
-          'time': time.time()
-      }
-      if not info:
-        success = client.add(
-            key, new_info, time=_MEMCACHE_MASTER_DOWNLOAD_EXPIRATION_SECONDS)
-      else:
-        success = client.cas(
-            key, new_info, time=_MEMCACHE_MASTER_DOWNLOAD_EXPIRATION_SECONDS)
-
-      if success:
-        logging.info('Download from %s is allowed. Waited %s seconds.',
-                     master_name, (time.time() + timeout_seconds - deadline))
-        return True
-
-    if time.time() > deadline:
-      logging.info('Download from %s is not allowed. Waited %s seconds.',
-                   master_name, timeout_seconds)
-      return False
-
-    logging.info('Waiting to download from %s', master_name)
-    time.sleep(_DOWNLOAD_INTERVAL_SECONDS + random.random())
+  key = _MEMCACHE_MASTER_DOWNLOAD_BUCKET % master_name
+
+  for _ in range(_MAX_RESERVATION_ATTEMPTS):
+    now = time.time()
+    drained_time = client.gets(key)
+    start_time = max(now, drained_time or now)
+    allowed_time = max(
+        now, start_time - (rate.burst - 1) * rate.interval_seconds)
+    if allowed_time - now > max_wait_seconds:
+      return None
+
+    new_drained_time = start_time + rate.interval_seconds
+    if drained_time is None:
+      success = client.add(
+          key, new_drained_time,
+          time=_MEMCACHE_MASTER_DOWNLOAD_EXPIRATION_SECONDS)
+    else:
+      success = client.cas(
+          key, new_drained_time,
+          time=_MEMCACHE_MASTER_DOWNLOAD_EXPIRATION_SECONDS)
+    if success:
+      return allowed_time
+
+  # Too many concurrent reservations.
+  logging.warning(  # pragma: no cover
+      'Failed to reserve download from %s', master_name)
+  return None  # pragma: no cover
+
+
+def GetDownloadDelaySeconds(
+    master_name, download_id, max_wait_seconds=_DEFAULT_MAX_WAIT_SECONDS):
+  """Returns how long to defer the specified download from a master.
+
+  The download is reserved on the first call for ``download_id``, and the
+  reservation is kept in memcache for later calls. So a pipeline that defers
+  its download by retrying keeps its place in line instead of sleeping in the
+  request until the download is allowed.
+
+  Args:
+    master_name (str): The name of the master to download from.
+    download_id (str): Identifies the download, e.g. a build or a step.
+    max_wait_seconds (float): Do not reserve a download which is allowed only
+        after this number of seconds from now.
+
+  Returns:
+    0 if the download is allowed now, and its reservation is used up then.
+    The number of seconds until the reserved download is allowed, if later.
+    None if no download is allowed within ``max_wait_seconds``.
+  """
+  key = _MEMCACHE_DOWNLOAD_RESERVATION % download_id
+  allowed_time = memcache.get(key)
+  if allowed_time is None:
+    allowed_time = ReserveDownload(master_name, max_wait_seconds)
+    if allowed_time is None:
+      logging.info('Download from %s is not allowed within %s seconds.',
+                   master_name, max_wait_seconds)
+      return None
+
+  delay_seconds = allowed_time - time.time()
+  if delay_seconds > 0:
+    memcache.set(key, allowed_time,
+                 time=_MEMCACHE_MASTER_DOWNLOAD_EXPIRATION_SECONDS)
+    return delay_seconds
+
+  memcache.delete(key)
+  return 0
@@ -34,8 +34,16 @@ class PullChangelogPipeline(BasePipeline):
       return change_logs
 
     for build in failure_info.get('builds', {}).values():
-      for revision in build['blame_list']:
-        change_log = self.GIT_REPO.GetChangeLog(revision)
+      # The blame list of a build is a contiguous range of commits ending at
+      # the chromium revision of the build, so it is fetched in bulk.
+      revisions = [
+          revision for revision in build['blame_list']
+          if revision not in change_logs]
+      fetched_change_logs = self.GIT_REPO.GetChangeLogs(
+          revisions, head_revision=build.get('chromium_revision'))
+
+      for revision in revisions:
+        change_log = fetched_change_logs.get(revision)
         if not change_log:  # pragma: no cover
           raise pipeline.Retry('Failed to get change log for %s' % revision)
 
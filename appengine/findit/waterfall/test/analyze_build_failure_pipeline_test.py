@@ -65,10 +65,10 @@ class AnalyzeBuildFailurePipelineTest(testing.AppengineTestCase):
     analysis.status = wf_analysis_status.ANALYZING
     analysis.put()
 
-    def MockWaitUntilDownloadAllowed(*_):
-      return True
+    def MockGetDownloadDelaySeconds(*_):
+      return 0
     self.mock(
-        lock_util, 'WaitUntilDownloadAllowed', MockWaitUntilDownloadAllowed)
+        lock_util, 'GetDownloadDelaySeconds', MockGetDownloadDelaySeconds)
 
     with self.mock_urlfetch() as urlfetch:
       # Mock build data.
@@ -0,0 +1,92 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Benchmark for build_failure_analysis.AnalyzeBuildFailure.
+
+Disabled by default. Run with:
+  FINDIT_BENCHMARK=1 ./test.py test appengine/findit \
+      waterfall/test/build_failure_analysis_benchmark_test.py
+"""
+
+import logging
+import os
+import time
+import unittest
+
+from testing_utils import testing
+
+from common.diff import ChangeType
+from waterfall import build_failure_analysis
+
+
+# Number of CLs in the blame list of the failed build.
+CLS_COUNT = 500
+# Number of files touched by each CL.
+TOUCHED_FILES_PER_CL = 20
+# Number of files in the compile failure log.
+FILES_IN_LOG_COUNT = 10000
+
+
+@unittest.skipUnless(os.environ.get('FINDIT_BENCHMARK'),
+                     'FINDIT_BENCHMARK unset')
+class BuildFailureAnalysisBenchmark(testing.AppengineTestCase):
+
+  def setUp(self):
+    super(BuildFailureAnalysisBenchmark, self).setUp()
+    self.change_logs = {}
+    for i in xrange(CLS_COUNT):
+      revision = 'r%d' % i
+      self.change_logs[revision] = {
+          'revision': revision,
+          'touched_files': [
+              {
+                  'change_type': ChangeType.ADD,
+                  'old_path': '/dev/null',
+                  'new_path': 'dir%d/sub%d/file%d_%d.cc' % (
+                      i % 50, j, i, j),
+              } for j in xrange(TOUCHED_FILES_PER_CL)
+          ],
+      }
+    self.failure_info = {
+        'failed': True,
+        'chromium_revision': 'r%d' % (CLS_COUNT - 1),
+        'failed_steps': {
+            'compile': {
+                'current_failure': 1,
+                'first_failure': 1,
+                'last_pass': 0,
+            },
+        },
+        'builds': {
+            '1': {
+                'blame_list': sorted(self.change_logs.keys()),
+            },
+        },
+    }
+    # Every 100th file in the log is the .o file of a touched file.
+    files = {}
+    for i in xrange(FILES_IN_LOG_COUNT):
+      if i % 100 == 0:
+        cl = i / 100 % CLS_COUNT
+        files['obj/dir%d/sub0/T.file%d_0.o' % (cl % 50, cl)] = []
+      else:
+        files['src/other%d/unrelated%d.cc' % (i % 50, i)] = []
+    self.failure_signals = {
+        'compile': {
+            'files': files,
+        },
+    }
+
+  def test_analyze_build_failure(self):
+    started = time.time()
+    result = build_failure_analysis.AnalyzeBuildFailure(
+        self.failure_info, self.change_logs, {}, self.failure_signals)
+    elapsed = time.time() - started
+    suspected_cls = result['failures'][0]['suspected_cls']
+    logging.warning(
+        'AnalyzeBuildFailure: %d CLs x %d touched files, %d files in log, '
+        '%d suspected CLs, %.2f sec',
+        CLS_COUNT, TOUCHED_FILES_PER_CL, FILES_IN_LOG_COUNT,
+        len(suspected_cls), elapsed)
+    self.assertEqual(FILES_IN_LOG_COUNT / 100, len(suspected_cls))
@@ -77,6 +77,48 @@ class BuildFailureAnalysisTest(testing.AppengineTestCase):
         build_failure_analysis._IsRelated('a', 'b'))
     self.assertFalse(build_failure_analysis._IsRelated('a', 'a'))
 
+  def testGetDirectoryPrefixes(self):
+    self.assertEqual(
+        ['a/', 'a/b/'],
+        build_failure_analysis._GetDirectoryPrefixes('a/b/c.cc'))
+    self.assertEqual([], build_failure_analysis._GetDirectoryPrefixes('c.cc'))
+
+  def testFilePathIndexFindsAllSameOrRelatedFiles(self):
+    changed_src_file_paths = [
+        'a/b/x.cc', 'a/b/x.h', 'a/b/x_impl_mac.h', 'a/b/x_unittest.cc',
+        'c/x.py', 'a/b/y.cc', 'b/x.cc', 'a/b/x.gyp', 'DEPS',
+    ]
+    file_paths_in_log = [
+        'x.cc', 'b/x.cc', 'a/b/x.cc', 'x_test.py', 'a/b/x.o',
+        'obj/a/b/T.x_impl.o', 'a/b/x_browsertest.cc', 'y.h', 'z.cc',
+        'x.gypi', 'a/b/x.cc.obj',
+    ]
+    change_log = {
+        'revision': 'rev',
+        'touched_files': [
+            {
+                'change_type': ChangeType.ADD,
+                'old_path': '/dev/null',
+                'new_path': path,
+            } for path in changed_src_file_paths
+        ]
+    }
+    file_path_index = build_failure_analysis._FilePathIndex([change_log], {})
+
+    for file_path_in_log in file_paths_in_log:
+      expected_paths = sorted(
+          path for path in changed_src_file_paths
+          if (build_failure_analysis._IsSameFile(path, file_path_in_log) or
+              build_failure_analysis._IsRelated(path, file_path_in_log)))
+      touched_files = file_path_index.GetTouchedFiles(file_path_in_log)
+      candidate_paths = [touched_file['new_path']
+                         for touched_file in touched_files.get('rev', [])]
+      self.assertTrue(
+          set(expected_paths).issubset(candidate_paths),
+          '%s: %s not in %s' % (
+              file_path_in_log, expected_paths, candidate_paths))
+      self.assertNotIn('DEPS', candidate_paths)
+
   def testCheckFilesAgainstSuspectedCL(self):
     failure_signal_json = {
         'files': {
@@ -26,10 +26,10 @@ class DetectFirstFailureTest(testing.AppengineTestCase):
     with self.mock_urlfetch() as urlfetch:
       self.mocked_urlfetch = urlfetch
 
-    def _WaitUntilDownloadAllowed(*_):
-      return True
+    def _GetDownloadDelaySeconds(*_):
+      return 0
 
-    self.mock(lock_util, 'WaitUntilDownloadAllowed', _WaitUntilDownloadAllowed)
+    self.mock(lock_util, 'GetDownloadDelaySeconds', _GetDownloadDelaySeconds)
 
   def _TimeBeforeNowBySeconds(self, seconds):
     return datetime.datetime.utcnow() - datetime.timedelta(0, seconds, 0)
@@ -102,6 +102,32 @@ class ExtractorUtilTest(unittest.TestCase):
         '../../chrome/test/ppapi/ppapi_test.cc:263: Failure',
         extractor_util.CPP_STACK_TRACE_FRAME_PATTERN)
 
+  def testMatchCppStackTraceFrame(self):
+    self.assertIsNotNone(extractor_util.MatchCppStackTraceFrame(
+        ' #1 0x110c7f21c in MaybeHandleDebugURL render_frame_impl.cc:341:5'))
+    self.assertIsNone(extractor_util.MatchCppStackTraceFrame(
+        '#1 0x110c7f21c in MaybeHandleDebugURL render_frame_impl.cc:341:5'))
+    self.assertIsNone(extractor_util.MatchCppStackTraceFrame(
+        '../../chrome/test/ppapi/ppapi_test.cc:263: Failure'))
+
+  def testFileExtensionHintPattern(self):
+    self.assertRegexpMatches(
+        'a/b/c.cc:12', extractor_util.FILE_EXTENSION_HINT_PATTERN)
+    self.assertRegexpMatches(
+        'File "a/b.py", line 1', extractor_util.FILE_EXTENSION_HINT_PATTERN)
+    self.assertRegexpMatches(
+        'libgfx.a(gfx.x.o)', extractor_util.FILE_EXTENSION_HINT_PATTERN)
+    self.assertNotRegexpMatches(
+        'a/b/c.ccc d/e', extractor_util.FILE_EXTENSION_HINT_PATTERN)
+
+  def testIterLines(self):
+    cases = ['', 'a', 'a\n', '\n', 'a\r\nb\rc\n\nd', '\n\r']
+    for case in cases:
+      for chunk_size in (1, 2, 100):
+        self.assertEqual(case.splitlines(),
+                         list(extractor_util.IterLines(case, chunk_size)),
+                         'Failed case: %r' % case)
+
   def testChromiumSrcPattern(self):
     cases = {
         '/b/build/slave/Android_Tests/build/src/a/b/c.py': ['a/b/c.py'],
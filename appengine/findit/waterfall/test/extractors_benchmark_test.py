@@ -0,0 +1,80 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Benchmark for the throughput of extractors on big failure logs.
+
+Disabled by default. Run with:
+  FINDIT_BENCHMARK=1 ./test.py test appengine/findit \
+      waterfall/test/extractors_benchmark_test.py
+"""
+
+import logging
+import os
+import time
+import unittest
+
+from testing_utils import testing
+
+from waterfall import extractors
+
+
+# Approximate size of each generated failure log.
+LOG_SIZE_BYTES = 8 * 1024 * 1024
+
+# Lines that are repeated to make up the compile log.
+COMPILE_LOG_LINES = [
+    '[1234/5678] CXX obj/content/browser/browser.frame_host.o',
+    'FAILED: obj/content/browser/browser.frame_host.o',
+    '../../content/browser/frame_host.cc:123:4: error: no member named x',
+    '  x->DoSomething();',
+    '../../content/public/browser/frame_host.h:45:3: note: declared here',
+    '1 error generated.',
+    'ninja: warning: multiple rules generate gen/a.h',
+]
+
+# Lines that are repeated to make up a test log.
+TEST_LOG_LINES = [
+    '[ RUN      ] Suite.Test',
+    '[1234:5678:0101/000000:WARNING:a/b/c.cc(12)] Something happened',
+    '../../a/b/c_unittest.cc:34: Failure',
+    '    #0 0x7f0000000000 in Function a/b/d.cc:56:7',
+    '    #1 0x7f0000000001 in Caller a/b/e.cc:89:1',
+    'Traceback (most recent call last):',
+    '  File "tools/run_test.py", line 12, in main',
+    '    return run()',
+    'RuntimeError: test failed',
+    '[  FAILED  ] Suite.Test (12 ms)',
+]
+
+
+def _GenerateLog(lines):
+  chunk = '\n'.join(lines) + '\n'
+  return chunk * (LOG_SIZE_BYTES / len(chunk))
+
+
+@unittest.skipUnless(os.environ.get('FINDIT_BENCHMARK'),
+                     'FINDIT_BENCHMARK unset')
+class ExtractorsBenchmark(testing.AppengineTestCase):
+
+  def _Benchmark(self, extractor_class, step_name, failure_log):
+    started = time.time()
+    signal = extractor_class().Extract(
+        failure_log, None, step_name, 'bot', 'master')
+    elapsed = time.time() - started
+    logging.warning(
+        '%s: %.1f MB in %.2f sec (%.1f MB/s)', extractor_class.__name__,
+        len(failure_log) / 1024.0 / 1024, elapsed,
+        len(failure_log) / 1024.0 / 1024 / elapsed)
+    return signal
+
+  def test_compile_step_extractor(self):
+    signal = self._Benchmark(extractors.CompileStepExtractor, 'compile',
+                             _GenerateLog(COMPILE_LOG_LINES))
+    self.assertIn('content/browser/frame_host.cc', signal.files)
+
+  def test_general_extractor(self):
+    signal = self._Benchmark(extractors.GeneralExtractor, 'browser_tests',
+                             _GenerateLog(TEST_LOG_LINES))
+    self.assertIn('a/b/c_unittest.cc', signal.files)
+    self.assertIn('tools/run_test.py', signal.files)
@@ -0,0 +1,90 @@
+# Copyright 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from testing_utils import testing
+
+from model.wf_master_settings import WfMasterSettings
+from waterfall import lock_util
+
+
+class _MockTime(object):
+  def __init__(self, now):
+    self.now = now
+
+  def time(self):
+    return self.now
+
+
+class LockUtilTest(testing.AppengineTestCase):
+
+  def setUp(self):
+    super(LockUtilTest, self).setUp()
+    self.mock_time = _MockTime(1000)
+    self.mock(lock_util, 'time', self.mock_time)
+
+  def testReserveDownloadHandsOutSlotsInOrder(self):
+    self.assertEqual(1000, lock_util.ReserveDownload('m', 30))
+    self.assertEqual(1010, lock_util.ReserveDownload('m', 30))
+    self.assertEqual(1020, lock_util.ReserveDownload('m', 30))
+    # Other masters are not affected.
+    self.assertEqual(1000, lock_util.ReserveDownload('m2', 30))
+
+    self.mock_time.now = 1015
+    self.assertEqual(1030, lock_util.ReserveDownload('m', 30))
+
+    # Slots become available right away after an idle period.
+    self.mock_time.now = 2000
+    self.assertEqual(2000, lock_util.ReserveDownload('m', 30))
+
+  def testReserveDownloadBeyondMaxWait(self):
+    self.assertEqual(1000, lock_util.ReserveDownload('m', 5))
+    self.assertIsNone(lock_util.ReserveDownload('m', 5))
+    # Nothing was reserved by the call above.
+    self.assertEqual(1010, lock_util.ReserveDownload('m', 10))
+
+  def testReserveDownloadWithBurst(self):
+    settings = WfMasterSettings.Create('m')
+    settings.download_burst = 3
+    settings.put()
+    self.assertEqual(lock_util.DownloadRate(interval_seconds=10, burst=3),
+                     lock_util.GetDownloadRate('m'))
+    self.assertEqual(1000, lock_util.ReserveDownload('m', 0))
+    self.assertEqual(1000, lock_util.ReserveDownload('m', 0))
+    self.assertEqual(1000, lock_util.ReserveDownload('m', 0))
+    self.assertIsNone(lock_util.ReserveDownload('m', 0))
+    self.assertEqual(1010, lock_util.ReserveDownload('m', 10))
+
+  def testConcurrentReservationsWithinDefaultWait(self):
+    # Reservations made at the same time are all served in turn, up to the
+    # default wait.
+    allowed_times = [
+        lock_util.ReserveDownload('m', lock_util._DEFAULT_MAX_WAIT_SECONDS)
+        for _ in range(11)]
+    self.assertEqual(range(1000, 1091, 10), allowed_times[:10])
+    self.assertIsNone(allowed_times[10])
+
+  def testGetDownloadRate(self):
+    self.assertEqual(lock_util._DEFAULT_DOWNLOAD_RATE,
+                     lock_util.GetDownloadRate('m'))
+    settings = WfMasterSettings.Create('m')
+    settings.download_interval_seconds = 2.5
+    settings.put()
+    self.assertEqual(lock_util.DownloadRate(interval_seconds=2.5, burst=1),
+                     lock_util.GetDownloadRate('m'))
+
+  def testGetDownloadDelaySeconds(self):
+    self.assertEqual(0, lock_util.GetDownloadDelaySeconds('m', 'd1'))
+    self.assertEqual(10, lock_util.GetDownloadDelaySeconds('m', 'd2'))
+    # The reservation of a deferred download is kept.
+    self.mock_time.now = 1005
+    self.assertEqual(5, lock_util.GetDownloadDelaySeconds('m', 'd2'))
+    self.assertEqual(15, lock_util.GetDownloadDelaySeconds('m', 'd3'))
+    self.mock_time.now = 1010
+    self.assertEqual(0, lock_util.GetDownloadDelaySeconds('m', 'd2'))
+    # The used up reservation is not kept.
+    self.assertEqual(20, lock_util.GetDownloadDelaySeconds('m', 'd2'))
+
+  def testGetDownloadDelaySecondsBeyondMaxWait(self):
+    self.assertEqual(0, lock_util.GetDownloadDelaySeconds('m', 'd1', 0))
+    self.assertIsNone(lock_util.GetDownloadDelaySeconds('m', 'd2', 0))